@@ -4,14 +4,17 @@ Agentic chapter modification endpoint for Writer Assistant.
 This endpoint uses the agentic text generator to iteratively refine
 a chapter until all feedback is properly incorporated.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from app.models.generation_models import ModifyChapterRequest
 from app.models.agentic_models import AgenticConfig
 from app.models.streaming_models import StreamingStatusEvent, StreamingErrorEvent
 from app.services.llm_inference import get_llm
+from app.services.llm_registry import LLMTask, get_task_executor, get_task_llm
+from app.services.inference_executor import JobPriority
 from app.services.context_builder import ContextBuilder
 from app.services.agentic_text_generator import AgenticTextGenerator
+from app.api.v1.endpoints.shared_utils import stream_until_disconnected, admit_request, character_selection_event
 from app.core.config import settings
 import logging
 
@@ -20,7 +23,7 @@ router = APIRouter()
 
 
 @router.post("/agentic-modify-chapter")
-async def agentic_modify_chapter(request: ModifyChapterRequest):
+async def agentic_modify_chapter(request: ModifyChapterRequest, http_request: Request):
     """
     Modify a chapter with agentic iteration to ensure all feedback is incorporated.
 
@@ -32,11 +35,13 @@ async def agentic_modify_chapter(request: ModifyChapterRequest):
 
     This endpoint demonstrates the agentic text generator with iterative refinement.
     """
-    llm = get_llm()
+    llm = get_task_llm(LLMTask.GENERATE, default=get_llm())
     if not llm:
         raise HTTPException(
             status_code=503,
             detail="LLM not initialized. Start server with MODEL_PATH configured.")
+    executor = get_task_executor(LLMTask.GENERATE)
+    ticket = admit_request(executor, JobPriority.BATCH)
 
     async def generate_with_updates():
         try:
@@ -57,10 +62,14 @@ async def agentic_modify_chapter(request: ModifyChapterRequest):
 
             base_context = ContextBuilder(request.request_context, llm)
             base_context.add_long_term_elements(
-                request.request_context.configuration.system_prompts.assistant_prompt
+                request.request_context.configuration.system_prompts.assistant_prompt,
+                for_chapter=chapter
             )
             base_context.add_character_states()
             base_context.add_recent_story_summary(include_up_to=chapter.number)
+            selection_event = character_selection_event(base_context, progress=10)
+            if selection_event:
+                yield f"data: {selection_event.model_dump_json()}\n\n"
             # Note: We DON'T add the agent instruction yet - the agent will do that
 
             # === STEP 2: Define initial generation prompt ===
@@ -75,7 +84,9 @@ async def agentic_modify_chapter(request: ModifyChapterRequest):
                 generation_temperature=settings.ENDPOINT_MODIFY_CHAPTER_TEMPERATURE,
                 generation_max_tokens=settings.ENDPOINT_MODIFY_CHAPTER_MAX_TOKENS,
                 evaluation_temperature=0.3,
-                evaluation_max_tokens=800
+                evaluation_max_tokens=800,
+                # Rewrites mostly repeat the chapter, so drafted tokens are usually accepted
+                speculative_generation=True
             )
 
             logger.info(f"Starting agentic modification of chapter {request.chapter_number} with config: {config}")
@@ -88,7 +99,7 @@ async def agentic_modify_chapter(request: ModifyChapterRequest):
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            agent = AgenticTextGenerator(llm, config=config)
+            agent = AgenticTextGenerator(llm, config=config, ticket=ticket, executor=executor)
 
             async for event in agent.generate(
                 base_context_builder=base_context,
@@ -106,7 +117,7 @@ async def agentic_modify_chapter(request: ModifyChapterRequest):
             yield f"data: {error_event.model_dump_json()}\n\n"
 
     return StreamingResponse(
-        generate_with_updates(),
+        stream_until_disconnected(http_request, generate_with_updates()),
         media_type="text/event-stream",
         headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
     )
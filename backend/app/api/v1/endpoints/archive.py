@@ -5,7 +5,7 @@ Provides endpoints for searching and retrieving archived stories,
 plus RAG-based question answering.
 """
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional
@@ -13,11 +13,13 @@ import logging
 
 from app.services.archive_service import get_archive_service
 from app.services.rag_service import get_rag_service, ChatMessage
+from app.services.inference_executor import JobPriority
 from app.models.streaming_models import (
     StreamingStatusEvent,
     StreamingResultEvent,
     StreamingErrorEvent
 )
+from app.api.v1.endpoints.shared_utils import stream_until_disconnected, admit_request
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
@@ -409,6 +411,7 @@ async def rag_query(request: RAGQueryRequest):
                 detail = "RAG feature is not available."
 
             raise HTTPException(status_code=503, detail=detail)
+        ticket = admit_request(rag_service.executor, JobPriority.NORMAL)
 
         # Build filter if provided
         filter_metadata = None
@@ -416,14 +419,16 @@ async def rag_query(request: RAGQueryRequest):
             filter_metadata = {'file_name': request.filter_file_name}
 
         # Perform RAG query
-        result = rag_service.query(
+        result = await rag_service.executor.run(
+            rag_service.query,
             question=request.question,
             n_context_chunks=request.n_context_chunks,
             max_tokens=request.max_tokens,
             temperature=(request.temperature
                          if request.temperature is not None
                          else settings.ENDPOINT_ARCHIVE_SEARCH_TEMPERATURE),
-            filter_metadata=filter_metadata)
+            filter_metadata=filter_metadata,
+            ticket=ticket)
 
         # Convert to response model
         sources = [
@@ -456,13 +461,15 @@ async def rag_query(request: RAGQueryRequest):
 
 
 @router.post("/rag/query/stream")
-async def rag_query_stream(request: RAGQueryRequest):
+async def rag_query_stream(request: RAGQueryRequest, http_request: Request):
     """
     Answer a question using RAG with Server-Sent Events streaming for real-time progress updates.
 
     Retrieves relevant story sections and uses an LLM to generate an answer
     based on the retrieved context, providing progress updates through each phase.
     """
+    rag_service = get_rag_service()
+    ticket = admit_request(rag_service.executor, JobPriority.NORMAL) if rag_service.is_enabled() else None
 
     async def generate_with_updates():
         try:
@@ -474,8 +481,6 @@ async def rag_query_stream(request: RAGQueryRequest):
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            rag_service = get_rag_service()
-
             # Check if RAG is enabled
             if not rag_service.is_enabled():
                 archive_enabled = rag_service.archive_service.is_enabled()
@@ -543,7 +548,8 @@ async def rag_query_stream(request: RAGQueryRequest):
             prompt = rag_service.build_rag_prompt(request.question, context)
 
             # Generate answer using LLM
-            answer = rag_service.llm.generate(
+            answer = await rag_service.executor.run(
+                rag_service.llm.generate,
                 prompt=prompt,
                 max_tokens=request.max_tokens or 1024,
                 temperature=(request.temperature
@@ -551,7 +557,8 @@ async def rag_query_stream(request: RAGQueryRequest):
                              else settings.ENDPOINT_ARCHIVE_SEARCH_TEMPERATURE),
                 stop=[
                     "Question:",
-                    "Context:"])
+                    "Context:"],
+                ticket=ticket)
 
             # Phase 4: Formatting
             status_event = StreamingStatusEvent(
@@ -600,7 +607,7 @@ async def rag_query_stream(request: RAGQueryRequest):
             yield f"data: {error_event.model_dump_json()}\n\n"
 
     return StreamingResponse(
-        generate_with_updates(),
+        stream_until_disconnected(http_request, generate_with_updates()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -612,13 +619,15 @@ async def rag_query_stream(request: RAGQueryRequest):
 
 
 @router.post("/rag/chat")
-async def rag_chat(request: RAGChatRequest):
+async def rag_chat(request: RAGChatRequest, http_request: Request):
     """
     Conduct a multi-turn chat conversation with RAG context using Server-Sent Events streaming.
 
     Maintains conversation history while retrieving relevant context
     for each user question, providing real-time progress updates.
     """
+    rag_service = get_rag_service()
+    ticket = admit_request(rag_service.executor, JobPriority.INTERACTIVE) if rag_service.is_enabled() else None
 
     async def generate_with_updates():
         try:
@@ -630,8 +639,6 @@ async def rag_chat(request: RAGChatRequest):
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            rag_service = get_rag_service()
-
             # Check if RAG is enabled
             if not rag_service.is_enabled():
                 archive_enabled = rag_service.archive_service.is_enabled()
@@ -676,14 +683,16 @@ async def rag_chat(request: RAGChatRequest):
             yield f"data: {status_event.model_dump_json()}\n\n"
 
             # Perform RAG chat
-            result = rag_service.chat(
+            result = await rag_service.executor.run(
+                rag_service.chat,
                 messages=messages,
                 n_context_chunks=request.n_context_chunks,
                 max_tokens=request.max_tokens,
                 temperature=(request.temperature
                              if request.temperature is not None
                              else settings.ENDPOINT_ARCHIVE_SUMMARIZE_TEMPERATURE),
-                filter_metadata=filter_metadata)
+                filter_metadata=filter_metadata,
+                ticket=ticket)
 
             # Phase 4: Formatting
             status_event = StreamingStatusEvent(
@@ -732,7 +741,7 @@ async def rag_chat(request: RAGChatRequest):
             yield f"data: {error_event.model_dump_json()}\n\n"
 
     return StreamingResponse(
-        generate_with_updates(),
+        stream_until_disconnected(http_request, generate_with_updates()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -1,7 +1,7 @@
 """
 Character feedback endpoint for Writer Assistant.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from app.models.generation_models import (
     CharacterFeedbackRequest,
@@ -15,8 +15,10 @@ from app.models.streaming_models import (
 )
 from app.models.request_context import RequestContext
 from app.services.llm_inference import get_llm
+from app.services.llm_registry import LLMTask, get_task_executor, get_task_llm
+from app.services.inference_executor import JobPriority
 from app.services.context_builder import ContextBuilder
-from app.api.v1.endpoints.shared_utils import parse_json_response, parse_list_response, get_character_details
+from app.api.v1.endpoints.shared_utils import parse_structured_response, StructuredStream, get_character_details, stream_until_disconnected, admit_request, QueuedCall, stream_chat_completion
 from app.core.config import settings
 import logging
 import json
@@ -27,13 +29,15 @@ router = APIRouter()
 
 
 @router.post("/character-feedback")
-async def character_feedback(request: CharacterFeedbackRequest):
+async def character_feedback(request: CharacterFeedbackRequest, http_request: Request):
     """Generate character feedback for a plot point using LLM with structured context and SSE streaming."""
-    llm = get_llm()
+    llm = get_task_llm(LLMTask.GENERATE, default=get_llm())
     if not llm:
         raise HTTPException(
             status_code=503,
             detail="LLM not initialized. Start server with --model-path")
+    executor = get_task_executor(LLMTask.GENERATE)
+    ticket = admit_request(executor, JobPriority.INTERACTIVE, llm=llm)
 
     async def generate_with_updates():
         try:
@@ -58,7 +62,7 @@ Your responses must reflect:
 
 Go beyond surface reactions. Show the layers—what {character.name} feels immediately, what bubbles up after, what they try to suppress, and what their body betrays before their mind catches up."""
 
-            context_builder = ContextBuilder(request.request_context, llm)
+            context_builder = ContextBuilder(request.request_context, llm, batched=True)
             context_builder.add_long_term_elements(system_prompt)
             context_builder.add_character_states()
             context_builder.add_recent_story_summary()
@@ -106,13 +110,27 @@ Make every element specific to {character.name}'s unique psychology—avoid gene
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            # Generate character feedback using LLM
-            response_text = llm.chat_completion(
-                context_builder.build_messages(),
+            build = QueuedCall(executor, ticket, context_builder.build_messages, progress=40,
+                               max_tokens=settings.ENDPOINT_CHARACTER_FEEDBACK_MAX_TOKENS)
+            async for queued_event in build.events():
+                yield queued_event
+            messages = build.result
+
+            # Stream the feedback, sending each list entry as soon as it is complete
+            stream = StructuredStream(stream_chat_completion(
+                executor,
+                llm,
+                messages,
+                prefix_message_count=context_builder.prefix_message_count,
+                affinity=context_builder.story_id,
+                ticket=ticket,
                 max_tokens=settings.ENDPOINT_CHARACTER_FEEDBACK_MAX_TOKENS,
                 temperature=settings.ENDPOINT_CHARACTER_FEEDBACK_TEMPERATURE,
                 json_schema_class=CharacterFeedback
-            )
+            ))
+            async for item_event in stream.events():
+                yield item_event
+            response_text = stream.text
 
             # Phase 3: Parsing
             status_event = StreamingStatusEvent(
@@ -122,18 +140,8 @@ Make every element specific to {character.name}'s unique psychology—avoid gene
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            parsed = parse_json_response(response_text)
-            if parsed and all(
-                k in parsed for k in [
-                    'actions',
-                    'dialog',
-                    'physicalSensations',
-                    'emotions',
-                    'internalMonologue']):
-                feedback = CharacterFeedback(**parsed)
-            else:
-                logger.debug("Failed to parse JSON", response_text)
-                raise ValueError("Failed to parse JSON from the LLM")
+            # The grammar constrained the output to CharacterFeedback
+            feedback = parse_structured_response(response_text, CharacterFeedback)
 
             # Final result
             result = CharacterFeedbackResponse(
@@ -150,7 +158,7 @@ Make every element specific to {character.name}'s unique psychology—avoid gene
             yield f"data: {error_event.model_dump_json()}\n\n"
 
     return StreamingResponse(
-        generate_with_updates(),
+        stream_until_disconnected(http_request, generate_with_updates()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -1,12 +1,11 @@
 """
 Editor review endpoint for Writer Assistant.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from app.models.generation_models import (
     EditorReviewRequest,
-    EditorReviewResponse,
-    EditorSuggestion
+    EditorReviewResponse
 )
 from app.models.streaming_models import (
     StreamingStatusEvent,
@@ -15,8 +14,10 @@ from app.models.streaming_models import (
 )
 from app.models.request_context import RequestContext
 from app.services.llm_inference import get_llm
+from app.services.llm_registry import LLMTask, get_task_executor, get_task_llm
+from app.services.inference_executor import JobPriority
 from app.services.context_builder import ContextBuilder
-from app.api.v1.endpoints.shared_utils import parse_json_response, parse_list_response
+from app.api.v1.endpoints.shared_utils import parse_structured_response, StructuredStream, stream_until_disconnected, admit_request, QueuedCall, stream_chat_completion, character_selection_event
 from app.core.config import settings
 import logging
 import json
@@ -28,13 +29,15 @@ router = APIRouter()
 
 
 @router.post("/editor-review")
-async def editor_review(request: EditorReviewRequest):
+async def editor_review(request: EditorReviewRequest, http_request: Request):
     """Generate editor review using LLM with structured context and SSE streaming."""
-    llm = get_llm()
+    llm = get_task_llm(LLMTask.RATE, default=get_llm())
     if not llm:
         raise HTTPException(
             status_code=503,
             detail="LLM not initialized. Start server with --model-path")
+    executor = get_task_executor(LLMTask.RATE)
+    ticket = admit_request(executor, JobPriority.NORMAL, llm=llm)
 
     async def generate_with_updates():
         try:
@@ -50,10 +53,15 @@ async def editor_review(request: EditorReviewRequest):
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            context_builder = ContextBuilder(request.request_context, llm)
-            context_builder.add_long_term_elements(request.request_context.configuration.system_prompts.editor_prompt)
+            context_builder = ContextBuilder(request.request_context, llm, batched=True)
+            context_builder.add_long_term_elements(
+                request.request_context.configuration.system_prompts.editor_prompt, for_chapter=chapter)
             context_builder.add_character_states()
-            context_builder.add_recent_story(include_up_to=request.chapter_number)
+            context_builder.add_recent_story(include_up_to=request.chapter_number, for_chapter=chapter)
+
+            selection_event = character_selection_event(context_builder, progress=20)
+            if selection_event:
+                yield f"data: {selection_event.model_dump_json()}\n\n"
             agent_instruction = f"""
 Review Chapter {request.chapter_number} for narrative quality and provide actionable improvement suggestions.
 
@@ -100,18 +108,27 @@ Note: Focus on constructive improvements, not just criticism. Each suggestion sh
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            # Generate editor review using streaming LLM
-            response_text = ""
-            for token in llm.chat_completion_stream(
-                context_builder.build_messages(),
+            build = QueuedCall(executor, ticket, context_builder.build_messages, progress=40,
+                               max_tokens=settings.ENDPOINT_EDITOR_REVIEW_MAX_TOKENS)
+            async for queued_event in build.events():
+                yield queued_event
+            messages = build.result
+
+            # Stream the review, sending each suggestion as soon as it is complete
+            stream = StructuredStream(stream_chat_completion(
+                executor,
+                llm,
+                messages,
+                prefix_message_count=context_builder.prefix_message_count,
+                affinity=context_builder.story_id,
+                ticket=ticket,
                 max_tokens=settings.ENDPOINT_EDITOR_REVIEW_MAX_TOKENS,
                 temperature=settings.ENDPOINT_EDITOR_REVIEW_TEMPERATURE,
                 json_schema_class=EditorReviewResponse
-            ):
-                response_text += token
-                # Optional: yield partial content updates (uncomment if desired)
-                # yield f"data: {json.dumps({'type': 'partial', 'content':
-                # token})}\n\n"
+            ))
+            async for item_event in stream.events():
+                yield item_event
+            response_text = stream.text
 
             # Phase 3: Parsing
             status_event = StreamingStatusEvent(
@@ -121,27 +138,8 @@ Note: Focus on constructive improvements, not just criticism. Each suggestion sh
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            parsed = parse_json_response(response_text)
-            if not parsed:
-                logger.debug(f"Failed to parse suggestions: {response_text}")
-                raise ValueError("Failed to parse JSON response from LLM")
-
-            suggestions = []
-            if parsed and 'suggestions' in parsed and isinstance(
-                    parsed['suggestions'], list):
-                for s in parsed['suggestions']:
-                    if isinstance(
-                            s, dict) and 'issue' in s and 'suggestion' in s:
-                        suggestions.append(EditorSuggestion(
-                            issue=s['issue'],
-                            suggestion=s['suggestion'],
-                            priority=s.get('priority', 'medium')
-                        ))
-
-            # Final result
-            result = EditorReviewResponse(
-                suggestions=suggestions
-            )
+            # The grammar constrained the output to EditorReviewResponse
+            result = parse_structured_response(response_text, EditorReviewResponse)
 
             result_event = StreamingResultEvent(data=result.model_dump())
             yield f"data: {result_event.model_dump_json()}\n\n"
@@ -152,7 +150,7 @@ Note: Focus on constructive improvements, not just criticism. Each suggestion sh
             yield f"data: {error_event.model_dump_json()}\n\n"
 
     return StreamingResponse(
-        generate_with_updates(),
+        stream_until_disconnected(http_request, generate_with_updates()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
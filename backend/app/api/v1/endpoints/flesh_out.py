@@ -1,7 +1,7 @@
 """
 Flesh out text expansion endpoint for Writer Assistant.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from app.models.generation_models import (
     FleshOutRequest,
@@ -15,7 +15,10 @@ from app.models.streaming_models import (
 )
 from app.models.request_context import RequestContext
 from app.services.llm_inference import get_llm
+from app.services.llm_registry import LLMTask, get_task_executor, get_task_llm
+from app.services.inference_executor import JobPriority
 from app.services.context_builder import ContextBuilder
+from app.api.v1.endpoints.shared_utils import PartialTextStream, stream_until_disconnected, admit_request, QueuedCall
 from app.core.config import settings
 from datetime import datetime, UTC
 from typing import Dict
@@ -29,13 +32,15 @@ router = APIRouter()
 
 
 @router.post("/flesh-out")
-async def flesh_out(request: FleshOutRequest):
+async def flesh_out(request: FleshOutRequest, http_request: Request):
     """Flesh out/expand brief text using LLM with structured context and SSE streaming."""
-    llm = get_llm()
+    llm = get_task_llm(LLMTask.GENERATE, default=get_llm())
     if not llm:
         raise HTTPException(
             status_code=503,
             detail="LLM not initialized. Start server with --model-path")
+    executor = get_task_executor(LLMTask.GENERATE)
+    ticket = admit_request(executor, JobPriority.NORMAL)
 
     agent_instructions: Dict[FleshOutType, str] = {
         FleshOutType.WORLDBUILDING: """Expand and enrich the provided worldbuilding text with additional depth and detail.
@@ -150,17 +155,24 @@ Focus on expanding the structural and narrative elements while maintaining the o
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            # Collect generated text from streaming
-            response_text = ""
-            for token in llm.chat_completion_stream(
-                context_builder.build_messages(),
+            build = QueuedCall(executor, ticket, context_builder.build_messages, progress=40,
+                               max_tokens=settings.ENDPOINT_FLESH_OUT_MAX_TOKENS)
+            async for queued_event in build.events():
+                yield queued_event
+            messages = build.result
+
+            # Stream generated text to the client as it is produced
+            text_stream = PartialTextStream(executor.stream(
+                llm.chat_completion_stream,
+                messages,
+                prefix_message_count=context_builder.prefix_message_count,
+                affinity=context_builder.story_id,
+                ticket=ticket,
                 max_tokens=settings.ENDPOINT_FLESH_OUT_MAX_TOKENS,
-                temperature=settings.ENDPOINT_FLESH_OUT_TEMPERATURE
-            ):
-                response_text += token
-                # Optional: yield partial content updates (uncomment if desired)
-                # yield f"data: {json.dumps({'type': 'partial', 'content':
-                # token})}\n\n"
+                temperature=settings.ENDPOINT_FLESH_OUT_TEMPERATURE))
+            async for partial_event in text_stream.events():
+                yield partial_event
+            response_text = text_stream.text
 
             # Phase 3: Finalizing
             status_event = StreamingStatusEvent(
@@ -188,7 +200,7 @@ Focus on expanding the structural and narrative elements while maintaining the o
             yield f"data: {error_event.model_dump_json()}\n\n"
 
     return StreamingResponse(
-        generate_with_updates(),
+        stream_until_disconnected(http_request, generate_with_updates()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -1,7 +1,7 @@
 """
 Generate chapter endpoint for Writer Assistant.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from app.models.generation_models import (
     GenerateChapterRequest,
@@ -14,7 +14,10 @@ from app.models.streaming_models import (
 )
 from app.models.request_context import RequestContext, ChapterDetails
 from app.services.llm_inference import get_llm
+from app.services.llm_registry import LLMTask, get_task_executor, get_task_llm
+from app.services.inference_executor import JobPriority
 from app.services.context_builder import ContextBuilder
+from app.api.v1.endpoints.shared_utils import PartialTextStream, stream_until_disconnected, admit_request, QueuedCall, character_selection_event
 from app.core.config import settings
 from datetime import datetime, UTC
 import logging
@@ -27,18 +30,20 @@ router = APIRouter()
 
 
 @router.post("/generate-chapter")
-async def generate_chapter(request: GenerateChapterRequest):
+async def generate_chapter(request: GenerateChapterRequest, http_request: Request):
     """Generate a complete chapter using LLM with structured context and SSE streaming."""
 
     def key_plot_items(chapter: ChapterDetails) -> str:
         key_plot_items = [f"  - {i}\n" for i in chapter.key_plot_items]
         return f"**Key Plot Items to Include:**\n{key_plot_items}" if key_plot_items else ""
 
-    llm = get_llm()
+    llm = get_task_llm(LLMTask.GENERATE, default=get_llm())
     if not llm:
         raise HTTPException(
             status_code=503,
             detail="LLM not initialized. Start server with --model-path")
+    executor = get_task_executor(LLMTask.GENERATE)
+    ticket = admit_request(executor, JobPriority.NORMAL)
 
     async def generate_with_updates():
         try:
@@ -55,9 +60,14 @@ async def generate_chapter(request: GenerateChapterRequest):
             yield f"data: {status_event.model_dump_json()}\n\n"
 
             context_builder = ContextBuilder(request.request_context, llm)
-            context_builder.add_long_term_elements(request.request_context.configuration.system_prompts.assistant_prompt)
+            context_builder.add_long_term_elements(
+                request.request_context.configuration.system_prompts.assistant_prompt, for_chapter=chapter)
             context_builder.add_character_states()
-            context_builder.add_recent_story(include_up_to=chapter.number)
+            context_builder.add_recent_story(include_up_to=chapter.number, for_chapter=chapter)
+
+            selection_event = character_selection_event(context_builder, progress=20)
+            if selection_event:
+                yield f"data: {selection_event.model_dump_json()}\n\n"
 
             agent_instruction = f"""
 Write Chapter {chapter.number} of the story, maintaining consistency with the established narrative, characters, and world.
@@ -96,17 +106,24 @@ Write the complete chapter now, developing the required plot elements in a narra
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            # Collect generated text from streaming
-            response_text = ""
-            for token in llm.chat_completion_stream(
-                context_builder.build_messages(),
+            build = QueuedCall(executor, ticket, context_builder.build_messages, progress=40,
+                               max_tokens=settings.ENDPOINT_GENERATE_CHAPTER_MAX_TOKENS)
+            async for queued_event in build.events():
+                yield queued_event
+            messages = build.result
+
+            # Stream generated text to the client as it is produced
+            text_stream = PartialTextStream(executor.stream(
+                llm.chat_completion_stream,
+                messages,
+                prefix_message_count=context_builder.prefix_message_count,
+                affinity=context_builder.story_id,
+                ticket=ticket,
                 max_tokens=settings.ENDPOINT_GENERATE_CHAPTER_MAX_TOKENS,
-                temperature=settings.ENDPOINT_GENERATE_CHAPTER_TEMPERATURE
-            ):
-                response_text += token
-                # Optional: yield partial content updates (uncomment if desired)
-                # yield f"data: {json.dumps({'type': 'partial', 'content':
-                # token})}\n\n"
+                temperature=settings.ENDPOINT_GENERATE_CHAPTER_TEMPERATURE))
+            async for partial_event in text_stream.events():
+                yield partial_event
+            response_text = text_stream.text
 
             # Phase 3: Finalizing
             status_event = StreamingStatusEvent(
@@ -134,7 +151,7 @@ Write the complete chapter now, developing the required plot elements in a narra
             yield f"data: {error_event.model_dump_json()}\n\n"
 
     return StreamingResponse(
-        generate_with_updates(),
+        stream_until_disconnected(http_request, generate_with_updates()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
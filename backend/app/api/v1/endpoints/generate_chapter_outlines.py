@@ -2,17 +2,31 @@
 Chapter Outline Generation Endpoint
 
 This endpoint generates a structured chapter outline from a story outline using AI.
+The /stream variant sends each chapter as an SSE event as soon as it is generated.
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from typing import List, Optional, Dict, Any
 import logging
 from datetime import datetime, UTC
 
-from app.services.llm_inference import get_llm
+from app.services.llm_inference import LLMInference, get_llm
+from app.services.llm_registry import LLMTask, get_task_executor, get_task_llm
+from app.services.inference_executor import JobPriority
 from app.services.context_builder import ContextBuilder
 from app.models.chapter_models import ChapterOutlineRequest, OutlineItem, ChapterOutlineResponse
-from app.api.v1.endpoints.shared_utils import parse_json_array_response
+from app.models.generation_models import GeneratedChapterOutline, GeneratedChapterOutlines
+from app.models.streaming_models import (
+    StreamingStatusEvent,
+    StreamingItemEvent,
+    StreamingResultEvent,
+    StreamingErrorEvent
+)
+from app.api.v1.endpoints.shared_utils import (
+    parse_json_array_response, admit_request, stream_until_disconnected, QueuedCall, StructuredStream,
+    stream_chat_completion
+)
 
 logger = logging.getLogger(__name__)
 
@@ -27,11 +41,13 @@ async def generate_chapter_outlines(request: ChapterOutlineRequest):
     chapter-by-chapter breakdown that can be used in the chapter development phase.
     """
     # Initialize LLM service
-    llm = get_llm()
+    llm = get_task_llm(LLMTask.GENERATE, default=get_llm())
     if not llm:
         raise HTTPException(
             status_code=503,
             detail="LLM not initialized. Start server with --model-path")
+    executor = get_task_executor(LLMTask.GENERATE)
+    ticket = admit_request(executor, JobPriority.BATCH)
 
     logger.info("Starting chapter outline generation")
     
@@ -39,8 +55,141 @@ async def generate_chapter_outlines(request: ChapterOutlineRequest):
         raise HTTPException(status_code=400, detail="Story outline cannot be empty")
     
     try:
-        # Prepare the base system prompt
-        system_prompt = """You are an expert story structure analyst and chapter outline generator with deep knowledge of narrative pacing, plot development, and three-act structure.
+        context_builder = _build_outline_context(request, llm)
+        messages = await executor.run(context_builder.build_messages, max_tokens=4000, ticket=ticket)
+
+        # Generate the chapter outline
+        response = await executor.run(
+            llm.chat_completion,
+            messages=messages,
+            prefix_message_count=context_builder.prefix_message_count,
+            affinity=context_builder.story_id,
+            ticket=ticket,
+            max_tokens=4000,
+            temperature=0.7
+        )
+        
+        # Parse the response into structured outline items
+        outline_items = _parse_chapter_outline_response(response)
+        if not outline_items:
+            raise ValueError('Failed to parse JSON response from LLM')
+        
+        logger.info(f"Successfully generated {len(outline_items)} chapter outline items")
+        
+        return ChapterOutlineResponse(
+            outline_items=outline_items,
+            context_metadata={
+                "generation_timestamp": datetime.now(UTC).isoformat(),
+                "generated_chapters": len(outline_items)
+            }
+        )
+        
+    except Exception as e:
+        logger.exception("Error generating chapter outline")
+        raise HTTPException(status_code=500, detail=f"Failed to generate chapter outline: {str(e)}")
+
+
+@router.post("/generate-chapter-outlines/stream")
+async def generate_chapter_outlines_stream(request: ChapterOutlineRequest, http_request: Request):
+    """
+    Generate a chapter outline with SSE streaming.
+
+    Each chapter is sent as an `item` event (path ["outline_items", index]) as
+    soon as the model has finished generating it; the final result event is the
+    same ChapterOutlineResponse as the non-streaming endpoint. Disconnecting
+    stops generation, so the client can cancel once it has enough chapters.
+    """
+    llm = get_task_llm(LLMTask.GENERATE, default=get_llm())
+    if not llm:
+        raise HTTPException(
+            status_code=503,
+            detail="LLM not initialized. Start server with --model-path")
+    if not request.request_context.story_outline.content.strip():
+        raise HTTPException(status_code=400, detail="Story outline cannot be empty")
+    executor = get_task_executor(LLMTask.GENERATE)
+    ticket = admit_request(executor, JobPriority.BATCH, llm=llm)
+
+    async def generate_with_updates():
+        try:
+            status_event = StreamingStatusEvent(
+                phase='context_processing',
+                message='Processing story outline...',
+                progress=10
+            )
+            yield f"data: {status_event.model_dump_json()}\n\n"
+
+            context_builder = _build_outline_context(request, llm, batched=True)
+            build = QueuedCall(executor, ticket, context_builder.build_messages, progress=10, max_tokens=4000)
+            async for queued_event in build.events():
+                yield queued_event
+            messages = build.result
+
+            status_event = StreamingStatusEvent(
+                phase='generating',
+                message='Generating chapter outline...',
+                progress=20
+            )
+            yield f"data: {status_event.model_dump_json()}\n\n"
+
+            stream = StructuredStream(stream_chat_completion(
+                executor,
+                llm,
+                messages,
+                prefix_message_count=context_builder.prefix_message_count,
+                affinity=context_builder.story_id,
+                ticket=ticket,
+                max_tokens=4000,
+                temperature=0.7,
+                json_schema_class=GeneratedChapterOutlines
+            ))
+            outline_items = []
+            async for item in stream.items():
+                # Only whole chapters (root array elements), not their plot item lists
+                if len(item.path) != 1:
+                    continue
+                outline_item = _outline_item(item.path[0], GeneratedChapterOutline.model_validate(item.value))
+                outline_items.append(outline_item)
+                item_event = StreamingItemEvent(
+                    path=["outline_items", outline_item.order - 1],
+                    value=outline_item.model_dump()
+                )
+                yield f"data: {item_event.model_dump_json()}\n\n"
+
+            if not stream.done:
+                raise ValueError("Incomplete chapter outline from the LLM (generation may have reached max_tokens)")
+            if not outline_items:
+                raise ValueError("The LLM generated no chapters")
+
+            logger.info(f"Successfully streamed {len(outline_items)} chapter outline items")
+            result = ChapterOutlineResponse(
+                outline_items=outline_items,
+                context_metadata={
+                    "generation_timestamp": datetime.now(UTC).isoformat(),
+                    "generated_chapters": len(outline_items)
+                }
+            )
+            result_event = StreamingResultEvent(data=result.model_dump())
+            yield f"data: {result_event.model_dump_json()}\n\n"
+
+        except Exception as e:
+            logger.exception("Error streaming chapter outline")
+            error_event = StreamingErrorEvent(message=str(e))
+            yield f"data: {error_event.model_dump_json()}\n\n"
+
+    return StreamingResponse(
+        stream_until_disconnected(http_request, generate_with_updates()),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
+    )
+
+
+def _build_outline_context(request: ChapterOutlineRequest, llm: LLMInference,
+                           batched: bool = False) -> ContextBuilder:
+    """Context with the outline generation prompts, shared by both endpoints (batched for the stream)."""
+    system_prompt = """You are an expert story structure analyst and chapter outline generator with deep knowledge of narrative pacing, plot development, and three-act structure.
 
 Your task is to analyze a story outline and create a detailed, well-paced chapter-by-chapter breakdown that transforms the outline into an actionable writing roadmap.
 
@@ -108,39 +257,37 @@ Example format:
 </OUTPUT_FORMAT>
 
 Respond ONLY with the JSON array, no additional text before or after."""
-        agent_prompt = f"""Please analyze the STORY_OUTLINE and create a detailed chapter breakdown:
+    agent_prompt = f"""Please analyze the STORY_OUTLINE and create a detailed chapter breakdown:
 
 Create a chapter-by-chapter outline that breaks down this story into well-structured chapters. Include all the elements in the plot outline to the story in the relevant chapter. Each chapter should advance the plot and contribute to the overall narrative arc. Consider the characters listed above and identify which characters are involved in each chapter."""
 
-        context_builder = ContextBuilder(request.request_context, llm)
-        context_builder.add_long_term_elements(system_prompt)
-        context_builder.add_agent_instruction(agent_prompt)
-        
-        # Generate the chapter outline
-        response = llm.chat_completion(
-            messages=context_builder.build_messages(),
-            max_tokens=4000,
-            temperature=0.7
-        )
-        
-        # Parse the response into structured outline items
-        outline_items = _parse_chapter_outline_response(response)
-        if not outline_items:
-            raise Exeption('Failed to parse JSON response from LLM')
-        
-        logger.info(f"Successfully generated {len(outline_items)} chapter outline items")
-        
-        return ChapterOutlineResponse(
-            outline_items=outline_items,
-            context_metadata={
-                "generation_timestamp": datetime.now(UTC).isoformat(),
-                "generated_chapters": len(outline_items)
-            }
-        )
-        
-    except Exception as e:
-        logger.exception("Error generating chapter outline")
-        raise HTTPException(status_code=500, detail=f"Failed to generate chapter outline: {str(e)}")
+    context_builder = ContextBuilder(request.request_context, llm, batched=batched)
+    context_builder.add_long_term_elements(system_prompt)
+    context_builder.add_agent_instruction(agent_prompt)
+    return context_builder
+
+
+def _outline_item(index: int, chapter: GeneratedChapterOutline) -> OutlineItem:
+    """Outline item for the chapter at position index (0-based) of the generated array."""
+    # If no key plot items provided, fall back to the description
+    key_plot_items = chapter.key_plot_items
+    if not key_plot_items and chapter.description:
+        key_plot_items = [chapter.description]
+
+    return OutlineItem(
+        id=f"chapter-{index+1}",
+        title=chapter.title,
+        description=chapter.description,
+        key_plot_items=key_plot_items,
+        order=index+1,
+        status="draft",
+        involved_characters=chapter.involved_characters,
+        metadata={
+            "created": datetime.now(UTC).isoformat(),
+            "lastModified": datetime.now(UTC).isoformat()
+        }
+    )
+
 
 def _parse_chapter_outline_response(response: str) -> List[OutlineItem]:
     """
@@ -157,28 +304,13 @@ def _parse_chapter_outline_response(response: str) -> List[OutlineItem]:
     if chapters_data and isinstance(chapters_data, list):
         for i, chapter_data in enumerate(chapters_data):
             if isinstance(chapter_data, dict):
-                # Extract key plot items, fallback to description if not provided
-                key_plot_items = chapter_data.get("key_plot_items", [])
-                description = chapter_data.get("description", "")
-                
-                # If no key plot items provided, try to create them from description
-                if not key_plot_items and description:
-                    key_plot_items = [description]
-                
-                outline_item = OutlineItem(
-                    id=f"chapter-{i+1}",
+                chapter = GeneratedChapterOutline(
                     title=chapter_data.get("title", f"Chapter {i+1}"),
-                    description=description,
-                    key_plot_items=key_plot_items,
-                    order=i+1,
-                    status="draft",
-                    involved_characters=chapter_data.get("involved_characters", []),
-                    metadata={
-                        "created": datetime.now(UTC).isoformat(),
-                        "lastModified": datetime.now(UTC).isoformat()
-                    }
+                    description=chapter_data.get("description", ""),
+                    key_plot_items=chapter_data.get("key_plot_items", []),
+                    involved_characters=chapter_data.get("involved_characters", [])
                 )
-                outline_items.append(outline_item)
+                outline_items.append(_outline_item(i, chapter))
         
         if outline_items:
             logger.info(f"Successfully parsed {len(outline_items)} chapters from JSON response")
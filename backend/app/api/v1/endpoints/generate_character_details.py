@@ -1,7 +1,7 @@
 """
 Generate character details endpoint for Writer Assistant.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from app.models.generation_models import (
     GenerateCharacterDetailsRequest,
@@ -14,8 +14,10 @@ from app.models.streaming_models import (
     StreamingErrorEvent
 )
 from app.services.llm_inference import get_llm
+from app.services.llm_registry import LLMTask, get_task_executor, get_task_llm
+from app.services.inference_executor import JobPriority
 from app.services.context_builder import ContextBuilder
-from app.api.v1.endpoints.shared_utils import parse_json_response, get_character_details
+from app.api.v1.endpoints.shared_utils import parse_json_response, get_character_details, stream_until_disconnected, admit_request, QueuedCall
 
 from app.core.config import settings
 import logging
@@ -28,13 +30,15 @@ router = APIRouter()
 
 
 @router.post("/generate-character-details")
-async def generate_character_details(request: GenerateCharacterDetailsRequest):
+async def generate_character_details(request: GenerateCharacterDetailsRequest, http_request: Request):
     """Generate detailed character information using LLM with structured context and SSE streaming."""
-    llm = get_llm()
+    llm = get_task_llm(LLMTask.GENERATE, default=get_llm())
     if not llm:
         raise HTTPException(
             status_code=503,
             detail="LLM not initialized. Start server with --model-path")
+    executor = get_task_executor(LLMTask.GENERATE)
+    ticket = admit_request(executor, JobPriority.NORMAL)
 
     async def generate_with_updates():
         try:
@@ -107,10 +111,18 @@ Respond ONLY in JSON format with these exact fields (and no extra escaping):
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
+            build = QueuedCall(executor, ticket, context_builder.build_messages, progress=40,
+                               max_tokens=settings.ENDPOINT_GENERATE_CHARACTER_DETAILS_MAX_TOKENS)
+            async for queued_event in build.events():
+                yield queued_event
+            messages = build.result
+
             # Collect generated text from streaming
             response_text = ""
-            for token in llm.chat_completion_stream(
-                    context_builder.build_messages(),
+            async for token in executor.stream(
+                    llm.chat_completion_stream,
+                    messages,
+                    ticket=ticket,
                     max_tokens=settings.ENDPOINT_GENERATE_CHARACTER_DETAILS_MAX_TOKENS,
                     temperature=settings.ENDPOINT_GENERATE_CHARACTER_DETAILS_TEMPERATURE,
                     json_schema_class=CharacterInfo):
@@ -156,7 +168,7 @@ Respond ONLY in JSON format with these exact fields (and no extra escaping):
             yield f"data: {error_event.model_dump_json()}\n\n"
 
     return StreamingResponse(
-        generate_with_updates(),
+        stream_until_disconnected(http_request, generate_with_updates()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -2,7 +2,7 @@
 LLM Chat endpoint for direct conversations with AI agents.
 Separate from RAG chat functionality.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from app.models.chat_models import LLMChatRequest, LLMChatResponse, ConversationMessage
 from app.models.streaming_models import (
@@ -12,7 +12,10 @@ from app.models.streaming_models import (
 )
 from app.models.request_context import RequestContext
 from app.services.llm_inference import get_llm
+from app.services.llm_registry import LLMTask, get_task_executor, get_task_llm
+from app.services.inference_executor import JobPriority
 from app.services.context_builder import ContextBuilder
+from app.api.v1.endpoints.shared_utils import stream_until_disconnected, admit_request, QueuedCall
 from datetime import datetime, UTC
 import logging
 import json
@@ -83,16 +86,18 @@ Approach: Be curious and exploratory. Use the "iceberg principle" - not everythi
 
 
 @router.post("/chat/llm")
-async def llm_chat(request: LLMChatRequest):
+async def llm_chat(request: LLMChatRequest, http_request: Request):
     """
     Direct LLM chat for interactive conversations with AI agents using SSE streaming.
     Separate from RAG chat functionality.
     """
-    llm = get_llm()
+    llm = get_task_llm(LLMTask.CHAT, default=get_llm())
     if not llm:
         raise HTTPException(
             status_code=503,
             detail="LLM not initialized. Start server with --model-path")
+    executor = get_task_executor(LLMTask.CHAT)
+    ticket = admit_request(executor, JobPriority.INTERACTIVE)
 
     async def generate_with_updates():
         try:
@@ -127,12 +132,22 @@ async def llm_chat(request: LLMChatRequest):
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            # Get LLM response
-            response_text = llm.chat_completion(
-                context_builder.build_messages(),
+            build = QueuedCall(executor, ticket, context_builder.build_messages, progress=40,
+                               max_tokens=request.max_tokens)
+            async for queued_event in build.events():
+                yield queued_event
+            messages = build.result
+
+            # Get LLM response (streamed so a client disconnect stops generation)
+            response_text = ''.join([token async for token in executor.stream(
+                llm.chat_completion_stream,
+                messages,
+                prefix_message_count=context_builder.prefix_message_count,
+                affinity=context_builder.story_id,
+                ticket=ticket,
                 max_tokens=request.max_tokens,
                 temperature=request.temperature
-            )
+            )]).strip()
 
             # Phase 3: Formatting
             status_event = StreamingStatusEvent(
@@ -162,7 +177,7 @@ async def llm_chat(request: LLMChatRequest):
             yield f"data: {error_event.model_dump_json()}\n\n"
 
     return StreamingResponse(
-        generate_with_updates(),
+        stream_until_disconnected(http_request, generate_with_updates()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -1,7 +1,7 @@
 """
 Rater feedback endpoint for Writer Assistant.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from app.models.generation_models import (
     RaterFeedbackRequest,
@@ -15,8 +15,10 @@ from app.models.streaming_models import (
     StreamingErrorEvent
 )
 from app.services.llm_inference import get_llm
+from app.services.llm_registry import LLMTask, get_task_executor, get_task_llm
+from app.services.inference_executor import JobPriority
 from app.services.context_builder import ContextBuilder
-from app.api.v1.endpoints.shared_utils import parse_json_response, parse_list_response
+from app.api.v1.endpoints.shared_utils import parse_structured_response, StructuredStream, stream_until_disconnected, admit_request, QueuedCall, stream_chat_completion
 from app.core.config import settings
 import logging
 import json
@@ -28,7 +30,7 @@ router = APIRouter()
 
 
 @router.post("/rater-feedback")
-async def rater_feedback_stream(request: RaterFeedbackRequest):
+async def rater_feedback_stream(request: RaterFeedbackRequest, http_request: Request):
     """Generate rater feedback with Server-Sent Events streaming for real-time progress updates."""
 
     def get_rater_prompt() -> str:
@@ -40,11 +42,13 @@ async def rater_feedback_stream(request: RaterFeedbackRequest):
             raise ValueError(f"Duplicate rater name {request.raterName}")
         return raters[0].system_prompt
 
-    llm = get_llm()
+    llm = get_task_llm(LLMTask.RATE, default=get_llm())
     if not llm:
         raise HTTPException(
             status_code=503,
             detail="LLM not initialized. Start server with --model-path")
+    executor = get_task_executor(LLMTask.RATE)
+    ticket = admit_request(executor, JobPriority.NORMAL, llm=llm)
 
     async def generate_with_updates():
         try:
@@ -75,7 +79,7 @@ Your feedback should be:
 
 Maintain a supportive but honest tone - your goal is to help the writer create the best story possible."""
 
-            context_builder = ContextBuilder(request.request_context, llm)
+            context_builder = ContextBuilder(request.request_context, llm, batched=True)
             context_builder.add_long_term_elements(system_prompt)
             context_builder.add_character_states()
             context_builder.add_recent_story_summary()
@@ -108,18 +112,27 @@ Generate 4-6 suggestions, each with an issue, suggestion, and priority level.
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            # Generate editor review using streaming LLM
-            response_text = ""
-            for token in llm.chat_completion_stream(
-                context_builder.build_messages(),
+            build = QueuedCall(executor, ticket, context_builder.build_messages, progress=40,
+                               max_tokens=settings.ENDPOINT_RATER_FEEDBACK_MAX_TOKENS)
+            async for queued_event in build.events():
+                yield queued_event
+            messages = build.result
+
+            # Stream the review, sending each suggestion as soon as it is complete
+            stream = StructuredStream(stream_chat_completion(
+                executor,
+                llm,
+                messages,
+                prefix_message_count=context_builder.prefix_message_count,
+                affinity=context_builder.story_id,
+                ticket=ticket,
                 max_tokens=settings.ENDPOINT_RATER_FEEDBACK_MAX_TOKENS,
                 temperature=settings.ENDPOINT_RATER_FEEDBACK_TEMPERATURE,
                 json_schema_class=RaterFeedback
-            ):
-                response_text += token
-                # Optional: yield partial content updates (uncomment if desired)
-                # yield f"data: {json.dumps({'type': 'partial', 'content':
-                # token})}\n\n"
+            ))
+            async for item_event in stream.events():
+                yield item_event
+            response_text = stream.text
 
             # Phase 3: Parsing
             status_event = StreamingStatusEvent(
@@ -129,14 +142,8 @@ Generate 4-6 suggestions, each with an issue, suggestion, and priority level.
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            # Parse the response
-            parsed = parse_json_response(response_text)
-
-            if parsed and 'opinion' in parsed and 'suggestions' in parsed:
-                feedback = RaterFeedback(**parsed)
-            else:
-                logger.debug(f"Failed to parse JSON: {response_text}")
-                raise ValueError("Failed to parse JSON output from LLM")
+            # The grammar constrained the output to RaterFeedback
+            feedback = parse_structured_response(response_text, RaterFeedback)
 
             # Final result
             result = RaterFeedbackResponse(
@@ -154,7 +161,7 @@ Generate 4-6 suggestions, each with an issue, suggestion, and priority level.
             yield f"data: {error_event.model_dump_json()}\n\n"
 
     return StreamingResponse(
-        generate_with_updates(),
+        stream_until_disconnected(http_request, generate_with_updates()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
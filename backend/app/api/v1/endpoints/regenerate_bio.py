@@ -1,7 +1,7 @@
 """
 Regenerate bio endpoint for Writer Assistant.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from app.models.generation_models import (
     RegenerateBioRequest,
@@ -14,8 +14,10 @@ from app.models.streaming_models import (
 )
 from app.models.request_context import RequestContext, CharacterDetails
 from app.services.llm_inference import get_llm
+from app.services.llm_registry import LLMTask, get_task_executor, get_task_llm
+from app.services.inference_executor import JobPriority
 from app.services.context_builder import ContextBuilder
-from app.api.v1.endpoints.shared_utils import get_character_details
+from app.api.v1.endpoints.shared_utils import get_character_details, PartialTextStream, stream_until_disconnected, admit_request, QueuedCall
 from app.core.config import settings
 import logging
 import json
@@ -26,13 +28,15 @@ router = APIRouter()
 
 
 @router.post("/regenerate-bio")
-async def regenerate_bio(request: RegenerateBioRequest):
+async def regenerate_bio(request: RegenerateBioRequest, http_request: Request):
     """Regenerate character bio from detailed character information using LLM with SSE streaming."""
-    llm = get_llm()
+    llm = get_task_llm(LLMTask.GENERATE, default=get_llm())
     if not llm:
         raise HTTPException(
             status_code=503,
             detail="LLM not initialized. Start server with --model-path")
+    executor = get_task_executor(LLMTask.GENERATE)
+    ticket = admit_request(executor, JobPriority.NORMAL)
 
     async def generate_with_updates():
         try:
@@ -79,13 +83,22 @@ Write a bio that makes the reader immediately understand and care about who this
             )
             yield f"data: {status_event.model_dump_json()}\n\n"
 
-            # Collect generated text from streaming
-            response_text = ""
-            for token in llm.chat_completion_stream(
-                    context_builder.build_messages(),
-                    max_tokens=settings.ENDPOINT_GENERATE_CHARACTER_DETAILS_MAX_TOKENS,
-                    temperature=settings.ENDPOINT_GENERATE_CHARACTER_DETAILS_TEMPERATURE):
-                response_text += token
+            build = QueuedCall(executor, ticket, context_builder.build_messages, progress=40,
+                               max_tokens=settings.ENDPOINT_GENERATE_CHARACTER_DETAILS_MAX_TOKENS)
+            async for queued_event in build.events():
+                yield queued_event
+            messages = build.result
+
+            # Stream generated text to the client as it is produced
+            text_stream = PartialTextStream(executor.stream(
+                llm.chat_completion_stream,
+                messages,
+                ticket=ticket,
+                max_tokens=settings.ENDPOINT_GENERATE_CHARACTER_DETAILS_MAX_TOKENS,
+                temperature=settings.ENDPOINT_GENERATE_CHARACTER_DETAILS_TEMPERATURE))
+            async for partial_event in text_stream.events():
+                yield partial_event
+            response_text = text_stream.text
             
             # Phase 3: Processing
             status_event = StreamingStatusEvent(
@@ -109,7 +122,7 @@ Write a bio that makes the reader immediately understand and care about who this
             yield f"data: {error_event.model_dump_json()}\n\n"
 
     return StreamingResponse(
-        generate_with_updates(),
+        stream_until_disconnected(http_request, generate_with_updates()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
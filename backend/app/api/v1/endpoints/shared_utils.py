@@ -1,10 +1,27 @@
 """
 Shared utility functions for AI generation endpoints.
 """
+import asyncio
 import json
+import logging
 import re
+import time
+from typing import Any, AsyncIterator, Callable, List, Optional, Type, TypeVar
 
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, ValidationError
+
+from app.core.config import settings
 from app.models.request_context import RequestContext, CharacterDetails
+from app.models.streaming_models import StreamingItemEvent, StreamingPartialEvent, StreamingStatusEvent
+from app.services.context_builder import ContextBuilder
+from app.services.inference_executor import InferenceExecutor, JobPriority, QueueFullError, QueueTicket
+from app.services.llm_inference import LLMInference
+from app.services.streaming_json import IncrementalJSONParser, JSONItem
+
+logger = logging.getLogger(__name__)
+
+ModelT = TypeVar('ModelT', bound=BaseModel)
 
 
 def parse_json_response(text: str) -> dict:
@@ -28,6 +45,28 @@ def parse_json_response(text: str) -> dict:
     return None
 
 
+def parse_structured_response(text: str, schema_class: Type[ModelT]) -> ModelT:
+    """
+    Validate output generated with json_schema_class=schema_class.
+
+    The grammar makes the model emit exactly one JSON document matching the
+    schema, so the whole text is parsed; it can only fail when generation
+    stopped early (max_tokens) or the output was not grammar-constrained.
+
+    Raises:
+        ValueError: If the text is not a valid schema_class document
+    """
+    try:
+        return schema_class.model_validate_json(text)
+    except ValidationError as e:
+        logger.debug(f"Invalid {schema_class.__name__} output: {text}")
+        if any(error['type'] == 'json_invalid' for error in e.errors()):
+            raise ValueError(
+                f"Incomplete JSON from the LLM for {schema_class.__name__} "
+                f"(generation may have reached max_tokens)") from e
+        raise ValueError(f"LLM output does not match {schema_class.__name__}: {e}") from e
+
+
 def parse_list_response(text: str, key: str) -> list:
     """Extract a list from LLM response"""
     lines = [line.strip() for line in text.split('\n') if line.strip()]
@@ -62,4 +101,323 @@ def get_character_details(request_context: RequestContext, character_name: str)
         raise ValueError(f"Character {character_name} not found in request_context")
     elif len(characters) > 1:
         raise ValueError(f"Duplicate character name {character_name}")
-    return characters[0]
\ No newline at end of file
+    return characters[0]
+
+
+class PartialTextStream:
+    """
+    Turns a token stream into coalesced `partial` SSE events.
+
+    Tokens are buffered and flushed as one event once flush_tokens tokens have
+    accumulated or flush_interval_ms has passed since the previous event, so
+    the client sees text as soon as generation starts without receiving one
+    event per token. The complete text is available as `text` once the
+    events have been consumed.
+
+    Usage:
+        stream = PartialTextStream(executor.stream(llm.chat_completion_stream, messages))
+        async for event in stream.events():
+            yield event
+        response_text = stream.text
+    """
+
+    def __init__(
+            self,
+            tokens: AsyncIterator[str],
+            flush_tokens: Optional[int] = None,
+            flush_interval_ms: Optional[int] = None):
+        self._tokens = tokens
+        self.flush_tokens = flush_tokens if flush_tokens is not None else settings.STREAMING_PARTIAL_FLUSH_TOKENS
+        self.flush_interval_ms = (flush_interval_ms if flush_interval_ms is not None
+                                  else settings.STREAMING_PARTIAL_FLUSH_MS)
+        self._parts: List[str] = []
+        self._pending: List[str] = []
+        self.token_count = 0
+
+    @property
+    def text(self) -> str:
+        """All text received so far."""
+        return ''.join(self._parts)
+
+    async def events(self) -> AsyncIterator[str]:
+        """Consume the token stream, yielding formatted SSE `partial` events."""
+        last_flush = time.monotonic()
+        async for token in self._tokens:
+            self._parts.append(token)
+            self._pending.append(token)
+            self.token_count += 1
+            now = time.monotonic()
+            if (len(self._pending) >= self.flush_tokens or
+                    (now - last_flush) * 1000 >= self.flush_interval_ms):
+                yield self._flush()
+                last_flush = now
+        if self._pending:
+            yield self._flush()
+
+    def _flush(self) -> str:
+        event = StreamingPartialEvent(content=''.join(self._pending), token_count=self.token_count)
+        self._pending = []
+        return f"data: {event.model_dump_json()}\n\n"
+
+
+class StructuredStream:
+    """
+    Turns a grammar-constrained token stream into `item` SSE events.
+
+    Each list element (and each member of the root object) is sent as soon as
+    it is complete, so clients can show feedback before the final result. The
+    token stream is closed as soon as the document is complete, and on the
+    first token that cannot continue valid JSON, in which case JSONStreamError
+    (a ValueError) is raised instead of generating on to max_tokens. The
+    complete text is available as `text` once the events have been consumed.
+
+    Usage:
+        stream = StructuredStream(stream_chat_completion(..., json_schema_class=SomeModel))
+        async for event in stream.events():
+            yield event
+        result = parse_structured_response(stream.text, SomeModel)
+
+    Endpoints that send their own events per value iterate items() instead.
+    """
+
+    def __init__(self, tokens: AsyncIterator[str]):
+        self._tokens = tokens
+        self._parser = IncrementalJSONParser()
+        self.token_count = 0
+
+    @property
+    def text(self) -> str:
+        """All text received so far."""
+        return self._parser.text
+
+    @property
+    def done(self) -> bool:
+        """Whether the complete document has been received."""
+        return self._parser.done
+
+    async def events(self) -> AsyncIterator[str]:
+        """Consume the token stream, yielding formatted SSE `item` events."""
+        items = self.items()
+        try:
+            async for item in items:
+                event = StreamingItemEvent(path=list(item.path), value=item.value)
+                yield f"data: {event.model_dump_json()}\n\n"
+        finally:
+            await items.aclose()
+
+    async def items(self) -> AsyncIterator[JSONItem]:
+        """Consume the token stream, yielding each value as it is completed."""
+        try:
+            async for token in self._tokens:
+                self.token_count += 1
+                for item in self._parser.feed(token):
+                    yield item
+                if self._parser.done:
+                    break
+        finally:
+            aclose = getattr(self._tokens, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+
+def stream_chat_completion(
+        executor: InferenceExecutor,
+        llm: LLMInference,
+        messages: List[dict],
+        *,
+        ticket: Optional[QueueTicket] = None,
+        prefix_message_count: Optional[int] = None,
+        affinity: Optional[str] = None,
+        **params) -> AsyncIterator[str]:
+    """
+    Token stream of a chat completion, decoded in the shared batch when batching is enabled.
+
+    With LLM_BATCH_MAX_SEQUENCES > 1, concurrent requests share decode steps in
+    llm.batch_engine; otherwise this is executor.stream(llm.chat_completion_stream, ...).
+    Batched requests wait for a sequence in ticket order, like executor jobs;
+    prefix state caching and preemption only apply to the executor path.
+
+    Args:
+        executor: The inference executor
+        llm: The LLM instance
+        messages: Chat messages from ContextBuilder.build_messages
+        ticket: Request ticket from admit_request
+        prefix_message_count: ContextBuilder.prefix_message_count
+        affinity: ContextBuilder.story_id
+        **params: Generation parameters (max_tokens, temperature, json_schema_class, ...)
+
+    Returns:
+        Async iterator of generated text
+    """
+    if llm.batch_engine is not None:
+        return llm.batch_engine.stream(messages, ticket=ticket, **params)
+    return executor.stream(
+        llm.chat_completion_stream,
+        messages,
+        prefix_message_count=prefix_message_count,
+        affinity=affinity,
+        ticket=ticket,
+        **params)
+
+
+def character_selection_event(context_builder: ContextBuilder, progress: int) -> Optional[StreamingStatusEvent]:
+    """
+    Status event reporting which characters got full profiles, if the builder filtered them.
+
+    Args:
+        context_builder: Builder after add_long_term_elements(for_chapter=...)
+        progress: Progress of the event
+
+    Returns:
+        The event, or None if every profile was kept
+    """
+    selection = context_builder.character_selection
+    if selection is None:
+        return None
+    total = len(selection.involved) + len(selection.stubbed)
+    return StreamingStatusEvent(
+        phase='context_processing',
+        message=(f'Full profiles for {len(selection.involved)} of {total} characters '
+                 f'({selection.saved_tokens} prompt tokens saved)'),
+        progress=progress,
+        data=selection.to_dict())
+
+
+def admit_request(executor: InferenceExecutor, priority: JobPriority,
+                  llm: Optional[LLMInference] = None) -> QueueTicket:
+    """
+    Admit an LLM request, or reject it with 429 when the inference queue is full.
+
+    Call this in the endpoint before returning the StreamingResponse, and pass
+    the ticket with every executor call made for the request.
+
+    Args:
+        executor: The inference executor
+        priority: Scheduling class of the endpoint
+        llm: Model the request streams from with stream_chat_completion; when
+            it has a batch engine, requests waiting for a batch sequence are
+            bounded too
+
+    Returns:
+        QueueTicket for the request
+
+    Raises:
+        HTTPException: 429 with a Retry-After header if too many jobs are waiting
+    """
+    try:
+        batch_engine = llm.batch_engine if llm is not None else None
+        if batch_engine is not None:
+            batch_engine.check_admission()
+        return executor.admit(priority)
+    except QueueFullError as e:
+        logger.warning(f"Rejecting request: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail="The model is busy. Please retry later.",
+            headers={"Retry-After": str(e.retry_after)})
+
+
+class QueuedCall:
+    """
+    Runs an executor job and reports the request's queue position while it waits.
+
+    While the job is queued behind other requests, a `queued` status event is
+    sent whenever its position changes. The job's return value is available as
+    `result` once the events have been consumed.
+
+    Usage:
+        build = QueuedCall(executor, ticket, context_builder.build_messages, progress=40)
+        async for event in build.events():
+            yield event
+        messages = build.result
+    """
+
+    def __init__(
+            self,
+            executor: InferenceExecutor,
+            ticket: QueueTicket,
+            func: Callable[..., Any],
+            *args,
+            progress: int = 0,
+            poll_interval: float = 0.5,
+            **kwargs):
+        self._executor = executor
+        self._ticket = ticket
+        self._call = (func, args, kwargs)
+        self._progress = progress
+        self._poll_interval = poll_interval
+        self.result: Any = None
+
+    async def events(self) -> AsyncIterator[str]:
+        func, args, kwargs = self._call
+        job = asyncio.ensure_future(self._executor.run(func, *args, ticket=self._ticket, **kwargs))
+        try:
+            # Jobs picked up within the first interval never report a position
+            await asyncio.wait({job}, timeout=self._poll_interval)
+            last_position = None
+            while not job.done():
+                position = self._executor.queue_position(self._ticket)
+                if position is None:
+                    break
+                if position != last_position:
+                    last_position = position
+                    event = StreamingStatusEvent(
+                        phase='queued',
+                        message=f'Waiting for the model ({position} in queue)...',
+                        progress=self._progress,
+                        data={'queue_position': position})
+                    yield f"data: {event.model_dump_json()}\n\n"
+                await asyncio.wait({job}, timeout=self._poll_interval)
+            self.result = await job
+        finally:
+            # Abandon the job if the client went away while it was queued
+            if not job.done():
+                job.cancel()
+
+
+async def stream_until_disconnected(
+        http_request: Request,
+        events: AsyncIterator[str],
+        poll_interval: float = 0.5) -> AsyncIterator[str]:
+    """
+    Forward SSE events until the client disconnects.
+
+    While waiting for the next event (which can take minutes during a JSON
+    generation that sends nothing in between) the connection is polled with
+    http_request.is_disconnected(). On disconnect the pending step of `events`
+    is cancelled, which abandons its inference job: the LLM stops generating
+    and the model is free for the next queued request.
+
+    Args:
+        http_request: The incoming request of the streaming endpoint
+        events: The endpoint's SSE event generator
+        poll_interval: Seconds between disconnect checks
+
+    Yields:
+        The events produced by `events`
+    """
+    iterator = events.__aiter__()
+    try:
+        while True:
+            next_event = asyncio.ensure_future(iterator.__anext__())
+            while True:
+                done, _ = await asyncio.wait({next_event}, timeout=poll_interval)
+                if done:
+                    break
+                if await http_request.is_disconnected():
+                    logger.info(f"Client disconnected from {http_request.url.path}; cancelling generation")
+                    next_event.cancel()
+                    try:
+                        await next_event
+                    except (asyncio.CancelledError, StopAsyncIteration):
+                        pass
+                    return
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield event
+    finally:
+        aclose = getattr(iterator, 'aclose', None)
+        if aclose is not None:
+            await aclose()
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Dict, Literal, Optional
 from pydantic_settings import BaseSettings
 from pydantic import ConfigDict, Field
 
@@ -47,6 +47,63 @@ class Settings(BaseSettings):
     LLM_CACHE_CAPACITY: int = Field(
         default=2*(1024**3),
         description="LLM prefix cache size (bytes); 0 to disable.")
+    LLM_PREFIX_CACHE_CAPACITY: int = Field(
+        default=1024**3,
+        ge=0,
+        description="Size of the cache of evaluated long-term context prefixes (bytes); 0 to disable.")
+    LLM_STATE_CACHE_DIR: Optional[str] = Field(
+        default=None,
+        description="Directory persisting evaluated context prefixes across restarts (None = disabled)")
+    LLM_STATE_CACHE_SIZE: int = Field(
+        default=10*(1024**3),
+        ge=0,
+        description="Maximum size of the on-disk state cache (bytes)")
+    LLM_POOL_SIZE: int = Field(
+        default=1,
+        ge=1,
+        description="Number of model replicas serving requests in parallel")
+    LLM_THREADS_PER_REPLICA: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="CPU threads per replica when LLM_POOL_SIZE > 1 (None = split LLM_N_THREADS or all cores evenly)")
+    LLM_MAX_QUEUE_DEPTH: int = Field(
+        default=32,
+        ge=0,
+        description="Waiting LLM jobs at which new requests are rejected with 429 (0 = no limit)")
+    LLM_BATCH_MAX_SEQUENCES: int = Field(
+        default=1,
+        ge=1,
+        le=64,
+        description="Concurrent requests decoded together in one batch (1 disables batched decoding)")
+    LLM_BATCH_CTX_PER_SEQUENCE: int = Field(
+        default=2048,
+        ge=256,
+        description="Context size of each batched sequence (capped at LLM_N_CTX)")
+    LLM_MODELS: Dict[str, str] = Field(
+        default_factory=dict,
+        description="Extra models by name, as JSON mapping name to GGUF path, for LLM_TASK_ROUTES")
+    LLM_TASK_ROUTES: Dict[str, str] = Field(
+        default_factory=dict,
+        description="JSON mapping task (summarize, evaluate, rate, generate, chat) to a model in LLM_MODELS; "
+                    "unrouted tasks use MODEL_PATH")
+    LLM_SPECULATIVE_DECODING: Literal["off", "prompt_lookup", "draft_model"] = Field(
+        default="off",
+        description="Drafter for speculative decoding of rewrites: off, prompt_lookup or draft_model")
+    LLM_DRAFT_MODEL_PATH: Optional[str] = Field(
+        default=None,
+        description="Small GGUF model sharing the main model's vocabulary, used when LLM_SPECULATIVE_DECODING=draft_model")
+    LLM_DRAFT_TOKENS: int = Field(
+        default=10,
+        ge=1,
+        le=64,
+        description="Tokens proposed per speculative draft")
+    LLM_PREEMPTION: bool = Field(
+        default=True,
+        description="Pause running generations at token boundaries to serve higher-priority requests")
+    LLM_TOKEN_CACHE_CAPACITY: int = Field(
+        default=1_000_000,
+        ge=0,
+        description="Total token ids kept by the tokenization cache (0 to disable)")
 
     # LLM Generation Settings
     LLM_TEMPERATURE: float = Field(
@@ -99,6 +156,50 @@ class Settings(BaseSettings):
         le=10000,
         description="Reserved tokens for generation buffer"
     )
+    CONTEXT_SUMMARY_CONCURRENCY: int = Field(
+        default=0,
+        ge=0,
+        description="Over-budget context elements summarized at the same time (0 for one per inference worker)"
+    )
+    CONTEXT_RETRIEVAL: bool = Field(
+        default=False,
+        description="Fill an over-budget RECENT_STORY with the passages most relevant to the target chapter"
+    )
+    CONTEXT_RETRIEVAL_MODEL: str = Field(
+        default="sentence-transformers/all-MiniLM-L6-v2",
+        description="sentence-transformers model embedding story passages for CONTEXT_RETRIEVAL (runs on the CPU)"
+    )
+    CONTEXT_RETRIEVAL_PASSAGE_WORDS: int = Field(
+        default=200,
+        ge=20,
+        le=2000,
+        description="Target length in words of the passages chapters are split into for CONTEXT_RETRIEVAL"
+    )
+    CONTEXT_CHARACTER_FILTER: bool = Field(
+        default=False,
+        description="Give full profiles only to characters involved in the target chapter; the rest get one-line stubs"
+    )
+    SUMMARY_CACHE_SIZE: int = Field(
+        default=256,
+        ge=0,
+        description="Maximum number of context summaries kept in memory"
+    )
+    SUMMARY_CACHE_DB_PATH: Optional[str] = Field(
+        default=None,
+        description="SQLite file for persisting context summaries across restarts (None keeps them in memory only)"
+    )
+
+    # Streaming Configuration
+    STREAMING_PARTIAL_FLUSH_TOKENS: int = Field(
+        default=8,
+        ge=1,
+        description="Send a partial text event after this many generated tokens"
+    )
+    STREAMING_PARTIAL_FLUSH_MS: int = Field(
+        default=150,
+        ge=0,
+        description="Send a partial text event after this many milliseconds, even if fewer tokens are buffered"
+    )
 
     # Endpoint-Specific Generation Settings
     # Character Feedback Endpoint
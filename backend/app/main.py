@@ -6,6 +6,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.api.v1.api import api_router
 from app.core.config import settings
 from app.services.llm_inference import initialize_llm, LLMInferenceConfig, get_llm
+from app.services.inference_executor import get_inference_executor, shutdown_inference_executor
+from app.services.llm_registry import get_model_registry, initialize_models, shutdown_models
+from app.services.grammar_cache import get_grammar_cache, warm_grammar_cache
+from app.services.summary_cache import get_summary_cache
 
 # Configure logging
 logging.basicConfig(
@@ -35,13 +39,26 @@ async def load_llm_async():
     try:
         # Run LLM initialization in a thread pool to avoid blocking
         loop = asyncio.get_event_loop()
+        # Structured-output grammars only depend on the response models
+        grammar_task = loop.run_in_executor(None, warm_grammar_cache)
         await loop.run_in_executor(None, initialize_llm, config)
+        await grammar_task
         logger.info("LLM initialized successfully")
         llm_loading = False
     except Exception as e:
         logger.exception(f"Failed to initialize LLM: {e}")
         llm_load_error = str(e)
         llm_loading = False
+        return
+
+    if settings.LLM_MODELS or settings.LLM_TASK_ROUTES:
+        # Routed tasks use the default model until their models are loaded
+        try:
+            await loop.run_in_executor(
+                None, initialize_models, config, settings.LLM_MODELS, settings.LLM_TASK_ROUTES,
+                settings.LLM_MAX_QUEUE_DEPTH, settings.LLM_PREEMPTION)
+        except Exception as e:
+            logger.exception(f"Failed to set up task routing; all tasks use the default model: {e}")
 
 
 @asynccontextmanager
@@ -55,6 +72,8 @@ async def lifespan(app: FastAPI):
 
     # Shutdown: Cleanup if needed
     logger.info("Server shutting down")
+    shutdown_models()
+    shutdown_inference_executor()
 
 
 app = FastAPI(
@@ -102,5 +121,11 @@ async def health_check():
         "status": "healthy",
         "llm_available": llm is not None,
         "llm_loading": llm_loading,
-        "llm_error": llm_load_error
+        "llm_error": llm_load_error,
+        "llm_stats": llm.get_stats() if llm else None,
+        "summary_cache_stats": get_summary_cache().get_stats(),
+        "grammar_cache_stats": get_grammar_cache().get_stats(),
+        "inference_workers": get_inference_executor().get_stats(),
+        "inference_affinity": get_inference_executor().get_affinity_stats(),
+        "task_routing": get_model_registry().get_stats()
     }
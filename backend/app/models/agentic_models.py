@@ -39,4 +39,8 @@ class AgenticConfig(BaseModel):
         ge=100,
         le=2000,
         description="Max tokens for evaluation feedback"
+    )
+    speculative_generation: bool = Field(
+        default=False,
+        description="Use speculative decoding for generation (rewrites that repeat much of their input)"
     )
\ No newline at end of file
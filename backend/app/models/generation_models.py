@@ -4,7 +4,7 @@ Pydantic models for generation API requests and responses.
 All API endpoints now accept only request_context data.
 """
 from typing import Dict, List, Optional, Any, Literal
-from pydantic import BaseModel, Field, field_validator, model_validator
+from pydantic import BaseModel, ConfigDict, Field, RootModel, field_validator, model_validator
 from enum import Enum
 from app.models.request_context import RequestContext
 
@@ -64,6 +64,11 @@ class CharacterFeedbackRequest(BaseModel):
                     "characters, outline, and chapters")
 
 class CharacterFeedback(BaseModel):
+    # Every list has a default for clients, but generation must produce all of them
+    model_config = ConfigDict(json_schema_extra={"required": [
+        "actions", "dialog", "physicalSensations", "emotions",
+        "internalMonologue", "goals", "memories", "subtext"]})
+
     actions: List[str] = Field(
         default_factory=list,
         description="Things the character does, actions taken"
@@ -117,7 +122,7 @@ class RaterFeedbackRequest(BaseModel):
 class RaterSuggestion(BaseModel):
     issue: str
     suggestion: str
-    priority: str  # "high", "medium", "low"
+    priority: Literal["high", "medium", "low"]
 
 
 class RaterFeedback(BaseModel):
@@ -205,7 +210,7 @@ class EditorReviewRequest(BaseModel):
 class EditorSuggestion(BaseModel):
     issue: str
     suggestion: str
-    priority: str  # "high", "medium", "low"
+    priority: Literal["high", "medium", "low"]
 
 
 class EditorReviewResponse(BaseModel):
@@ -264,3 +269,30 @@ class RegenerateBioRequest(BaseModel):
 class RegenerateBioResponse(BaseModel):
     basicBio: str = Field(
         description="Generated bio summary from character details")
+
+
+# Chapter outline as generated by the LLM, before ids and order are assigned
+class GeneratedChapterOutline(BaseModel):
+    # Lists default to empty for lenient parsing, but generation must produce them
+    model_config = ConfigDict(json_schema_extra={"required": [
+        "title", "description", "key_plot_items", "involved_characters"]})
+
+    title: str
+    description: str
+    key_plot_items: List[str] = Field(default_factory=list)
+    involved_characters: List[str] = Field(default_factory=list)
+
+
+class GeneratedChapterOutlines(RootModel[List[GeneratedChapterOutline]]):
+    """JSON array of chapters, one element per chapter"""
+
+
+# Response models generated with schema-constrained decoding (json_schema_class);
+# their grammars are built at startup (see grammar_cache.warm_grammar_cache)
+STRUCTURED_OUTPUT_MODELS = (
+    CharacterFeedback,
+    RaterFeedback,
+    EditorReviewResponse,
+    CharacterInfo,
+    GeneratedChapterOutlines,
+)
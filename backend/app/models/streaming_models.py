@@ -1,7 +1,7 @@
 """
 Streaming response models for Server-Sent Events (SSE) endpoints.
 """
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List, Union
 from pydantic import BaseModel, Field
 from enum import Enum
 
@@ -11,6 +11,8 @@ class StreamingEventType(str, Enum):
     STATUS = "status"
     RESULT = "result"
     ERROR = "error"
+    PARTIAL = "partial"
+    ITEM = "item"
 
 
 class StreamingStatusEvent(BaseModel):
@@ -22,6 +24,20 @@ class StreamingStatusEvent(BaseModel):
     data: Optional[Dict[str, Any]] = Field(default=None, description="Partial response data")
 
 
+class StreamingPartialEvent(BaseModel):
+    """Incremental generated text, sent while the LLM is still producing output."""
+    type: StreamingEventType = Field(default=StreamingEventType.PARTIAL)
+    content: str = Field(description="Text generated since the previous partial event")
+    token_count: int = Field(description="Total tokens generated so far", ge=0)
+
+
+class StreamingItemEvent(BaseModel):
+    """A completed list element or field of structured output, sent before the final result."""
+    type: StreamingEventType = Field(default=StreamingEventType.ITEM)
+    path: List[Union[str, int]] = Field(description="Location of the value in the result, e.g. [\"actions\", 0]")
+    value: Any = Field(description="The completed value")
+
+
 class StreamingResultEvent(BaseModel):
     """Final result event containing the complete response."""
     type: StreamingEventType = Field(default=StreamingEventType.RESULT)
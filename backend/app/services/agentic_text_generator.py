@@ -22,7 +22,9 @@ from app.models.streaming_models import (
     StreamingErrorEvent
 )
 from app.services.context_builder import ContextBuilder
+from app.services.inference_executor import InferenceExecutor, QueueTicket, get_inference_executor
 from app.services.llm_inference import LLMInference
+from app.services.llm_registry import LLMTask, get_model_registry
 
 logger = logging.getLogger(__name__)
 
@@ -48,24 +50,51 @@ class AgenticTool(ABC):
 class LLMGenerationTool(AgenticTool):
     """Tool for LLM text generation."""
 
-    def __init__(self, llm: LLMInference):
+    def __init__(
+            self,
+            llm: LLMInference,
+            executor: Optional[InferenceExecutor] = None,
+            ticket: Optional[QueueTicket] = None,
+            context_executor: Optional[InferenceExecutor] = None):
+        """
+        Args:
+            llm: Model generating the text
+            executor: Executor driving llm (the default executor if None)
+            ticket: Queue ticket of the request
+            context_executor: Executor driving the context builder's model, which
+                builds the messages (defaults to executor)
+        """
         self.llm = llm
-
-    async def execute(self, context_builder: ContextBuilder, temperature: float = 0.8, max_tokens: int = 2000) -> str:
+        self.executor = executor or get_inference_executor()
+        self.context_executor = context_executor or self.executor
+        self.ticket = ticket
+
+    async def execute(
+            self,
+            context_builder: ContextBuilder,
+            temperature: float = 0.8,
+            max_tokens: int = 2000,
+            speculative: bool = False) -> str:
         """
         Generate text using the LLM.
 
         Args:
             context_builder: ContextBuilder with prompts and context
+            speculative: Draft tokens with the configured speculative decoder
 
         Returns:
             Generated text
         """
-        messages = context_builder.build_messages()
+        messages = await self.context_executor.run(
+            context_builder.build_messages, max_tokens=max_tokens, ticket=self.ticket)
 
         content = ""
-        for tokens in self.llm.chat_completion_stream(
-            messages, temperature=temperature, max_tokens=max_tokens
+        async for tokens in self.executor.stream(
+            self.llm.chat_completion_stream, messages, temperature=temperature, max_tokens=max_tokens,
+            prefix_message_count=context_builder.prefix_message_count,
+            affinity=context_builder.story_id,
+            ticket=self.ticket,
+            speculative=speculative
         ):
             content += tokens
         return content
@@ -82,19 +111,44 @@ class AgenticTextGenerator:
     Future expansion: Add more tools (web search, RAG, calculators, etc.)
     """
 
-    def __init__(self, llm: LLMInference, config: Optional[AgenticConfig] = None):
+    def __init__(
+            self,
+            llm: LLMInference,
+            config: Optional[AgenticConfig] = None,
+            ticket: Optional[QueueTicket] = None,
+            executor: Optional[InferenceExecutor] = None):
         """
         Initialize the agentic text generator.
 
         Args:
             llm: LLMInference instance for text generation
+            config: Iteration settings
+            ticket: Queue ticket of the request, so every iteration keeps its priority
+            executor: Executor driving llm (the default executor if None)
         """
         self.llm = llm
         self.config = config or AgenticConfig()
         self.tools: Dict[str, AgenticTool] = {
-            'llm_generate': LLMGenerationTool(llm)
+            'llm_generate': LLMGenerationTool(llm, executor=executor, ticket=ticket),
+            'llm_evaluate': self._create_evaluation_tool(llm, executor, ticket)
         }
 
+    @staticmethod
+    def _create_evaluation_tool(
+            llm: LLMInference,
+            executor: Optional[InferenceExecutor],
+            ticket: Optional[QueueTicket]) -> LLMGenerationTool:
+        """Evaluation runs on the model routed to LLMTask.EVALUATE, if any."""
+        registry = get_model_registry()
+        if not registry.is_routed(LLMTask.EVALUATE):
+            return LLMGenerationTool(llm, executor=executor, ticket=ticket)
+        # The context is built for llm, so its messages are built on llm's executor
+        return LLMGenerationTool(
+            registry.get_llm(LLMTask.EVALUATE, llm),
+            executor=registry.get_executor(LLMTask.EVALUATE),
+            ticket=ticket,
+            context_executor=executor or get_inference_executor())
+
     def add_tool(self, name: str, tool: AgenticTool):
         """
         Register a new tool for the agent to use.
@@ -147,7 +201,8 @@ class AgenticTextGenerator:
                 content = await self.tools['llm_generate'].execute(
                     generation_context,
                     temperature=self.config.generation_temperature,
-                    max_tokens=self.config.generation_max_tokens)
+                    max_tokens=self.config.generation_max_tokens,
+                    speculative=self.config.speculative_generation)
 
                 logger.info(f"Generated {len(content)} characters in iteration {iteration}")
 
@@ -263,7 +318,7 @@ FEEDBACK: [Detailed explanation of what works well and what needs improvement. I
         eval_context.add_agent_instruction(eval_prompt)
 
         # Use LLM tool for evaluation
-        response = await self.tools['llm_generate'].execute(
+        response = await self.tools['llm_evaluate'].execute(
             eval_context,
             temperature=self.config.evaluation_temperature,
             max_tokens=self.config.evaluation_max_tokens
@@ -1,14 +1,35 @@
 import logging
-from copy import deepcopy
-from dataclasses import dataclass
+import re
+import threading
+import weakref
+from dataclasses import dataclass, replace
 from enum import Enum
-from typing import Dict, List, Optional, Set
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
-from app.models.request_context import RequestContext, CharacterDetails, CharacterState
-from app.services.llm_inference import LLMInference
+from app.core.config import settings
+from app.models.request_context import RequestContext, CharacterDetails, CharacterState, ChapterDetails, OutlineItem
+from app.services.context_plan import ContextPlan, ContextPlanEntry, plan_context
+from app.services.inference_executor import InferenceExecutor, current_executor
+from app.services.llm_inference import LLMInference, TokenizedText
+from app.services.llm_registry import LLMTask, get_model_registry
+from app.services.passage_index import PassageIndex, get_passage_index
+from app.services.summary_cache import SummaryCache, get_summary_cache, make_summary_key
 
 logger = logging.getLogger(__name__)
 
+# Fixed budgets keep the cached chapter and rolling summaries reusable even
+# though the budget left for RECENT_STORY varies from request to request.
+CHAPTER_SUMMARY_TOKENS = 400
+ROLLING_SUMMARY_TOKENS = 1500
+
+# Share of a relevance-ranked RECENT_STORY kept for the end of the newest chapter
+RELEVANCE_WINDOW_SHARE = 0.25
+
+# Words of a character's name that do not identify the character on their own
+_NAME_TITLES = frozenset({
+    'mr', 'mrs', 'ms', 'miss', 'dr', 'doctor', 'sir', 'lady', 'lord', 'the', 'detective', 'captain',
+    'officer', 'professor', 'king', 'queen', 'prince', 'princess', 'father', 'mother', 'aunt', 'uncle'})
+
 
 class ContextRole(str, Enum):
     SYSTEM = 'system'
@@ -21,54 +42,296 @@ class SummarizationStrategy(str, Enum):
     SUMMARIZED = 'summarized'
     ROLLING_WINDOW = 'rolling_window'
     SUMMARY_AND_ROLLING_WINDOW = 'summary_and_rolling_window'
+    RELEVANCE_RANKED = 'relevance_ranked'
 
 
-@dataclass
+@dataclass(frozen=True, eq=False)
 class ContextItem:
+    """
+    One element of the context.
+
+    Elements are immutable so that ContextBuilder.copy can share them between
+    builders; measurements and summaries are cached per element (by identity).
+    """
     tag: Optional[str]
     role: str
     content: str
     token_budget: int
     summarization_strategy: SummarizationStrategy = SummarizationStrategy.LITERAL
+    chapters: Optional[Tuple[ChapterDetails, ...]] = None
+    # What RELEVANCE_RANKED passages are ranked against
+    query: Optional[str] = None
 
-    def structured_content(self):
-        return f'<{self.tag}>\n{self.content.strip()}\n</{self.tag}>\n' if self.tag else self.content
+    def structured_content(self, content: Optional[str] = None):
+        content = self.content if content is None else content
+        return f'<{self.tag}>\n{content.strip()}\n</{self.tag}>\n' if self.tag else content
+
+
+@dataclass
+class CharacterSelection:
+    """Characters given full profiles for a chapter (see add_characters) and the tokens saved."""
+    involved: List[str]
+    stubbed: List[str]
+    full_tokens: int
+    tokens: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.full_tokens - self.tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "involved_characters": self.involved,
+            "stubbed_characters": self.stubbed,
+            "full_tokens": self.full_tokens,
+            "tokens": self.tokens,
+            "saved_tokens": self.saved_tokens,
+        }
+
+
+class _ElementCache:
+    """
+    Tokenizations and summarized content of elements, shared by a builder and its copies.
+
+    An element cannot change, so what was measured or summarized for it stays
+    valid in every copy holding it. Entries go away with their element.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokenized: "weakref.WeakKeyDictionary[ContextItem, TokenizedText]" = weakref.WeakKeyDictionary()
+        self._reduced: "weakref.WeakKeyDictionary[ContextItem, Dict[int, Tuple[str, int]]]" = weakref.WeakKeyDictionary()
+
+    def get_tokenized(self, e: ContextItem) -> Optional[TokenizedText]:
+        with self._lock:
+            return self._tokenized.get(e)
+
+    def put_tokenized(self, e: ContextItem, tokenized: TokenizedText):
+        with self._lock:
+            self._tokenized[e] = tokenized
+
+    def get_reduced(self, e: ContextItem, token_budget: int) -> Optional[Tuple[str, int]]:
+        """
+        Content the element was summarized to for the largest budget whose result fits token_budget.
+
+        Budgets shift slightly between copies as their other elements differ,
+        so a summary that still fits is reused rather than written again.
+        """
+        with self._lock:
+            reductions = self._reduced.get(e, {})
+            fitting = [budget for budget, (_, count) in reductions.items() if count <= token_budget]
+            return reductions[max(fitting)] if fitting else None
+
+    def put_reduced(self, e: ContextItem, token_budget: int, reduced: Tuple[str, int]):
+        with self._lock:
+            self._reduced.setdefault(e, {})[token_budget] = reduced
 
 
 class ContextBuilder:
-    def __init__(self, request_context: RequestContext, model: LLMInference):
+    def __init__(self, request_context: RequestContext, model: LLMInference,
+                 summary_cache: Optional[SummaryCache] = None,
+                 summary_model: Optional[LLMInference] = None,
+                 summary_executor: Optional[InferenceExecutor] = None,
+                 passage_index: Optional[PassageIndex] = None,
+                 batched: bool = False):
+        """
+        Args:
+            request_context: Story state the context is built from
+            model: Model the messages are built for; budgets are counted in its tokens
+            summary_cache: Cache of summaries (the global one if None)
+            summary_model: Model that writes summaries (the one routed to
+                LLMTask.SUMMARIZE if None, which is `model` unless routed)
+            summary_executor: Executor driving summary_model when it is not `model`
+            passage_index: Index ranking story passages for CONTEXT_RETRIEVAL
+                (the global one if None)
+            batched: The messages are streamed with stream_chat_completion, so they
+                must also fit a batch engine sequence when batching is enabled
+        """
         self._request_context: RequestContext = request_context
-        self._elements: List[ContextItem] = []
+        # Immutable, so copies share the tuple and each add creates a new one
+        self._elements: Tuple[ContextItem, ...] = ()
+        self._element_cache = _ElementCache()
         self._model: LLMInference = model
+        self._summary_cache: SummaryCache = summary_cache if summary_cache is not None else get_summary_cache()
+        if summary_model is None:
+            registry = get_model_registry()
+            if registry.is_routed(LLMTask.SUMMARIZE):
+                summary_model = registry.get_llm(LLMTask.SUMMARIZE, model)
+                summary_executor = registry.get_executor(LLMTask.SUMMARIZE)
+        self._summary_model: LLMInference = summary_model if summary_model is not None else model
+        self._summary_executor: Optional[InferenceExecutor] = summary_executor
+        self._passage_index: Optional[PassageIndex] = passage_index
+        self._batched: bool = batched
+        self._prefix_count: int = 0
+        # Characters filtered by add_characters(for_chapter=...), if any
+        self.character_selection: Optional[CharacterSelection] = None
+        # Plan used by the most recent build_messages call
+        self.last_plan: Optional[ContextPlan] = None
 
     def copy(self) -> 'ContextBuilder':
+        """
+        Fork the builder; elements added to either side afterwards do not affect the other.
+
+        Elements are shared rather than copied, along with what has been
+        measured and summarized for them, so a fork costs the same however
+        long the story is and building its messages only works on the
+        elements added since.
+        """
         new_builder = ContextBuilder(
             self._request_context,
-            self._model
+            self._model,
+            self._summary_cache,
+            self._summary_model,
+            self._summary_executor,
+            self._passage_index,
+            self._batched
         )
-        # Deep copy the elements list
-        new_builder._elements = deepcopy(self._elements)
+        new_builder._elements = self._elements
+        new_builder._element_cache = self._element_cache
+        new_builder._prefix_count = self._prefix_count
+        new_builder.character_selection = self.character_selection
         return new_builder
 
-    def build_messages(self) -> List[Dict[str, str]]:
+    @property
+    def prefix_message_count(self) -> int:
+        """
+        Number of leading messages that make up the long-term block.
+
+        These messages are identical across requests for the same story, so
+        LLMInference can reuse their evaluated state (see chat_completion).
+        Zero if add_long_term_elements was not the first thing added.
+        """
+        return self._prefix_count
+
+    @property
+    def story_id(self) -> Optional[str]:
+        """
+        Id of the story the context belongs to.
+
+        Passed as the executor affinity key so a story's requests run on the
+        replica that already evaluated its long-term prefix.
+        """
+        metadata = self._request_context.context_metadata
+        return metadata.story_id if metadata else None
+
+    def build_messages(self, max_tokens: Optional[int] = None) -> List[Dict[str, str]]:
+        """
+        Render the elements as chat messages that fit the model's context window.
+
+        Args:
+            max_tokens: Tokens the response will be generated with, reserved
+                out of the window (CONTEXT_BUFFER_TOKENS if None)
+
+        Raises:
+            ValueError: If the literal elements alone do not fit
+        """
+        plan = self.plan_context(max_tokens)
+        self.last_plan = plan
+        if plan.over_budget:
+            logger.info(f"Context plan: {plan}")
+        else:
+            logger.debug(f"Context plan: {plan}")
+
+        # Summaries of different elements are independent: write them all at
+        # once, then render the rest and assemble the messages in order
+        summarized = [i for i, (e, entry) in enumerate(zip(self._elements, plan.entries))
+                      if entry.over_budget and self._reduces_with_model(e)]
+        reduced = dict(zip(summarized, self._run_concurrently(self._reduce, [
+            {'e': self._elements[i], 'token_budget': plan.entries[i].allocated,
+             'tokenized': plan.entries[i].tokenized}
+            for i in summarized])))
+
         chat = []
-        token_limit = 0
-        token_count = 0
-        for e in self._elements:
-            token_limit += e.token_budget
-            content, tokens = self._get_content(e, token_limit - token_count)
+        for i, (e, entry) in enumerate(zip(self._elements, plan.entries)):
+            content, _ = reduced[i] if i in reduced else self._get_content(e, entry.allocated, entry.tokenized)
             chat.append({'role': e.role, 'content': content.strip()})
-            token_count += tokens
         return chat
 
+    def plan_context(self, max_tokens: Optional[int] = None) -> ContextPlan:
+        """
+        Measure every element and allocate the context window between them.
+
+        Nothing is summarized here; build_messages reduces the elements the
+        plan marks as over budget.
+
+        Args:
+            max_tokens: Tokens reserved for the response (CONTEXT_BUFFER_TOKENS if None)
+
+        Returns:
+            The plan, one entry per element in order
+        """
+        entries = []
+        for e in self._elements:
+            tokenized = self._element_cache.get_tokenized(e)
+            if tokenized is None:
+                tokenized = self._model.tokenize_with_offsets(e.structured_content())
+                self._element_cache.put_tokenized(e, tokenized)
+            entries.append(ContextPlanEntry(
+                tag=e.tag,
+                role=e.role,
+                strategy=e.summarization_strategy.value,
+                tokens=tokenized.token_count,
+                budget=e.token_budget,
+                reducible=e.summarization_strategy != SummarizationStrategy.LITERAL,
+                tokenized=tokenized))
+        return plan_context(
+            entries,
+            self._context_window(),
+            max_tokens if max_tokens is not None else settings.CONTEXT_BUFFER_TOKENS)
+
+    @staticmethod
+    def _reduces_with_model(e: ContextItem) -> bool:
+        """Whether reducing the element calls the summary model or the passage embedder."""
+        return e.summarization_strategy in (
+            SummarizationStrategy.SUMMARIZED, SummarizationStrategy.SUMMARY_AND_ROLLING_WINDOW,
+            SummarizationStrategy.RELEVANCE_RANKED)
+
+    @staticmethod
+    def _run_concurrently(func: Callable[..., Any], calls: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Run independent summarization calls at the same time and return their results in order.
+
+        On an inference worker the calls are spread over the executor's free
+        workers, each driving its own model replica (see
+        InferenceExecutor.run_all_sync); elsewhere, or with a single worker,
+        they run one after another.
+        """
+        executor = current_executor()
+        if executor is None or len(calls) < 2:
+            return [func(**kwargs) for kwargs in calls]
+        return executor.run_all_sync(func, calls, max_concurrency=settings.CONTEXT_SUMMARY_CONCURRENCY)
+
+    def _context_window(self) -> int:
+        """Tokens the model attends to: its n_ctx, CONTEXT_MAX_TOKENS and, for batched builds, the batch sequence size."""
+        window = settings.CONTEXT_MAX_TOKENS
+        n_ctx = getattr(getattr(self._model, 'config', None), 'n_ctx', None)
+        window = min(window, n_ctx if isinstance(n_ctx, int) else settings.LLM_N_CTX)
+        sequence_ctx = getattr(getattr(self._model, 'batch_engine', None), 'n_ctx_per_sequence', None)
+        if self._batched and isinstance(sequence_ctx, int):
+            window = min(window, sequence_ctx)
+        return window
+
     def build_prompt(self) -> str:
         return '\n'.join([e['content'] for e in self.build_messages()])
 
-    def add_long_term_elements(self, system_prompt: str):
+    def _add(self, e: ContextItem):
+        self._elements += (e,)
+
+    def add_long_term_elements(self, system_prompt: str, for_chapter: Optional[ChapterDetails] = None):
+        """
+        Add the system prompt, worldbuilding, characters and story outline.
+
+        Args:
+            system_prompt: System prompt of the task
+            for_chapter: Chapter the context is for (see add_characters)
+        """
+        is_prefix = not self._elements
         self.add_system_prompt(system_prompt)
         self.add_worldbuilding()
-        self.add_characters()
+        self.add_characters(for_chapter=for_chapter)
         self.add_story_outline()
+        if is_prefix:
+            self._prefix_count = len(self._elements)
 
     def add_system_prompt(self, prompt: str):
         content = prompt
@@ -77,7 +340,7 @@ class ContextBuilder:
         if self._request_context.configuration.system_prompts.main_suffix:
             content = f"{content}\n{self._request_context.configuration.system_prompts.main_suffix}"
         content = content + '\n'
-        self._elements.append(ContextItem(
+        self._add(ContextItem(
             tag=None,
             role=ContextRole.SYSTEM,
             content=content,
@@ -86,14 +349,32 @@ class ContextBuilder:
 
     def add_worldbuilding(self):
         if self._request_context.worldbuilding and self._request_context.worldbuilding.content:
-            self._elements.append(ContextItem(
+            self._add(ContextItem(
                 tag='WORLD_BUILDING',
                 role=ContextRole.USER,
                 content=self._request_context.worldbuilding.content,
                 token_budget=2000,
                 summarization_strategy=SummarizationStrategy.SUMMARIZED))
 
-    def add_characters(self, tag: str = 'CHARACTERS', exclude_characters: Set[str] = {}, include_characters: Set[str] = {}):
+    def add_characters(self, tag: str = 'CHARACTERS', exclude_characters: Set[str] = {}, include_characters: Set[str] = {},
+                       for_chapter: Optional[ChapterDetails] = None):
+        """
+        Add the profiles of the visible characters.
+
+        With CONTEXT_CHARACTER_FILTER and a for_chapter, only the characters
+        involved in that chapter get full profiles and the rest a one-line
+        stub; the result is kept as character_selection. A character is
+        involved if the chapter's outline item lists it in
+        involved_characters, or if its name appears in the chapter's title,
+        plot point or key plot items or in the outline item. When no
+        character can be identified every profile is kept.
+
+        Args:
+            tag: Tag of the element
+            exclude_characters: Names of characters to leave out
+            include_characters: Names of the only characters to add (all if empty)
+            for_chapter: Chapter the context is for
+        """
         def add_item(title: str, element) -> str:
             return f"  {title}: {element}\n" if element else ""
 
@@ -113,38 +394,95 @@ class ContextBuilder:
             content += add_item("Relationships", c.relationships)
             return f"- Name: {c.name}\n{content}" if content else ""
 
+        def character_stub(c: CharacterDetails) -> str:
+            bio = re.match(r'[^\n]*?(?:[.!?](?=\s|$)|$)', (c.basic_bio or '').strip(), re.MULTILINE).group()
+            return f"- Name: {c.name} (not in this chapter){f': {bio}' if bio else ''}\n"
+
         if self._request_context.characters:
-            characters = '\n'.join(
-                [format_character(c)
-                 for c in self._request_context.characters
-                 if (not c.is_hidden and
-                     c.name not in exclude_characters and
-                     (not include_characters or c.name in include_characters))])
+            visible = [c for c in self._request_context.characters
+                       if (not c.is_hidden and
+                           c.name not in exclude_characters and
+                           (not include_characters or c.name in include_characters))]
+            characters = '\n'.join([format_character(c) for c in visible])
+
+            involved = None
+            if for_chapter is not None and settings.CONTEXT_CHARACTER_FILTER:
+                involved = self._involved_characters(for_chapter, visible)
+            if involved:
+                filtered = '\n'.join([format_character(c) if c.id in involved else character_stub(c) for c in visible])
+                full_tokens, tokens = self._model.count_tokens_batch([characters, filtered])
+                self.character_selection = CharacterSelection(
+                    involved=[c.name for c in visible if c.id in involved],
+                    stubbed=[c.name for c in visible if c.id not in involved],
+                    full_tokens=full_tokens,
+                    tokens=tokens)
+                logger.info(f"Full profiles for {len(involved)} of {len(visible)} characters in chapter "
+                            f"{for_chapter.number}; {self.character_selection.saved_tokens} tokens saved")
+                characters = filtered
+
             if characters:
-                self._elements.append(ContextItem(
+                self._add(ContextItem(
                     tag=tag,
                     role=ContextRole.USER,
                     content=characters,
                     token_budget=2000,
                     summarization_strategy=SummarizationStrategy.SUMMARIZED))
 
+    def _involved_characters(self, chapter: ChapterDetails, characters: List[CharacterDetails]) -> Set[str]:
+        """Ids of the characters involved in chapter (see add_characters)."""
+        texts = [chapter.title, chapter.plot_point or '', *chapter.key_plot_items]
+        listed = set()
+        for item in self._outline_items(chapter):
+            texts += [item.title, item.description, *item.key_plot_items]
+            listed.update(name.strip().lower() for name in item.involved_characters)
+        text = '\n'.join(texts)
+
+        involved = set()
+        for c in characters:
+            # The full name in any case, or a distinctive part of it as written in the name
+            parts = [p for p in re.findall(r'\w+', c.name) if len(p) >= 3 and p.lower() not in _NAME_TITLES]
+            if (c.id.lower() in listed or c.name.strip().lower() in listed
+                    or any(p.lower() in listed for p in parts)
+                    or re.search(rf'\b{re.escape(c.name.strip())}\b', text, re.IGNORECASE)
+                    or any(re.search(rf'\b{re.escape(p)}\b', text) for p in parts)):
+                involved.add(c.id)
+        return involved
+
+    def _outline_items(self, chapter: ChapterDetails) -> List[OutlineItem]:
+        """
+        The outline item of a chapter and the items nested under it.
+
+        The chapter item is the one with the chapter's title, or else the
+        chapter-type item at the chapter's position in the outline.
+        """
+        outline = self._request_context.story_outline
+        if not outline or not outline.outline_items:
+            return []
+        chapter_items = sorted((i for i in outline.outline_items if i.type == 'chapter'), key=lambda i: i.order)
+        item = next((i for i in chapter_items if i.title.strip().lower() == chapter.title.strip().lower()), None)
+        if item is None and 0 < chapter.number <= len(chapter_items):
+            item = chapter_items[chapter.number - 1]
+        if item is None:
+            return []
+        return [item] + [i for i in outline.outline_items if i.parent_id == item.id]
+
     def add_story_outline(self):
         if self._request_context.context_metadata.story_title:
-            self._elements.append(ContextItem(
+            self._add(ContextItem(
                 tag='STORY_TITLE',
                 role=ContextRole.USER,
                 content=self._request_context.context_metadata.story_title,
                 token_budget=2000,
                 summarization_strategy=SummarizationStrategy.LITERAL))
         if self._request_context.story_outline and self._request_context.story_outline.summary:
-            self._elements.append(ContextItem(
+            self._add(ContextItem(
                 tag='STORY_SUMMARY',
                 role=ContextRole.USER,
                 content=self._request_context.story_outline.summary,
                 token_budget=2000,
                 summarization_strategy=SummarizationStrategy.LITERAL))
         if self._request_context.story_outline and self._request_context.story_outline.content:
-            self._elements.append(ContextItem(
+            self._add(ContextItem(
                 tag='STORY_OUTLINE',
                 role=ContextRole.USER,
                 content=self._request_context.story_outline.content,
@@ -170,35 +508,49 @@ class ContextBuilder:
         if self._request_context.character_states:
             character_states = "".join([format_character_state(c) for c in self._request_context.character_states])
             if character_states:
-                self._elements.append(ContextItem(
+                self._add(ContextItem(
                     tag='CHARACTER_STATES',
                     role=ContextRole.USER,
                     content=character_states,
                     token_budget=2000,
                     summarization_strategy=SummarizationStrategy.SUMMARIZED))
 
-    def add_recent_story(self, include_up_to: Optional[int] = None):
-        content = self._get_chapters(include_up_to)
-        if content:
-            self._elements.append(ContextItem(
+    def add_recent_story(self, include_up_to: Optional[int] = None, for_chapter: Optional[ChapterDetails] = None):
+        """
+        Add the chapters before include_up_to.
+
+        Args:
+            include_up_to: Number of the first chapter to leave out (all chapters if None)
+            for_chapter: Chapter the context is for; with CONTEXT_RETRIEVAL, an
+                over-budget story keeps the passages most relevant to its
+                title, plot point and key plot items instead of summaries
+        """
+        chapters = self._get_chapter_list(include_up_to)
+        if chapters:
+            query = self._retrieval_query(for_chapter) if for_chapter and settings.CONTEXT_RETRIEVAL else None
+            self._add(ContextItem(
                 tag='RECENT_STORY',
                 role=ContextRole.USER,
-                content=content,
+                content=''.join(self._format_chapter(c) for c in chapters),
                 token_budget=15000,
-                summarization_strategy=SummarizationStrategy.SUMMARY_AND_ROLLING_WINDOW))
+                summarization_strategy=(SummarizationStrategy.RELEVANCE_RANKED if query
+                                        else SummarizationStrategy.SUMMARY_AND_ROLLING_WINDOW),
+                chapters=tuple(chapters),
+                query=query))
 
     def add_recent_story_summary(self, include_up_to: Optional[int] = None):
-        content = self._get_chapters(include_up_to)
-        if content:
-            self._elements.append(ContextItem(
+        chapters = self._get_chapter_list(include_up_to)
+        if chapters:
+            self._add(ContextItem(
                 tag='RECENT_STORY_SUMMARY',
                 role=ContextRole.USER,
-                content=content,
+                content=''.join(self._format_chapter(c) for c in chapters),
                 token_budget=5000,
-                summarization_strategy=SummarizationStrategy.SUMMARIZED))
+                summarization_strategy=SummarizationStrategy.SUMMARIZED,
+                chapters=tuple(chapters)))
 
     def add_agent_instruction(self, prompt: str):
-        self._elements.append(ContextItem(
+        self._add(ContextItem(
             tag=None,
             role=ContextRole.USER,
             content=prompt,
@@ -207,37 +559,62 @@ class ContextBuilder:
 
     def add_chat(self, role: ContextRole, content: str):
         ## FIXME ##
-        self._elements.append(ContextItem(
+        self._add(ContextItem(
             tag=None,
             role=role,
             content=content,
             token_budget=5000,
             summarization_strategy=SummarizationStrategy.ROLLING_WINDOW))
 
-    def _get_content(self, e: ContextItem, token_budget: int) -> (str, int):
+    def _reduce(self, e: ContextItem, token_budget: int, tokenized: Optional[TokenizedText] = None) -> (str, int):
+        """Summarize an over-budget element, reusing a summary made by this builder or a copy."""
+        reduced = self._element_cache.get_reduced(e, token_budget)
+        if reduced is None:
+            reduced = self._get_content(e, token_budget, tokenized)
+            self._element_cache.put_reduced(e, token_budget, reduced)
+        return reduced
+
+    def _get_content(self, e: ContextItem, token_budget: int, tokenized: Optional[TokenizedText] = None) -> (str, int):
         content = e.structured_content()
 
-        content_truncation = self._model.truncate_to_tokens(content, token_budget)
+        # Tokenize once (plan_context already has); both cuts below slice the same offset map
+        if tokenized is None:
+            tokenized = self._model.tokenize_with_offsets(content)
+        content_truncation = tokenized.truncate(token_budget)
         if content_truncation.head is None:
             return content_truncation.tail, content_truncation.tail_token_count
 
-        if e.summarization_strategy == SummarizationStrategy.SUMMARIZED:
-            return self._summarize(content, token_budget)
+        if e.summarization_strategy == SummarizationStrategy.RELEVANCE_RANKED:
+            return self._get_relevant_content(e, token_budget)
+        if e.chapters and e.summarization_strategy in (
+                SummarizationStrategy.SUMMARIZED, SummarizationStrategy.SUMMARY_AND_ROLLING_WINDOW):
+            return self._get_chapter_content(e, token_budget)
+        elif e.summarization_strategy == SummarizationStrategy.SUMMARIZED:
+            return self._summarize(content, token_budget, e.summarization_strategy)
         elif e.summarization_strategy == SummarizationStrategy.ROLLING_WINDOW:
             return content_truncation.tail, content_truncation.tail_token_count
         elif e.summarization_strategy == SummarizationStrategy.SUMMARY_AND_ROLLING_WINDOW:
-            content_truncation = self._model.truncate_to_tokens(content, int(token_budget * 0.60))
-            summary, summary_count = self._summarize(content_truncation.head, int(token_budget * 0.40))
+            content_truncation = tokenized.truncate(int(token_budget * 0.60))
+            summary, summary_count = self._summarize(
+                content_truncation.head, int(token_budget * 0.40), e.summarization_strategy)
             return f"{summary}\n{content_truncation.tail}", summary_count + content_truncation.tail_token_count
         else:
             raise ValueError(f"Token budget exceeded {content_truncation.tail_token_count} > {token_budget} for {e.tag} {e.role}")
 
-    def _summarize(self, content: str, token_budget: int) -> (str, int):
+    def _summarize(self, content: str, token_budget: int,
+                   strategy: SummarizationStrategy = SummarizationStrategy.SUMMARIZED) -> (str, int):
         """
         Summarize content using the LLM to reduce token count.
 
+        Summaries are memoized in the summary cache, so unchanged content is
+        only summarized once per budget, strategy and model. They are written
+        by the summary model (see LLMTask.SUMMARIZE) on its own executor, and
+        counted in tokens of the model the messages are built for.
+
         Args:
             content: The content to summarize
+            token_budget: Maximum tokens for the summary
+            strategy: Summarization strategy of the element being summarized
 
         Returns:
             Tuple of (summarized_content, token_count)
@@ -245,6 +622,14 @@ class ContextBuilder:
         if not content or not content.strip():
             return "", 0
 
+        cache_key = None
+        model_id = getattr(self._summary_model, 'model_id', None)
+        if isinstance(model_id, str):
+            cache_key = make_summary_key(content, token_budget, strategy.value, model_id)
+            cached = self._summary_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
         # Create a prompt for the LLM to summarize the content
         summarization_prompt = f"""Please provide a concise summary of the following content. Focus on the key information and main points while significantly reducing the length.
 
@@ -255,26 +640,225 @@ Summary:"""
 
         try:
             # Use lower temperature for more consistent, factual summarization
-            summary = self._model.generate(
-                prompt=summarization_prompt,
-                temperature=0.3,
-                max_tokens=token_budget
-            )
+            if self._summary_executor is not None:
+                summary = self._summary_executor.run_sync(
+                    self._summary_model.generate,
+                    prompt=summarization_prompt,
+                    temperature=0.3,
+                    max_tokens=token_budget
+                )
+            else:
+                summary = self._summary_model.generate(
+                    prompt=summarization_prompt,
+                    temperature=0.3,
+                    max_tokens=token_budget
+                )
 
             # Count tokens in the summary
             token_count = self._model.count_tokens(summary)
-
-            return summary, token_count
-
         except Exception as e:
             logger.exception("Summarization failed")
             raise ValueError("Text summarization failed")
 
-    def _get_chapters(self, include_up_to: Optional[int]):
-        content = ""
+        if cache_key is not None:
+            self._summary_cache.put(cache_key, summary, token_count)
+        return summary, token_count
+
+    def _get_chapter_content(self, e: ContextItem, token_budget: int) -> (str, int):
+        """
+        Fit a chapter-based element into its budget using per-chapter summaries.
+
+        The most recent chapters are kept verbatim (up to 60% of the budget for
+        SUMMARY_AND_ROLLING_WINDOW, none for SUMMARIZED). Every earlier chapter
+        is summarized on its own, keyed by chapter id and last_modified, so an
+        unchanged chapter is only ever summarized once. When the chapter
+        summaries do not fit either, the oldest are folded into a rolling
+        "story so far" summary one chapter at a time, which is also cached, so
+        a new chapter costs one chapter summary and one rolling step.
+
+        Args:
+            e: Element created by add_recent_story or add_recent_story_summary
+            token_budget: Tokens available for the element
+
+        Returns:
+            Tuple of (content, token_count)
+        """
+        chapters = e.chapters
+        texts = [self._format_chapter(c) for c in chapters]
+
+        window_budget = 0
+        if e.summarization_strategy == SummarizationStrategy.SUMMARY_AND_ROLLING_WINDOW:
+            window_budget = int(token_budget * 0.60)
+
+        # Rolling window of whole chapters, newest first
+        window_start = len(chapters)
+        window_count = 0
+        if window_budget > 0:
+            for i, count in reversed(list(enumerate(self._model.count_tokens_batch(texts)))):
+                if window_count + count > window_budget:
+                    break
+                window_start = i
+                window_count += count
+
+        window = ''.join(texts[window_start:])
+        sections = []
+        if window_budget > 0 and window_start == len(chapters):
+            # The newest chapter alone exceeds the window: keep its end and
+            # summarize its beginning after the earlier chapters
+            window_start -= 1
+            newest = chapters[-1]
+            heading = f"**Chapter {newest.number}: {newest.title} (end)**\n"
+            heading_count = self._model.count_tokens(heading)
+            truncation = self._model.tokenize_with_offsets(newest.content).truncate_start(
+                max(window_budget - heading_count, 0))
+            window = f"{heading}{truncation.tail.strip()}\n\n"
+            window_count = heading_count + truncation.tail_token_count
+            if truncation.head:
+                partial, _ = self._summarize(truncation.head, CHAPTER_SUMMARY_TOKENS, e.summarization_strategy)
+                sections.append(self._format_chapter_summary(newest, partial))
+
+        summaries = self._run_concurrently(self._summarize_chapter, [
+            {'chapter': c, 'text': text} for c, text in zip(chapters[:window_start], texts)])
+        summaries.extend(sections)
+        summary, summary_count = self._fold_summaries(chapters[:window_start], summaries,
+                                                      token_budget - window_count)
+
+        content = e.structured_content(f"{summary}\n{window}" if summary else window)
+        return content, summary_count + window_count
+
+    def _get_relevant_content(self, e: ContextItem, token_budget: int) -> (str, int):
+        """
+        Fit a chapter-based element into its budget with the passages most relevant to its query.
+
+        The end of the newest chapter is kept for continuity (up to
+        RELEVANCE_WINDOW_SHARE of the budget); the rest is filled with the
+        highest-ranked passages of every chapter (see passage_index), shown
+        in story order under their chapter headings. Falls back to chapter
+        summaries when no passage index is available.
+
+        Args:
+            e: Element created by add_recent_story with for_chapter
+            token_budget: Tokens available for the element
+
+        Returns:
+            Tuple of (content, token_count)
+        """
+        index = self._passage_index if self._passage_index is not None else get_passage_index()
+        if index is None:
+            return self._get_chapter_content(
+                replace(e, summarization_strategy=SummarizationStrategy.SUMMARY_AND_ROLLING_WINDOW), token_budget)
+
+        newest = e.chapters[-1]
+        window = self._model.tokenize_with_offsets(newest.content).truncate_start(
+            int(token_budget * RELEVANCE_WINDOW_SHARE))
+        # Passages of the newest chapter must end before the window starts
+        cut = len(window.head) if window.head else 0
+        window_text = f"**Chapter {newest.number}: {newest.title} (end)**\n{window.tail.strip()}\n\n"
+
+        # Keep a tenth of what is left for chapter headings and separators
+        remaining = int((token_budget - self._model.count_tokens(window_text)) * 0.9)
+        candidates = [s.passage for s in index.rank(e.query, e.chapters)
+                      if s.passage.chapter is not newest or s.passage.end <= cut]
+        chosen = []
+        for i in range(0, len(candidates), 32):
+            if remaining <= 0:
+                break
+            batch = candidates[i:i + 32]
+            for passage, count in zip(batch, self._model.count_tokens_batch([p.text for p in batch])):
+                if count <= remaining:
+                    chosen.append(passage)
+                    remaining -= count
+
+        sections = []
+        previous = None
+        for passage in sorted(chosen, key=lambda p: (p.chapter.number, p.start)):
+            if previous is None or previous.chapter is not passage.chapter:
+                sections.append(f"**Chapter {passage.chapter.number}: {passage.chapter.title} (excerpts)**\n")
+            elif passage.chapter.content[previous.end:passage.start].strip():
+                sections.append("[...]\n")
+            sections.append(f"{passage.text.strip()}\n\n")
+            previous = passage
+        sections.append(window_text)
+
+        truncation = self._model.tokenize_with_offsets(''.join(sections)).truncate_start(token_budget)
+        return e.structured_content(truncation.tail), truncation.tail_token_count
+
+    @staticmethod
+    def _retrieval_query(chapter: ChapterDetails) -> str:
+        """Text RECENT_STORY passages are ranked against for a chapter."""
+        return '\n'.join(item for item in [chapter.title, chapter.plot_point, *chapter.key_plot_items] if item)
+
+    def _summarize_chapter(self, chapter: ChapterDetails, text: str) -> str:
+        """Summary of one chapter, cached by chapter id and last_modified."""
+        model_id = getattr(self._summary_model, 'model_id', None)
+        cache_key = None
+        if isinstance(model_id, str):
+            cache_key = make_summary_key(
+                f"{chapter.id}@{chapter.last_modified.isoformat()}", CHAPTER_SUMMARY_TOKENS, 'chapter', model_id)
+            cached = self._summary_cache.get(cache_key)
+            if cached is not None:
+                return self._format_chapter_summary(chapter, cached[0])
+
+        summary, token_count = self._summarize(text, CHAPTER_SUMMARY_TOKENS)
+        if cache_key is not None:
+            self._summary_cache.put(cache_key, summary, token_count)
+        return self._format_chapter_summary(chapter, summary)
+
+    def _fold_summaries(self, chapters: List[ChapterDetails], summaries: List[str], token_budget: int) -> (str, int):
+        """
+        Combine chapter summaries, folding the oldest into a rolling summary if needed.
+
+        Args:
+            chapters: Chapters that were summarized, oldest first
+            summaries: Formatted summaries (one per chapter, plus an optional partial one)
+            token_budget: Tokens available for the combined summaries
+
+        Returns:
+            Tuple of (combined_summaries, token_count)
+        """
+        if not summaries:
+            return "", 0
+
+        counts = self._model.count_tokens_batch(summaries)
+        if sum(counts) <= token_budget:
+            return ''.join(summaries), sum(counts)
+
+        # Keep the newest summaries that fit next to the rolling summary
+        keep_from = len(summaries)
+        kept_count = 0
+        for i in range(len(summaries) - 1, -1, -1):
+            if kept_count + counts[i] > token_budget - ROLLING_SUMMARY_TOKENS:
+                break
+            keep_from = i
+            kept_count += counts[i]
+
+        # Only whole chapters are folded; a partial summary always stays
+        keep_from = min(keep_from, len(chapters))
+        content = ''.join(summaries)
+        if keep_from > 1:
+            rolling = summaries[0]
+            for chapter_summary in summaries[1:keep_from]:
+                rolling, _ = self._summarize(f"{rolling}\n{chapter_summary}", ROLLING_SUMMARY_TOKENS)
+            content = (f"**Story so far (Chapters {chapters[0].number}-{chapters[keep_from - 1].number})**\n"
+                       f"{rolling.strip()}\n\n" + ''.join(summaries[keep_from:]))
+
+        # Drop whatever still does not fit from the oldest end
+        truncation = self._model.tokenize_with_offsets(content).truncate_start(token_budget)
+        return truncation.tail, truncation.tail_token_count
+
+    def _get_chapter_list(self, include_up_to: Optional[int]) -> List[ChapterDetails]:
+        chapters = []
         for c in sorted(self._request_context.chapters, key=lambda c: c.number):
             if include_up_to is not None and c.number >= include_up_to:
                 break
             if c.title and c.content:
-                content += f"**Chapter {c.number}: {c.title}**\n{c.content}\n\n"
-        return content
+                chapters.append(c)
+        return chapters
+
+    @staticmethod
+    def _format_chapter(chapter: ChapterDetails) -> str:
+        return f"**Chapter {chapter.number}: {chapter.title}**\n{chapter.content}\n\n"
+
+    @staticmethod
+    def _format_chapter_summary(chapter: ChapterDetails, summary: str) -> str:
+        return f"**Chapter {chapter.number}: {chapter.title} (summary)**\n{summary.strip()}\n\n"
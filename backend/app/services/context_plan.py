@@ -0,0 +1,189 @@
+"""
+Token budget planning for ContextBuilder.
+
+Each context element carries a nominal token_budget, but the budgets used to
+be spent greedily in element order without regard to the model's context
+window or the tokens the response needs, so a request either overflowed the
+window or summarized an element while budget sat unused elsewhere.
+
+build_messages now measures every element once and plans the whole prompt
+before anything is summarized:
+
+- the window is min(LLM_N_CTX, CONTEXT_MAX_TOKENS) (or the batch engine's
+  per-sequence context), minus room for generation and per-message overhead;
+  the full max_tokens is reserved for generation unless it would leave the
+  prompt less than half the window, in which case the reserve is clamped and
+  a warning logged
+- literal elements (system prompt, instructions, outline) are kept whole
+- every other element that fits its share of what is left is kept whole; the
+  rest split the remainder in proportion to their nominal budgets
+  (weighted max-min fairness), so unused budget flows to elements that need
+  it and only elements that cannot fit are summarized or truncated
+
+The resulting ContextPlan is kept on the builder (`last_plan`) and logged.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Approximate chat-template tokens added around each message
+MESSAGE_OVERHEAD_TOKENS = 8
+
+
+@dataclass
+class ContextPlanEntry:
+    """Measured size and planned allocation of one context element."""
+    tag: Optional[str]
+    role: str
+    strategy: str
+    tokens: int
+    budget: int
+    reducible: bool
+    allocated: int = 0
+    # Tokenization reused when the element is rendered
+    tokenized: Any = field(default=None, repr=False, compare=False)
+
+    @property
+    def over_budget(self) -> bool:
+        """Whether the element has to be summarized or truncated."""
+        return self.tokens > self.allocated
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "tag": self.tag,
+            "role": str(getattr(self.role, 'value', self.role)),
+            "strategy": self.strategy,
+            "tokens": self.tokens,
+            "budget": self.budget,
+            "allocated": self.allocated,
+            "over_budget": self.over_budget,
+        }
+
+
+@dataclass
+class ContextPlan:
+    """Token allocation for every element of a prompt."""
+    context_window: int
+    generation_reserve: int
+    message_overhead: int
+    entries: List[ContextPlanEntry]
+    # Tokens the response was requested with; more than generation_reserve if clamped
+    max_tokens: int = 0
+
+    @property
+    def reserve_clamped(self) -> bool:
+        """Whether less than max_tokens is reserved for the response."""
+        return self.generation_reserve < self.max_tokens
+
+    @property
+    def prompt_budget(self) -> int:
+        """Tokens available to element content."""
+        return self.context_window - self.generation_reserve - self.message_overhead
+
+    @property
+    def measured_tokens(self) -> int:
+        """Tokens of all elements before any reduction."""
+        return sum(e.tokens for e in self.entries)
+
+    @property
+    def planned_tokens(self) -> int:
+        """Upper bound of the prompt's tokens once over-budget elements are reduced."""
+        return sum(min(e.tokens, e.allocated) for e in self.entries)
+
+    @property
+    def over_budget(self) -> List[ContextPlanEntry]:
+        """Elements that will be summarized or truncated."""
+        return [e for e in self.entries if e.over_budget]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "context_window": self.context_window,
+            "generation_reserve": self.generation_reserve,
+            "max_tokens": self.max_tokens,
+            "message_overhead": self.message_overhead,
+            "prompt_budget": self.prompt_budget,
+            "measured_tokens": self.measured_tokens,
+            "planned_tokens": self.planned_tokens,
+            "entries": [e.to_dict() for e in self.entries],
+        }
+
+    def __str__(self) -> str:
+        reduced = ', '.join(f"{e.tag or e.role} {e.tokens}->{e.allocated}" for e in self.over_budget)
+        clamped = f" of {self.max_tokens} requested" if self.reserve_clamped else ""
+        return (f"{self.measured_tokens} of {self.prompt_budget} prompt tokens "
+                f"(window {self.context_window}, {self.generation_reserve}{clamped} reserved for generation); "
+                f"reduced: {reduced or 'none'}")
+
+
+def plan_context(
+        entries: List[ContextPlanEntry],
+        context_window: int,
+        max_tokens: int) -> ContextPlan:
+    """
+    Allocate the window's prompt tokens to measured elements.
+
+    Args:
+        entries: Measured elements in prompt order (allocated is filled in)
+        context_window: Tokens the model can attend to
+        max_tokens: Tokens to reserve for the response. Reserved in full
+            unless the prompt would then have to be reduced below half the
+            window; the reserve is then clamped to whichever is larger of
+            half the window and what the unreduced prompt leaves, with a
+            warning (see ContextPlan.reserve_clamped)
+
+    Returns:
+        The plan
+
+    Raises:
+        ValueError: If the elements that cannot be reduced do not fit
+    """
+    message_overhead = MESSAGE_OVERHEAD_TOKENS * len(entries)
+    generation_reserve = max_tokens
+    if max_tokens > context_window // 2:
+        unreduced_room = context_window - message_overhead - sum(e.tokens for e in entries)
+        generation_reserve = min(max_tokens, max(context_window // 2, unreduced_room))
+        if generation_reserve < max_tokens:
+            logger.warning(
+                f"max_tokens {max_tokens} does not fit a {context_window}-token window next to the prompt; "
+                f"reserving {generation_reserve} tokens for generation")
+
+    plan = ContextPlan(
+        context_window=context_window,
+        generation_reserve=generation_reserve,
+        message_overhead=message_overhead,
+        entries=entries,
+        max_tokens=max_tokens)
+
+    remaining = plan.prompt_budget
+    pending = []
+    for e in entries:
+        if e.reducible:
+            pending.append(e)
+        else:
+            e.allocated = e.tokens
+            remaining -= e.tokens
+    if remaining < 0:
+        raise ValueError(
+            f"Context does not fit: {plan.prompt_budget - remaining} tokens of literal context "
+            f"for a prompt budget of {plan.prompt_budget}")
+
+    # Elements within their weighted share keep everything; each one that
+    # leaves frees budget for the rest, so repeat until none fit
+    while pending:
+        weight = sum(max(e.budget, 1) for e in pending)
+        fitting = [e for e in pending if e.tokens * weight <= remaining * max(e.budget, 1)]
+        if not fitting:
+            break
+        for e in fitting:
+            e.allocated = e.tokens
+            remaining -= e.tokens
+        fitted = {id(e) for e in fitting}
+        pending = [e for e in pending if id(e) not in fitted]
+
+    if pending:
+        weight = sum(max(e.budget, 1) for e in pending)
+        for e in pending:
+            e.allocated = remaining * max(e.budget, 1) // weight
+    return plan
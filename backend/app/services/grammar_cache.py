@@ -0,0 +1,137 @@
+"""
+Cache of JSON-schema grammars for structured output.
+
+Passing response_format with a JSON schema to llama-cpp makes it convert the
+schema to a GBNF grammar on every call, in Python, before a single token is
+sampled. The structured endpoints use a handful of fixed Pydantic response
+models, so their grammars are built once (at startup for the models listed in
+generation_models.STRUCTURED_OUTPUT_MODELS, on first use for any other) and
+the grammar is passed to llama-cpp directly.
+"""
+import json
+import logging
+import threading
+from typing import Dict, Iterable, Optional, Type
+
+from pydantic import BaseModel
+
+try:
+    from llama_cpp.llama_grammar import LlamaGrammar
+    LLAMA_CPP_AVAILABLE = True
+except ImportError:
+    LLAMA_CPP_AVAILABLE = False
+    LlamaGrammar = None
+
+logger = logging.getLogger(__name__)
+
+
+class GrammarCache:
+    """Grammars keyed by response model class."""
+
+    def __init__(self):
+        self._grammars: Dict[Type[BaseModel], "LlamaGrammar"] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._grammars)
+
+    def get(self, schema_class: Type[BaseModel]) -> "LlamaGrammar":
+        """
+        Grammar constraining output to a model's JSON schema, built on first use.
+
+        Args:
+            schema_class: Pydantic model the output must validate against
+
+        Returns:
+            LlamaGrammar for the model's schema
+
+        Raises:
+            ValueError: If the schema cannot be converted to a grammar
+        """
+        with self._lock:
+            grammar = self._grammars.get(schema_class)
+            if grammar is not None:
+                self.hits += 1
+                return grammar
+            self.misses += 1
+        # Built outside the lock; a concurrent miss just builds the same grammar twice
+        grammar = self._build(schema_class)
+        with self._lock:
+            return self._grammars.setdefault(schema_class, grammar)
+
+    def warm(self, schema_classes: Iterable[Type[BaseModel]]) -> int:
+        """
+        Build the grammars of the given models ahead of their first request.
+
+        Args:
+            schema_classes: Response models to build grammars for
+
+        Returns:
+            Number of grammars built
+        """
+        built = 0
+        for schema_class in schema_classes:
+            if schema_class in self._grammars:
+                continue
+            try:
+                grammar = self._build(schema_class)
+            except ValueError:
+                logger.exception(f"Failed to build grammar for {schema_class.__name__}")
+                continue
+            with self._lock:
+                self._grammars.setdefault(schema_class, grammar)
+            built += 1
+        return built
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Cache counters for monitoring (reported by /health).
+
+        Returns:
+            Dict of counter name to value
+        """
+        return {"grammars": len(self._grammars), "hits": self.hits, "misses": self.misses}
+
+    @staticmethod
+    def _build(schema_class: Type[BaseModel]) -> "LlamaGrammar":
+        if LlamaGrammar is None:
+            raise ValueError("llama-cpp-python is not installed")
+        try:
+            return LlamaGrammar.from_json_schema(json.dumps(schema_class.model_json_schema()), verbose=False)
+        except Exception as e:
+            raise ValueError(f"Cannot build a grammar for {schema_class.__name__}: {e}") from e
+
+
+# Global instance for singleton pattern
+_grammar_cache: Optional[GrammarCache] = None
+_grammar_cache_lock = threading.Lock()
+
+
+def get_grammar_cache() -> GrammarCache:
+    """
+    Get the global grammar cache, creating it on first use.
+
+    Returns:
+        GrammarCache instance
+    """
+    global _grammar_cache
+
+    with _grammar_cache_lock:
+        if _grammar_cache is None:
+            _grammar_cache = GrammarCache()
+        return _grammar_cache
+
+
+def warm_grammar_cache() -> int:
+    """
+    Build the grammars of the structured response models in generation_models.
+
+    Returns:
+        Number of grammars built
+    """
+    from app.models.generation_models import STRUCTURED_OUTPUT_MODELS
+    built = get_grammar_cache().warm(STRUCTURED_OUTPUT_MODELS)
+    logger.info(f"Built {built} response grammars")
+    return built
@@ -0,0 +1,665 @@
+"""
+Inference executor for running blocking LLM calls off the event loop.
+
+llama.cpp generation is synchronous and can take minutes for a chapter, so
+endpoints must not call LLMInference directly from inside their async SSE
+generators. The executor owns dedicated worker threads that talk to the model;
+callers submit work and await the result (or iterate streamed tokens) through
+an asyncio.Queue, so the event loop stays free for /health, token counting and
+archive search while a generation is running. Jobs are taken from a single
+queue, which serializes access to the shared model: concurrent requests wait
+their turn instead of driving the same llama context at the same time.
+
+With an LLMInferencePool there is one worker per model replica; each worker
+only drives its own replica (see current_worker_index), and whichever worker is
+idle takes the next job. Jobs may carry an affinity key (the story id): the
+executor remembers which worker last ran each key, because that worker's
+replica holds the story's evaluated long-term prefix, and keeps the key's jobs
+on it. If that worker is busy the job goes to the first worker that is free.
+
+Waiting jobs are ordered by priority class (interactive before normal before
+batch work) and then by request: endpoints take a QueueTicket when they admit
+a request (admit() raises QueueFullError once max_pending jobs are waiting)
+and pass it with every job of that request, so a request's follow-up jobs are
+not overtaken by requests that arrived later.
+
+A long streaming generation can be preempted: when a higher-priority job is
+waiting and no worker is free, the stream's call polls preemption_requested()
+at token boundaries, snapshots its model state, and calls
+serve_preempting_jobs() to run the waiting jobs on its own worker thread
+before restoring the snapshot and continuing (see LLMInference.chat_completion_stream).
+"""
+import asyncio
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Message kinds passed from worker threads back to the event loop
+_ITEM = 'item'
+_DONE = 'done'
+_ERROR = 'error'
+
+# Job currently executing on each worker thread, the worker's index and its executor
+_worker_context = threading.local()
+
+# Number of affinity keys remembered
+_AFFINITY_CAPACITY = 4096
+
+
+class JobPriority(IntEnum):
+    """Scheduling class of a request; lower values run first."""
+    INTERACTIVE = 0
+    NORMAL = 1
+    BATCH = 2
+
+
+class QueueFullError(Exception):
+    """Raised by InferenceExecutor.admit when too many jobs are waiting."""
+
+    def __init__(self, pending: int, retry_after: int):
+        super().__init__(f"Inference queue is full ({pending} jobs waiting)")
+        self.pending = pending
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True, eq=False)
+class QueueTicket:
+    """Priority and arrival order shared by all jobs of one request."""
+    priority: JobPriority
+    seq: int
+
+
+@dataclass
+class _InferenceJob:
+    """A unit of work queued for the inference worker threads."""
+    func: Callable[..., Any]
+    args: Tuple[Any, ...]
+    kwargs: Dict[str, Any]
+    loop: asyncio.AbstractEventLoop
+    output: asyncio.Queue
+    streaming: bool
+    ticket: QueueTicket
+    affinity: Optional[str] = None
+    cancelled: threading.Event = field(default_factory=threading.Event)
+
+
+class InferenceExecutor:
+    """
+    Runs blocking LLM calls on dedicated worker threads.
+
+    Use run() for calls that return a single value (chat_completion, generate,
+    ContextBuilder.build_messages) and stream() for calls that return an
+    iterator of tokens (chat_completion_stream).
+    """
+
+    def __init__(self, num_workers: int = 1, max_pending: int = 0, preemption: bool = True):
+        """
+        Initialize the executor and start its worker threads.
+
+        Args:
+            num_workers: Number of worker threads; use 1 for a single shared model
+            max_pending: Waiting jobs at which admit() rejects new requests (0 for no limit)
+            preemption: Whether running streams pause for higher-priority jobs
+        """
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+
+        self.max_pending = max_pending
+        self.preemption = preemption
+        self._tickets = itertools.count()
+        self._pending: List[_InferenceJob] = []
+        self._running: List[Optional[_InferenceJob]] = [None] * num_workers
+        self._affinity: "OrderedDict[str, int]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self.affinity_hits = 0
+        self.affinity_misses = 0
+        self.affinity_new = 0
+        self._workers: List[threading.Thread] = []
+        self._started = time.monotonic()
+        self._busy_since: List[Optional[float]] = [None] * num_workers
+        self._busy_seconds: List[float] = [0.0] * num_workers
+        self._jobs_done: List[int] = [0] * num_workers
+        self._preemptions: List[int] = [0] * num_workers
+        for i in range(num_workers):
+            worker = threading.Thread(
+                target=self._worker_loop,
+                args=(i,),
+                name=f"llm-inference-{i}",
+                daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def num_workers(self) -> int:
+        return len(self._workers)
+
+    @property
+    def pending_jobs(self) -> int:
+        """Number of jobs waiting for a worker (not counting running jobs)."""
+        with self._cond:
+            return len(self._pending)
+
+    def admit(self, priority: JobPriority = JobPriority.NORMAL) -> QueueTicket:
+        """
+        Admit a request, or reject it when the queue is full.
+
+        Args:
+            priority: Scheduling class of the request
+
+        Returns:
+            QueueTicket to pass to run() and stream() for the request's jobs
+
+        Raises:
+            QueueFullError: If max_pending jobs are already waiting
+        """
+        with self._cond:
+            pending = len(self._pending)
+            if self.max_pending and pending >= self.max_pending:
+                raise QueueFullError(pending, self._estimate_wait(pending))
+            return QueueTicket(priority=priority, seq=next(self._tickets))
+
+    def queue_position(self, ticket: QueueTicket) -> Optional[int]:
+        """
+        1-based position of the request's first waiting job, or None if it has none.
+
+        Args:
+            ticket: Ticket returned by admit()
+        """
+        with self._cond:
+            for position, job in enumerate(self._pending, start=1):
+                if job.ticket is ticket:
+                    return position
+        return None
+
+    def _estimate_wait(self, pending: int) -> int:
+        """Seconds until a job queued behind `pending` others would likely start."""
+        jobs_done = sum(self._jobs_done)
+        average = sum(self._busy_seconds) / jobs_done if jobs_done else 1.0
+        return max(1, math.ceil(average * (pending + 1) / self.num_workers))
+
+    def get_affinity_stats(self) -> Dict[str, Any]:
+        """
+        Affinity routing counters for monitoring (reported by /health).
+
+        Returns:
+            Jobs that ran on the worker holding their key (hits), on another
+            worker because it was busy (misses), with a key seen for the first
+            time (new), and hits / (hits + misses)
+        """
+        routed = self.affinity_hits + self.affinity_misses
+        return {
+            "affinity_hits": self.affinity_hits,
+            "affinity_misses": self.affinity_misses,
+            "affinity_new": self.affinity_new,
+            "affinity_hit_rate": round(self.affinity_hits / routed, 4) if routed else None,
+        }
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """
+        Per-worker utilization for monitoring (reported by /health).
+
+        Returns:
+            One dict per worker with whether it is busy, the number of jobs it
+            ran, its busy time, the fraction of uptime it spent busy and how
+            many times it paused a stream for higher-priority jobs
+        """
+        now = time.monotonic()
+        uptime = max(now - self._started, 1e-9)
+        stats = []
+        for i in range(self.num_workers):
+            busy_since = self._busy_since[i]
+            busy_seconds = self._busy_seconds[i] + (now - busy_since if busy_since is not None else 0.0)
+            stats.append({
+                "worker": i,
+                "busy": busy_since is not None,
+                "jobs": self._jobs_done[i],
+                "busy_seconds": round(busy_seconds, 3),
+                "utilization": round(busy_seconds / uptime, 4),
+                "preemptions": self._preemptions[i],
+            })
+        return stats
+
+    async def run(self, func: Callable[..., Any], *args, affinity: Optional[str] = None,
+                  ticket: Optional[QueueTicket] = None, **kwargs) -> Any:
+        """
+        Run a blocking call on a worker thread and await its result.
+
+        Args:
+            func: Callable to execute (e.g. llm.chat_completion)
+            *args, **kwargs: Arguments forwarded to func
+            affinity: Key (story id) whose jobs should stay on the same worker
+            ticket: Request ticket from admit() (None queues as a new normal-priority request)
+
+        Returns:
+            The value returned by func
+
+        Raises:
+            Any exception raised by func
+        """
+        job = self._submit(func, args, kwargs, streaming=False, affinity=affinity, ticket=ticket)
+        try:
+            kind, value = await job.output.get()
+        finally:
+            # No-op once finished; skips the job if the caller went away while queued
+            job.cancelled.set()
+
+        if kind == _ERROR:
+            raise value
+        return value
+
+    async def stream(self, func: Callable[..., Any], *args, affinity: Optional[str] = None,
+                     ticket: Optional[QueueTicket] = None, **kwargs) -> AsyncIterator[Any]:
+        """
+        Run a blocking iterator on a worker thread and yield its items.
+
+        Items are handed over through an asyncio.Queue as soon as the worker
+        produces them. Closing the returned async iterator (for example when
+        the SSE client disconnects) stops the worker from pulling further items
+        and closes the underlying iterator.
+
+        Args:
+            func: Callable returning an iterator (e.g. llm.chat_completion_stream)
+            *args, **kwargs: Arguments forwarded to func
+            affinity: Key (story id) whose jobs should stay on the same worker
+            ticket: Request ticket from admit() (None queues as a new normal-priority request)
+
+        Yields:
+            Items produced by the iterator
+        """
+        job = self._submit(func, args, kwargs, streaming=True, affinity=affinity, ticket=ticket)
+        try:
+            while True:
+                kind, value = await job.output.get()
+                if kind == _ITEM:
+                    yield value
+                elif kind == _ERROR:
+                    raise value
+                else:
+                    return
+        finally:
+            job.cancelled.set()
+
+    def run_sync(self, func: Callable[..., Any], *args, affinity: Optional[str] = None,
+                 ticket: Optional[QueueTicket] = None, **kwargs) -> Any:
+        """
+        Run a blocking call on this executor from another executor's worker and wait for it.
+
+        For jobs that need a second model part-way through, such as
+        ContextBuilder.build_messages summarizing with a model routed to
+        summarization: the call is queued here under the calling job's ticket
+        while the calling worker waits. Outside a worker thread, or on one of
+        this executor's own workers, func is called directly.
+
+        Args:
+            func: Callable to execute
+            *args, **kwargs: Arguments forwarded to func
+            affinity: Key (story id) whose jobs should stay on the same worker
+            ticket: Request ticket (defaults to the calling job's)
+
+        Returns:
+            The value returned by func
+        """
+        job = getattr(_worker_context, 'job', None)
+        if job is None or getattr(_worker_context, 'executor', None) is self:
+            return func(*args, **kwargs)
+        future = asyncio.run_coroutine_threadsafe(
+            self.run(func, *args, affinity=affinity, ticket=ticket or job.ticket, **kwargs),
+            job.loop)
+        return future.result()
+
+    def run_all_sync(self, func: Callable[..., Any], calls: Sequence[Dict[str, Any]],
+                     max_concurrency: int = 0) -> List[Any]:
+        """
+        Run independent blocking calls concurrently from a worker and wait for all of them.
+
+        For jobs that fan out part-way through, such as ContextBuilder.build_messages
+        summarizing several over-budget elements: helper jobs are queued under
+        the calling job's ticket and take calls from a shared list on whichever
+        workers are free. When called from one of this executor's own workers,
+        that worker takes calls from the list too rather than sitting idle, so
+        the calls finish even if no other worker ever becomes free. Outside a
+        worker thread, or with a single worker, the calls run one after another.
+
+        Args:
+            func: Callable to execute once per call
+            calls: Keyword arguments of each call
+            max_concurrency: Most calls running at once (0 for one per worker)
+
+        Returns:
+            The value returned by each call, in order
+
+        Raises:
+            The first exception raised by a call, once every call has finished
+        """
+        job = getattr(_worker_context, 'job', None)
+        on_own_worker = getattr(_worker_context, 'executor', None) is self
+        concurrency = min(len(calls), self.num_workers, max_concurrency or self.num_workers)
+        if job is None or concurrency <= 1 or (on_own_worker and self.num_workers == 1):
+            return [func(**kwargs) for kwargs in calls]
+
+        results: List[Any] = [None] * len(calls)
+        errors: List[Optional[BaseException]] = [None] * len(calls)
+        remaining = list(range(len(calls)))
+        unfinished = [len(calls)]
+        done = threading.Condition()
+
+        def take_calls():
+            while True:
+                with done:
+                    if not remaining:
+                        return
+                    i = remaining.pop(0)
+                try:
+                    results[i] = func(**calls[i])
+                except Exception as e:
+                    errors[i] = e
+                with done:
+                    unfinished[0] -= 1
+                    done.notify_all()
+
+        # This worker is one of the helpers when the calls run on its own executor
+        helpers = [
+            asyncio.run_coroutine_threadsafe(self.run(take_calls, ticket=job.ticket), job.loop)
+            for _ in range(concurrency - 1 if on_own_worker else concurrency)]
+        if on_own_worker:
+            take_calls()
+        with done:
+            done.wait_for(lambda: unfinished[0] == 0)
+        # Helpers that never started have nothing left to do
+        for helper in helpers:
+            helper.cancel()
+
+        for error in errors:
+            if error is not None:
+                raise error
+        return results
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop the worker threads after the queued jobs have been processed.
+
+        Args:
+            wait: Whether to block until the workers have exited
+        """
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def _submit(self, func: Callable[..., Any], args: tuple, kwargs: dict, streaming: bool,
+                affinity: Optional[str] = None, ticket: Optional[QueueTicket] = None) -> _InferenceJob:
+        with self._cond:
+            if ticket is None:
+                ticket = QueueTicket(priority=JobPriority.NORMAL, seq=next(self._tickets))
+            job = _InferenceJob(
+                func=func,
+                args=args,
+                kwargs=kwargs,
+                loop=asyncio.get_running_loop(),
+                output=asyncio.Queue(),
+                streaming=streaming,
+                ticket=ticket,
+                affinity=affinity)
+            # Keep pending ordered by (priority, request order); FIFO within a request
+            key = (ticket.priority, ticket.seq)
+            index = len(self._pending)
+            while index > 0 and key < (self._pending[index - 1].ticket.priority, self._pending[index - 1].ticket.seq):
+                index -= 1
+            self._pending.insert(index, job)
+            self._cond.notify_all()
+        return job
+
+    def _next_job(self, index: int) -> Optional[_InferenceJob]:
+        """Block until there is a job for worker index; None once shut down and drained."""
+        with self._cond:
+            while True:
+                job = self._take_job(index)
+                if job is not None:
+                    self._running[index] = job
+                    # Jobs preferring this worker may now go to another one
+                    self._cond.notify_all()
+                    return job
+                if self._shutdown and not self._pending:
+                    return None
+                self._cond.wait()
+
+    def _take_job(self, index: int) -> Optional[_InferenceJob]:
+        """
+        Remove and return the first pending job worker index may run.
+
+        A job whose affinity key belongs to another worker is left for that
+        worker unless it is busy. Must be called with self._cond held.
+        """
+        i = 0
+        while i < len(self._pending):
+            job = self._pending[i]
+            if job.cancelled.is_set():
+                logger.debug(f"Skipping cancelled inference job {job.func}")
+                del self._pending[i]
+                continue
+            preferred = self._affinity.get(job.affinity) if job.affinity is not None else None
+            if preferred is None or preferred == index or self._running[preferred] is not None:
+                del self._pending[i]
+                if job.affinity is not None:
+                    self._record_affinity(job.affinity, preferred, index)
+                return job
+            i += 1
+        return None
+
+    def _record_affinity(self, key: str, preferred: Optional[int], index: int):
+        if preferred is None:
+            self.affinity_new += 1
+        elif preferred == index:
+            self.affinity_hits += 1
+        else:
+            self.affinity_misses += 1
+        # This worker's replica now holds the key's prefix
+        self._affinity[key] = index
+        self._affinity.move_to_end(key)
+        while len(self._affinity) > _AFFINITY_CAPACITY:
+            self._affinity.popitem(last=False)
+
+    def _worker_loop(self, index: int):
+        _worker_context.index = index
+        _worker_context.executor = self
+        while True:
+            job = self._next_job(index)
+            if job is None:
+                break
+            self._busy_since[index] = time.monotonic()
+            try:
+                outcome = self._execute(job)
+            finally:
+                self._busy_seconds[index] += time.monotonic() - self._busy_since[index]
+                self._busy_since[index] = None
+                self._jobs_done[index] += 1
+                with self._cond:
+                    self._running[index] = None
+            # Only report completion once the worker is idle, so the caller's
+            # next job sees its affinity worker as free
+            self._emit(job, *outcome)
+
+    def _execute(self, job: _InferenceJob) -> Tuple[str, Any]:
+        """Run job on the calling worker thread and return the message reporting its outcome."""
+        outer = getattr(_worker_context, 'job', None)
+        _worker_context.job = job
+        try:
+            if job.streaming:
+                self._run_streaming(job)
+                return _DONE, None
+            return _DONE, job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            return _ERROR, e
+        finally:
+            _worker_context.job = outer
+
+    def _preempting_job_waiting(self, job: _InferenceJob) -> bool:
+        """
+        Whether a job of higher priority than job is waiting and no worker is free for it.
+
+        Must be called with self._cond held.
+        """
+        if not self.preemption:
+            return False
+        while self._pending and self._pending[0].cancelled.is_set():
+            del self._pending[0]
+        return (bool(self._pending)
+                and self._pending[0].ticket.priority < job.ticket.priority
+                and all(running is not None for running in self._running))
+
+    def _serve_preempting_jobs(self, index: int, paused: _InferenceJob) -> int:
+        """Run waiting higher-priority jobs on worker index while paused is suspended."""
+        served = 0
+        while True:
+            with self._cond:
+                if not self._preempting_job_waiting(paused):
+                    break
+                job = self._pending.pop(0)
+                if job.affinity is not None:
+                    self._record_affinity(job.affinity, self._affinity.get(job.affinity), index)
+                self._running[index] = job
+            try:
+                outcome = self._execute(job)
+            finally:
+                self._jobs_done[index] += 1
+                with self._cond:
+                    self._running[index] = paused
+            self._emit(job, *outcome)
+            served += 1
+        if served:
+            self._preemptions[index] += 1
+            logger.info(f"Paused a priority {paused.ticket.priority.name} stream to serve {served} job(s)")
+        return served
+
+    def _run_streaming(self, job: _InferenceJob):
+        iterator = job.func(*job.args, **job.kwargs)
+        try:
+            for item in iterator:
+                if job.cancelled.is_set():
+                    logger.info("Inference stream abandoned by caller; stopping generation")
+                    break
+                self._emit(job, _ITEM, item)
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    @staticmethod
+    def _emit(job: _InferenceJob, kind: str, value: Any):
+        try:
+            job.loop.call_soon_threadsafe(job.output.put_nowait, (kind, value))
+        except RuntimeError:
+            # The caller's event loop is closed; nobody is listening anymore
+            job.cancelled.set()
+
+
+def preemption_requested() -> bool:
+    """
+    Whether the job running on this thread should pause for higher-priority work.
+
+    True when a job of higher priority than the current one is waiting and
+    every worker is busy. Streaming calls poll this between tokens and, when
+    it is set, snapshot their state and call serve_preempting_jobs(). Always
+    False outside an executor worker thread.
+    """
+    executor = getattr(_worker_context, 'executor', None)
+    job = getattr(_worker_context, 'job', None)
+    if executor is None or job is None:
+        return False
+    with executor._cond:
+        return executor._preempting_job_waiting(job)
+
+
+def serve_preempting_jobs() -> int:
+    """
+    Run the waiting higher-priority jobs on this worker thread, then return.
+
+    The caller must leave the model in a state it can restore afterwards, as
+    the jobs run on the same model replica. Returns the number of jobs run
+    (0 outside an executor worker thread).
+    """
+    executor = getattr(_worker_context, 'executor', None)
+    job = getattr(_worker_context, 'job', None)
+    if executor is None or job is None:
+        return 0
+    return executor._serve_preempting_jobs(_worker_context.index, job)
+
+
+def current_job_cancelled() -> bool:
+    """
+    Whether the caller of the job running on this thread has gone away.
+
+    Long-running calls such as LLMInference.chat_completion_stream poll this
+    to stop generating as soon as the SSE client disconnects. Always False
+    outside an executor worker thread.
+    """
+    job = getattr(_worker_context, 'job', None)
+    return job is not None and job.cancelled.is_set()
+
+
+def current_worker_index() -> Optional[int]:
+    """
+    Index of the executor worker running on this thread, or None elsewhere.
+
+    LLMInferencePool uses it to pin each worker to its own model replica.
+    """
+    return getattr(_worker_context, 'index', None)
+
+
+def current_executor() -> Optional[InferenceExecutor]:
+    """
+    Executor whose job is running on this thread, or None elsewhere.
+
+    ContextBuilder uses it to fan summaries out over the free workers (see
+    InferenceExecutor.run_all_sync).
+    """
+    if getattr(_worker_context, 'job', None) is None:
+        return None
+    return getattr(_worker_context, 'executor', None)
+
+
+# Global instance for singleton pattern
+_executor_instance: Optional[InferenceExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_inference_executor() -> InferenceExecutor:
+    """
+    Get the global inference executor, creating it on first use.
+
+    The executor has one worker per model replica (LLM_POOL_SIZE).
+
+    Returns:
+        InferenceExecutor instance
+    """
+    global _executor_instance
+
+    with _executor_lock:
+        if _executor_instance is None:
+            from app.core.config import settings
+            _executor_instance = InferenceExecutor(
+                num_workers=settings.LLM_POOL_SIZE,
+                max_pending=settings.LLM_MAX_QUEUE_DEPTH,
+                preemption=settings.LLM_PREEMPTION)
+        return _executor_instance
+
+
+def shutdown_inference_executor():
+    """Stop the global inference executor, if it was started."""
+    global _executor_instance
+
+    with _executor_lock:
+        if _executor_instance is not None:
+            _executor_instance.shutdown(wait=False)
+            _executor_instance = None
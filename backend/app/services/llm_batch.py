@@ -0,0 +1,461 @@
+"""
+Continuous batching of concurrent chat completions in one llama context.
+
+LLMInference generates one sequence at a time, so concurrent requests (all
+enabled raters reviewing a chapter at once, say) queue behind each other. On
+CPU a decode step is bound by reading the weights, and a step that carries a
+token for each of several sequences costs little more than a step for one.
+
+BatchEngine owns a second llama context on the loaded model, with room for
+LLM_BATCH_MAX_SEQUENCES sequences, and a thread that runs decode steps. Every
+step carries the next token of each generating sequence, plus prompt tokens
+of newly admitted sequences up to the batch size. Requests join and leave the
+batch between steps (continuous batching) rather than waiting for a whole
+batch to finish. Each sequence has its own sampler, so temperature, repetition
+penalty and JSON-schema grammars work as they do for create_chat_completion.
+
+The engine does not use the executor's workers: callers iterate
+BatchEngine.stream() directly on the event loop (see
+shared_utils.stream_chat_completion). It follows the executor's scheduling
+rules, though: waiting requests are ordered by their QueueTicket (priority
+class, then arrival), and check_admission() rejects new requests with
+QueueFullError once max_pending of them are waiting for a sequence.
+"""
+import asyncio
+import codecs
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.services.grammar_cache import get_grammar_cache
+from app.services.inference_executor import JobPriority, QueueFullError, QueueTicket
+
+try:
+    import llama_cpp
+    from llama_cpp import _internals as llama_internals
+    LLAMA_CPP_AVAILABLE = True
+except ImportError:
+    LLAMA_CPP_AVAILABLE = False
+    llama_cpp = None
+    llama_internals = None
+
+if TYPE_CHECKING:
+    from app.services.llm_inference import LLMInference
+
+logger = logging.getLogger(__name__)
+
+# Message kinds passed from the engine thread back to the event loop
+_ITEM = 'item'
+_DONE = 'done'
+_ERROR = 'error'
+
+
+def _stop_boundary(text: str, stops: List[str], start: int = 0) -> Tuple[int, bool]:
+    """
+    How much of the generated text may be sent to the caller.
+
+    Args:
+        text: Text generated so far
+        stops: Stop strings
+        start: Length of text already sent (no stop string ends before it)
+
+    Returns:
+        (end, stopped): text[:end] can be sent; stopped is True if a stop
+        string was found at end. Otherwise a suffix that could be the start of
+        a stop string is held back.
+    """
+    first = -1
+    for stop in stops:
+        if not stop:
+            continue
+        i = text.find(stop, max(0, start - len(stop) + 1))
+        if i >= 0 and (first < 0 or i < first):
+            first = i
+    if first >= 0:
+        return first, True
+
+    held = 0
+    for stop in stops:
+        for k in range(min(len(stop) - 1, len(text)), held, -1):
+            if text.endswith(stop[:k]):
+                held = k
+                break
+    return len(text) - held, False
+
+
+@dataclass
+class _BatchRequest:
+    """A chat completion submitted to the engine, and its decoding progress."""
+    messages: List[Dict[str, str]]
+    params: Dict[str, Any]
+    loop: asyncio.AbstractEventLoop
+    output: asyncio.Queue
+    # Scheduling order while waiting: (priority, request order)
+    order: Tuple[int, float] = (JobPriority.NORMAL, math.inf)
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    seq_id: int = -1
+    prompt: List[int] = field(default_factory=list)
+    sampler: Any = None
+    stop: List[str] = field(default_factory=list)
+    max_tokens: int = 0
+    # Tokens of the sequence in the KV cache
+    n_past: int = 0
+    # Sampled token not yet decoded
+    next_token: Optional[int] = None
+    generated: int = 0
+    text: str = ''
+    sent: int = 0
+    decoder: Any = field(default_factory=lambda: codecs.getincrementaldecoder('utf-8')(errors='replace'))
+
+
+class BatchEngine:
+    """
+    Decodes several chat completions together in one multi-sequence llama context.
+
+    Usage:
+        async for token in llm.batch_engine.stream(messages, max_tokens=500):
+            ...
+    """
+
+    def __init__(self, llm: "LLMInference", max_sequences: int, n_ctx_per_sequence: Optional[int] = None,
+                 max_pending: int = 0):
+        """
+        Create the batch context and start the decode thread.
+
+        Args:
+            llm: Loaded LLMInference whose model weights, chat template and
+                sampling defaults are used
+            max_sequences: Sequences decoded together; further requests wait
+            n_ctx_per_sequence: Context size of each sequence (default: the model's n_ctx);
+                the batch context holds max_sequences times this many tokens of KV cache
+            max_pending: Waiting requests at which check_admission() rejects new ones (0 for no limit)
+
+        Raises:
+            RuntimeError: If the llama context cannot be created
+        """
+        if max_sequences < 1:
+            raise ValueError("max_sequences must be at least 1")
+
+        self._llm = llm
+        self.max_sequences = max_sequences
+        self.n_ctx_per_sequence = n_ctx_per_sequence or llm.config.n_ctx
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._waiting: List[_BatchRequest] = []
+        self._active: Dict[int, _BatchRequest] = {}
+        self._free_ids: List[int] = list(range(max_sequences))
+        self._shutdown = False
+        self.steps = 0
+        self.sequence_steps = 0
+        self.generated_tokens = 0
+        self.prompt_tokens = 0
+        self.decode_seconds = 0.0
+        self.completed = 0
+        self._open_context()
+        self._thread = threading.Thread(target=self._run, name="llm-batch", daemon=True)
+        self._thread.start()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Batching counters for monitoring (reported by /health with the LLM stats).
+
+        Returns:
+            Dict of counter name to value
+        """
+        return {
+            "batch_active_sequences": len(self._active),
+            "batch_waiting": len(self._waiting),
+            "batch_completed": self.completed,
+            "batch_steps": self.steps,
+            "batch_mean_sequences": round(self.sequence_steps / self.steps, 2) if self.steps else 0.0,
+            "batch_generated_tokens": self.generated_tokens,
+            "batch_tokens_per_second": (
+                round(self.generated_tokens / self.decode_seconds, 2) if self.decode_seconds else 0.0),
+        }
+
+    @property
+    def pending(self) -> int:
+        """Number of requests waiting for a free sequence."""
+        with self._cond:
+            return len(self._waiting)
+
+    def check_admission(self):
+        """
+        Reject a new request when too many are already waiting for a sequence.
+
+        Call this with InferenceExecutor.admit when the request will be
+        decoded here (see shared_utils.admit_request).
+
+        Raises:
+            QueueFullError: If max_pending requests are already waiting
+        """
+        with self._cond:
+            pending = len(self._waiting)
+            if self.max_pending and pending >= self.max_pending:
+                # Sequences overlap, so decode time per completion is the interval between them
+                average = self.decode_seconds / self.completed if self.completed else 1.0
+                raise QueueFullError(pending, max(1, math.ceil(average * (pending + 1))))
+
+    async def stream(self, messages: List[Dict[str, str]], ticket: Optional[QueueTicket] = None,
+                     **params) -> AsyncIterator[str]:
+        """
+        Generate a chat completion in the shared batch, yielding text as it is produced.
+
+        Closing the iterator (e.g. the SSE client disconnected) removes the
+        sequence from the batch at the next step.
+
+        Args:
+            messages: List of message dicts with 'role' and 'content' keys
+            ticket: Request ticket from InferenceExecutor.admit; requests
+                without one wait behind every normal-priority ticket
+            **params: max_tokens, temperature, top_p, top_k, repeat_penalty,
+                stop and json_schema_class, as for LLMInference.chat_completion_stream
+
+        Yields:
+            Text pieces as they are generated
+        """
+        request = _BatchRequest(
+            messages=messages,
+            params=params,
+            loop=asyncio.get_running_loop(),
+            output=asyncio.Queue())
+        if ticket is not None:
+            request.order = (ticket.priority, ticket.seq)
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Batch engine is shut down")
+            # Keep waiting ordered by (priority, request order), as the executor does
+            index = len(self._waiting)
+            while index > 0 and request.order < self._waiting[index - 1].order:
+                index -= 1
+            self._waiting.insert(index, request)
+            self._cond.notify_all()
+        try:
+            while True:
+                kind, value = await request.output.get()
+                if kind == _ITEM:
+                    yield value
+                elif kind == _ERROR:
+                    raise value
+                else:
+                    break
+        finally:
+            request.cancelled.set()
+            with self._cond:
+                self._cond.notify_all()
+
+    def shutdown(self, wait: bool = True):
+        """Stop the decode thread; requests still running are abandoned."""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            self._thread.join()
+
+    # -- decode thread --
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._shutdown and not self._waiting and not self._active:
+                    self._cond.wait()
+                if self._shutdown:
+                    break
+                admitted = []
+                while self._waiting and self._free_ids:
+                    request = self._waiting.pop(0)
+                    if request.cancelled.is_set():
+                        continue
+                    request.seq_id = self._free_ids.pop(0)
+                    admitted.append(request)
+
+            for request in admitted:
+                self._active[request.seq_id] = request
+                try:
+                    self._prepare(request)
+                except Exception as e:
+                    logger.exception("Failed to start batched sequence")
+                    self._finish(request, _ERROR, RuntimeError(f"Streaming chat completion failed: {e}"))
+
+            for request in list(self._active.values()):
+                if request.cancelled.is_set():
+                    logger.info(f"Batched sequence abandoned after {request.generated} tokens")
+                    self._finish(request)
+
+            if self._active:
+                try:
+                    self._step()
+                except Exception as e:
+                    logger.exception("Batched decode step failed")
+                    for request in list(self._active.values()):
+                        self._finish(request, _ERROR, RuntimeError(f"Streaming chat completion failed: {e}"))
+
+    def _prepare(self, request: _BatchRequest):
+        """Tokenize the request's prompt and build its sampler."""
+        params = request.params
+        config = self._llm.config
+        request.prompt = self._llm._tokenize_chat(request.messages, add_generation_prompt=True)
+        if len(request.prompt) >= self.n_ctx_per_sequence:
+            raise ValueError(
+                f"Prompt of {len(request.prompt)} tokens does not fit the "
+                f"{self.n_ctx_per_sequence}-token sequence context")
+        max_tokens = params.get('max_tokens') or config.max_tokens
+        request.max_tokens = min(max_tokens, self.n_ctx_per_sequence - len(request.prompt))
+        request.stop = list(params.get('stop') or [])
+        request.sampler = self._create_sampler(params)
+        self.prompt_tokens += len(request.prompt)
+
+    def _step(self):
+        """Run one decode step over every active sequence and sample their next tokens."""
+        budget = self._n_batch
+        sampled: List[Tuple[int, _BatchRequest]] = []
+        self._batch_reset()
+
+        # The next token of every generating sequence
+        for request in self._active.values():
+            if request.next_token is not None:
+                sampled.append((self._batch_add(request.next_token, request.n_past, request.seq_id, True), request))
+                request.n_past += 1
+                request.next_token = None
+                budget -= 1
+
+        # Fill the rest of the batch with prompt tokens of new sequences
+        for request in self._active.values():
+            if budget <= 0:
+                break
+            remaining = len(request.prompt) - request.n_past
+            if remaining <= 0:
+                continue
+            chunk = request.prompt[request.n_past:request.n_past + budget]
+            for k, token in enumerate(chunk):
+                last = request.n_past + k == len(request.prompt) - 1
+                index = self._batch_add(token, request.n_past + k, request.seq_id, last)
+                if last:
+                    sampled.append((index, request))
+            request.n_past += len(chunk)
+            budget -= len(chunk)
+
+        started = time.monotonic()
+        self._decode()
+        self.decode_seconds += time.monotonic() - started
+        self.steps += 1
+        self.sequence_steps += len(sampled)
+
+        for index, request in sampled:
+            self._accept(request, self._sample(request, index))
+
+    def _accept(self, request: _BatchRequest, token: int):
+        """Send the text of a sampled token and decide whether the sequence continues."""
+        if self._is_eog(token):
+            self._send_text(request, len(request.text))
+            self._finish(request, _DONE)
+            return
+
+        request.generated += 1
+        self.generated_tokens += 1
+        request.text += request.decoder.decode(self._token_piece(token))
+        end, stopped = _stop_boundary(request.text, request.stop, request.sent)
+        if stopped or request.generated >= request.max_tokens:
+            self._send_text(request, end if stopped else len(request.text))
+            self._finish(request, _DONE)
+            return
+        self._send_text(request, end)
+        request.next_token = token
+
+    def _send_text(self, request: _BatchRequest, end: int):
+        if end > request.sent:
+            self._emit(request, _ITEM, request.text[request.sent:end])
+            request.sent = end
+
+    def _finish(self, request: _BatchRequest, kind: Optional[str] = None, value: Any = None):
+        """Remove a sequence from the batch, free its KV cache cells and notify the caller."""
+        self._active.pop(request.seq_id, None)
+        self._release(request.seq_id)
+        with self._cond:
+            self._free_ids.append(request.seq_id)
+        request.seq_id = -1
+        if kind is not None:
+            if kind == _DONE:
+                self.completed += 1
+            self._emit(request, kind, value)
+
+    @staticmethod
+    def _emit(request: _BatchRequest, kind: str, value: Any):
+        try:
+            request.loop.call_soon_threadsafe(request.output.put_nowait, (kind, value))
+        except RuntimeError:
+            # The caller's event loop is closed; nobody is listening anymore
+            request.cancelled.set()
+
+    # -- llama.cpp --
+
+    def _open_context(self):
+        model = self._llm.model
+        params = llama_cpp.llama_context_params.from_buffer_copy(model.context_params)
+        params.n_ctx = self.n_ctx_per_sequence * self.max_sequences
+        params.n_seq_max = self.max_sequences
+        self._n_batch = params.n_batch
+        if self.max_sequences > self._n_batch:
+            raise ValueError(f"max_sequences ({self.max_sequences}) exceeds the batch size ({self._n_batch})")
+        self._ctx = llama_internals.LlamaContext(model=model._model, params=params, verbose=model.verbose)
+        self._batch = llama_internals.LlamaBatch(
+            n_tokens=self._n_batch, embd=0, n_seq_max=self.max_sequences, verbose=model.verbose)
+        kv_mb = self._kv_cache_bytes(model._model.model, params.n_ctx) // 1024**2
+        logger.info(
+            f"Batch engine ready: {self.max_sequences} sequences of {self.n_ctx_per_sequence} tokens "
+            f"({params.n_ctx}-token KV cache, ~{kv_mb} MB)")
+
+    @staticmethod
+    def _kv_cache_bytes(model, n_ctx: int) -> int:
+        """Approximate KV cache size of an n_ctx context, assuming the default f16 cache type."""
+        n_layer = llama_cpp.llama_model_n_layer(model)
+        n_head = max(llama_cpp.llama_model_n_head(model), 1)
+        n_embd_kv = llama_cpp.llama_model_n_embd(model) * llama_cpp.llama_model_n_head_kv(model) // n_head
+        return 2 * n_layer * n_embd_kv * n_ctx * 2
+
+    def _create_sampler(self, params: Dict[str, Any]):
+        config = self._llm.config
+        grammar = None
+        schema_class = params.get('json_schema_class')
+        if schema_class is not None:
+            grammar = get_grammar_cache().get(schema_class)
+        temperature = params.get('temperature')
+        repeat_penalty = params.get('repeat_penalty')
+        return self._llm.model._init_sampler(
+            top_k=params.get('top_k') or config.top_k,
+            top_p=params.get('top_p') or config.top_p,
+            temp=temperature if temperature is not None else config.temperature,
+            repeat_penalty=repeat_penalty if repeat_penalty is not None else config.repeat_penalty,
+            grammar=grammar)
+
+    def _batch_reset(self):
+        self._batch.reset()
+
+    def _batch_add(self, token: int, pos: int, seq_id: int, logits: bool) -> int:
+        batch = self._batch.batch
+        i = batch.n_tokens
+        batch.token[i] = token
+        batch.pos[i] = pos
+        batch.seq_id[i][0] = seq_id
+        batch.n_seq_id[i] = 1
+        batch.logits[i] = logits
+        batch.n_tokens = i + 1
+        return i
+
+    def _decode(self):
+        self._ctx.decode(self._batch)
+
+    def _sample(self, request: _BatchRequest, index: int) -> int:
+        return request.sampler.sample(self._ctx, index)
+
+    def _token_piece(self, token: int) -> bytes:
+        return self._llm.model._model.token_to_piece(token)
+
+    def _is_eog(self, token: int) -> bool:
+        return llama_cpp.llama_token_is_eog(self._llm.model._model.vocab, token)
+
+    def _release(self, seq_id: int):
+        self._ctx.kv_cache_seq_rm(seq_id, -1, -1)
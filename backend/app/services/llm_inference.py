@@ -2,19 +2,32 @@
 Local LLM Inference using llama.cpp
 Provides a simple interface for generating text with local models.
 """
+import codecs
 import logging
-from typing import Optional, Dict, Any, List, Type
-from dataclasses import dataclass
+import threading
+from typing import Optional, Dict, Any, Callable, List, Type
+from dataclasses import dataclass, field
+from functools import cached_property
 from pathlib import Path
 from pydantic import BaseModel
 
+from app.services.grammar_cache import get_grammar_cache
+from app.services.inference_executor import current_job_cancelled, preemption_requested, serve_preempting_jobs
+from app.services.llm_batch import BatchEngine
+from app.services.llm_speculative import TrackingDrafter, create_drafter
+from app.services.llm_state_cache import (
+    DiskStateCache, PrefixStateCache, hash_message_prefix, load_llama_state, save_llama_state)
+from app.services.token_cache import TokenCache
+
 try:
     from llama_cpp import Llama, LlamaRAMCache
+    from llama_cpp.llama_chat_format import Jinja2ChatFormatter
     LLAMA_CPP_AVAILABLE = True
 except ImportError:
     LLAMA_CPP_AVAILABLE = False
     Llama = None
     LlamaRAMCache = None
+    Jinja2ChatFormatter = None
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +39,64 @@ class TokenTruncation:
     head: Optional[str] = None
 
 
+@dataclass
+class TokenizedText:
+    """
+    Text with its token ids and a token-to-character offset map.
+
+    offsets[i] is the character offset in text right after the first i tokens,
+    so a prefix or suffix of any token budget can be cut by slicing the text
+    instead of decoding tokens. The map is computed on first use.
+    """
+    text: str
+    tokens: List[int]
+    offset_map: Callable[[], List[int]] = field(repr=False, compare=False)
+
+    @property
+    def token_count(self) -> int:
+        return len(self.tokens)
+
+    @cached_property
+    def offsets(self) -> List[int]:
+        return self.offset_map()
+
+    def truncate(self, max_tokens: int) -> TokenTruncation:
+        """
+        Split the text after max_tokens tokens.
+
+        Args:
+            max_tokens: Maximum number of tokens allowed
+
+        Returns:
+            TokenTruncation with the first max_tokens tokens as tail and the rest as head
+        """
+        if len(self.tokens) <= max_tokens:
+            return TokenTruncation(tail=self.text, tail_token_count=len(self.tokens))
+        cut = self.offsets[max_tokens]
+        return TokenTruncation(
+            head=self.text[cut:],
+            tail=self.text[:cut],
+            tail_token_count=max_tokens)
+
+    def truncate_start(self, max_tokens: int) -> TokenTruncation:
+        """
+        Split the text before its last max_tokens tokens.
+
+        Args:
+            max_tokens: Maximum number of tokens allowed
+
+        Returns:
+            TokenTruncation with the last max_tokens tokens as tail and the text before them as head
+        """
+        if len(self.tokens) <= max_tokens:
+            return TokenTruncation(tail=self.text, tail_token_count=len(self.tokens))
+        cut = self.offsets[len(self.tokens) - max_tokens]
+        return TokenTruncation(
+            head=self.text[:cut],
+            tail=self.text[cut:],
+            tail_token_count=max_tokens)
+
+
 class LLMInferenceConfig:
     """Configuration for LLM inference"""
 
@@ -42,7 +113,19 @@ class LLMInferenceConfig:
         repeat_penalty: float = 1.1,
         verbose: bool = False,
         verbose_generation: bool = False,
-        cache_capacity: int = 0
+        cache_capacity: int = 0,
+        prefix_cache_capacity: int = 0,
+        state_cache_dir: Optional[str] = None,
+        state_cache_size: int = 10 * 1024**3,
+        token_cache_capacity: int = 0,
+        pool_size: int = 1,
+        threads_per_replica: Optional[int] = None,
+        batch_max_sequences: int = 1,
+        batch_max_pending: int = 0,
+        batch_ctx_per_sequence: int = 2048,
+        speculative_decoding: str = 'off',
+        draft_model_path: Optional[str] = None,
+        draft_tokens: int = 10
     ):
         """
         Initialize LLM inference configuration.
@@ -60,6 +143,18 @@ class LLMInferenceConfig:
             verbose: Enable verbose logging
             verbose_generation: Enable verbose logging of prompts, messages, and outputs
             cache_capacity: RAM cache size (bytes)
+            prefix_cache_capacity: Size of the message-prefix state cache (bytes); 0 to disable
+            state_cache_dir: Directory persisting prefix states across restarts (None to disable)
+            state_cache_size: Maximum size of the on-disk state cache (bytes)
+            token_cache_capacity: Total token ids kept by the tokenization cache; 0 to disable
+            pool_size: Number of model replicas serving requests in parallel
+            threads_per_replica: CPU threads per replica when pool_size > 1 (None to split n_threads or all cores)
+            batch_max_sequences: Sequences decoded together by the batch engine; 1 to disable it
+            batch_max_pending: Requests waiting for a batch sequence at which new ones are rejected (0 for no limit)
+            batch_ctx_per_sequence: Context size of each batched sequence (capped at n_ctx)
+            speculative_decoding: Drafter for speculative decoding: 'off', 'prompt_lookup' or 'draft_model'
+            draft_model_path: Path to the draft GGUF file when speculative_decoding is 'draft_model'
+            draft_tokens: Tokens proposed per draft
         """
         self.model_path = model_path
         self.n_ctx = n_ctx
@@ -73,6 +168,18 @@ class LLMInferenceConfig:
         self.verbose = verbose
         self.verbose_generation = verbose_generation
         self.cache_capacity = cache_capacity
+        self.prefix_cache_capacity = prefix_cache_capacity
+        self.state_cache_dir = state_cache_dir
+        self.state_cache_size = state_cache_size
+        self.token_cache_capacity = token_cache_capacity
+        self.pool_size = pool_size
+        self.threads_per_replica = threads_per_replica
+        self.batch_max_sequences = batch_max_sequences
+        self.batch_max_pending = batch_max_pending
+        self.batch_ctx_per_sequence = batch_ctx_per_sequence
+        self.speculative_decoding = speculative_decoding
+        self.draft_model_path = draft_model_path
+        self.draft_tokens = draft_tokens
 
     @classmethod
     def from_settings(cls, settings) -> Optional["LLMInferenceConfig"]:
@@ -100,7 +207,19 @@ class LLMInferenceConfig:
             repeat_penalty=settings.LLM_REPEAT_PENALTY,
             verbose=settings.LLM_VERBOSE,
             verbose_generation=settings.LLM_VERBOSE_GENERATION,
-            cache_capacity=settings.LLM_CACHE_CAPACITY
+            cache_capacity=settings.LLM_CACHE_CAPACITY,
+            prefix_cache_capacity=settings.LLM_PREFIX_CACHE_CAPACITY,
+            state_cache_dir=settings.LLM_STATE_CACHE_DIR,
+            state_cache_size=settings.LLM_STATE_CACHE_SIZE,
+            token_cache_capacity=settings.LLM_TOKEN_CACHE_CAPACITY,
+            pool_size=settings.LLM_POOL_SIZE,
+            threads_per_replica=settings.LLM_THREADS_PER_REPLICA,
+            batch_max_sequences=settings.LLM_BATCH_MAX_SEQUENCES,
+            batch_max_pending=settings.LLM_MAX_QUEUE_DEPTH,
+            batch_ctx_per_sequence=settings.LLM_BATCH_CTX_PER_SEQUENCE,
+            speculative_decoding=settings.LLM_SPECULATIVE_DECODING,
+            draft_model_path=settings.LLM_DRAFT_MODEL_PATH,
+            draft_tokens=settings.LLM_DRAFT_TOKENS
         )
 
 
@@ -110,12 +229,13 @@ class LLMInference:
     Provides text generation capabilities with local models.
     """
 
-    def __init__(self, config: LLMInferenceConfig):
+    def __init__(self, config: LLMInferenceConfig, token_cache: Optional[TokenCache] = None):
         """
         Initialize the LLM inference engine.
 
         Args:
             config: LLMInferenceConfig with model settings
+            token_cache: Tokenization cache to use instead of creating one (shared by pool replicas)
 
         Raises:
             ImportError: If llama-cpp-python is not installed
@@ -130,8 +250,119 @@ class LLMInference:
 
         self.config = config
         self.model: Optional[Llama] = None
+        self._prefix_cache: Optional[PrefixStateCache] = None
+        self._token_cache: Optional[TokenCache] = token_cache
+        if self._token_cache is None and config.token_cache_capacity > 0:
+            self._token_cache = TokenCache(config.token_cache_capacity)
+        self._chat_formatter = None
+        self._format_lock = threading.Lock()
+        self._batch_engine: Optional[BatchEngine] = None
+        self._drafter: Optional[TrackingDrafter] = None
+        self._speculative_model: Optional[Llama] = None
+        self.cancelled_generations = 0
+        self.cancelled_tokens_saved = 0
+        self.preempted_generations = 0
         self._load_model()
 
+    @property
+    def model_id(self) -> str:
+        """Identifier of the loaded model (its file name), used to key cached outputs."""
+        return Path(self.config.model_path).name
+
+    @property
+    def batch_engine(self) -> Optional[BatchEngine]:
+        """Continuous batching engine, or None unless batch_max_sequences > 1."""
+        return self._batch_engine
+
+    @property
+    def speculative_available(self) -> bool:
+        """Whether chat_completion_stream(speculative=True) uses a drafter."""
+        return self._drafter is not None
+
+    @property
+    def prefix_cache(self) -> Optional[PrefixStateCache]:
+        """Message-prefix state cache, or None when disabled."""
+        return self._prefix_cache
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Runtime counters for monitoring (reported by /health).
+
+        Returns:
+            Dict of counter name to value
+        """
+        stats = {
+            "cancelled_generations": self.cancelled_generations,
+            "cancelled_tokens_saved": self.cancelled_tokens_saved,
+            "preempted_generations": self.preempted_generations,
+        }
+        if self._prefix_cache is not None:
+            stats.update({
+                "prefix_cache_hits": self._prefix_cache.hits,
+                "prefix_cache_disk_hits": self._prefix_cache.disk_hits,
+                "prefix_cache_misses": self._prefix_cache.misses,
+                "prefix_cache_bytes": self._prefix_cache.cache_size,
+            })
+        if self._token_cache is not None:
+            stats.update({
+                "token_cache_hits": self._token_cache.hits,
+                "token_cache_misses": self._token_cache.misses,
+                "token_cache_tokens": self._token_cache.cache_size,
+            })
+        if self._batch_engine is not None:
+            stats.update(self._batch_engine.get_stats())
+        if self._drafter is not None:
+            stats.update({
+                "speculative_drafts": self._drafter.drafts,
+                "speculative_proposed_tokens": self._drafter.proposed_tokens,
+                "speculative_accepted_tokens": self._drafter.accepted_tokens,
+                "speculative_acceptance_rate": round(self._drafter.acceptance_rate, 3),
+            })
+        return stats
+
+    def _record_cancellation(self, max_tokens: int, generated_tokens: int):
+        """Count a generation stopped early because its caller went away."""
+        saved = max(max_tokens - generated_tokens, 0)
+        self.cancelled_generations += 1
+        self.cancelled_tokens_saved += saved
+        logger.info(
+            f"Generation cancelled after {generated_tokens} tokens; "
+            f"skipped up to {saved} tokens (total saved: {self.cancelled_tokens_saved})")
+
+    def _yield_to_preempting_jobs(self, model: Llama):
+        """
+        Pause a streaming generation while higher-priority jobs use the model.
+
+        Called between tokens, while the llama generator is suspended: the
+        context state and the sampler (which carries repetition penalty and
+        grammar state) are snapshotted, the waiting jobs run on this worker,
+        and the snapshot is restored so generation resumes without
+        re-evaluating the prompt or the tokens generated so far.
+
+        Args:
+            model: Context the paused stream runs on (main or speculative)
+
+        The snapshot keeps only the score rows the generator may still read:
+        the last one, or a whole draft's worth while one is being verified.
+        """
+        sampler = getattr(model, '_sampler', None)
+        draft_model = getattr(model, 'draft_model', None)
+        score_rows = self.config.draft_tokens + 1 if draft_model is not None else 1
+        state = save_llama_state(model, score_rows=score_rows)
+        model.draft_model = None
+        try:
+            served = serve_preempting_jobs()
+        finally:
+            load_llama_state(model, state)
+            model._sampler = sampler
+            model.draft_model = draft_model
+            if self._drafter is not None:
+                # Drafts proposed before the pause were already settled or are discarded
+                self._drafter.reset()
+        if served:
+            self.preempted_generations += 1
+            logger.info(f"Resumed generation after serving {served} higher-priority job(s)")
+
     def _load_model(self):
         """Load the model from disk"""
         model_path = Path(self.config.model_path)
@@ -159,6 +390,163 @@ class LLMInference:
         except Exception as e:
             raise RuntimeError(f"Failed to load model: {str(e)}")
 
+        if self.config.prefix_cache_capacity > 0 or self.config.state_cache_dir:
+            self._chat_formatter = self._create_chat_formatter()
+            if self._chat_formatter is not None:
+                self._prefix_cache = PrefixStateCache(
+                    self.config.prefix_cache_capacity,
+                    disk_cache=self._open_state_cache())
+            else:
+                logger.warning("Model has no chat template; prefix state cache disabled")
+
+        if self.config.batch_max_sequences > 1:
+            self._batch_engine = self._create_batch_engine()
+
+        if self.config.speculative_decoding != 'off':
+            self._drafter = create_drafter(self.config, self.model.n_vocab())
+            if self._drafter is not None:
+                self._speculative_model = self._load_speculative_model()
+                if self._speculative_model is None:
+                    self._drafter = None
+
+    def _load_speculative_model(self) -> Optional[Llama]:
+        """
+        Load a second context of the model for speculative streams.
+
+        Verifying a draft needs the logits of every drafted position, which
+        llama-cpp-python only keeps with logits_all: an n_ctx x n_vocab float32
+        scores matrix. Only speculative streams run on this context, so other
+        requests on the main context don't pay for it. Failures only disable
+        speculative decoding.
+        """
+        try:
+            model = Llama(
+                model_path=self.config.model_path,
+                n_ctx=self.config.n_ctx,
+                n_gpu_layers=self.config.n_gpu_layers,
+                n_threads=self.config.n_threads,
+                logits_all=True,
+                verbose=self.config.verbose
+            )
+        except Exception as e:
+            logger.warning(f"Speculative context failed to load; speculative decoding disabled: {e}")
+            return None
+        scores_mb = self.config.n_ctx * self.model.n_vocab() * 4 // 1024**2
+        logger.info(f"Loaded speculative context ({scores_mb} MB of logits for {self.config.n_ctx} positions)")
+        return model
+
+    def _create_batch_engine(self) -> Optional[BatchEngine]:
+        """Start the continuous batching engine; failures only disable batching."""
+        if self._chat_formatter is None:
+            self._chat_formatter = self._create_chat_formatter()
+        if self._chat_formatter is None:
+            logger.warning("Model has no chat template; batched decoding disabled")
+            return None
+        try:
+            return BatchEngine(
+                self, self.config.batch_max_sequences,
+                n_ctx_per_sequence=min(self.config.batch_ctx_per_sequence, self.config.n_ctx),
+                max_pending=self.config.batch_max_pending)
+        except Exception as e:
+            logger.warning(f"Batch engine unavailable, requests will be decoded one at a time: {e}")
+            return None
+
+    def _open_state_cache(self) -> Optional[DiskStateCache]:
+        """Open the on-disk prefix state cache if configured; failures only disable persistence."""
+        if not self.config.state_cache_dir:
+            return None
+        try:
+            return DiskStateCache(
+                directory=self.config.state_cache_dir,
+                size_limit=self.config.state_cache_size,
+                model_path=self.config.model_path)
+        except Exception as e:
+            logger.warning(f"Disk state cache unavailable, prefix states will not persist: {e}")
+            return None
+
+    def _create_chat_formatter(self):
+        """Build a formatter for the model's chat template so prompts can be tokenized ahead of generation."""
+        metadata = getattr(self.model, 'metadata', None)
+        template = metadata.get('tokenizer.chat_template') if isinstance(metadata, dict) else None
+        if not template:
+            return None
+
+        def token_text(token_id: int) -> str:
+            if token_id < 0:
+                return ""
+            return self.model.detokenize([token_id], special=True).decode('utf-8', errors='ignore')
+
+        return Jinja2ChatFormatter(
+            template=template,
+            eos_token=token_text(self.model.token_eos()),
+            bos_token=token_text(self.model.token_bos()))
+
+    def _tokenize_chat(self, messages: List[Dict[str, str]], add_generation_prompt: bool) -> List[int]:
+        """Tokenize messages the way llama.cpp does for create_chat_completion."""
+        # The batch engine formats prompts on its own thread
+        with self._format_lock:
+            self._chat_formatter.add_generation_prompt = add_generation_prompt
+            prompt = self._chat_formatter(messages=messages).prompt
+        return self.model.tokenize(prompt.encode('utf-8'), add_bos=False, special=True)
+
+    @staticmethod
+    def _common_prefix_length(a, b) -> int:
+        n = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            n += 1
+        return n
+
+    def _restore_prefix_state(self, model: Llama, messages: List[Dict[str, str]],
+                              prefix_message_count: Optional[int]):
+        """
+        Make the llama context start from the evaluated state of messages[:prefix_message_count].
+
+        On a cache hit the saved state is loaded, so create_chat_completion only
+        evaluates the tokens after the prefix. On a miss the prefix is evaluated
+        once and its state is snapshotted for the next request sharing it.
+        Failures are logged and fall back to a full prompt evaluation.
+
+        Args:
+            model: Context to prepare (main or speculative)
+            messages: Full list of chat messages for the request
+            prefix_message_count: Number of leading messages forming the shared prefix
+        """
+        if (self._prefix_cache is None or not prefix_message_count
+                or prefix_message_count >= len(messages)):
+            return
+
+        try:
+            prompt_tokens = self._tokenize_chat(messages, add_generation_prompt=True)
+            current_tokens = model.input_ids[:model.n_tokens].tolist()
+            key = hash_message_prefix(messages[:prefix_message_count])
+
+            state = self._prefix_cache.get(key)
+            if state is not None:
+                state_tokens = state.input_ids[:state.n_tokens].tolist()
+                if self._common_prefix_length(state_tokens, prompt_tokens) == len(state_tokens):
+                    if self._common_prefix_length(current_tokens, state_tokens) < len(state_tokens):
+                        load_llama_state(model, state)
+                    logger.info(f"Prefix state cache hit: reusing {len(state_tokens)} of {len(prompt_tokens)} prompt tokens")
+                    return
+
+            prefix_tokens = self._tokenize_chat(messages[:prefix_message_count], add_generation_prompt=False)
+            # create_chat_completion must still evaluate at least one prompt token
+            n_prefix = min(self._common_prefix_length(prefix_tokens, prompt_tokens), len(prompt_tokens) - 1)
+            if n_prefix <= 0:
+                return
+
+            n_cached = min(self._common_prefix_length(current_tokens, prompt_tokens), n_prefix)
+            model.n_tokens = n_cached
+            if n_cached < n_prefix:
+                model.eval(prompt_tokens[n_cached:n_prefix])
+            self._prefix_cache.put(key, save_llama_state(model))
+            logger.info(f"Prefix state cache miss: evaluated and saved {n_prefix} prefix tokens")
+        except Exception:
+            logger.exception("Prefix state restore failed; evaluating full prompt")
+            model.reset()
+
     def generate(
         self,
         prompt: str,
@@ -204,10 +592,7 @@ class LLMInference:
         }
 
         if json_schema_class is not None:
-            generation_params["response_format"] = {
-                "type": "json_object",
-                "schema": json_schema_class.model_json_schema()
-            }
+            generation_params["grammar"] = get_grammar_cache().get(json_schema_class)
 
         logger.debug(f"Generating with params: {generation_params}")
 
@@ -248,7 +633,8 @@ class LLMInference:
         top_k: Optional[int] = None,
         repeat_penalty: Optional[float] = None,
         stop: Optional[List[str]] = None,
-        json_schema_class: Optional[Type[BaseModel]] = None
+        json_schema_class: Optional[Type[BaseModel]] = None,
+        prefix_message_count: Optional[int] = None
     ) -> str:
         """
         Generate a chat completion from a list of messages.
@@ -262,6 +648,8 @@ class LLMInference:
             top_k: Top-k sampling
             repeat_penalty: Repetition penalty
             stop: List of stop sequences
+            prefix_message_count: Number of leading messages shared across requests
+                (e.g. ContextBuilder.prefix_message_count); their evaluated state is cached
 
         Returns:
             Generated response text
@@ -279,10 +667,7 @@ class LLMInference:
         }
 
         if json_schema_class is not None:
-            generation_params["response_format"] = {
-                "type": "json_object",
-                "schema": json_schema_class.model_json_schema()
-            }
+            generation_params["grammar"] = get_grammar_cache().get(json_schema_class)
 
         # Log messages if verbose generation is enabled
         if self.config.verbose_generation:
@@ -293,6 +678,7 @@ class LLMInference:
             logger.info(f"[LLM Messages]{debug_messages}")
 
         try:
+            self._restore_prefix_state(self.model, messages, prefix_message_count)
             response = self.model.create_chat_completion(
                 messages=messages,
                 **generation_params
@@ -325,7 +711,9 @@ class LLMInference:
         top_k: Optional[int] = None,
         repeat_penalty: Optional[float] = None,
         stop: Optional[List[str]] = None,
-        json_schema_class: Optional[Type[BaseModel]] = None
+        json_schema_class: Optional[Type[BaseModel]] = None,
+        prefix_message_count: Optional[int] = None,
+        speculative: bool = False
     ):
         """
         Generate a streaming chat completion from a list of messages.
@@ -338,9 +726,19 @@ class LLMInference:
             top_k: Top-k sampling
             repeat_penalty: Repetition penalty
             stop: List of stop sequences
+            prefix_message_count: Number of leading messages shared across requests
+                (e.g. ContextBuilder.prefix_message_count); their evaluated state is cached
+            speculative: Use the configured drafter (LLM_SPECULATIVE_DECODING) for this
+                generation; meant for output that largely repeats the prompt, like rewrites.
+                It runs on the speculative context, which keeps logits for every position
 
         Yields:
             Token strings as they are generated
+
+        Generation stops early, without error, when the generator is closed or
+        the executor job it runs in is cancelled (client disconnected). It
+        pauses between tokens while higher-priority executor jobs are waiting
+        for a busy model and resumes from a state snapshot.
         """
         if self.model is None:
             raise RuntimeError("Model not loaded.")
@@ -356,10 +754,7 @@ class LLMInference:
         }
 
         if json_schema_class is not None:
-            generation_params["response_format"] = {
-                "type": "json_object",
-                "schema": json_schema_class.model_json_schema()
-            }
+            generation_params["grammar"] = get_grammar_cache().get(json_schema_class)
 
         # Log messages if verbose generation is enabled
         if self.config.verbose_generation:
@@ -369,23 +764,57 @@ class LLMInference:
                     debug_messages += f"\n{k}: {v}"
             logger.info(f"[LLM Messages (streaming)]{debug_messages}")
 
+        drafter = self._drafter if speculative else None
+        model = self._speculative_model if drafter is not None else self.model
         try:
-            stream = self.model.create_chat_completion(
+            self._restore_prefix_state(model, messages, prefix_message_count)
+            stream = model.create_chat_completion(
                 messages=messages,
                 **generation_params
             )
+            if drafter is not None:
+                # Read by the llama generator on every step, so it only affects this stream
+                drafter.reset()
+                proposed, accepted = drafter.proposed_tokens, drafter.accepted_tokens
+                model.draft_model = drafter
 
             # Accumulate output for logging if verbose generation is enabled
             accumulated_output = [] if self.config.verbose_generation else None
 
-            for chunk in stream:
-                if 'choices' in chunk and len(chunk['choices']) > 0:
-                    delta = chunk['choices'][0].get('delta', {})
-                    if 'content' in delta:
-                        content = delta['content']
-                        if accumulated_output is not None:
-                            accumulated_output.append(content)
-                        yield content
+            generated_tokens = 0
+            cancelled = False
+            try:
+                for chunk in stream:
+                    if current_job_cancelled():
+                        cancelled = True
+                        break
+                    if preemption_requested():
+                        self._yield_to_preempting_jobs(model)
+                    if 'choices' in chunk and len(chunk['choices']) > 0:
+                        delta = chunk['choices'][0].get('delta', {})
+                        if 'content' in delta:
+                            content = delta['content']
+                            generated_tokens += 1
+                            if accumulated_output is not None:
+                                accumulated_output.append(content)
+                            yield content
+            except GeneratorExit:
+                cancelled = True
+                raise
+            finally:
+                if cancelled:
+                    self._record_cancellation(generation_params["max_tokens"], generated_tokens)
+                # Closing the llama stream stops token generation
+                close = getattr(stream, 'close', None)
+                if close is not None:
+                    close()
+                if drafter is not None:
+                    model.draft_model = None
+                    proposed = drafter.proposed_tokens - proposed
+                    if proposed:
+                        logger.info(
+                            f"Speculative decoding accepted {drafter.accepted_tokens - accepted}"
+                            f"/{proposed} drafted tokens")
 
             # Log complete output if verbose generation is enabled
             if self.config.verbose_generation and accumulated_output:
@@ -420,20 +849,31 @@ class LLMInference:
         """
         Encode text to token IDs.
 
+        Results are cached by text, so unchanged story elements are only
+        tokenized once.
+
         Args:
             text: Text to encode
 
         Returns:
             List of token IDs
         """
+        if self._token_cache is not None:
+            tokens = self._token_cache.get(text)
+            if tokens is not None:
+                return tokens
+
         try:
             # Use the model's tokenizer to encode text
             tokens = self.model.tokenize(text.encode('utf-8'))
-            return tokens
         except Exception as e:
             logger.exception("Error encoding text")
             raise ValueError('Model not loaded')
 
+        if self._token_cache is not None:
+            self._token_cache.put(text, tokens)
+        return tokens
+
     def decode(self, tokens: List[int]) -> str:
         """
         Decode token IDs to text.
@@ -476,6 +916,52 @@ class LLMInference:
         """
         return [self.count_tokens(text) for text in texts]
 
+    def tokenize_with_offsets(self, text: str) -> TokenizedText:
+        """
+        Encode text once, keeping a map from token positions to character offsets.
+
+        Callers that need several cuts of the same text (e.g. at 100% and 60%
+        of a budget) should tokenize once and call truncate() on the result.
+
+        Args:
+            text: Text to encode
+
+        Returns:
+            TokenizedText for the text
+        """
+        tokens = self.encode(text) if text else []
+        return TokenizedText(text=text, tokens=tokens, offset_map=lambda: self._token_offsets(text, tokens))
+
+    def _token_offsets(self, text: str, tokens: List[int]) -> List[int]:
+        """
+        Character offset in text after each token, from the tokens' byte pieces.
+
+        Token pieces are matched against the UTF-8 bytes of the text; a token
+        ending inside a multi-byte character maps to the start of that
+        character. SentencePiece models prefix the first word with a space that
+        is not in the text, which is skipped. If a tokenizer normalizes the
+        text so the pieces do not match, the offsets are approximated from the
+        decoded pieces.
+        """
+        data = text.encode('utf-8')
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        offsets = [0]
+        byte_pos = 0
+        char_pos = 0
+        matched = True
+        for token in tokens:
+            piece = self.model.detokenize([token])
+            if matched and not data.startswith(piece, byte_pos):
+                if piece.startswith(b' ') and data.startswith(piece[1:], byte_pos):
+                    piece = piece[1:]
+                else:
+                    matched = False
+                    logger.debug("Token pieces do not match the text; approximating offsets")
+            byte_pos += len(piece)
+            char_pos += len(decoder.decode(piece))
+            offsets.append(min(char_pos, len(text)))
+        return offsets
+
     def truncate_to_tokens(self, text: str, max_tokens: int) -> TokenTruncation:
         """
         Truncate text to fit within a maximum token count.
@@ -487,18 +973,14 @@ class LLMInference:
         Returns:
             Truncated text that fits within token limit
         """
-        tokens = self.encode(text) if text else []
-        if len(tokens) <= max_tokens:
-            return TokenTruncation(tail=text, tail_token_count=len(tokens))
-
-        # Truncate tokens and decode back to text
-        return TokenTruncation(
-            head=self.decode(tokens[max_tokens:]),
-            tail=self.decode(tokens[:max_tokens]),
-            tail_token_count=max_tokens)
+        return self.tokenize_with_offsets(text).truncate(max_tokens)
 
     def __del__(self):
         """Cleanup when object is destroyed"""
+        if getattr(self, '_batch_engine', None) is not None:
+            self._batch_engine.shutdown(wait=False)
+        if getattr(self, '_speculative_model', None) is not None:
+            del self._speculative_model
         if hasattr(self, 'model') and self.model is not None:
             logger.info("Unloading model")
             del self.model
@@ -512,6 +994,9 @@ def initialize_llm(config: LLMInferenceConfig) -> LLMInference:
     """
     Initialize the global LLM instance.
 
+    With config.pool_size > 1 this is an LLMInferencePool of that many
+    replicas, which offers the same interface.
+
     Args:
         config: LLMInferenceConfig with model settings
 
@@ -524,7 +1009,11 @@ def initialize_llm(config: LLMInferenceConfig) -> LLMInference:
         logger.warning("LLM already initialized. Replacing existing instance.")
         del _llm_instance
 
-    _llm_instance = LLMInference(config)
+    if config.pool_size > 1:
+        from app.services.llm_pool import LLMInferencePool
+        _llm_instance = LLMInferencePool(config)
+    else:
+        _llm_instance = LLMInference(config)
     return _llm_instance
 
 
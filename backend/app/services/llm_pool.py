@@ -0,0 +1,127 @@
+"""
+Pool of LLMInference replicas for serving several requests at once.
+
+A single llama context generates one sequence at a time, so with one model
+every user waits behind the current generation. LLMInferencePool loads
+LLM_POOL_SIZE replicas of the same GGUF file, each with its own context and
+its own share of the CPU threads. Weights are memory-mapped, so the replicas
+share one copy of them in the page cache; only the KV caches are per replica.
+
+The inference executor runs one worker thread per replica and pins each worker
+to its replica (current_worker_index), so the pool is a drop-in replacement for
+LLMInference: endpoints keep calling executor.stream(llm.chat_completion_stream,
+...) and the call runs on whichever replica's worker is idle.
+"""
+import copy
+import logging
+import os
+from typing import Any, Dict, List
+
+from app.services.inference_executor import current_worker_index
+from app.services.llm_inference import LLMInference, LLMInferenceConfig
+from app.services.token_cache import TokenCache
+
+logger = logging.getLogger(__name__)
+
+
+class LLMInferencePool:
+    """
+    Several LLMInference replicas behind the LLMInference interface.
+
+    Model calls are forwarded to the replica of the executor worker making the
+    call; calls made outside the executor (e.g. token counting on the event
+    loop) use the first replica. Other attributes (config, model_id,
+    batch_engine, ...) are read from the first replica.
+    """
+
+    # Methods forwarded to the calling worker's replica
+    _DISPATCHED = frozenset({
+        'generate', 'chat_completion', 'chat_completion_stream', 'get_embedding',
+        'encode', 'decode', 'count_tokens', 'count_tokens_batch',
+        'tokenize_with_offsets', 'truncate_to_tokens',
+    })
+
+    def __init__(self, config: LLMInferenceConfig):
+        """
+        Load config.pool_size replicas.
+
+        Args:
+            config: LLMInferenceConfig with model settings and pool_size
+
+        Raises:
+            FileNotFoundError, ImportError, RuntimeError: As for LLMInference
+        """
+        self.config = config
+        replica_config = self._replica_config(config)
+        token_cache = TokenCache(config.token_cache_capacity) if config.token_cache_capacity > 0 else None
+
+        logger.info(
+            f"Loading {config.pool_size} model replicas with {replica_config.n_threads} threads each")
+        # Only the first replica runs a batch engine (see batch_engine)
+        batchless_config = copy.copy(replica_config)
+        batchless_config.batch_max_sequences = 1
+        self._replicas: List[LLMInference] = [
+            LLMInference(replica_config if i == 0 else batchless_config, token_cache=token_cache)
+            for i in range(config.pool_size)
+        ]
+
+    @staticmethod
+    def _replica_config(config: LLMInferenceConfig) -> LLMInferenceConfig:
+        """Per-replica config: threads and memory caches are split between replicas."""
+        replica_config = copy.copy(config)
+        if config.threads_per_replica:
+            replica_config.n_threads = config.threads_per_replica
+        else:
+            total_threads = config.n_threads or os.cpu_count() or 1
+            replica_config.n_threads = max(1, total_threads // config.pool_size)
+        replica_config.cache_capacity = config.cache_capacity // config.pool_size
+        replica_config.prefix_cache_capacity = config.prefix_cache_capacity // config.pool_size
+        return replica_config
+
+    @property
+    def replicas(self) -> List[LLMInference]:
+        return list(self._replicas)
+
+    @property
+    def pool_size(self) -> int:
+        return len(self._replicas)
+
+    def current_replica(self) -> LLMInference:
+        """Replica bound to the calling executor worker (the first one outside the executor)."""
+        index = current_worker_index()
+        if index is None:
+            return self._replicas[0]
+        return self._replicas[index % len(self._replicas)]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Runtime counters summed over the replicas, plus the per-replica values.
+
+        Returns:
+            Dict of counter name to value
+        """
+        replica_stats = [replica.get_stats() for replica in self._replicas]
+        stats: Dict[str, Any] = {"pool_size": len(self._replicas)}
+        for replica in replica_stats:
+            for name, value in replica.items():
+                if name.startswith('token_cache_'):
+                    # Shared between replicas
+                    stats[name] = value
+                else:
+                    stats[name] = stats.get(name, 0) + value
+        if stats.get("speculative_proposed_tokens"):
+            stats["speculative_acceptance_rate"] = round(
+                stats["speculative_accepted_tokens"] / stats["speculative_proposed_tokens"], 3)
+        stats["replicas"] = replica_stats
+        return stats
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._DISPATCHED:
+            def dispatch(*args, **kwargs):
+                return getattr(self.current_replica(), name)(*args, **kwargs)
+            dispatch.__name__ = name
+            return dispatch
+        return getattr(self._replicas[0], name)
+
@@ -0,0 +1,247 @@
+"""
+Named models and task routing.
+
+Every request type used to run on the one model loaded from MODEL_PATH, even
+structural work like summarizing old chapters or judging an agentic draft.
+The registry loads extra models by name (LLM_MODELS) and routes task types to
+them (LLM_TASK_ROUTES), so cheap tasks can run on a small, fast model while
+prose stays on the large one:
+
+    LLM_MODELS={"small": "./models/qwen2.5-1.5b-instruct-q4_k_m.gguf"}
+    LLM_TASK_ROUTES={"summarize": "small", "evaluate": "small"}
+
+Tasks that are not routed, or routed to a model that failed to load, use the
+default model (get_llm()) and the default executor. Each named model has its
+own single-worker InferenceExecutor, so its jobs run alongside generations on
+the default model instead of queueing behind them. Callers look up both
+halves by task:
+
+    llm = get_task_llm(LLMTask.RATE, default=get_llm())
+    executor = get_task_executor(LLMTask.RATE)
+"""
+import copy
+import logging
+import threading
+from enum import Enum
+from typing import Any, Dict, Optional
+
+from app.services.inference_executor import InferenceExecutor, get_inference_executor
+from app.services.llm_inference import LLMInference, LLMInferenceConfig
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'default'
+
+
+class LLMTask(str, Enum):
+    """Kinds of LLM work that can be routed to different models."""
+    SUMMARIZE = 'summarize'
+    EVALUATE = 'evaluate'
+    RATE = 'rate'
+    GENERATE = 'generate'
+    CHAT = 'chat'
+
+
+class ModelRegistry:
+    """Named models with their executors, and the task routing table."""
+
+    def __init__(self):
+        self._models: Dict[str, LLMInference] = {}
+        self._executors: Dict[str, InferenceExecutor] = {}
+        self._routes: Dict[LLMTask, str] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, llm: LLMInference, executor: InferenceExecutor):
+        """
+        Add a named model.
+
+        Args:
+            name: Name used in the routing table
+            llm: Loaded model
+            executor: Executor whose workers drive the model
+        """
+        if name == DEFAULT_MODEL:
+            raise ValueError(f"'{DEFAULT_MODEL}' is reserved for the MODEL_PATH model")
+        with self._lock:
+            self._models[name] = llm
+            self._executors[name] = executor
+
+    def set_route(self, task: LLMTask, name: str):
+        """
+        Route a task to a named model ('default' for the MODEL_PATH model).
+
+        Raises:
+            ValueError: If the model is not registered
+        """
+        if name != DEFAULT_MODEL and not self.has_model(name):
+            raise ValueError(f"Unknown model '{name}' for task '{task.value}'")
+        with self._lock:
+            if name == DEFAULT_MODEL:
+                self._routes.pop(task, None)
+            else:
+                self._routes[task] = name
+
+    def has_model(self, name: str) -> bool:
+        """Whether a named model is registered."""
+        return name in self._models
+
+    def model_name(self, task: LLMTask) -> str:
+        """Name of the model serving a task."""
+        return self._routes.get(task, DEFAULT_MODEL)
+
+    def is_routed(self, task: LLMTask) -> bool:
+        """Whether a task runs on a named model rather than the default one."""
+        return task in self._routes
+
+    def get_llm(self, task: LLMTask, default: Optional[LLMInference]) -> Optional[LLMInference]:
+        """
+        Model serving a task.
+
+        Args:
+            task: Task type
+            default: Model serving unrouted tasks, normally get_llm()
+        """
+        name = self._routes.get(task)
+        if name is not None:
+            return self._models[name]
+        return default
+
+    def get_executor(self, task: LLMTask) -> InferenceExecutor:
+        """Executor whose workers drive the model serving a task."""
+        name = self._routes.get(task)
+        if name is not None:
+            return self._executors[name]
+        return get_inference_executor()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Routing table and per-model counters (reported by /health).
+
+        Returns:
+            Dict with "routes" (task to model name) and "models" (name to stats)
+        """
+        with self._lock:
+            models = dict(self._models)
+            executors = dict(self._executors)
+            routes = {task.value: self.model_name(task) for task in LLMTask}
+        return {
+            "routes": routes,
+            "models": {
+                name: {
+                    "model_id": llm.model_id,
+                    "llm_stats": llm.get_stats(),
+                    "inference_workers": executors[name].get_stats(),
+                }
+                for name, llm in models.items()
+            },
+        }
+
+    def shutdown(self):
+        """Stop the named models' executors and drop the models."""
+        with self._lock:
+            for executor in self._executors.values():
+                executor.shutdown(wait=False)
+            self._models.clear()
+            self._executors.clear()
+            self._routes.clear()
+
+
+def routed_model_config(config: LLMInferenceConfig, model_path: str) -> LLMInferenceConfig:
+    """
+    Config for a named model, derived from the default model's.
+
+    Named models are single replicas without batching or speculative
+    decoding; context size, threads and caches follow the default model.
+    """
+    routed = copy.copy(config)
+    routed.model_path = model_path
+    routed.pool_size = 1
+    routed.threads_per_replica = None
+    routed.batch_max_sequences = 1
+    routed.speculative_decoding = 'off'
+    routed.draft_model_path = None
+    return routed
+
+
+# Global instance for singleton pattern
+_registry = ModelRegistry()
+
+
+def initialize_models(
+        config: LLMInferenceConfig,
+        models: Dict[str, str],
+        routes: Dict[str, str],
+        max_pending: int = 0,
+        preemption: bool = True) -> ModelRegistry:
+    """
+    Load the named models and install the routing table.
+
+    A model that fails to load is logged and skipped; tasks routed to it stay
+    on the default model.
+
+    Args:
+        config: Config of the default model, used as a template
+        models: Model name to GGUF path (LLM_MODELS)
+        routes: Task name to model name (LLM_TASK_ROUTES)
+        max_pending: Queue depth of each named model's executor
+        preemption: Whether streams on named models pause for higher-priority jobs
+
+    Returns:
+        The global ModelRegistry
+
+    Raises:
+        ValueError: If routes name an unknown task or a model not in models
+    """
+    tasks = {}
+    for task_name, model_name in routes.items():
+        try:
+            task = LLMTask(task_name)
+        except ValueError:
+            raise ValueError(
+                f"Unknown task '{task_name}' in LLM_TASK_ROUTES; "
+                f"expected one of {', '.join(t.value for t in LLMTask)}")
+        if model_name != DEFAULT_MODEL and model_name not in models:
+            raise ValueError(f"LLM_TASK_ROUTES routes '{task_name}' to '{model_name}', which is not in LLM_MODELS")
+        tasks[task] = model_name
+
+    _registry.shutdown()
+    for name, path in models.items():
+        logger.info(f"Loading model '{name}' from {path}")
+        try:
+            llm = LLMInference(routed_model_config(config, path))
+        except Exception as e:
+            logger.exception(f"Failed to load model '{name}'; its tasks use the default model: {e}")
+            continue
+        _registry.register(name, llm, InferenceExecutor(max_pending=max_pending, preemption=preemption))
+
+    for task, model_name in tasks.items():
+        if model_name == DEFAULT_MODEL or _registry.has_model(model_name):
+            _registry.set_route(task, model_name)
+            logger.info(f"Routing '{task.value}' to model '{model_name}'")
+    return _registry
+
+
+def get_model_registry() -> ModelRegistry:
+    """Get the global model registry."""
+    return _registry
+
+
+def get_task_llm(task: LLMTask, default: Optional[LLMInference]) -> Optional[LLMInference]:
+    """
+    Model serving a task.
+
+    Args:
+        task: Task type
+        default: Model serving unrouted tasks, normally get_llm()
+    """
+    return _registry.get_llm(task, default)
+
+
+def get_task_executor(task: LLMTask) -> InferenceExecutor:
+    """Executor to submit a task's model calls to."""
+    return _registry.get_executor(task)
+
+
+def shutdown_models():
+    """Stop the named models' executors and clear the routing table."""
+    _registry.shutdown()
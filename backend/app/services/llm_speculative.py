@@ -0,0 +1,167 @@
+"""
+Speculative decoding drafters for LLMInference.
+
+Rewrite endpoints (modify_chapter, agentic_modify_chapter) mostly reproduce
+text that is already in the prompt. With speculative decoding a cheap
+drafter proposes the next few tokens, the model evaluates all of them in one
+batch, and keeps the proposed tokens up to the first one it would not have
+sampled itself. Every accepted token saves a sequential decode step, and the
+output is the same as without drafting.
+
+Two drafters are available (LLM_SPECULATIVE_DECODING):
+- prompt_lookup: continues the latest n-gram from where it last occurred in
+  the prompt or the output so far (llama-cpp's LlamaPromptLookupDecoding).
+  It costs nothing and suits rewrites.
+- draft_model: a small GGUF (LLM_DRAFT_MODEL_PATH) with the main model's
+  vocabulary, decoded greedily. It also helps with new prose, at the cost of
+  running a second model.
+
+TrackingDrafter wraps either one and counts how many proposed tokens the
+model accepts.
+"""
+import logging
+from typing import Any, Optional, Tuple
+
+try:
+    import numpy as np
+    from llama_cpp import Llama
+    from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+    LLAMA_CPP_AVAILABLE = True
+except ImportError:
+    LLAMA_CPP_AVAILABLE = False
+    np = None
+    Llama = None
+    LlamaDraftModel = object
+    LlamaPromptLookupDecoding = None
+
+logger = logging.getLogger(__name__)
+
+
+class DraftModelDrafter(LlamaDraftModel):
+    """Proposes tokens by greedy decoding with a small draft model."""
+
+    def __init__(
+            self,
+            model_path: str,
+            num_pred_tokens: int = 10,
+            n_ctx: int = 4096,
+            n_threads: Optional[int] = None,
+            n_gpu_layers: int = 0,
+            verbose: bool = False):
+        """
+        Load the draft model.
+
+        Args:
+            model_path: Path to the draft GGUF file (same vocabulary as the main model)
+            num_pred_tokens: Tokens proposed per draft
+            n_ctx: Context size; should match the main model's
+            n_threads: CPU threads (None for auto)
+            n_gpu_layers: Layers to offload to GPU
+            verbose: Enable llama.cpp logging
+        """
+        self.model = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            n_gpu_layers=n_gpu_layers,
+            verbose=verbose)
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, /, **kwargs: Any):
+        draft = []
+        if len(input_ids) + self.num_pred_tokens < self.model.n_ctx():
+            # generate() reuses the KV cache for the prefix shared with the previous draft
+            for token in self.model.generate(input_ids.tolist(), temp=0.0, repeat_penalty=1.0, reset=True):
+                if token == self.model.token_eos():
+                    break
+                draft.append(token)
+                if len(draft) >= self.num_pred_tokens:
+                    break
+        return np.array(draft, dtype=np.intc)
+
+
+class TrackingDrafter(LlamaDraftModel):
+    """
+    Wraps a drafter and measures its acceptance rate.
+
+    llama-cpp calls the drafter with the context so far, after evaluating the
+    previous draft. The tokens added to the context since that call are the
+    accepted part of the previous draft followed by one token the model
+    sampled itself, so comparing them with the previous draft gives the
+    number of accepted tokens.
+    """
+
+    def __init__(self, drafter: LlamaDraftModel):
+        self._drafter = drafter
+        self._last: Optional[Tuple[int, Any]] = None
+        self.drafts = 0
+        self.proposed_tokens = 0
+        self.accepted_tokens = 0
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted_tokens / self.proposed_tokens if self.proposed_tokens else 0.0
+
+    def reset(self):
+        """Forget the pending draft; call when a new generation starts."""
+        self._last = None
+
+    def __call__(self, input_ids, /, **kwargs: Any):
+        self._settle(input_ids)
+        proposal = self._drafter(input_ids, **kwargs)
+        if len(proposal):
+            self._last = (len(input_ids), np.array(proposal, copy=True))
+        return proposal
+
+    def _settle(self, input_ids):
+        """Count how much of the previous draft made it into input_ids."""
+        if self._last is None:
+            return
+        start, proposal = self._last
+        self._last = None
+        produced = input_ids[start:len(input_ids) - 1]
+        accepted = 0
+        for drafted, actual in zip(proposal, produced):
+            if drafted != actual:
+                break
+            accepted += 1
+        self.drafts += 1
+        self.proposed_tokens += len(proposal)
+        self.accepted_tokens += accepted
+
+
+def create_drafter(config, n_vocab: int) -> Optional[TrackingDrafter]:
+    """
+    Build the drafter selected by config.speculative_decoding.
+
+    Args:
+        config: LLMInferenceConfig
+        n_vocab: Vocabulary size of the main model (a draft model must match it)
+
+    Returns:
+        TrackingDrafter, or None when speculative decoding is off or unavailable
+    """
+    mode = config.speculative_decoding
+    if mode == 'prompt_lookup':
+        return TrackingDrafter(LlamaPromptLookupDecoding(num_pred_tokens=config.draft_tokens))
+    if mode == 'draft_model':
+        if not config.draft_model_path:
+            logger.warning("LLM_DRAFT_MODEL_PATH is not set; speculative decoding disabled")
+            return None
+        try:
+            drafter = DraftModelDrafter(
+                config.draft_model_path,
+                num_pred_tokens=config.draft_tokens,
+                n_ctx=config.n_ctx,
+                n_threads=config.n_threads,
+                n_gpu_layers=config.n_gpu_layers,
+                verbose=config.verbose)
+        except Exception as e:
+            logger.warning(f"Draft model failed to load; speculative decoding disabled: {e}")
+            return None
+        if drafter.model.n_vocab() != n_vocab:
+            logger.warning("Draft model vocabulary differs from the main model's; speculative decoding disabled")
+            return None
+        logger.info(f"Loaded draft model {config.draft_model_path}")
+        return TrackingDrafter(drafter)
+    return None
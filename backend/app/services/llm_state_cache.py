@@ -0,0 +1,395 @@
+"""
+Prompt-prefix state caching for LLM inference.
+
+Most requests for a story start with the same long-term block (system prompt,
+worldbuilding, characters, outline) built by ContextBuilder.add_long_term_elements.
+Re-evaluating that block on every rater/character/editor call costs several
+seconds for a large story, so LLMInference snapshots the llama state right
+after evaluating the prefix and restores it when a later request starts with
+the same messages. States can also be persisted to disk (DiskStateCache) so
+warm prefixes survive a restart.
+
+States are taken with save_llama_state rather than Llama.save_state: the
+latter also copies the model's scores matrix, up to n_tokens x n_vocab
+float32 values (1.3 GB for a 10k-token prefix with a 32k vocabulary), of
+which at most the last row is ever read again.
+"""
+import ctypes
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    DISKCACHE_AVAILABLE = False
+    diskcache = None
+
+try:
+    import llama_cpp
+    from llama_cpp import LlamaState
+    LLAMA_CPP_AVAILABLE = True
+except ImportError:
+    LLAMA_CPP_AVAILABLE = False
+    llama_cpp = None
+    LlamaState = None
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+logger = logging.getLogger(__name__)
+
+_CHECKSUM_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def hash_message_prefix(messages: List[Dict[str, str]]) -> str:
+    """
+    Compute a stable key for a list of chat messages.
+
+    Args:
+        messages: Message dicts with 'role' and 'content' keys
+
+    Returns:
+        Hex digest identifying the messages
+    """
+    payload = json.dumps(
+        [[m.get('role'), m.get('content')] for m in messages],
+        ensure_ascii=False,
+        separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def save_llama_state(model: "Llama", score_rows: int = 1) -> "LlamaState":
+    """
+    Snapshot a Llama's context: its llama.cpp state, tokens and last logits.
+
+    The llama.cpp state holds the KV cache and the logits of the last decoded
+    batch, which is all sampling needs to continue. Of the Python-side scores
+    matrix only the last score_rows rows are kept, and only when the model
+    fills it (logits_all); otherwise it holds nothing that is read again.
+
+    Args:
+        model: Llama whose context is saved
+        score_rows: Trailing rows of scores to keep with logits_all
+
+    Returns:
+        LlamaState to pass to load_llama_state
+
+    Raises:
+        RuntimeError: If llama.cpp fails to copy the state
+    """
+    ctx = model._ctx.ctx
+    size = int(llama_cpp.llama_state_get_size(ctx))
+    buffer = (ctypes.c_uint8 * size)()
+    n_bytes = int(llama_cpp.llama_state_get_data(ctx, buffer, size))
+    if n_bytes > size:
+        raise RuntimeError("Failed to copy llama state data")
+
+    n_tokens = model.n_tokens
+    rows = min(score_rows, n_tokens) if getattr(model, '_logits_all', False) else 0
+    return LlamaState(
+        input_ids=model.input_ids[:n_tokens].copy(),
+        scores=model.scores[n_tokens - rows:n_tokens, :].copy(),
+        n_tokens=n_tokens,
+        llama_state=ctypes.string_at(buffer, n_bytes),
+        llama_state_size=n_bytes,
+        seed=model._seed)
+
+
+def load_llama_state(model: "Llama", state: "LlamaState"):
+    """
+    Restore a state taken by save_llama_state (or Llama.save_state).
+
+    The saved score rows are written back at the end of the evaluated tokens;
+    earlier rows of scores are left as they are.
+
+    Args:
+        model: Llama to restore
+        state: Saved state
+
+    Raises:
+        RuntimeError: If llama.cpp rejects the state
+    """
+    n_tokens = state.n_tokens
+    if getattr(model, '_logits_all', False):
+        rows = min(len(state.scores), n_tokens)
+        model.scores[n_tokens - rows:n_tokens, :] = state.scores[len(state.scores) - rows:]
+    model.input_ids[:n_tokens] = state.input_ids[:n_tokens]
+    model.n_tokens = n_tokens
+    model._seed = state.seed
+
+    data = (ctypes.c_uint8 * state.llama_state_size).from_buffer_copy(state.llama_state)
+    if int(llama_cpp.llama_state_set_data(model._ctx.ctx, data, state.llama_state_size)) != state.llama_state_size:
+        raise RuntimeError("Failed to set llama state data")
+
+
+def trim_llama_state(state: Any, score_rows: int = 1) -> Any:
+    """
+    Drop all but the last score_rows rows of a state's scores.
+
+    States written by Llama.save_state carry the full scores matrix; this
+    makes them the size save_llama_state would have produced.
+
+    Args:
+        state: Saved state
+        score_rows: Trailing rows of scores to keep
+
+    Returns:
+        The state itself if it is already small enough, else a trimmed copy
+    """
+    scores = getattr(state, 'scores', None)
+    if scores is None or len(scores) <= score_rows:
+        return state
+    return LlamaState(
+        input_ids=state.input_ids[:state.n_tokens],
+        scores=scores[len(scores) - score_rows:].copy(),
+        n_tokens=state.n_tokens,
+        llama_state=state.llama_state,
+        llama_state_size=state.llama_state_size,
+        seed=state.seed)
+
+
+def state_size_bytes(state: Any) -> int:
+    """
+    Estimate the memory held by a saved llama state.
+
+    Args:
+        state: llama_cpp.LlamaState returned by save_llama_state()
+
+    Returns:
+        Size in bytes of the KV data plus the token and logit arrays
+    """
+    size = int(getattr(state, 'llama_state_size', 0) or 0)
+    for array_name in ('input_ids', 'scores'):
+        array = getattr(state, array_name, None)
+        size += int(getattr(array, 'nbytes', 0) or 0)
+    return size
+
+
+class DiskStateCache:
+    """
+    Persistent store of llama states keyed by message-prefix hash.
+
+    Keys include a checksum of the model file, so states written for another
+    model (or another version of the same file) are never loaded. The store is
+    capped at size_limit bytes and evicts least recently used entries.
+    """
+
+    def __init__(self, directory: str, size_limit: int, model_path: str):
+        """
+        Open (or create) the on-disk cache.
+
+        Args:
+            directory: Directory holding the cache files
+            size_limit: Maximum size of the cache on disk (bytes)
+            model_path: Path to the GGUF model the states belong to
+
+        Raises:
+            ImportError: If diskcache is not installed
+        """
+        if not DISKCACHE_AVAILABLE:
+            raise ImportError(
+                "diskcache is not installed. "
+                "Install it with: pip install diskcache"
+            )
+
+        self.directory = directory
+        self.size_limit = size_limit
+        self._cache = diskcache.Cache(
+            directory,
+            size_limit=size_limit,
+            eviction_policy='least-recently-used')
+        self.model_checksum = self._model_checksum(model_path)
+        logger.info(f"Disk state cache at {directory} ({self.volume} bytes in use)")
+
+    @property
+    def volume(self) -> int:
+        """Size of the cache on disk (bytes)."""
+        return int(self._cache.volume())
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def __contains__(self, key: str) -> bool:
+        return self._state_key(key) in self._cache
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Load a state from disk.
+
+        Args:
+            key: Message-prefix hash
+
+        Returns:
+            The stored state, or None if not cached
+        """
+        state = self._cache.get(self._state_key(key))
+        return trim_llama_state(state) if state is not None else None
+
+    def put(self, key: str, state: Any):
+        """
+        Write a state to disk, evicting old entries beyond size_limit.
+
+        Args:
+            key: Message-prefix hash
+            state: llama_cpp.LlamaState to store; only its last scores row is written
+        """
+        self._cache.set(self._state_key(key), trim_llama_state(state))
+
+    def clear(self):
+        """Remove all stored states."""
+        self._cache.clear()
+
+    def close(self):
+        self._cache.close()
+
+    def _state_key(self, key: str) -> str:
+        return f"state:{self.model_checksum}:{key}"
+
+    def _model_checksum(self, model_path: str) -> str:
+        """
+        SHA-256 of the model file.
+
+        Hashing a multi-gigabyte model takes a while, so the result is stored in
+        the cache itself under the file's path, size and modification time and
+        only recomputed when the file changes.
+        """
+        stat = os.stat(model_path)
+        stat_key = f"checksum:{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        checksum = self._cache.get(stat_key)
+        if checksum is None:
+            logger.info(f"Computing checksum of {model_path}")
+            digest = hashlib.sha256()
+            with open(model_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(_CHECKSUM_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            checksum = digest.hexdigest()
+            self._cache.set(stat_key, checksum)
+        return checksum
+
+
+class PrefixStateCache:
+    """
+    In-memory LRU of llama states keyed by message-prefix hash.
+
+    Entries are evicted least-recently-used first until the total size of the
+    stored states fits within capacity_bytes. A single state larger than the
+    whole capacity is not stored in memory.
+
+    An optional DiskStateCache acts as a second tier: states are written
+    through to disk and memory misses are looked up there.
+    """
+
+    def __init__(self, capacity_bytes: int, disk_cache: Optional[DiskStateCache] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            capacity_bytes: Maximum total size of states kept in memory (bytes)
+            disk_cache: Optional persistent store backing the memory cache
+        """
+        self.capacity_bytes = capacity_bytes
+        self.disk_cache = disk_cache
+        self._states: "OrderedDict[str, Any]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def cache_size(self) -> int:
+        """Total size of the stored states (bytes)."""
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._states
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a state and mark it as most recently used.
+
+        Args:
+            key: Message-prefix hash
+
+        Returns:
+            The stored state, or None if not cached
+        """
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                self._states.move_to_end(key)
+                self.hits += 1
+                return state
+
+        state = self._get_from_disk(key)
+        with self._lock:
+            if state is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._store(key, state)
+            return state
+
+    def put(self, key: str, state: Any):
+        """
+        Store a state, evicting least recently used entries to stay within capacity.
+
+        Args:
+            key: Message-prefix hash
+            state: llama_cpp.LlamaState to store
+        """
+        with self._lock:
+            self._store(key, state)
+        if self.disk_cache is not None:
+            try:
+                self.disk_cache.put(key, state)
+            except Exception:
+                logger.exception("Failed to write prefix state to disk cache")
+
+    def clear(self):
+        """Remove all stored states."""
+        with self._lock:
+            self._states.clear()
+            self._sizes.clear()
+            self._size = 0
+
+    def _get_from_disk(self, key: str) -> Optional[Any]:
+        if self.disk_cache is None:
+            return None
+        try:
+            return self.disk_cache.get(key)
+        except Exception:
+            logger.exception("Failed to read prefix state from disk cache")
+            return None
+
+    def _store(self, key: str, state: Any):
+        size = state_size_bytes(state)
+        self._remove(key)
+        if size > self.capacity_bytes:
+            logger.debug(
+                f"Prefix state of {size} bytes exceeds memory cache capacity "
+                f"{self.capacity_bytes}; not keeping it in memory")
+            return
+        self._states[key] = state
+        self._sizes[key] = size
+        self._size += size
+        while self._size > self.capacity_bytes:
+            evicted, _ = self._states.popitem(last=False)
+            self._size -= self._sizes.pop(evicted)
+            logger.debug(f"Evicted prefix state {evicted[:12]}")
+
+    def _remove(self, key: str):
+        if key in self._states:
+            del self._states[key]
+            self._size -= self._sizes.pop(key)
@@ -0,0 +1,220 @@
+"""
+Relevance-ranked passages of earlier chapters for RECENT_STORY.
+
+For a long story RECENT_STORY keeps the newest text and summarizes the rest,
+whether or not the chapter being written needs it. With CONTEXT_RETRIEVAL
+enabled, ContextBuilder instead fills most of the element's budget with the
+passages of earlier chapters that are most similar to the target chapter's
+title, plot point and key plot items.
+
+Chapters are split into passages of whole lines (about
+CONTEXT_RETRIEVAL_PASSAGE_WORDS words each) and embedded with a small
+sentence-transformers model on the CPU. Embeddings are cached by chapter id
+and last_modified, so a request only embeds the chapters added or edited since
+the previous one, plus its query.
+"""
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.models.request_context import ChapterDetails
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+# Number of chapters whose passages and embeddings are remembered
+_CACHE_CAPACITY = 1024
+
+# Sentences of a line too long to be one passage
+_SENTENCE = re.compile(r'\S.*?(?:[.!?]+["\'”’)\]]*(?=\s)|$)', re.S)
+
+# Texts to embed, returning one row per text
+Embedder = Callable[[List[str]], np.ndarray]
+
+Span = Tuple[int, int]
+
+
+class Passage(NamedTuple):
+    """A run of whole lines of a chapter."""
+    chapter: ChapterDetails
+    start: int
+    end: int
+
+    @property
+    def text(self) -> str:
+        return self.chapter.content[self.start:self.end]
+
+
+class ScoredPassage(NamedTuple):
+    """A passage and its cosine similarity to the query."""
+    score: float
+    passage: Passage
+
+
+def split_passages(content: str, max_words: int) -> List[Span]:
+    """
+    Split text into passages of up to max_words words.
+
+    Passages are made of whole lines; a line longer than max_words is split
+    between sentences, and a sentence longer than that is a passage of its own.
+
+    Args:
+        content: Chapter text
+        max_words: Target passage length
+
+    Returns:
+        (start, end) character offsets of each passage, in order
+    """
+    units: List[Tuple[int, int, int]] = []
+    for line in re.finditer(r'[^\n]*\S[^\n]*', content):
+        words = len(line.group().split())
+        if words <= max_words:
+            units.append((line.start(), line.end(), words))
+            continue
+        for sentence in _SENTENCE.finditer(line.group()):
+            units.append((line.start() + sentence.start(), line.start() + sentence.end(),
+                          len(sentence.group().split())))
+
+    spans: List[Span] = []
+    start = end = None
+    words = 0
+    for unit_start, unit_end, unit_words in units:
+        if start is not None and words + unit_words > max_words:
+            spans.append((start, end))
+            start = None
+        if start is None:
+            start, words = unit_start, 0
+        end = unit_end
+        words += unit_words
+    if start is not None:
+        spans.append((start, end))
+    return spans
+
+
+class PassageIndex:
+    """
+    Embeds chapter passages once and ranks them against a query.
+
+    Thread safe; embedding calls are serialized.
+    """
+
+    def __init__(self, embed: Embedder, passage_words: int = 200, capacity: int = _CACHE_CAPACITY):
+        """
+        Initialize the index.
+
+        Args:
+            embed: Function embedding a list of texts
+            passage_words: Target passage length in words
+            capacity: Maximum number of chapters kept
+        """
+        self.passage_words = passage_words
+        self.capacity = capacity
+        self._embed = embed
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[List[Span], np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._embed_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Chapter cache counters for monitoring."""
+        return {"hits": self.hits, "misses": self.misses, "chapters": len(self._entries)}
+
+    def rank(self, query: str, chapters: Sequence[ChapterDetails]) -> List[ScoredPassage]:
+        """
+        Rank the passages of chapters by similarity to query.
+
+        Args:
+            query: Text describing what the context is needed for
+            chapters: Chapters to take passages from
+
+        Returns:
+            Every passage of the chapters, most similar first
+        """
+        ranked = []
+        query_vector = self._encode([query])[0]
+        for chapter in chapters:
+            spans, vectors = self._chapter_passages(chapter)
+            if not spans:
+                continue
+            for (start, end), score in zip(spans, vectors @ query_vector):
+                ranked.append(ScoredPassage(float(score), Passage(chapter, start, end)))
+        ranked.sort(key=lambda s: s.score, reverse=True)
+        return ranked
+
+    def _chapter_passages(self, chapter: ChapterDetails) -> Tuple[List[Span], np.ndarray]:
+        """Passage offsets and embeddings of a chapter, cached by id and last_modified."""
+        key = (chapter.id, chapter.last_modified.isoformat())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        spans = split_passages(chapter.content, self.passage_words)
+        vectors = self._encode([chapter.content[start:end] for start, end in spans]) if spans else None
+        entry = (spans, vectors)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Unit-length embeddings of texts, one row each."""
+        with self._embed_lock:
+            vectors = np.asarray(self._embed(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+# Global instance for singleton pattern
+_passage_index: Optional[PassageIndex] = None
+_passage_index_failed = False
+_passage_index_lock = threading.Lock()
+
+
+def get_passage_index() -> Optional[PassageIndex]:
+    """
+    Get the global passage index, loading CONTEXT_RETRIEVAL_MODEL on first use.
+
+    Returns:
+        PassageIndex instance, or None if sentence-transformers is not
+        installed or the model could not be loaded
+    """
+    global _passage_index, _passage_index_failed
+
+    with _passage_index_lock:
+        if _passage_index is None and not _passage_index_failed:
+            from app.core.config import settings
+            if not SENTENCE_TRANSFORMERS_AVAILABLE:
+                logger.warning("CONTEXT_RETRIEVAL requires sentence-transformers; using chapter summaries")
+                _passage_index_failed = True
+                return None
+            try:
+                logger.info(f"Loading passage embedding model: {settings.CONTEXT_RETRIEVAL_MODEL}")
+                model = SentenceTransformer(settings.CONTEXT_RETRIEVAL_MODEL, device='cpu')
+            except Exception:
+                logger.exception("Failed to load passage embedding model; using chapter summaries")
+                _passage_index_failed = True
+                return None
+            _passage_index = PassageIndex(
+                lambda texts: model.encode(texts, batch_size=32, convert_to_numpy=True),
+                passage_words=settings.CONTEXT_RETRIEVAL_PASSAGE_WORDS)
+        return _passage_index
@@ -12,7 +12,9 @@ from dataclasses import dataclass
 
 from app.core.config import settings
 from app.services.archive_service import ArchiveService, ArchiveSearchResult
+from app.services.inference_executor import InferenceExecutor
 from app.services.llm_inference import LLMInference, get_llm
+from app.services.llm_registry import LLMTask, get_task_executor, get_task_llm
 from app.services.query_analyzer import QueryAnalyzer, QueryAnalysis
 
 logger = logging.getLogger(__name__)
@@ -54,7 +56,8 @@ class RAGService:
 
         Args:
             archive_service: ArchiveService for retrieving relevant content
-            llm: LLMInference instance for generating answers (uses global if None)
+            llm: LLMInference instance for generating answers (the model routed
+                to LLMTask.CHAT if None)
         """
         self.archive_service = archive_service
         self._llm = llm
@@ -62,10 +65,15 @@ class RAGService:
 
     @property
     def llm(self) -> Optional[LLMInference]:
-        """Get LLM instance (lazy load from global)."""
-        if self._llm is None:
-            self._llm = get_llm()
-        return self._llm
+        """Get LLM instance (looked up per call, so routing set up after startup applies)."""
+        if self._llm is not None:
+            return self._llm
+        return get_task_llm(LLMTask.CHAT, default=get_llm())
+
+    @property
+    def executor(self) -> InferenceExecutor:
+        """Executor to run query() and chat() on; it drives the model answering."""
+        return get_task_executor(LLMTask.CHAT)
 
     def is_enabled(self) -> bool:
         """Check if RAG service is fully enabled (archive + LLM)."""
@@ -0,0 +1,268 @@
+"""
+Incremental JSON parsing of streamed LLM output.
+
+Structured endpoints generate one JSON document under a grammar, but the
+client only saw it once the whole document had been generated and validated.
+IncrementalJSONParser is fed the text as it streams and reports each value as
+soon as its closing quote or bracket arrives:
+
+- every element of an array, e.g. ("actions", 0) or (2,) for a root array
+- every member of the root object, e.g. ("opinion",)
+
+Values are reported once complete, so an object inside a list is reported
+whole rather than field by field. Text that cannot continue a JSON document
+raises JSONStreamError immediately, which lets the caller stop generation
+instead of running on to max_tokens.
+
+Usage:
+    parser = IncrementalJSONParser()
+    for token in tokens:
+        for item in parser.feed(token):
+            print(item.path, item.value)
+        if parser.done:
+            break
+    parser.close()  # completes a root number, raises if the text was cut off
+"""
+import json
+from typing import Any, List, NamedTuple, Optional, Tuple, Union
+
+JSONPath = Tuple[Union[str, int], ...]
+
+_WHITESPACE = ' \t\n\r'
+_ESCAPES = '"\\/bfnrtu'
+_HEX_DIGITS = '0123456789abcdefABCDEF'
+_NUMBER_START = '-0123456789'
+_NUMBER_CHARS = '0123456789+-.eE'
+_LITERALS = {'t': 'true', 'f': 'false', 'n': 'null'}
+
+# Scanner states
+_VALUE = 'value'                    # expecting a value
+_VALUE_OR_CLOSE = 'value_or_close'  # just after '['
+_KEY = 'key'                        # after ',' in an object
+_KEY_OR_CLOSE = 'key_or_close'      # just after '{'
+_COLON = 'colon'
+_AFTER_VALUE = 'after_value'        # expecting ',' or the closing bracket
+_STRING = 'string'
+_NUMBER = 'number'
+_LITERAL = 'literal'
+_END = 'end'                        # root value complete
+
+
+class JSONStreamError(ValueError):
+    """Streamed text can no longer form a valid JSON document."""
+
+
+class JSONItem(NamedTuple):
+    """A completed value and its location in the document."""
+    path: JSONPath
+    value: Any
+
+
+class _Frame:
+    """An open object or array."""
+    __slots__ = ('is_object', 'path', 'start', 'index', 'key')
+
+    def __init__(self, is_object: bool, path: JSONPath, start: int):
+        self.is_object = is_object
+        self.path = path
+        self.start = start
+        self.index = 0
+        self.key: Optional[str] = None
+
+
+class IncrementalJSONParser:
+    """Push parser reporting array elements and root members as they complete."""
+
+    def __init__(self):
+        self._text = ''
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._state = _VALUE
+        self._value_start = 0
+        self._string_is_key = False
+        self._escape = False
+        self._unicode_digits = 0
+        self._literal = ''
+        self.value: Any = None
+
+    @property
+    def done(self) -> bool:
+        """Whether the root value is complete."""
+        return self._state == _END
+
+    @property
+    def text(self) -> str:
+        """All text fed so far."""
+        return self._text
+
+    def feed(self, chunk: str) -> List[JSONItem]:
+        """
+        Parse the next piece of text.
+
+        Args:
+            chunk: Text generated since the previous call
+
+        Returns:
+            Values completed by this chunk, in document order
+
+        Raises:
+            JSONStreamError: If the text cannot be part of a JSON document
+        """
+        self._text += chunk
+        items: List[JSONItem] = []
+        text = self._text
+        while self._pos < len(text):
+            if self._step(text[self._pos], items):
+                self._pos += 1
+        return items
+
+    def close(self) -> List[JSONItem]:
+        """
+        Signal the end of the text.
+
+        A root number has no closing delimiter, so it only completes here.
+
+        Returns:
+            Values completed by the end of the text
+
+        Raises:
+            JSONStreamError: If the text ends before the document is complete
+        """
+        items: List[JSONItem] = []
+        if self._state == _NUMBER and not self._stack:
+            self._complete(len(self._text), items)
+        if self._state != _END:
+            self._fail("unexpected end of the document")
+        return items
+
+    def _step(self, char: str, items: List[JSONItem]) -> bool:
+        """Process one character; returns False to process it again in the new state."""
+        state = self._state
+
+        if state == _STRING:
+            if self._unicode_digits:
+                if char not in _HEX_DIGITS:
+                    self._fail(f"invalid \\u escape {char!r}")
+                self._unicode_digits -= 1
+            elif self._escape:
+                if char not in _ESCAPES:
+                    self._fail(f"invalid escape \\{char}")
+                self._escape = False
+                if char == 'u':
+                    self._unicode_digits = 4
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                if self._string_is_key:
+                    self._stack[-1].key = json.loads(self._text[self._value_start:self._pos + 1])
+                    self._state = _COLON
+                else:
+                    self._complete(self._pos + 1, items)
+            elif char < ' ':
+                self._fail("control character in string")
+            return True
+
+        if state == _NUMBER:
+            if char in _NUMBER_CHARS:
+                return True
+            self._complete(self._pos, items)
+            return False
+
+        if state == _LITERAL:
+            if char != self._literal[self._pos - self._value_start]:
+                self._fail(f"expected {self._literal!r}")
+            if self._pos - self._value_start == len(self._literal) - 1:
+                self._complete(self._pos + 1, items)
+            return True
+
+        if char in _WHITESPACE:
+            return True
+
+        if state in (_VALUE, _VALUE_OR_CLOSE):
+            if state == _VALUE_OR_CLOSE and char == ']':
+                self._close(items)
+            else:
+                self._start_value(char)
+        elif state in (_KEY, _KEY_OR_CLOSE):
+            if state == _KEY_OR_CLOSE and char == '}':
+                self._close(items)
+            elif char == '"':
+                self._start_string(is_key=True)
+            else:
+                self._fail("expected an object key")
+        elif state == _COLON:
+            if char != ':':
+                self._fail("expected ':'")
+            self._state = _VALUE
+        elif state == _AFTER_VALUE:
+            frame = self._stack[-1]
+            if char == ',':
+                self._state = _KEY if frame.is_object else _VALUE
+            elif char == ('}' if frame.is_object else ']'):
+                self._close(items)
+            else:
+                self._fail(f"expected ',' or {'}' if frame.is_object else ']'!r}")
+        else:
+            self._fail("text after the end of the document")
+        return True
+
+    def _start_value(self, char: str):
+        self._value_start = self._pos
+        if char in '{[':
+            is_object = char == '{'
+            self._stack.append(_Frame(is_object, self._child_path(), self._pos))
+            self._state = _KEY_OR_CLOSE if is_object else _VALUE_OR_CLOSE
+        elif char == '"':
+            self._start_string(is_key=False)
+        elif char in _NUMBER_START:
+            self._state = _NUMBER
+        elif char in _LITERALS:
+            self._literal = _LITERALS[char]
+            self._state = _LITERAL
+        else:
+            self._fail(f"unexpected {char!r}")
+
+    def _start_string(self, is_key: bool):
+        self._value_start = self._pos
+        self._string_is_key = is_key
+        self._escape = False
+        self._unicode_digits = 0
+        self._state = _STRING
+
+    def _close(self, items: List[JSONItem]):
+        frame = self._stack.pop()
+        self._value_start = frame.start
+        self._complete(self._pos + 1, items)
+
+    def _child_path(self) -> JSONPath:
+        """Path of the value starting at the current position."""
+        if not self._stack:
+            return ()
+        parent = self._stack[-1]
+        return parent.path + ((parent.key,) if parent.is_object else (parent.index,))
+
+    def _complete(self, end: int, items: List[JSONItem]):
+        """Finish the value spanning _value_start to end and report it if it is an item."""
+        raw = self._text[self._value_start:end]
+        if not self._stack:
+            self.value = self._decode(raw)
+            self._state = _END
+            return
+        parent = self._stack[-1]
+        if not parent.is_object or len(self._stack) == 1:
+            items.append(JSONItem(self._child_path(), self._decode(raw)))
+        elif self._state == _NUMBER:
+            self._decode(raw)
+        if not parent.is_object:
+            parent.index += 1
+        self._state = _AFTER_VALUE
+
+    def _decode(self, raw: str) -> Any:
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError as e:
+            self._fail(f"invalid value {raw[:40]!r} ({e.msg})")
+
+    def _fail(self, reason: str):
+        snippet = self._text[max(0, self._pos - 30):self._pos + 1]
+        raise JSONStreamError(f"Invalid JSON at offset {self._pos}: {reason} (near {snippet!r})")
@@ -0,0 +1,208 @@
+"""
+Memoized LLM summaries for ContextBuilder.
+
+ContextBuilder summarizes worldbuilding, characters, character states and
+recent story whenever they exceed their token budgets. The same story is sent
+with every request, so the same text would be summarized again and again; this
+cache returns the earlier summary when the content, budget, strategy and model
+are unchanged. Entries live in an in-memory LRU and, optionally, in a SQLite
+database so they survive restarts.
+"""
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SummaryKey = Tuple[str, int, str, str]
+
+
+def make_summary_key(content: str, token_budget: int, strategy: str, model_id: str) -> SummaryKey:
+    """
+    Build the cache key for a summary.
+
+    Args:
+        content: Text being summarized
+        token_budget: Token budget of the summary
+        strategy: Summarization strategy of the context element
+        model_id: Identifier of the model producing the summary
+
+    Returns:
+        Tuple of (content hash, budget, strategy, model id)
+    """
+    content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    return (content_hash, token_budget, str(strategy), model_id)
+
+
+class SummaryCache:
+    """
+    LRU cache of (summary, token_count) with optional SQLite persistence.
+
+    Lookups check memory first, then the database; database hits are promoted
+    into memory. Writes go to both.
+    """
+
+    def __init__(self, capacity: int = 256, db_path: Optional[str] = None, db_max_entries: int = 10000):
+        """
+        Initialize the cache.
+
+        Args:
+            capacity: Maximum number of summaries kept in memory
+            db_path: SQLite database file for persistence (None for memory only)
+            db_max_entries: Maximum number of summaries kept in the database
+        """
+        self.capacity = capacity
+        self.db_max_entries = db_max_entries
+        self._entries: "OrderedDict[SummaryKey, Tuple[str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                " content_hash TEXT NOT NULL,"
+                " token_budget INTEGER NOT NULL,"
+                " strategy TEXT NOT NULL,"
+                " model_id TEXT NOT NULL,"
+                " summary TEXT NOT NULL,"
+                " token_count INTEGER NOT NULL,"
+                " last_used REAL NOT NULL,"
+                " PRIMARY KEY (content_hash, token_budget, strategy, model_id))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS summaries_last_used ON summaries (last_used)")
+            self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Runtime counters for monitoring (reported by /health).
+
+        Returns:
+            Dict of counter name to value
+        """
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def get(self, key: SummaryKey) -> Optional[Tuple[str, int]]:
+        """
+        Look up a summary.
+
+        Args:
+            key: Key from make_summary_key
+
+        Returns:
+            (summary, token_count) or None if not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            entry = self._db_get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, entry)
+            return entry
+
+    def put(self, key: SummaryKey, summary: str, token_count: int):
+        """
+        Store a summary.
+
+        Args:
+            key: Key from make_summary_key
+            summary: Summary text
+            token_count: Token count of the summary
+        """
+        with self._lock:
+            self._store(key, (summary, token_count))
+            self._db_put(key, summary, token_count)
+
+    def clear(self):
+        """Remove all summaries from memory and the database."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM summaries")
+                self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _store(self, key: SummaryKey, entry: Tuple[str, int]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def _db_get(self, key: SummaryKey) -> Optional[Tuple[str, int]]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT summary, token_count FROM summaries"
+                " WHERE content_hash = ? AND token_budget = ? AND strategy = ? AND model_id = ?",
+                key).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE summaries SET last_used = ?"
+                " WHERE content_hash = ? AND token_budget = ? AND strategy = ? AND model_id = ?",
+                (time.time(), *key))
+            self._db.commit()
+            return row[0], row[1]
+        except sqlite3.Error:
+            logger.exception("Failed to read summary cache database")
+            return None
+
+    def _db_put(self, key: SummaryKey, summary: str, token_count: int):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO summaries"
+                " (content_hash, token_budget, strategy, model_id, summary, token_count, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, summary, token_count, time.time()))
+            self._db.execute(
+                "DELETE FROM summaries WHERE rowid IN ("
+                " SELECT rowid FROM summaries ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.db_max_entries,))
+            self._db.commit()
+        except sqlite3.Error:
+            logger.exception("Failed to write summary cache database")
+
+
+# Global instance for singleton pattern
+_summary_cache: Optional[SummaryCache] = None
+_summary_cache_lock = threading.Lock()
+
+
+def get_summary_cache() -> SummaryCache:
+    """
+    Get the global summary cache, creating it from settings on first use.
+
+    Returns:
+        SummaryCache instance
+    """
+    global _summary_cache
+
+    with _summary_cache_lock:
+        if _summary_cache is None:
+            from app.core.config import settings
+            _summary_cache = SummaryCache(
+                capacity=settings.SUMMARY_CACHE_SIZE,
+                db_path=settings.SUMMARY_CACHE_DB_PATH)
+        return _summary_cache
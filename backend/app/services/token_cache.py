@@ -0,0 +1,98 @@
+"""
+Token-id caching for LLMInference.encode.
+
+ContextBuilder tokenizes every context element on every request to check it
+against its budget, and the token endpoints count the same system prompts over
+and over. Story elements rarely change between requests, so LLMInference keeps
+their token ids in an LRU keyed by a hash of the text.
+"""
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+class TokenCache:
+    """
+    LRU of token ids keyed by text hash, bounded by the total number of tokens.
+
+    Token ids are stored as compact int arrays; get() returns a fresh list so
+    callers may modify it.
+    """
+
+    def __init__(self, capacity_tokens: int):
+        """
+        Initialize the cache.
+
+        Args:
+            capacity_tokens: Maximum total number of token ids kept
+        """
+        self.capacity_tokens = capacity_tokens
+        self._entries: "OrderedDict[bytes, array]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache_size(self) -> int:
+        """Total number of token ids stored."""
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def get(self, text: str) -> Optional[List[int]]:
+        """
+        Look up the token ids of a text.
+
+        Args:
+            text: Text that was tokenized
+
+        Returns:
+            Token ids, or None if not cached
+        """
+        key = self._key(text)
+        with self._lock:
+            tokens = self._entries.get(key)
+            if tokens is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return tokens.tolist()
+
+    def put(self, text: str, tokens: List[int]):
+        """
+        Store the token ids of a text, evicting least recently used entries.
+
+        Args:
+            text: Text that was tokenized
+            tokens: Its token ids
+        """
+        if len(tokens) > self.capacity_tokens:
+            return
+        key = self._key(text)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = array('i', tokens)
+            self._size += len(tokens)
+            while self._size > self.capacity_tokens:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "tokens": self._size}
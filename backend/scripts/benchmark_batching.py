@@ -0,0 +1,124 @@
+"""
+Batched decoding benchmark for Writer Assistant.
+
+Generates the same set of concurrent chat completions twice: one after the
+other through LLMInference.chat_completion_stream (the sequential path every
+request takes without batching), then all at once through the continuous
+batching engine. Reports wall time and aggregate generated tokens per second
+for each, so LLM_BATCH_MAX_SEQUENCES can be tuned for a model and machine.
+
+Example:
+    python scripts/benchmark_batching.py --model-path ./models/model.gguf --requests 4
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.llm_inference import LLMInference, LLMInferenceConfig  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# One prompt per simulated rater, so sequences diverge as they would in practice
+RATER_FOCUS = [
+    "pacing and tension",
+    "character voice and dialogue",
+    "sensory detail and setting",
+    "plot logic and continuity",
+    "emotional impact",
+    "prose style and word choice",
+    "foreshadowing and payoff",
+    "opening and closing lines",
+]
+
+SCENE = (
+    "The lighthouse keeper found the letter wedged beneath the door on the morning "
+    "the fog refused to lift. It was addressed to her brother, who had been dead "
+    "for eleven years, and the handwriting was his."
+)
+
+
+def build_requests(count: int) -> List[List[Dict[str, str]]]:
+    requests = []
+    for i in range(count):
+        focus = RATER_FOCUS[i % len(RATER_FOCUS)]
+        requests.append([
+            {"role": "system", "content": f"You are a story critic focused on {focus}."},
+            {"role": "user", "content": f"Give detailed feedback on this scene:\n\n{SCENE}"},
+        ])
+    return requests
+
+
+def run_sequential(llm: LLMInference, requests, max_tokens: int) -> int:
+    tokens = 0
+    for messages in requests:
+        for _ in llm.chat_completion_stream(messages, max_tokens=max_tokens):
+            tokens += 1
+    return tokens
+
+
+async def run_batched(llm: LLMInference, requests, max_tokens: int) -> int:
+    async def one(messages) -> int:
+        return len([piece async for piece in llm.batch_engine.stream(messages, max_tokens=max_tokens)])
+
+    return sum(await asyncio.gather(*[one(messages) for messages in requests]))
+
+
+def report(name: str, tokens: int, seconds: float):
+    logger.info(f"{name:<10} {tokens:>6} tokens in {seconds:7.2f}s  ({tokens / seconds:7.2f} tokens/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare sequential and batched decoding throughput'
+    )
+    parser.add_argument('--model-path', required=True, help='Path to the GGUF model file')
+    parser.add_argument('--requests', type=int, default=4, help='Concurrent requests (default: 4)')
+    parser.add_argument('--max-tokens', type=int, default=256, help='Tokens generated per request (default: 256)')
+    parser.add_argument('--n-ctx', type=int, default=4096, help='Context size per sequence (default: 4096)')
+    parser.add_argument('--n-threads', type=int, default=None, help='CPU threads (default: auto)')
+    parser.add_argument('--n-gpu-layers', type=int, default=0, help='Layers offloaded to GPU (default: 0)')
+    args = parser.parse_args()
+
+    config = LLMInferenceConfig(
+        model_path=args.model_path,
+        n_ctx=args.n_ctx,
+        n_threads=args.n_threads,
+        n_gpu_layers=args.n_gpu_layers,
+        batch_max_sequences=max(2, args.requests))
+    llm = LLMInference(config)
+    if llm.batch_engine is None:
+        logger.error("Batch engine could not be started for this model")
+        sys.exit(1)
+
+    requests = build_requests(args.requests)
+    # Warm up so the first timed run does not pay for page-faulting the weights
+    run_sequential(llm, requests[:1], 8)
+
+    started = time.perf_counter()
+    sequential_tokens = run_sequential(llm, requests, args.max_tokens)
+    sequential_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched_tokens = asyncio.run(run_batched(llm, requests, args.max_tokens))
+    batched_seconds = time.perf_counter() - started
+
+    logger.info(f"{args.requests} requests, up to {args.max_tokens} tokens each")
+    report("sequential", sequential_tokens, sequential_seconds)
+    report("batched", batched_tokens, batched_seconds)
+    logger.info(f"Speedup: {sequential_seconds / batched_seconds:.2f}x wall time")
+    logger.info(f"Engine stats: {llm.batch_engine.get_stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,12 +3,13 @@ from unittest.mock import Mock, MagicMock, patch
 from fastapi.testclient import TestClient
 from pydantic import ConfigDict, Field
 import json
+import re
 from datetime import datetime
 from typing import List
 
 from app.main import app
 from app.core.config import Settings
-from app.services.llm_inference import LLMInference, TokenTruncation
+from app.services.llm_inference import LLMInference, TokenTruncation, TokenizedText
 from app.models.request_context import (
     RequestContext,
     CharacterDetails,
@@ -40,6 +41,8 @@ def mock_tokenizer():
 def mock_llm():
     """Mock the LLM for all tests"""
     mock_llm_instance = MagicMock()
+    # Decode one request at a time (no batch engine)
+    mock_llm_instance.batch_engine = None
 
     # Mock tokenization methods
     def mock_count_tokens(text: str) -> int:
@@ -80,6 +83,16 @@ def mock_llm():
 
     mock_llm_instance.truncate_to_tokens.side_effect = mock_truncate_to_tokens
 
+    def mock_tokenize_with_offsets(text: str) -> TokenizedText:
+        """One token per word; offsets end at each word"""
+        words = list(re.finditer(r'\S+', text or ''))
+        return TokenizedText(
+            text=text,
+            tokens=list(range(len(words))),
+            offset_map=lambda: [0] + [m.end() for m in words])
+
+    mock_llm_instance.tokenize_with_offsets.side_effect = mock_tokenize_with_offsets
+
     # Mock generate method with intelligent responses
     def generate_side_effect(prompt, **kwargs):
         # Agentic evaluation - check first as it's very specific
@@ -19,6 +19,8 @@ from app.models.streaming_models import (
     StreamingErrorEvent
 )
 from app.services.context_builder import ContextBuilder
+from app.services.inference_executor import InferenceExecutor
+from app.services.llm_registry import LLMTask, get_model_registry
 from app.models.request_context import (
     RequestContext,
     StoryConfiguration,
@@ -54,6 +56,15 @@ def mock_llm():
 
     llm.truncate_to_tokens.side_effect = truncate_to_tokens
 
+    def tokenize_with_offsets(text):
+        from app.services.llm_inference import TokenizedText
+        return TokenizedText(
+            text=text,
+            tokens=text.split(),
+            offset_map=lambda: [0] + [m.end() for m in re.finditer(r'\S+', text)])
+
+    llm.tokenize_with_offsets.side_effect = tokenize_with_offsets
+
     return llm
 
 
@@ -176,7 +187,7 @@ class TestLLMGenerationTool:
         tool = LLMGenerationTool(mock_llm)
 
         # Mock streaming response
-        def chat_completion_stream(messages, temperature=0.8, max_tokens=2000):
+        def chat_completion_stream(messages, temperature=0.8, max_tokens=2000, **kwargs):
             # Verify parameters were passed
             assert temperature == 0.5
             assert max_tokens == 1000
@@ -188,6 +199,23 @@ class TestLLMGenerationTool:
 
         assert result == "test"
 
+    @pytest.mark.asyncio
+    async def test_llm_generation_tool_speculative(self, mock_llm, simple_context_builder):
+        """Test that speculative generation is requested only when asked for"""
+        tool = LLMGenerationTool(mock_llm)
+        requested = []
+
+        def chat_completion_stream(messages, speculative=False, **kwargs):
+            requested.append(speculative)
+            yield "test"
+
+        mock_llm.chat_completion_stream = chat_completion_stream
+
+        await tool.execute(simple_context_builder)
+        await tool.execute(simple_context_builder, speculative=True)
+
+        assert requested == [False, True]
+
 
 class TestAgenticTextGenerator:
     """Test AgenticTextGenerator"""
@@ -414,6 +442,31 @@ class TestAgenticTextGenerator:
         assert passed is False
         assert "improvement" in feedback.lower()
 
+    @pytest.mark.asyncio
+    async def test_evaluate_content_on_routed_model(self, mock_llm, simple_context_builder):
+        """Test that evaluation runs on the model routed to the evaluate task"""
+        small_llm = MagicMock()
+
+        def chat_completion_stream(*args, **kwargs):
+            yield "PASSED: YES\nFEEDBACK: Fine."
+
+        small_llm.chat_completion_stream = chat_completion_stream
+        mock_llm.chat_completion_stream.side_effect = AssertionError("evaluated on the prose model")
+        registry = get_model_registry()
+        small_executor = InferenceExecutor()
+        registry.register("small", small_llm, small_executor)
+        registry.set_route(LLMTask.EVALUATE, "small")
+        try:
+            agent = AgenticTextGenerator(mock_llm)
+            passed, feedback = await agent._evaluate_content(simple_context_builder, "Test content", "Must be good")
+        finally:
+            registry.shutdown()
+
+        assert passed is True
+        assert agent.tools['llm_evaluate'].llm is small_llm
+        assert agent.tools['llm_evaluate'].executor is small_executor
+        assert agent.tools['llm_generate'].llm is mock_llm
+
     def test_refine_prompt(self, mock_llm):
         """Test prompt refinement"""
         agent = AgenticTextGenerator(mock_llm)
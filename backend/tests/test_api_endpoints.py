@@ -21,6 +21,7 @@ class TestHealthEndpoints:
         data = response.json()
         assert "status" in data
         assert data["status"] == "healthy"
+        assert "llm_stats" in data
 
 
 class TestAPIErrorHandling:
@@ -0,0 +1,81 @@
+"""
+Tests for queue admission of the archive RAG endpoints.
+"""
+import json
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from app.services.inference_executor import InferenceExecutor, JobPriority, QueueFullError
+from app.services.rag_service import RAGResponse
+
+
+@pytest.fixture
+def rag_service():
+    service = Mock()
+    service.is_enabled.return_value = True
+    service.executor = Mock(spec=InferenceExecutor)
+    service.executor.admit.return_value = "ticket"
+    service.executor.run = AsyncMock(return_value=RAGResponse(
+        query="Who is the captain?", answer="Mara.", sources=[], context_used=""))
+    with patch('app.api.v1.endpoints.archive.get_rag_service', return_value=service):
+        yield service
+
+
+def sse_messages(response):
+    return [json.loads(line[6:]) for line in response.text.split('\n') if line.startswith('data: ')]
+
+
+class TestRAGAdmission:
+    """Test that RAG requests are admitted and their jobs carry the ticket"""
+
+    def test_query_admitted_with_ticket(self, client, rag_service):
+        response = client.post("/api/v1/archive/rag/query", json={"question": "Who is the captain?"})
+
+        assert response.status_code == 200
+        assert response.json()["answer"] == "Mara."
+        rag_service.executor.admit.assert_called_once_with(JobPriority.NORMAL)
+        assert rag_service.executor.run.call_args.kwargs["ticket"] == "ticket"
+
+    def test_query_stream_admitted_with_ticket(self, client, rag_service):
+        rag_service.archive_service.search.return_value = [Mock(
+            file_path="/a.txt", file_name="a.txt", chunk_text="Mara commands the ship.", similarity_score=0.9)]
+        rag_service.executor.run.return_value = "Mara."
+
+        response = client.post("/api/v1/archive/rag/query/stream", json={"question": "Who is the captain?"})
+
+        assert sse_messages(response)[-1]["type"] == "result"
+        rag_service.executor.admit.assert_called_once_with(JobPriority.NORMAL)
+        assert rag_service.executor.run.call_args.kwargs["ticket"] == "ticket"
+
+    def test_chat_admitted_as_interactive(self, client, rag_service):
+        response = client.post("/api/v1/archive/rag/chat", json={
+            "messages": [{"role": "user", "content": "Who is the captain?"}]})
+
+        assert sse_messages(response)[-1]["type"] == "result"
+        rag_service.executor.admit.assert_called_once_with(JobPriority.INTERACTIVE)
+        assert rag_service.executor.run.call_args.kwargs["ticket"] == "ticket"
+
+    @pytest.mark.parametrize("path, body", [
+        ("/api/v1/archive/rag/query", {"question": "Who is the captain?"}),
+        ("/api/v1/archive/rag/query/stream", {"question": "Who is the captain?"}),
+        ("/api/v1/archive/rag/chat", {"messages": [{"role": "user", "content": "Who is the captain?"}]}),
+    ])
+    def test_queue_full(self, client, rag_service, path, body):
+        rag_service.executor.admit.side_effect = QueueFullError(pending=32, retry_after=30)
+
+        response = client.post(path, json=body)
+
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "30"
+        rag_service.executor.run.assert_not_called()
+
+    def test_disabled_rag_not_admitted(self, client, rag_service):
+        rag_service.is_enabled.return_value = False
+        rag_service.llm = None
+
+        response = client.post("/api/v1/archive/rag/chat", json={
+            "messages": [{"role": "user", "content": "Who is the captain?"}]})
+
+        assert sse_messages(response)[-1]["type"] == "error"
+        rag_service.executor.admit.assert_not_called()
@@ -3,8 +3,11 @@ Tests for character feedback endpoint.
 """
 import pytest
 import json
+import time
 from fastapi.testclient import TestClient
 
+from app.services.inference_executor import InferenceExecutor, QueueFullError
+
 
 def extract_final_result_from_streaming_response(response):
     """Helper function to extract the final result from a streaming SSE response."""
@@ -147,3 +150,46 @@ class TestCharacterFeedbackEndpoint:
             result_data = result_messages[0].get('data', {})
             assert 'characterName' in result_data
             assert 'feedback' in result_data
+
+    def test_character_feedback_streams_items_before_result(self, client, sample_character_feedback_request):
+        """Test that each feedback entry is sent as soon as it is generated"""
+        response = client.post("/api/v1/character-feedback", json=sample_character_feedback_request)
+        messages = [json.loads(line[6:]) for line in response.text.split('\n') if line.startswith('data: ')]
+        types = [msg['type'] for msg in messages]
+
+        assert 'item' in types
+        assert types.index('item') < types.index('result')
+        feedback = messages[types.index('result')]['data']['feedback']
+        action_items = [msg for msg in messages if msg['type'] == 'item' and msg['path'][0] == 'actions']
+        assert [msg['value'] for msg in action_items[:-1]] == feedback['actions']
+        assert [msg['path'] for msg in action_items[:-1]] == [['actions', i] for i in range(len(feedback['actions']))]
+
+    def test_character_feedback_invalid_json_stops_early(self, client, sample_character_feedback_request, mock_llm):
+        """Test that output that cannot be JSON ends the stream with an error"""
+        produced = []
+
+        def chat_completion_stream(messages, **kwargs):
+            for token in ['Sure', '!', ' Here'] + [' is'] * 2000:
+                produced.append(token)
+                time.sleep(0.001)
+                yield token
+
+        mock_llm.chat_completion_stream.side_effect = chat_completion_stream
+        response = client.post("/api/v1/character-feedback", json=sample_character_feedback_request)
+        messages = [json.loads(line[6:]) for line in response.text.split('\n') if line.startswith('data: ')]
+
+        assert messages[-1]['type'] == 'error'
+        assert 'Invalid JSON' in messages[-1]['message']
+        assert 'result' not in [msg['type'] for msg in messages]
+        assert len(produced) < 2000
+
+    def test_character_feedback_queue_full(self, client, sample_character_feedback_request, monkeypatch):
+        """Test that a full inference queue rejects the request with 429"""
+        def reject(self, priority):
+            raise QueueFullError(pending=32, retry_after=30)
+
+        monkeypatch.setattr(InferenceExecutor, "admit", reject)
+        response = client.post("/api/v1/character-feedback", json=sample_character_feedback_request)
+
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "30"
@@ -5,6 +5,13 @@ This module tests the ContextBuilder class which provides a flexible way to buil
 context for LLM prompts with token budget management and various summarization strategies.
 """
 
+import asyncio
+import re
+from dataclasses import FrozenInstanceError
+import threading
+import time
+
+import numpy as np
 import pytest
 from unittest.mock import Mock, MagicMock, patch
 from datetime import datetime
@@ -15,7 +22,12 @@ from app.services.context_builder import (
     SummarizationStrategy,
     ContextItem
 )
-from app.services.llm_inference import LLMInference, TokenTruncation
+from app.core.config import settings
+from app.services.inference_executor import InferenceExecutor
+from app.services.llm_inference import LLMInference, TokenTruncation, TokenizedText
+from app.services.llm_registry import LLMTask, get_model_registry
+from app.services.passage_index import PassageIndex
+from app.services.summary_cache import SummaryCache, make_summary_key
 from app.models.request_context import (
     RequestContext,
     StoryConfiguration,
@@ -23,7 +35,9 @@ from app.models.request_context import (
     WorldbuildingInfo,
     CharacterDetails,
     CharacterState,
+    ChapterDetails,
     StoryOutline,
+    OutlineItem,
     RequestContextMetadata
 )
 
@@ -149,8 +163,13 @@ def mock_llm_inference():
         return len(text.split()) if text else 0
 
     mock_llm.truncate_to_tokens.side_effect = mock_truncate
+    mock_llm.tokenize_with_offsets.side_effect = lambda text: TokenizedText(
+        text=text,
+        tokens=text.split(),
+        offset_map=lambda: [0] + [m.end() for m in re.finditer(r'\S+', text)])
     mock_llm.generate.side_effect = mock_generate
     mock_llm.count_tokens.side_effect = mock_count_tokens
+    mock_llm.count_tokens_batch.side_effect = lambda texts: [mock_count_tokens(t) for t in texts]
     return mock_llm
 
 
@@ -162,7 +181,7 @@ class TestContextBuilderInitialization:
         builder = ContextBuilder(minimal_request_context, mock_llm_inference)
 
         assert builder._request_context == minimal_request_context
-        assert builder._elements == []
+        assert builder._elements == ()
         assert builder._model == mock_llm_inference
 
     def test_initialization_with_full_context(self, full_request_context, mock_llm_inference):
@@ -170,7 +189,7 @@ class TestContextBuilderInitialization:
         builder = ContextBuilder(full_request_context, mock_llm_inference)
 
         assert builder._request_context == full_request_context
-        assert builder._elements == []
+        assert builder._elements == ()
 
 
 class TestAddSystemPrompt:
@@ -440,8 +459,51 @@ class TestBuildMessages:
 
         # Verify that chat was built
         assert len(chat) == 2
-        # Token truncation should have been called for each element
-        assert mock_llm_inference.truncate_to_tokens.call_count >= 2
+        # Each element should have been tokenized once
+        assert mock_llm_inference.tokenize_with_offsets.call_count == 2
+
+
+class TestPrefixMessageCount:
+    """Test prefix_message_count for long-term context reuse."""
+
+    def test_prefix_defaults_to_zero(self, full_request_context, mock_llm_inference):
+        builder = ContextBuilder(full_request_context, mock_llm_inference)
+        builder.add_system_prompt("Write a story.")
+
+        assert builder.prefix_message_count == 0
+
+    def test_prefix_covers_long_term_elements(self, full_request_context, mock_llm_inference):
+        builder = ContextBuilder(full_request_context, mock_llm_inference)
+        builder.add_long_term_elements("Write a story.")
+        long_term_count = len(builder._elements)
+        builder.add_character_states()
+        builder.add_agent_instruction("Continue the story.")
+
+        assert builder.prefix_message_count == long_term_count
+        assert len(builder.build_messages()) > long_term_count
+
+    def test_no_prefix_when_long_term_elements_not_first(self, full_request_context, mock_llm_inference):
+        builder = ContextBuilder(full_request_context, mock_llm_inference)
+        builder.add_agent_instruction("Instruction first.")
+        builder.add_long_term_elements("Write a story.")
+
+        assert builder.prefix_message_count == 0
+
+    def test_copy_preserves_prefix(self, full_request_context, mock_llm_inference):
+        builder = ContextBuilder(full_request_context, mock_llm_inference)
+        builder.add_long_term_elements("Write a story.")
+
+        assert builder.copy().prefix_message_count == builder.prefix_message_count
+
+
+class TestStoryId:
+    """Test the story id used for replica affinity."""
+
+    def test_story_id_from_metadata(self, full_request_context, mock_llm_inference):
+        builder = ContextBuilder(full_request_context, mock_llm_inference)
+
+        assert builder.story_id == full_request_context.context_metadata.story_id
+        assert builder.copy().story_id == builder.story_id
 
 
 class TestBuildPrompt:
@@ -657,6 +719,585 @@ class TestSummarize:
         assert len(content.split()) < len(long_content.split())
 
 
+class TestSummaryCaching:
+    """Test memoization of summaries across requests."""
+
+    def test_unchanged_content_summarized_once(self, minimal_request_context, mock_llm_inference):
+        mock_llm_inference.model_id = "model.gguf"
+        cache = SummaryCache(capacity=8)
+        content = "Content to summarize " * 20
+
+        first = ContextBuilder(minimal_request_context, mock_llm_inference, cache)._summarize(content, 100)
+        second = ContextBuilder(minimal_request_context, mock_llm_inference, cache)._summarize(content, 100)
+
+        assert first == second
+        mock_llm_inference.generate.assert_called_once()
+        assert cache.hits == 1
+
+    def test_changed_inputs_resummarize(self, minimal_request_context, mock_llm_inference):
+        mock_llm_inference.model_id = "model.gguf"
+        cache = SummaryCache(capacity=8)
+        builder = ContextBuilder(minimal_request_context, mock_llm_inference, cache)
+        content = "Content to summarize " * 20
+
+        builder._summarize(content, 100)
+        builder._summarize(content + "More.", 100)
+        builder._summarize(content, 50)
+        builder._summarize(content, 100, SummarizationStrategy.SUMMARY_AND_ROLLING_WINDOW)
+        mock_llm_inference.model_id = "other.gguf"
+        builder._summarize(content, 100)
+
+        assert mock_llm_inference.generate.call_count == 5
+
+    def test_copy_shares_cache(self, minimal_request_context, mock_llm_inference):
+        mock_llm_inference.model_id = "model.gguf"
+        cache = SummaryCache(capacity=8)
+        builder = ContextBuilder(minimal_request_context, mock_llm_inference, cache)
+        content = "Content to summarize " * 20
+
+        builder._summarize(content, 100)
+        builder.copy()._summarize(content, 100)
+
+        mock_llm_inference.generate.assert_called_once()
+
+    def test_failures_are_not_cached(self, minimal_request_context, mock_llm_inference):
+        mock_llm_inference.model_id = "model.gguf"
+        cache = SummaryCache(capacity=8)
+        builder = ContextBuilder(minimal_request_context, mock_llm_inference, cache)
+        generate = mock_llm_inference.generate.side_effect
+        mock_llm_inference.generate.side_effect = RuntimeError("LLM error")
+
+        with pytest.raises(ValueError):
+            builder._summarize("Content to summarize", 100)
+        mock_llm_inference.generate.side_effect = generate
+
+        builder._summarize("Content to summarize", 100)
+        assert mock_llm_inference.generate.call_count == 2
+
+
+def make_chapter(number: int, words: int = 100, modified: datetime = datetime(2024, 1, 1)) -> ChapterDetails:
+    return ChapterDetails(
+        id=f"chapter-{number}",
+        number=number,
+        title=f"Title {number}",
+        content=" ".join([f"c{number}w{i}" for i in range(words)]),
+        created=datetime(2024, 1, 1),
+        last_modified=modified)
+
+
+def summarized_texts(mock_llm_inference):
+    """Contents passed to the summarization prompt, in call order."""
+    return [c[1]['prompt'].split("Content to summarize:")[1].split("Summary:")[0].strip()
+            for c in mock_llm_inference.generate.call_args_list]
+
+
+class TestChapterSummaries:
+    """Test per-chapter summaries for RECENT_STORY."""
+
+    @pytest.fixture
+    def cached_llm(self, mock_llm_inference):
+        mock_llm_inference.model_id = "model.gguf"
+        return mock_llm_inference
+
+    def build(self, request_context, model, cache, chapters, budget=400):
+        request_context.chapters = chapters
+        builder = ContextBuilder(request_context, model, cache)
+        builder.add_recent_story()
+        return builder._get_content(builder._elements[0], budget)
+
+    def test_fitting_story_is_literal(self, minimal_request_context, cached_llm):
+        content, token_count = self.build(minimal_request_context, cached_llm, SummaryCache(capacity=64),
+                                          [make_chapter(1), make_chapter(2)], budget=1000)
+
+        cached_llm.generate.assert_not_called()
+        assert "c1w0" in content and "c2w99" in content
+
+    def test_older_chapters_summarized_individually(self, minimal_request_context, cached_llm):
+        chapters = [make_chapter(n) for n in range(1, 5)]
+
+        content, token_count = self.build(minimal_request_context, cached_llm, SummaryCache(capacity=64), chapters)
+
+        # Chapters 3 and 4 fit the 60% window; 1 and 2 are summarized one by one
+        assert cached_llm.generate.call_count == 2
+        texts = summarized_texts(cached_llm)
+        assert texts[0].startswith("**Chapter 1: Title 1**") and "c2w0" not in texts[0]
+        assert texts[1].startswith("**Chapter 2: Title 2**")
+        assert "**Chapter 1: Title 1 (summary)**" in content
+        assert content.startswith("<RECENT_STORY>\n")
+        assert "c3w0" in content and "c4w99" in content
+        assert token_count <= 400
+
+    def test_new_chapter_costs_one_summary(self, minimal_request_context, cached_llm):
+        cache = SummaryCache(capacity=64)
+        self.build(minimal_request_context, cached_llm, cache, [make_chapter(n) for n in range(1, 5)])
+        cached_llm.generate.reset_mock()
+
+        self.build(minimal_request_context, cached_llm, cache, [make_chapter(n) for n in range(1, 6)])
+
+        # Only chapter 3 left the window
+        assert cached_llm.generate.call_count == 1
+        assert summarized_texts(cached_llm)[0].startswith("**Chapter 3: Title 3**")
+
+    def test_edited_chapter_is_resummarized(self, minimal_request_context, cached_llm):
+        cache = SummaryCache(capacity=64)
+        self.build(minimal_request_context, cached_llm, cache, [make_chapter(n) for n in range(1, 5)])
+        cached_llm.generate.reset_mock()
+
+        chapters = [make_chapter(n) for n in range(1, 5)]
+        chapters[0] = make_chapter(1, modified=datetime(2024, 2, 1))
+        chapters[0].content += " An edited ending."
+        self.build(minimal_request_context, cached_llm, cache, chapters)
+
+        assert cached_llm.generate.call_count == 1
+        assert summarized_texts(cached_llm)[0].startswith("**Chapter 1: Title 1**")
+
+    def test_oldest_summaries_fold_into_rolling_summary(self, minimal_request_context, cached_llm, monkeypatch):
+        monkeypatch.setattr("app.services.context_builder.ROLLING_SUMMARY_TOKENS", 30)
+        cache = SummaryCache(capacity=256)
+        chapters = [make_chapter(n) for n in range(1, 13)]
+
+        content, token_count = self.build(minimal_request_context, cached_llm, cache, chapters)
+
+        assert "**Story so far (Chapters 1-" in content
+        assert "**Chapter 10: Title 10 (summary)**" in content
+        assert token_count <= 400
+
+        # Adding a chapter reuses the cached chapter and rolling summaries
+        cached_llm.generate.reset_mock()
+        self.build(minimal_request_context, cached_llm, cache, chapters + [make_chapter(13)])
+        assert cached_llm.generate.call_count <= 2
+
+    def test_oversized_last_chapter(self, minimal_request_context, cached_llm):
+        content, token_count = self.build(minimal_request_context, cached_llm, SummaryCache(capacity=64),
+                                          [make_chapter(1), make_chapter(2, words=500)])
+
+        assert "**Chapter 2: Title 2 (summary)**" in content
+        assert token_count <= 400
+
+    def test_oversized_last_chapter_keeps_its_end(self, minimal_request_context, cached_llm):
+        chapter = make_chapter(2, words=0)
+        chapter.content = " ".join(["opening"] * 200 + ["closing"] * 300)
+
+        content, token_count = self.build(minimal_request_context, cached_llm, SummaryCache(capacity=64),
+                                          [make_chapter(1), chapter])
+
+        # The opening is summarized, in story order before the kept ending
+        partial = [text for text in summarized_texts(cached_llm) if "opening" in text]
+        assert len(partial) == 1 and chapter.content.startswith(partial[0])
+        summary_at = content.index("**Chapter 2: Title 2 (summary)**")
+        end_at = content.index("**Chapter 2: Title 2 (end)**")
+        assert summary_at < end_at
+        assert content.rstrip().endswith("closing\n</RECENT_STORY>")
+        assert "opening" not in content[end_at:]
+        assert token_count <= 400
+
+    def test_overflowing_summaries_keep_newest(self, minimal_request_context, cached_llm):
+        builder = ContextBuilder(minimal_request_context, cached_llm)
+        # A chapter summary and the partial summary of the newest chapter
+        summaries = [f"**Chapter {n} (summary)**\n" + " ".join([f"s{n}"] * 40) + "\n\n" for n in (1, 2)]
+
+        content, token_count = builder._fold_summaries([make_chapter(1)], summaries, 30)
+
+        assert token_count == 30
+        assert "s1" not in content and content.strip().endswith("s2")
+
+    def test_recent_story_summary_summarizes_every_chapter(self, minimal_request_context, cached_llm):
+        minimal_request_context.chapters = [make_chapter(n) for n in range(1, 4)]
+        builder = ContextBuilder(minimal_request_context, cached_llm, SummaryCache(capacity=64))
+        builder.add_recent_story_summary()
+
+        content, token_count = builder._get_content(builder._elements[0], 200)
+
+        assert cached_llm.generate.call_count == 3
+        assert "c3w99" not in content
+        assert "**Chapter 3: Title 3 (summary)**" in content
+
+
+class TestContextPlanning:
+    """Test planning the context window before building messages."""
+
+    def builder(self, request_context, model, n_ctx, worldbuilding_words, story_words, batched=False):
+        model.config = Mock(n_ctx=n_ctx)
+        model.batch_engine = None
+        request_context.worldbuilding = WorldbuildingInfo(content=" ".join(["world"] * worldbuilding_words))
+        request_context.chapters = [make_chapter(1, words=story_words)]
+        builder = ContextBuilder(request_context, model, SummaryCache(capacity=8), batched=batched)
+        builder.add_system_prompt("Write the next chapter.")
+        builder.add_worldbuilding()
+        builder.add_recent_story()
+        builder.add_agent_instruction("Continue the story.")
+        return builder
+
+    def test_oversized_element_kept_when_window_has_room(self, minimal_request_context, mock_llm_inference):
+        # Worldbuilding is over its nominal 2000-token budget but fits the window
+        builder = self.builder(minimal_request_context, mock_llm_inference, 8192,
+                               worldbuilding_words=2500, story_words=100)
+
+        messages = builder.build_messages(max_tokens=1000)
+
+        mock_llm_inference.generate.assert_not_called()
+        assert builder.last_plan.over_budget == []
+        assert messages[1]['content'].count("world") == 2500
+
+    def test_only_overflowing_element_summarized(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference, 4096,
+                               worldbuilding_words=100, story_words=3000)
+
+        messages = builder.build_messages(max_tokens=1000)
+
+        plan = builder.last_plan
+        assert [e.tag for e in plan.over_budget] == ['RECENT_STORY']
+        assert plan.generation_reserve == 1000
+        assert plan.planned_tokens <= plan.prompt_budget
+        # Part of the chapter is summarized, the rest kept verbatim
+        assert mock_llm_inference.generate.call_count == 1
+        assert "**Chapter 1: Title 1 (summary)**" in messages[2]['content']
+
+    def test_window_limited_by_batch_sequences(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference, 8192,
+                               worldbuilding_words=10, story_words=10, batched=True)
+        mock_llm_inference.batch_engine = Mock(n_ctx_per_sequence=2048)
+
+        assert builder.plan_context(max_tokens=500).context_window == 2048
+        assert builder.copy().plan_context(max_tokens=500).context_window == 2048
+
+    def test_unbatched_window_ignores_batch_sequences(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference, 8192,
+                               worldbuilding_words=10, story_words=10)
+        mock_llm_inference.batch_engine = Mock(n_ctx_per_sequence=2048)
+
+        assert builder.plan_context(max_tokens=500).context_window == 8192
+
+    def test_elements_measured_once(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference, 4096,
+                               worldbuilding_words=100, story_words=100)
+
+        builder.build_messages()
+
+        assert mock_llm_inference.tokenize_with_offsets.call_count == 4
+
+    def test_literal_context_too_large(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference, 4096,
+                               worldbuilding_words=10, story_words=10)
+        builder.add_agent_instruction(" ".join(["instruction"] * 4000))
+
+        with pytest.raises(ValueError, match="Context does not fit"):
+            builder.build_messages(max_tokens=500)
+
+
+
+class TestCopy:
+    """Test forking builders without copying their elements."""
+
+    def builder(self, request_context, model):
+        model.config = Mock(n_ctx=4096)
+        model.batch_engine = None
+        request_context.worldbuilding = WorldbuildingInfo(content=" ".join(["world"] * 4000))
+        builder = ContextBuilder(request_context, model, SummaryCache(capacity=8))
+        builder.add_system_prompt("Write the next chapter.")
+        builder.add_worldbuilding()
+        return builder
+
+    def test_copy_shares_elements(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference)
+
+        fork = builder.copy()
+        fork.add_agent_instruction("Continue the story.")
+
+        assert fork._elements[:2] == builder._elements
+        assert fork._elements[0] is builder._elements[0]
+        assert len(builder._elements) == 2
+
+    def test_elements_are_immutable(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference)
+
+        with pytest.raises(FrozenInstanceError):
+            builder._elements[1].content = "changed"
+
+    def test_copies_reuse_measurements(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference)
+        builder.build_messages(max_tokens=500)
+
+        for instruction in ("First draft.", "Second draft, with feedback."):
+            fork = builder.copy()
+            fork.add_agent_instruction(instruction)
+            fork.build_messages(max_tokens=500)
+
+        # Two base elements, then only each fork's instruction
+        assert mock_llm_inference.tokenize_with_offsets.call_count == 4
+
+    def test_copies_reuse_summaries(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference)
+
+        messages = []
+        for instruction in ("Short.", " ".join(["longer"] * 200)):
+            fork = builder.copy()
+            fork.add_agent_instruction(instruction)
+            messages.append(fork.build_messages(max_tokens=500))
+
+        # The worldbuilding budget shrank, but its summary still fits
+        mock_llm_inference.generate.assert_called_once()
+        assert messages[0][1] == messages[1][1]
+
+    def test_summary_rewritten_when_it_no_longer_fits(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference)
+
+        for instruction in ("Short.", " ".join(["longer"] * 3000)):
+            fork = builder.copy()
+            fork.add_agent_instruction(instruction)
+            fork.build_messages(max_tokens=500)
+
+        assert mock_llm_inference.generate.call_count == 2
+
+
+
+def keyword_embed(texts):
+    """Embed texts as counts of a few keywords."""
+    return np.array([[text.lower().count(word) for word in ("dragon", "castle", "sea")] + [0.1] for text in texts])
+
+
+class TestRelevanceRankedStory:
+    """Test filling RECENT_STORY with the passages most relevant to the target chapter."""
+
+    @pytest.fixture(autouse=True)
+    def retrieval_enabled(self, monkeypatch):
+        monkeypatch.setattr(settings, 'CONTEXT_RETRIEVAL', True)
+
+    def builder(self, request_context, model, index):
+        model.config = Mock(n_ctx=2048)
+        model.batch_engine = None
+        filler = "\n".join(" ".join(["sailing"] * 40) for _ in range(20))
+        request_context.chapters = [
+            make_chapter(1, words=0),
+            make_chapter(2, words=0),
+            make_chapter(3, words=0),
+        ]
+        request_context.chapters[0].content = f"{filler}\nThe dragon sleeps under the old castle.\n{filler}"
+        request_context.chapters[1].content = filler
+        request_context.chapters[2].content = (
+            "A dragon shadow crossed the castle walls.\n" + filler + "\nThe crew reached the harbour at dawn.")
+        target = ChapterDetails(
+            id="chapter-4", number=4, title="The Dragon Wakes", content="",
+            plot_point="The dragon attacks the castle", key_plot_items=["Castle walls fall"],
+            created=datetime(2024, 1, 1), last_modified=datetime(2024, 1, 1))
+        builder = ContextBuilder(request_context, model, SummaryCache(capacity=8), passage_index=index)
+        builder.add_system_prompt("Write the next chapter.")
+        builder.add_recent_story(for_chapter=target)
+        return builder
+
+    def test_relevant_passage_kept_without_summaries(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference,
+                               PassageIndex(keyword_embed, passage_words=40))
+
+        messages = builder.build_messages(max_tokens=500)
+
+        assert builder._elements[1].summarization_strategy == SummarizationStrategy.RELEVANCE_RANKED
+        assert builder._elements[1].query == "The Dragon Wakes\nThe dragon attacks the castle\nCastle walls fall"
+        mock_llm_inference.generate.assert_not_called()
+        story = messages[1]['content']
+        assert "**Chapter 1: Title 1 (excerpts)**" in story
+        assert "\nThe dragon sleeps under the old castle.\n" in story
+        assert "**Chapter 3: Title 3 (end)**" in story
+        assert mock_llm_inference.count_tokens(story) <= builder.last_plan.entries[1].allocated
+
+    def test_newest_chapter_ending_kept(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference,
+                               PassageIndex(keyword_embed, passage_words=40))
+
+        story = builder.build_messages(max_tokens=500)[1]['content']
+
+        # The ending is the window; the relevant opening is an excerpt before it
+        window_at = story.index("**Chapter 3: Title 3 (end)**")
+        assert story.rstrip().endswith("The crew reached the harbour at dawn.\n</RECENT_STORY>")
+        assert "A dragon shadow crossed the castle walls." not in story[window_at:]
+        assert story.index("A dragon shadow crossed the castle walls.") < window_at
+
+    def test_excerpts_in_story_order(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference,
+                               PassageIndex(keyword_embed, passage_words=40))
+
+        story = builder.build_messages(max_tokens=500)[1]['content']
+
+        headings = re.findall(r"\*\*Chapter (\d+): Title \d+ \((excerpts|end)\)\*\*", story)
+        assert [int(n) for n, _ in headings] == sorted(int(n) for n, _ in headings)
+
+    def test_disabled_by_default(self, minimal_request_context, mock_llm_inference, monkeypatch):
+        monkeypatch.setattr(settings, 'CONTEXT_RETRIEVAL', False)
+        builder = self.builder(minimal_request_context, mock_llm_inference,
+                               PassageIndex(keyword_embed, passage_words=40))
+
+        assert builder._elements[1].summarization_strategy == SummarizationStrategy.SUMMARY_AND_ROLLING_WINDOW
+
+    def test_falls_back_to_summaries_without_index(self, minimal_request_context, mock_llm_inference):
+        builder = self.builder(minimal_request_context, mock_llm_inference, None)
+
+        with patch('app.services.context_builder.get_passage_index', return_value=None):
+            messages = builder.build_messages(max_tokens=500)
+
+        assert mock_llm_inference.generate.called
+        assert "(summary)**" in messages[1]['content']
+
+
+
+class TestCharacterFilter:
+    """Test full profiles only for the characters involved in the target chapter."""
+
+    @pytest.fixture(autouse=True)
+    def filter_enabled(self, monkeypatch):
+        monkeypatch.setattr(settings, 'CONTEXT_CHARACTER_FILTER', True)
+
+    @pytest.fixture
+    def request_context(self, minimal_request_context):
+        minimal_request_context.characters = [
+            CharacterDetails(id="chen", name="Detective Sarah Chen", basic_bio="A cynical detective. Hates rain.",
+                             personality="Determined", last_modified=datetime(2024, 1, 1)),
+            CharacterDetails(id="webb", name="Marcus Webb", basic_bio="A dockside smuggler.",
+                             personality="Charming", last_modified=datetime(2024, 1, 1)),
+            CharacterDetails(id="tom", name="Old Tom", basic_bio="A fisherman who sees everything.\nHe drinks.",
+                             personality="Quiet", last_modified=datetime(2024, 1, 1)),
+        ]
+        return minimal_request_context
+
+    @staticmethod
+    def chapter(title="The Docks", plot_point=None, number=2):
+        return ChapterDetails(id=f"chapter-{number}", number=number, title=title, content="", plot_point=plot_point,
+                              created=datetime(2024, 1, 1), last_modified=datetime(2024, 1, 1))
+
+    def test_full_profiles_only_for_involved(self, request_context, mock_llm_inference):
+        builder = ContextBuilder(request_context, mock_llm_inference)
+
+        builder.add_characters(for_chapter=self.chapter(plot_point="Chen confronts Webb at the docks"))
+
+        content = builder._elements[0].content
+        assert "- Name: Detective Sarah Chen\n  Basic Bio:" in content
+        assert "- Name: Marcus Webb\n  Basic Bio:" in content
+        assert "- Name: Old Tom (not in this chapter): A fisherman who sees everything.\n" in content
+        assert "Quiet" not in content
+        selection = builder.character_selection
+        assert selection.involved == ["Detective Sarah Chen", "Marcus Webb"]
+        assert selection.stubbed == ["Old Tom"]
+        assert selection.saved_tokens > 0
+        assert selection.to_dict()["saved_tokens"] == selection.full_tokens - selection.tokens
+
+    def test_name_parts_matched_as_written(self, request_context, mock_llm_inference):
+        request_context.characters += [
+            CharacterDetails(id="mcgregor", name="Angus McGregor", basic_bio="The harbour master.",
+                             personality="Gruff", last_modified=datetime(2024, 1, 1)),
+            CharacterDetails(id="devries", name="Anna DeVries", basic_bio="A journalist.",
+                             personality="Curious", last_modified=datetime(2024, 1, 1)),
+        ]
+        builder = ContextBuilder(request_context, mock_llm_inference)
+
+        builder.add_characters(for_chapter=self.chapter(plot_point="McGregor hides the ledger from DeVries"))
+
+        assert builder.character_selection.involved == ["Angus McGregor", "Anna DeVries"]
+
+    def test_outline_involved_characters(self, request_context, mock_llm_inference):
+        request_context.story_outline = StoryOutline(content="", outline_items=[
+            OutlineItem(id="ch1", type="chapter", title="Arrival", description="", order=0),
+            OutlineItem(id="ch2", type="chapter", title="At the harbour", description="Night falls.", order=1),
+            OutlineItem(id="sc1", type="scene", title="Nets", description="", order=2, parent_id="ch2",
+                        involved_characters=["tom"]),
+        ])
+        builder = ContextBuilder(request_context, mock_llm_inference)
+
+        # Matched by position: the chapter's title differs from the outline item's
+        builder.add_characters(for_chapter=self.chapter(title="The Docks", number=2))
+
+        assert builder.character_selection.involved == ["Old Tom"]
+
+    def test_title_words_do_not_identify_characters(self, request_context, mock_llm_inference):
+        builder = ContextBuilder(request_context, mock_llm_inference)
+
+        builder.add_characters(for_chapter=self.chapter(plot_point="The detective waits for the old boat"))
+
+        # Nobody identified, so every profile is kept
+        assert builder.character_selection is None
+        assert builder._elements[0].content.count("Basic Bio:") == 3
+
+    def test_disabled(self, request_context, mock_llm_inference, monkeypatch):
+        monkeypatch.setattr(settings, 'CONTEXT_CHARACTER_FILTER', False)
+        builder = ContextBuilder(request_context, mock_llm_inference)
+
+        builder.add_long_term_elements("System", for_chapter=self.chapter(plot_point="Chen confronts Webb"))
+
+        assert builder.character_selection is None
+        assert "Quiet" in builder._elements[1].content
+
+
+class TestParallelSummaries:
+    """Test summarizing independent over-budget elements at the same time."""
+
+    @pytest.fixture
+    def pool_executor(self):
+        executor = InferenceExecutor(num_workers=3)
+        yield executor
+        executor.shutdown()
+
+    def builder(self, request_context, model):
+        model.config = Mock(n_ctx=4096)
+        model.batch_engine = None
+        request_context.worldbuilding = WorldbuildingInfo(content=" ".join(["world"] * 3000))
+        request_context.chapters = [make_chapter(n, words=1000) for n in (1, 2, 3)]
+        builder = ContextBuilder(request_context, model, SummaryCache(capacity=8))
+        builder.add_system_prompt("Write the next chapter.")
+        builder.add_worldbuilding()
+        builder.add_recent_story_summary()
+        builder.add_agent_instruction("Continue the story.")
+        return builder
+
+    @staticmethod
+    def track_concurrency(model):
+        """Make generate slow and record the most calls seen running at once."""
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+        generate = model.generate.side_effect
+
+        def slow_generate(prompt: str, **kwargs) -> str:
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return generate(prompt, **kwargs)
+
+        model.generate.side_effect = slow_generate
+        return peak
+
+    def test_summaries_run_concurrently_on_pool(self, minimal_request_context, mock_llm_inference, pool_executor):
+        builder = self.builder(minimal_request_context, mock_llm_inference)
+        peak = self.track_concurrency(mock_llm_inference)
+
+        messages = asyncio.run(pool_executor.run(builder.build_messages, max_tokens=500))
+
+        assert [e.tag for e in builder.last_plan.over_budget] == ['WORLD_BUILDING', 'RECENT_STORY_SUMMARY']
+        assert mock_llm_inference.generate.call_count == 4
+        assert peak[0] >= 2
+        # Messages stay in element order
+        assert messages[1]['content'].startswith('<WORLD_BUILDING>')
+        assert messages[2]['content'].startswith('<RECENT_STORY_SUMMARY>')
+        assert messages[2]['content'].index("Title 1 (summary)") < messages[2]['content'].index("Title 3 (summary)")
+
+    def test_same_messages_as_sequential(self, minimal_request_context, mock_llm_inference, pool_executor):
+        builder = self.builder(minimal_request_context, mock_llm_inference)
+
+        sequential = builder.build_messages(max_tokens=500)
+        parallel = asyncio.run(pool_executor.run(builder.build_messages, max_tokens=500))
+
+        assert parallel == sequential
+
+    def test_concurrency_setting(self, minimal_request_context, mock_llm_inference, pool_executor, monkeypatch):
+        monkeypatch.setattr(settings, 'CONTEXT_SUMMARY_CONCURRENCY', 1)
+        builder = self.builder(minimal_request_context, mock_llm_inference)
+        peak = self.track_concurrency(mock_llm_inference)
+
+        asyncio.run(pool_executor.run(builder.build_messages, max_tokens=500))
+
+        assert peak[0] == 1
+
+
 class TestEdgeCases:
     """Test edge cases and error conditions."""
 
@@ -718,3 +1359,49 @@ class TestEdgeCases:
 
         # Should not add any elements
         assert len(builder._elements) == 0
+
+
+class TestSummaryModel:
+    """Test summarizing with a model other than the one the context is built for."""
+
+    def test_summary_model_writes_summary(self, minimal_request_context, mock_llm_inference):
+        summary_model = MagicMock()
+        summary_model.model_id = "small.gguf"
+        summary_model.generate.return_value = "short summary"
+        cache = SummaryCache(capacity=10)
+        builder = ContextBuilder(minimal_request_context, mock_llm_inference, cache, summary_model=summary_model)
+
+        summary, token_count = builder._summarize("A long passage that does not fit", 10)
+
+        assert summary == "short summary"
+        mock_llm_inference.generate.assert_not_called()
+        # Budgets are in tokens of the model the messages are for
+        mock_llm_inference.count_tokens.assert_called_once_with("short summary")
+        assert token_count == 2
+        assert cache.get(make_summary_key("A long passage that does not fit", 10, 'summarized', "small.gguf"))
+
+    def test_summary_executor_runs_generation(self, minimal_request_context, mock_llm_inference):
+        summary_model = MagicMock()
+        summary_executor = MagicMock()
+        summary_executor.run_sync.return_value = "short summary"
+        builder = ContextBuilder(
+            minimal_request_context, mock_llm_inference,
+            summary_model=summary_model, summary_executor=summary_executor)
+
+        assert builder.copy()._summarize("A long passage", 10)[0] == "short summary"
+        assert summary_executor.run_sync.call_args.args == (summary_model.generate,)
+        summary_model.generate.assert_not_called()
+
+    def test_routed_summarize_task(self, minimal_request_context, mock_llm_inference):
+        registry = get_model_registry()
+        summary_model = MagicMock()
+        summary_executor = MagicMock()
+        registry.register("small", summary_model, summary_executor)
+        registry.set_route(LLMTask.SUMMARIZE, "small")
+        try:
+            builder = ContextBuilder(minimal_request_context, mock_llm_inference)
+        finally:
+            registry.shutdown()
+
+        assert builder._summary_model is summary_model
+        assert builder._summary_executor is summary_executor
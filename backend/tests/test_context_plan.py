@@ -0,0 +1,105 @@
+"""
+Tests for planning the token budget of a prompt.
+"""
+import logging
+
+import pytest
+
+from app.services.context_plan import MESSAGE_OVERHEAD_TOKENS, ContextPlanEntry, plan_context
+
+
+def entry(tag, tokens, budget=1000, reducible=True):
+    return ContextPlanEntry(tag=tag, role='user', strategy='summarized' if reducible else 'literal',
+                            tokens=tokens, budget=budget, reducible=reducible)
+
+
+def window_for(prompt_budget, entries, reserve=0):
+    return prompt_budget + reserve + MESSAGE_OVERHEAD_TOKENS * len(entries)
+
+
+class TestPlanContext:
+    """Test allocating the context window between elements"""
+
+    def test_everything_fits(self):
+        entries = [entry('SYSTEM', 100, reducible=False), entry('WORLD_BUILDING', 3000, budget=2000),
+                   entry('RECENT_STORY', 500, budget=15000)]
+
+        plan = plan_context(entries, window_for(4000, entries), max_tokens=0)
+
+        # WORLD_BUILDING exceeds its nominal budget but the window has room
+        assert plan.over_budget == []
+        assert [e.allocated for e in entries] == [100, 3000, 500]
+        assert plan.planned_tokens == plan.measured_tokens == 3600
+
+    def test_unused_budget_flows_to_overflowing_element(self):
+        entries = [entry('WORLD_BUILDING', 100, budget=2000), entry('CHARACTERS', 100, budget=2000),
+                   entry('RECENT_STORY', 5000, budget=2000)]
+
+        plan = plan_context(entries, window_for(3000, entries), max_tokens=0)
+
+        assert [e.tag for e in plan.over_budget] == ['RECENT_STORY']
+        assert entries[2].allocated == 2800
+
+    def test_overflowing_elements_share_by_budget(self):
+        entries = [entry('SYSTEM', 400, reducible=False), entry('WORLD_BUILDING', 5000, budget=1000),
+                   entry('RECENT_STORY', 9000, budget=3000), entry('CHARACTERS', 200, budget=1000)]
+
+        plan = plan_context(entries, window_for(4600, entries), max_tokens=0)
+
+        assert [e.tag for e in plan.over_budget] == ['WORLD_BUILDING', 'RECENT_STORY']
+        assert entries[1].allocated == 1000
+        assert entries[2].allocated == 3000
+        assert plan.planned_tokens <= plan.prompt_budget
+
+    def test_generation_reserved(self):
+        entries = [entry('RECENT_STORY', 3000)]
+
+        plan = plan_context(entries, 4096, max_tokens=1500)
+
+        assert plan.generation_reserve == 1500
+        assert entries[0].allocated == 4096 - 1500 - MESSAGE_OVERHEAD_TOKENS
+
+    def test_large_reserve_kept_when_prompt_fits(self):
+        entries = [entry('RECENT_STORY', 100)]
+
+        plan = plan_context(entries, 4096, max_tokens=3500)
+
+        assert plan.generation_reserve == 3500
+        assert not plan.reserve_clamped
+        assert plan.over_budget == []
+
+    def test_reserve_clamped_with_warning(self, caplog):
+        entries = [entry('SYSTEM', 500, reducible=False), entry('RECENT_STORY', 3000)]
+
+        with caplog.at_level(logging.WARNING, logger='app.services.context_plan'):
+            plan = plan_context(entries, 4096, max_tokens=4000)
+
+        # The prompt keeps half the window rather than being reduced to nothing
+        assert plan.generation_reserve == 2048
+        assert plan.reserve_clamped
+        assert "max_tokens 4000 does not fit" in caplog.text
+        assert "2048 of 4000 requested reserved for generation" in str(plan)
+        assert plan.to_dict()["max_tokens"] == 4000
+        assert entries[1].allocated == 2048 - 500 - 2 * MESSAGE_OVERHEAD_TOKENS
+
+    def test_clamped_reserve_uses_room_left_by_prompt(self):
+        entries = [entry('RECENT_STORY', 1000)]
+
+        plan = plan_context(entries, 4096, max_tokens=4000)
+
+        assert plan.generation_reserve == 4096 - 1000 - MESSAGE_OVERHEAD_TOKENS
+        assert plan.over_budget == []
+
+    def test_literal_overflow(self):
+        entries = [entry('SYSTEM', 3000, reducible=False), entry('INSTRUCTION', 2000, reducible=False)]
+
+        with pytest.raises(ValueError, match="Context does not fit"):
+            plan_context(entries, 4096, max_tokens=0)
+
+    def test_plan_is_loggable(self):
+        entries = [entry('RECENT_STORY', 5000)]
+
+        plan = plan_context(entries, 4096, max_tokens=1000)
+
+        assert "reduced: RECENT_STORY 5000->" in str(plan)
+        assert plan.to_dict()["entries"][0]["over_budget"] is True
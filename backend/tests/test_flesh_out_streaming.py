@@ -181,7 +181,7 @@ class TestFleshOutStreamingEndpoint:
         # Result should be the last message
         assert message_types[-1] == 'result'
         
-        # Status messages should come before result
+        # Status and partial text messages should come before result
         result_index = message_types.index('result')
         for i in range(result_index):
-            assert message_types[i] == 'status'
+            assert message_types[i] in ('status', 'partial')
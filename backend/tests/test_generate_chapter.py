@@ -166,3 +166,48 @@ class TestGenerateChapterEndpoint:
             assert 'chapterText' in result_data
             assert 'wordCount' in result_data
             assert 'metadata' in result_data
+
+    def test_generate_chapter_streams_partial_text(self, client, sample_generate_chapter_request):
+        """Test that generated text is streamed as partial events before the result"""
+        response = client.post("/api/v1/generate-chapter", json=sample_generate_chapter_request)
+
+        messages = [json.loads(line[6:]) for line in response.text.split('\n') if line.startswith('data: ')]
+        message_types = [msg['type'] for msg in messages]
+        partials = [msg for msg in messages if msg['type'] == 'partial']
+
+        assert len(partials) > 0
+        assert message_types.index('partial') < message_types.index('result')
+        result = messages[message_types.index('result')]['data']
+        assert ''.join(p['content'] for p in partials).strip() == result['chapterText']
+        assert partials[-1]['token_count'] >= len(partials)
+
+
+class TestGenerateChapterCharacterFilter:
+    """Test reporting the characters left out of a chapter's context"""
+
+    def test_savings_reported_in_status_event(self, client, sample_generate_chapter_request, monkeypatch):
+        from datetime import datetime
+        from app.core.config import settings
+
+        monkeypatch.setattr(settings, 'CONTEXT_CHARACTER_FILTER', True)
+        request_context = sample_generate_chapter_request["request_context"]
+        request_context["chapters"][0]["plot_point"] = "Sarah Chen discovers a crucial clue at the crime scene"
+        request_context["characters"].append({
+            "id": "john_doe",
+            "name": "John Doe",
+            "basic_bio": "A mysterious figure who appears at crime scenes.",
+            "personality": "Enigmatic and imposing, with secretive motives",
+            "last_modified": datetime.now().isoformat()
+        })
+
+        response = client.post("/api/v1/generate-chapter", json=sample_generate_chapter_request)
+
+        messages = [json.loads(line[6:]) for line in response.text.split('\n') if line.startswith('data: ')]
+        selections = [m for m in messages if m['type'] == 'status' and (m.get('data') or {}).get('stubbed_characters')]
+        assert len(selections) == 1
+        data = selections[0]['data']
+        assert data['involved_characters'] == ["Detective Sarah Chen"]
+        assert data['stubbed_characters'] == ["John Doe"]
+        assert data['saved_tokens'] > 0
+        assert "1 of 2 characters" in selections[0]['message']
+        assert messages[-1]['type'] == 'result'
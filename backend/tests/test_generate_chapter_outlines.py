@@ -3,8 +3,12 @@ Tests for chapter outline generation endpoint.
 """
 import pytest
 import json
+from unittest.mock import patch
 from fastapi.testclient import TestClient
 
+from app.api.v1.endpoints import generate_chapter_outlines
+from app.services.inference_executor import JobPriority
+
 
 class TestGenerateChapterOutlineEndpoint:
     """Test chapter outline generation endpoint"""
@@ -363,3 +367,70 @@ class TestGenerateChapterOutlineEndpoint:
             # Should not contain placeholder text
             assert "TODO" not in item["title"]
             assert "TODO" not in item["description"]
+
+
+def parse_sse_messages(response):
+    return [json.loads(line[6:]) for line in response.text.split('\n') if line.startswith('data: ')]
+
+
+class TestGenerateChapterOutlineStreamEndpoint:
+    """Test the SSE chapter outline endpoint"""
+
+    def test_chapters_streamed_before_result(self, client, sample_chapter_outline_request):
+        """Test that each chapter is sent as soon as it is generated"""
+        response = client.post("/api/v1/generate-chapter-outlines/stream", json=sample_chapter_outline_request)
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "text/event-stream; charset=utf-8"
+        messages = parse_sse_messages(response)
+        types = [msg['type'] for msg in messages]
+        assert types[-1] == 'result'
+
+        items = [msg for msg in messages if msg['type'] == 'item']
+        result = messages[-1]['data']
+        assert [item['path'] for item in items] == [['outline_items', i] for i in range(len(result['outline_items']))]
+        assert [item['value']['id'] for item in items] == [item['id'] for item in result['outline_items']]
+        assert result['context_metadata']['generated_chapters'] == len(items)
+
+    def test_streamed_chapter_matches_non_streaming(self, client, sample_chapter_outline_request):
+        """Test that streamed outline items match the non-streaming endpoint"""
+        streamed = parse_sse_messages(
+            client.post("/api/v1/generate-chapter-outlines/stream", json=sample_chapter_outline_request))[-1]['data']
+        blocking = client.post("/api/v1/generate-chapter-outlines", json=sample_chapter_outline_request).json()
+
+        def without_metadata(items):
+            return [{k: v for k, v in item.items() if k != 'metadata'} for item in items]
+
+        assert without_metadata(streamed['outline_items']) == without_metadata(blocking['outline_items'])
+
+    @pytest.mark.parametrize("path", ["/api/v1/generate-chapter-outlines", "/api/v1/generate-chapter-outlines/stream"])
+    def test_admitted_as_batch(self, client, sample_chapter_outline_request, path):
+        """Test that both outline endpoints queue behind interactive and normal requests"""
+        with patch.object(generate_chapter_outlines, 'admit_request',
+                          wraps=generate_chapter_outlines.admit_request) as mock_admit:
+            client.post(path, json=sample_chapter_outline_request)
+
+        assert mock_admit.call_args.args[1] == JobPriority.BATCH
+
+    def test_empty_story_outline(self, client, sample_chapter_outline_request):
+        """Test that an empty story outline is rejected before streaming"""
+        request = sample_chapter_outline_request.copy()
+        request["request_context"]["story_outline"]["content"] = "   "
+
+        response = client.post("/api/v1/generate-chapter-outlines/stream", json=request)
+
+        assert response.status_code == 400
+
+    def test_truncated_output_reports_error(self, client, sample_chapter_outline_request, mock_llm):
+        """Test that output cut off by max_tokens ends with an error after the complete chapters"""
+        def chat_completion_stream(messages, **kwargs):
+            yield '[{"title": "The Discovery", "description": "A clue.", '
+            yield '"key_plot_items": ["Clue found"], "involved_characters": []}, '
+            yield '{"title": "Following'
+
+        mock_llm.chat_completion_stream.side_effect = chat_completion_stream
+        messages = parse_sse_messages(
+            client.post("/api/v1/generate-chapter-outlines/stream", json=sample_chapter_outline_request))
+
+        assert [msg['type'] for msg in messages if msg['type'] != 'status'] == ['item', 'error']
+        assert messages[-1]['message'].startswith("Incomplete chapter outline")
@@ -0,0 +1,68 @@
+"""
+Tests for the cache of JSON-schema grammars used for structured output.
+"""
+from typing import List
+from unittest.mock import patch
+
+import pytest
+from pydantic import BaseModel
+
+from app.models.generation_models import STRUCTURED_OUTPUT_MODELS, CharacterFeedback, RaterFeedback
+from app.services.grammar_cache import LLAMA_CPP_AVAILABLE, GrammarCache
+
+pytestmark = pytest.mark.skipif(not LLAMA_CPP_AVAILABLE, reason="Requires llama-cpp-python to be installed")
+
+
+class Verdict(BaseModel):
+    passed: bool
+    notes: List[str]
+
+
+class TestGrammarCache:
+    """Test building each response model's grammar once"""
+
+    def test_grammar_built_once(self):
+        cache = GrammarCache()
+
+        first = cache.get(Verdict)
+        second = cache.get(Verdict)
+
+        assert first is second
+        assert cache.get_stats() == {"grammars": 1, "hits": 1, "misses": 1}
+
+    def test_grammar_constrains_fields(self):
+        grammar = GrammarCache().get(Verdict)
+
+        assert 'passed-kv ::= "\\"passed\\""' in grammar._grammar
+        assert 'notes-kv ::= "\\"notes\\""' in grammar._grammar
+
+    def test_character_feedback_requires_every_list(self):
+        grammar = GrammarCache().get(CharacterFeedback)._grammar
+
+        root = next(line for line in grammar.splitlines() if line.startswith('root ::='))
+        for field in CharacterFeedback.model_fields:
+            assert f"{field}-kv" in root
+        assert "?" not in root
+
+    def test_priority_limited_to_levels(self):
+        grammar = GrammarCache().get(RaterFeedback)._grammar
+
+        assert 'RaterSuggestion-priority ::= "\\"high\\"" | "\\"medium\\"" | "\\"low\\""' in grammar
+
+    def test_warm_builds_structured_output_models(self):
+        cache = GrammarCache()
+
+        assert cache.warm(STRUCTURED_OUTPUT_MODELS) == len(STRUCTURED_OUTPUT_MODELS)
+        assert cache.warm(STRUCTURED_OUTPUT_MODELS) == 0
+
+        cache.get(STRUCTURED_OUTPUT_MODELS[0])
+        assert cache.get_stats()["misses"] == 0
+
+    def test_unconvertible_schema(self):
+        cache = GrammarCache()
+
+        with patch('app.services.grammar_cache.LlamaGrammar.from_json_schema', side_effect=RuntimeError("bad")):
+            with pytest.raises(ValueError, match="Verdict"):
+                cache.get(Verdict)
+            assert cache.warm([Verdict]) == 0
+        assert len(cache) == 0
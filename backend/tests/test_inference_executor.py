@@ -0,0 +1,564 @@
+"""
+Tests for the InferenceExecutor that runs blocking LLM calls off the event loop.
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.services.inference_executor import (
+    InferenceExecutor,
+    JobPriority,
+    QueueFullError,
+    current_executor,
+    current_job_cancelled,
+    current_worker_index,
+    preemption_requested,
+    serve_preempting_jobs,
+)
+
+
+@pytest.fixture
+def executor():
+    executor = InferenceExecutor()
+    yield executor
+    executor.shutdown()
+
+
+class TestInferenceExecutorRun:
+    """Test single-result jobs"""
+
+    @pytest.mark.asyncio
+    async def test_run_returns_result(self, executor):
+        result = await executor.run(lambda a, b=0: a + b, 2, b=3)
+        assert result == 5
+
+    @pytest.mark.asyncio
+    async def test_run_executes_on_worker_thread(self, executor):
+        thread_name = await executor.run(lambda: threading.current_thread().name)
+        assert thread_name.startswith("llm-inference-")
+
+    @pytest.mark.asyncio
+    async def test_run_propagates_exceptions(self, executor):
+        def fail():
+            raise RuntimeError("Generation failed: boom")
+
+        with pytest.raises(RuntimeError, match="boom"):
+            await executor.run(fail)
+
+    @pytest.mark.asyncio
+    async def test_event_loop_not_blocked(self, executor):
+        """A long blocking call must not stall other coroutines"""
+        ticks = []
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(executor.run(time.sleep, 0.2), ticker())
+
+        assert len(ticks) == 5
+        assert ticks[-1] - ticks[0] < 0.2
+
+    @pytest.mark.asyncio
+    async def test_concurrent_jobs_are_serialized(self, executor):
+        active = []
+        max_active = []
+        lock = threading.Lock()
+
+        def job():
+            with lock:
+                active.append(1)
+                max_active.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.pop()
+
+        await asyncio.gather(*[executor.run(job) for _ in range(4)])
+
+        assert max(max_active) == 1
+
+
+class TestInferenceExecutorStream:
+    """Test streaming jobs"""
+
+    @pytest.mark.asyncio
+    async def test_stream_yields_items_in_order(self, executor):
+        def tokens():
+            yield "Once "
+            yield "upon "
+            yield "a time"
+
+        result = [t async for t in executor.stream(tokens)]
+
+        assert result == ["Once ", "upon ", "a time"]
+
+    @pytest.mark.asyncio
+    async def test_stream_forwards_arguments(self, executor):
+        def tokens(messages, max_tokens=0):
+            yield messages[0]["content"]
+            yield str(max_tokens)
+
+        result = [t async for t in executor.stream(tokens, [{"role": "user", "content": "Hi"}], max_tokens=7)]
+
+        assert result == ["Hi", "7"]
+
+    @pytest.mark.asyncio
+    async def test_stream_propagates_exceptions(self, executor):
+        def tokens():
+            yield "partial"
+            raise RuntimeError("Streaming chat completion failed")
+
+        received = []
+        with pytest.raises(RuntimeError, match="Streaming chat completion failed"):
+            async for t in executor.stream(tokens):
+                received.append(t)
+
+        assert received == ["partial"]
+
+    @pytest.mark.asyncio
+    async def test_closing_stream_stops_generation(self, executor):
+        produced = []
+        closed = threading.Event()
+
+        def tokens():
+            try:
+                for i in range(1000):
+                    produced.append(i)
+                    time.sleep(0.001)
+                    yield i
+            finally:
+                closed.set()
+
+        stream = executor.stream(tokens)
+        async for t in stream:
+            if t >= 2:
+                break
+        await stream.aclose()
+
+        assert await asyncio.get_running_loop().run_in_executor(None, closed.wait, 2)
+        assert len(produced) < 1000
+
+        # The worker is free again for the next job
+        assert await executor.run(lambda: "next") == "next"
+
+    @pytest.mark.asyncio
+    async def test_job_sees_cancellation(self, executor):
+        """Code running in a job can poll whether its caller went away"""
+        observed = []
+        started = threading.Event()
+
+        def tokens():
+            observed.append(current_job_cancelled())
+            yield "first"
+            started.set()
+            # A slow model step; the caller disconnects meanwhile
+            time.sleep(0.1)
+            observed.append(current_job_cancelled())
+            yield "second"
+
+        stream = executor.stream(tokens)
+        assert await stream.__anext__() == "first"
+        await stream.aclose()
+        await executor.run(lambda: None)
+
+        assert observed == [False, True]
+        assert current_job_cancelled() is False
+
+
+class TestInferenceExecutorWorkers:
+    """Test worker identity and utilization"""
+
+    @pytest.mark.asyncio
+    async def test_worker_index(self):
+        executor = InferenceExecutor(num_workers=2)
+        try:
+            index = await executor.run(current_worker_index)
+        finally:
+            executor.shutdown()
+
+        assert index in (0, 1)
+        assert current_worker_index() is None
+
+    @pytest.mark.asyncio
+    async def test_utilization_stats(self, executor):
+        await executor.run(time.sleep, 0.05)
+
+        stats = executor.get_stats()
+
+        assert len(stats) == 1
+        assert stats[0]["jobs"] == 1
+        assert stats[0]["busy"] is False
+        assert stats[0]["busy_seconds"] >= 0.05
+        assert 0 < stats[0]["utilization"] <= 1
+
+
+class TestInferenceExecutorAffinity:
+    """Test story-affinity routing across workers"""
+
+    @pytest.fixture
+    def pool_executor(self):
+        executor = InferenceExecutor(num_workers=3)
+        yield executor
+        executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_same_key_stays_on_worker(self, pool_executor):
+        workers = [await pool_executor.run(current_worker_index, affinity="story-1") for _ in range(5)]
+
+        assert len(set(workers)) == 1
+        stats = pool_executor.get_affinity_stats()
+        assert stats["affinity_new"] == 1
+        assert stats["affinity_hits"] == 4
+        assert stats["affinity_hit_rate"] == 1.0
+
+    @pytest.mark.asyncio
+    async def test_busy_worker_falls_back(self, pool_executor):
+        home = await pool_executor.run(current_worker_index, affinity="story-1")
+        release = threading.Event()
+
+        def hold():
+            release.wait(timeout=5)
+            return current_worker_index()
+
+        held = asyncio.ensure_future(pool_executor.run(hold, affinity="story-1"))
+        await asyncio.sleep(0.05)
+        other = await pool_executor.run(current_worker_index, affinity="story-1")
+        release.set()
+
+        assert await held == home
+        assert other != home
+        stats = pool_executor.get_affinity_stats()
+        assert stats["affinity_hits"] == 1
+        assert stats["affinity_misses"] == 1
+        assert stats["affinity_hit_rate"] == 0.5
+
+        # The worker that served the fallback now holds the story's prefix
+        assert await pool_executor.run(current_worker_index, affinity="story-1") == other
+
+    @pytest.mark.asyncio
+    async def test_keys_spread_over_idle_workers(self, pool_executor):
+        barrier = threading.Barrier(3)
+
+        def job():
+            barrier.wait(timeout=5)
+            return current_worker_index()
+
+        workers = await asyncio.gather(*[pool_executor.run(job, affinity=f"story-{i}") for i in range(3)])
+
+        assert sorted(workers) == [0, 1, 2]
+
+    @pytest.mark.asyncio
+    async def test_affinity_not_forwarded(self, executor):
+        def job(**kwargs):
+            return kwargs
+
+        assert await executor.run(job, affinity="story-1", a=1) == {"a": 1}
+        assert [x async for x in executor.stream(lambda **kw: iter([kw]), affinity="story-1")] == [{}]
+
+
+class TestInferenceExecutorPriority:
+    """Test priority ordering and admission control"""
+
+    @pytest.fixture
+    def bounded_executor(self):
+        executor = InferenceExecutor(max_pending=2)
+        yield executor
+        executor.shutdown()
+
+    async def _block_worker(self, executor):
+        """Occupy the single worker until the returned event is set."""
+        release = threading.Event()
+        started = threading.Event()
+
+        def hold():
+            started.set()
+            release.wait(timeout=5)
+
+        blocker = asyncio.ensure_future(executor.run(hold))
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        return release, blocker
+
+    async def _wait_pending(self, executor, count):
+        while executor.pending_jobs < count:
+            await asyncio.sleep(0.01)
+
+    @pytest.mark.asyncio
+    async def test_higher_priority_runs_first(self, executor):
+        release, blocker = await self._block_worker(executor)
+        order = []
+
+        jobs = []
+        for name, priority in [("batch", JobPriority.BATCH), ("normal", JobPriority.NORMAL),
+                               ("interactive", JobPriority.INTERACTIVE), ("normal-2", JobPriority.NORMAL)]:
+            ticket = executor.admit(priority)
+            jobs.append(asyncio.ensure_future(executor.run(order.append, name, ticket=ticket)))
+            await self._wait_pending(executor, len(jobs))
+
+        release.set()
+        await asyncio.gather(blocker, *jobs)
+
+        assert order == ["interactive", "normal", "normal-2", "batch"]
+
+    @pytest.mark.asyncio
+    async def test_request_jobs_keep_their_place(self, executor):
+        release, blocker = await self._block_worker(executor)
+        order = []
+
+        first = executor.admit(JobPriority.NORMAL)
+        second = executor.admit(JobPriority.NORMAL)
+        later = asyncio.ensure_future(executor.run(order.append, "second", ticket=second))
+        await self._wait_pending(executor, 1)
+        # A follow-up job of an earlier request goes ahead of later requests
+        follow_up = asyncio.ensure_future(executor.run(order.append, "first", ticket=first))
+        await self._wait_pending(executor, 2)
+
+        release.set()
+        await asyncio.gather(blocker, later, follow_up)
+
+        assert order == ["first", "second"]
+
+    @pytest.mark.asyncio
+    async def test_queue_position(self, executor):
+        release, blocker = await self._block_worker(executor)
+        normal = executor.admit(JobPriority.NORMAL)
+        interactive = executor.admit(JobPriority.INTERACTIVE)
+
+        job = asyncio.ensure_future(executor.run(lambda: None, ticket=normal))
+        await self._wait_pending(executor, 1)
+        assert executor.queue_position(normal) == 1
+        assert executor.queue_position(interactive) is None
+
+        urgent = asyncio.ensure_future(executor.run(lambda: None, ticket=interactive))
+        await self._wait_pending(executor, 2)
+        assert executor.queue_position(interactive) == 1
+        assert executor.queue_position(normal) == 2
+
+        release.set()
+        await asyncio.gather(blocker, job, urgent)
+        assert executor.queue_position(normal) is None
+
+    @pytest.mark.asyncio
+    async def test_admit_rejects_when_queue_full(self, bounded_executor):
+        release, blocker = await self._block_worker(bounded_executor)
+        jobs = [asyncio.ensure_future(bounded_executor.run(lambda: None)) for _ in range(2)]
+        await self._wait_pending(bounded_executor, 2)
+
+        with pytest.raises(QueueFullError) as exc_info:
+            bounded_executor.admit(JobPriority.INTERACTIVE)
+        assert exc_info.value.pending == 2
+        assert exc_info.value.retry_after >= 1
+
+        release.set()
+        await asyncio.gather(blocker, *jobs)
+        assert bounded_executor.admit(JobPriority.INTERACTIVE) is not None
+
+    def test_unbounded_queue_always_admits(self, executor):
+        tickets = [executor.admit(JobPriority.BATCH) for _ in range(100)]
+        assert len({t.seq for t in tickets}) == 100
+
+
+class TestInferenceExecutorPreemption:
+    """Test pausing a low-priority stream for higher-priority jobs"""
+
+    def preemptible_stream(self, started, order, tokens=50):
+        """Stream that yields to waiting jobs between tokens, like chat_completion_stream."""
+        def stream():
+            started.set()
+            for i in range(tokens):
+                if preemption_requested():
+                    order.append("paused")
+                    serve_preempting_jobs()
+                    order.append("resumed")
+                time.sleep(0.005)
+                yield i
+        return stream
+
+    @pytest.mark.asyncio
+    async def test_interactive_job_preempts_batch_stream(self, executor):
+        started = threading.Event()
+        order = []
+        batch = executor.admit(JobPriority.BATCH)
+
+        async def consume():
+            return [x async for x in executor.stream(self.preemptible_stream(started, order), ticket=batch)]
+
+        stream_task = asyncio.ensure_future(consume())
+        while not started.is_set():
+            await asyncio.sleep(0.005)
+
+        interactive = executor.admit(JobPriority.INTERACTIVE)
+        result = await executor.run(lambda: order.append("interactive") or "chat", ticket=interactive)
+
+        assert result == "chat"
+        assert order == ["paused", "interactive", "resumed"]
+        assert await stream_task == list(range(50))
+        assert executor.get_stats()[0]["preemptions"] == 1
+
+    @pytest.mark.asyncio
+    async def test_same_priority_does_not_preempt(self, executor):
+        started = threading.Event()
+        order = []
+
+        stream_task = asyncio.ensure_future(
+            self._collect(executor, self.preemptible_stream(started, order, tokens=10), JobPriority.NORMAL))
+        while not started.is_set():
+            await asyncio.sleep(0.005)
+        await executor.run(lambda: order.append("normal"), ticket=executor.admit(JobPriority.NORMAL))
+
+        await stream_task
+        assert order == ["normal"]
+        assert executor.get_stats()[0]["preemptions"] == 0
+
+    @pytest.mark.asyncio
+    async def test_preemption_disabled(self):
+        executor = InferenceExecutor(preemption=False)
+        try:
+            started = threading.Event()
+            order = []
+            stream_task = asyncio.ensure_future(
+                self._collect(executor, self.preemptible_stream(started, order, tokens=10), JobPriority.BATCH))
+            while not started.is_set():
+                await asyncio.sleep(0.005)
+            await executor.run(lambda: order.append("interactive"), ticket=executor.admit(JobPriority.INTERACTIVE))
+
+            await stream_task
+            assert order == ["interactive"]
+        finally:
+            executor.shutdown()
+
+    def test_outside_worker(self):
+        assert preemption_requested() is False
+        assert serve_preempting_jobs() == 0
+
+    @staticmethod
+    async def _collect(executor, func, priority):
+        return [x async for x in executor.stream(func, ticket=executor.admit(priority))]
+
+
+class TestInferenceExecutorRunSync:
+    """Test calls from one executor's job onto another executor"""
+
+    @pytest.mark.asyncio
+    async def test_runs_on_other_executor_worker(self, executor):
+        other = InferenceExecutor()
+        try:
+            # Both executors name their thread llm-inference-0, so compare thread ids
+            inner_thread = await executor.run(lambda: other.run_sync(threading.get_ident))
+            outer_thread = await executor.run(threading.get_ident)
+
+            assert inner_thread != outer_thread
+            assert inner_thread in {worker.ident for worker in other._workers}
+        finally:
+            other.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_keeps_calling_job_priority(self, executor):
+        other = InferenceExecutor()
+        try:
+            ticket = executor.admit(JobPriority.INTERACTIVE)
+            seen = []
+            original_submit = other._submit
+
+            def submit(*args, **kwargs):
+                seen.append(kwargs["ticket"])
+                return original_submit(*args, **kwargs)
+
+            other._submit = submit
+            await executor.run(lambda: other.run_sync(lambda: None), ticket=ticket)
+
+            assert seen == [ticket]
+        finally:
+            other.shutdown()
+
+    def test_outside_worker_calls_directly(self, executor):
+        assert executor.run_sync(threading.get_ident) == threading.get_ident()
+
+    @pytest.mark.asyncio
+    async def test_own_worker_calls_directly(self, executor):
+        """A single-worker executor must not wait on itself"""
+        assert await asyncio.wait_for(executor.run(lambda: executor.run_sync(lambda: 42)), timeout=5) == 42
+
+
+class TestInferenceExecutorRunAllSync:
+    """Test fanning independent calls out over an executor's workers"""
+
+    @pytest.fixture
+    def pool_executor(self):
+        executor = InferenceExecutor(num_workers=3)
+        yield executor
+        executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_calls_spread_over_free_workers(self, pool_executor):
+        barrier = threading.Barrier(3)
+
+        def call(n):
+            barrier.wait(timeout=5)
+            return n, current_worker_index()
+
+        results = await asyncio.wait_for(
+            pool_executor.run(lambda: pool_executor.run_all_sync(call, [{"n": i} for i in range(3)])),
+            timeout=10)
+
+        assert [n for n, _ in results] == [0, 1, 2]
+        assert sorted(worker for _, worker in results) == [0, 1, 2]
+
+    @pytest.mark.asyncio
+    async def test_calling_worker_finishes_calls_when_others_busy(self, pool_executor):
+        release = threading.Event()
+        held = [asyncio.ensure_future(pool_executor.run(release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+
+        try:
+            results = await asyncio.wait_for(
+                pool_executor.run(lambda: pool_executor.run_all_sync(
+                    lambda n: (n, current_worker_index()), [{"n": i} for i in range(4)])),
+                timeout=5)
+        finally:
+            release.set()
+            await asyncio.gather(*held)
+
+        assert [n for n, _ in results] == [0, 1, 2, 3]
+        assert len({worker for _, worker in results}) == 1
+
+    @pytest.mark.asyncio
+    async def test_max_concurrency(self, pool_executor):
+        results = await pool_executor.run(lambda: pool_executor.run_all_sync(
+            lambda: threading.get_ident(), [{}] * 3, max_concurrency=1))
+
+        assert len(set(results)) == 1
+
+    @pytest.mark.asyncio
+    async def test_error_raised_after_every_call_finished(self, pool_executor):
+        finished = []
+
+        def call(n):
+            if n == 0:
+                raise ValueError("summary failed")
+            time.sleep(0.05)
+            finished.append(n)
+
+        with pytest.raises(ValueError, match="summary failed"):
+            await pool_executor.run(lambda: pool_executor.run_all_sync(call, [{"n": i} for i in range(3)]))
+
+        assert sorted(finished) == [1, 2]
+
+    @pytest.mark.asyncio
+    async def test_single_worker_runs_calls_in_order(self, executor):
+        results = await asyncio.wait_for(
+            executor.run(lambda: executor.run_all_sync(lambda n: n * 2, [{"n": 1}, {"n": 2}])),
+            timeout=5)
+
+        assert results == [2, 4]
+
+    def test_outside_worker(self, pool_executor):
+        assert pool_executor.run_all_sync(lambda: threading.get_ident(), [{}] * 2) == [threading.get_ident()] * 2
+        assert current_executor() is None
+
+    @pytest.mark.asyncio
+    async def test_current_executor(self, executor):
+        assert await executor.run(current_executor) is executor
@@ -0,0 +1,246 @@
+"""
+Tests for the continuous batching engine.
+
+The llama.cpp calls are replaced by a scripted model: each request's params
+carry the token ids its sampler will produce, so scheduling, stop handling and
+cancellation can be tested without loading a GGUF file.
+"""
+import asyncio
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.services.inference_executor import JobPriority, QueueFullError, QueueTicket
+from app.services.llm_batch import BatchEngine, _stop_boundary
+
+EOG = 0
+VOCAB = {1: "Hel", 2: "lo", 3: " wor", 4: "ld", 5: " EN", 6: "D", 7: "!"}
+
+
+class ScriptedBatchEngine(BatchEngine):
+    """BatchEngine whose model replays the token ids given in each request's params."""
+
+    def __init__(self, max_sequences=4, n_batch=16, step_delay=0.0, n_ctx=64, max_pending=0):
+        self.n_batch = n_batch
+        self.step_delay = step_delay
+        self.batches = []
+        self.released = []
+        llm = MagicMock()
+        llm.config.n_ctx = n_ctx
+        llm.config.max_tokens = 100
+        llm._tokenize_chat.side_effect = lambda messages, add_generation_prompt: [
+            100 + i for i, _ in enumerate(messages[0]["content"].split())]
+        super().__init__(llm, max_sequences, max_pending=max_pending)
+
+    def _open_context(self):
+        self._n_batch = self.n_batch
+
+    def _create_sampler(self, params):
+        return iter(params["script"])
+
+    def _batch_reset(self):
+        self._current = []
+
+    def _batch_add(self, token, pos, seq_id, logits):
+        self._current.append((token, pos, seq_id, logits))
+        return len(self._current) - 1
+
+    def _decode(self):
+        time.sleep(self.step_delay)
+        self.batches.append(list(self._current))
+
+    def _sample(self, request, index):
+        return next(request.sampler, EOG)
+
+    def _token_piece(self, token):
+        return VOCAB[token].encode("utf-8")
+
+    def _is_eog(self, token):
+        return token == EOG
+
+    def _release(self, seq_id):
+        self.released.append(seq_id)
+
+
+def prompt(words=3):
+    return [{"role": "user", "content": " ".join(["word"] * words)}]
+
+
+async def collect(engine, script, words=3, **params):
+    return "".join([piece async for piece in engine.stream(prompt(words), script=script, **params)])
+
+
+async def wait_for_pending(engine, count):
+    for _ in range(500):
+        if engine.pending == count:
+            return
+        await asyncio.sleep(0.002)
+    assert engine.pending == count
+
+
+@pytest.fixture
+def engine():
+    engine = ScriptedBatchEngine()
+    yield engine
+    engine.shutdown()
+
+
+class TestStopBoundary:
+    """Test holding back text that may be the start of a stop string"""
+
+    def test_no_stops(self):
+        assert _stop_boundary("Hello", []) == (5, False)
+
+    def test_stop_found(self):
+        assert _stop_boundary("Hello END more", ["END"]) == (6, True)
+
+    def test_partial_stop_held_back(self):
+        assert _stop_boundary("Hello EN", ["END"]) == (6, False)
+
+    def test_earliest_stop_wins(self):
+        assert _stop_boundary("a STOP b END", ["END", "STOP"]) == (2, True)
+
+
+class TestBatchEngine:
+    """Test scheduling sequences into shared decode steps"""
+
+    @pytest.mark.asyncio
+    async def test_generates_until_end_of_generation(self, engine):
+        assert await collect(engine, [1, 2, 3, 4]) == "Hello world"
+
+        # Prompt step, then one step per generated token fed back
+        assert [len(b) for b in engine.batches] == [3, 1, 1, 1, 1]
+        assert engine.released == [0]
+        stats = engine.get_stats()
+        assert stats["batch_completed"] == 1
+        assert stats["batch_generated_tokens"] == 4
+
+    @pytest.mark.asyncio
+    async def test_tokens_fed_back_at_next_position(self, engine):
+        await collect(engine, [1, 2], words=3)
+
+        prompt_step, first, second = engine.batches
+        assert [(pos, logits) for _, pos, _, logits in prompt_step] == [(0, False), (1, False), (2, True)]
+        assert first == [(1, 3, 0, True)]
+        assert second == [(2, 4, 0, True)]
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_steps(self):
+        engine = ScriptedBatchEngine(step_delay=0.005)
+        try:
+            results = await asyncio.gather(*[collect(engine, [1, 2, 3, 4, 7] * 4) for _ in range(3)])
+
+            assert results == ["Hello world!" * 4] * 3
+            assert max(len({seq for _, _, seq, _ in b}) for b in engine.batches) == 3
+            assert engine.get_stats()["batch_mean_sequences"] > 1
+        finally:
+            engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_waits_for_free_sequence(self):
+        engine = ScriptedBatchEngine(max_sequences=1, step_delay=0.002)
+        try:
+            results = await asyncio.gather(collect(engine, [1, 2]), collect(engine, [3, 4]))
+
+            assert results == ["Hello", " world"]
+            assert all(len({seq for _, _, seq, _ in b}) == 1 for b in engine.batches)
+        finally:
+            engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_long_prompt_prefilled_in_chunks(self):
+        engine = ScriptedBatchEngine(n_batch=4)
+        try:
+            assert await collect(engine, [1, 2], words=10) == "Hello"
+            assert [len(b) for b in engine.batches] == [4, 4, 2, 1, 1]
+        finally:
+            engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_stop_string(self, engine):
+        assert await collect(engine, [1, 2, 5, 6, 3, 4], stop=["END"]) == "Hello "
+
+    @pytest.mark.asyncio
+    async def test_partial_stop_is_sent_at_end(self, engine):
+        assert await collect(engine, [1, 2, 5], stop=["END"]) == "Hello EN"
+
+    @pytest.mark.asyncio
+    async def test_max_tokens(self, engine):
+        assert await collect(engine, [1, 2, 3, 4], max_tokens=2) == "Hello"
+
+    @pytest.mark.asyncio
+    async def test_prompt_too_long(self):
+        engine = ScriptedBatchEngine(n_ctx=8)
+        try:
+            with pytest.raises(RuntimeError, match="does not fit"):
+                await collect(engine, [1], words=10)
+            # The sequence slot is free again
+            assert await collect(engine, [1, 2]) == "Hello"
+        finally:
+            engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_closed_stream_leaves_batch(self):
+        engine = ScriptedBatchEngine(max_sequences=1, step_delay=0.002)
+        try:
+            stream = engine.stream(prompt(), script=[1] * 1000)
+            assert await stream.__anext__() == "Hel"
+            await stream.aclose()
+
+            # The abandoned sequence is dropped, so the next request gets its slot
+            assert await asyncio.wait_for(collect(engine, [1, 2]), timeout=5) == "Hello"
+            assert engine.get_stats()["batch_generated_tokens"] < 1000
+        finally:
+            engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_waiting_requests_served_in_ticket_order(self):
+        engine = ScriptedBatchEngine(max_sequences=1, step_delay=0.002)
+        finished = []
+
+        async def run(script, ticket):
+            stream = engine.stream(prompt(), ticket=ticket, script=script)
+            text = "".join([piece async for piece in stream])
+            finished.append(text)
+
+        try:
+            running = engine.stream(prompt(), script=[1] * 1000)
+            assert await running.__anext__() == "Hel"
+            batch = asyncio.create_task(run([3], QueueTicket(JobPriority.BATCH, 1)))
+            normal = asyncio.create_task(run([4], QueueTicket(JobPriority.NORMAL, 3)))
+            interactive = asyncio.create_task(run([2], QueueTicket(JobPriority.INTERACTIVE, 2)))
+            await wait_for_pending(engine, 3)
+            await running.aclose()
+
+            await asyncio.wait_for(asyncio.gather(batch, normal, interactive), timeout=5)
+            assert finished == ["lo", "ld", " wor"]
+        finally:
+            engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_admission_bounded_by_max_pending(self):
+        engine = ScriptedBatchEngine(max_sequences=1, step_delay=0.002, max_pending=1)
+        try:
+            engine.check_admission()
+            running = engine.stream(prompt(), script=[1] * 1000)
+            assert await running.__anext__() == "Hel"
+            waiting = asyncio.create_task(collect(engine, [1, 2]))
+            await wait_for_pending(engine, 1)
+
+            with pytest.raises(QueueFullError) as exc_info:
+                engine.check_admission()
+            assert exc_info.value.pending == 1
+            assert exc_info.value.retry_after >= 1
+
+            await running.aclose()
+            assert await asyncio.wait_for(waiting, timeout=5) == "Hello"
+            engine.check_admission()
+        finally:
+            engine.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_shutdown_rejects_new_requests(self, engine):
+        engine.shutdown()
+        with pytest.raises(RuntimeError, match="shut down"):
+            await collect(engine, [1])
@@ -2,6 +2,9 @@
 Tests for LLM Inference module.
 Note: These tests don't require an actual model file - they test configuration and error handling.
 """
+import ctypes
+from types import SimpleNamespace
+
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 from pathlib import Path
@@ -14,6 +17,9 @@ from app.services.llm_inference import (
     LLAMA_CPP_AVAILABLE
 )
 from app.core.config import Settings
+from app.services.grammar_cache import get_grammar_cache
+from app.services.llm_state_cache import load_llama_state, state_size_bytes
+from pydantic import BaseModel
 
 
 class TestLLMInferenceConfig:
@@ -81,6 +87,18 @@ class TestLLMInferenceConfig:
         mock_settings.LLM_VERBOSE = False
         mock_settings.LLM_VERBOSE_GENERATION = False
         mock_settings.LLM_CACHE_CAPACITY = 1024**2
+        mock_settings.LLM_PREFIX_CACHE_CAPACITY = 1024**2
+        mock_settings.LLM_STATE_CACHE_DIR = None
+        mock_settings.LLM_STATE_CACHE_SIZE = 10 * 1024**3
+        mock_settings.LLM_TOKEN_CACHE_CAPACITY = 1_000_000
+        mock_settings.LLM_POOL_SIZE = 1
+        mock_settings.LLM_THREADS_PER_REPLICA = None
+        mock_settings.LLM_BATCH_MAX_SEQUENCES = 1
+        mock_settings.LLM_MAX_QUEUE_DEPTH = 32
+        mock_settings.LLM_BATCH_CTX_PER_SEQUENCE = 2048
+        mock_settings.LLM_SPECULATIVE_DECODING = "off"
+        mock_settings.LLM_DRAFT_MODEL_PATH = None
+        mock_settings.LLM_DRAFT_TOKENS = 10
 
         config = LLMInferenceConfig.from_settings(mock_settings)
 
@@ -92,6 +110,9 @@ class TestLLMInferenceConfig:
         assert config.top_p == 0.95
         assert config.max_tokens == 2048
         assert config.cache_capacity == 1024**2
+        assert config.prefix_cache_capacity == 1024**2
+        assert config.batch_max_pending == 32
+        assert config.batch_ctx_per_sequence == 2048
 
     def test_config_from_settings_minimal(self):
         """Test config from settings with only MODEL_PATH"""
@@ -108,6 +129,18 @@ class TestLLMInferenceConfig:
         mock_settings.LLM_VERBOSE = False
         mock_settings.LLM_VERBOSE_GENERATION = False
         mock_settings.LLM_CACHE_CAPACITY = 2 * 1024**3
+        mock_settings.LLM_PREFIX_CACHE_CAPACITY = 1024**3
+        mock_settings.LLM_STATE_CACHE_DIR = None
+        mock_settings.LLM_STATE_CACHE_SIZE = 10 * 1024**3
+        mock_settings.LLM_TOKEN_CACHE_CAPACITY = 1_000_000
+        mock_settings.LLM_POOL_SIZE = 1
+        mock_settings.LLM_THREADS_PER_REPLICA = None
+        mock_settings.LLM_BATCH_MAX_SEQUENCES = 1
+        mock_settings.LLM_MAX_QUEUE_DEPTH = 32
+        mock_settings.LLM_BATCH_CTX_PER_SEQUENCE = 2048
+        mock_settings.LLM_SPECULATIVE_DECODING = "off"
+        mock_settings.LLM_DRAFT_MODEL_PATH = None
+        mock_settings.LLM_DRAFT_TOKENS = 10
 
         config = LLMInferenceConfig.from_settings(mock_settings)
 
@@ -141,6 +174,18 @@ class TestLLMInferenceConfig:
         mock_settings.LLM_VERBOSE = True
         mock_settings.LLM_VERBOSE_GENERATION = False
         mock_settings.LLM_CACHE_CAPACITY = 2 * 1024**3
+        mock_settings.LLM_PREFIX_CACHE_CAPACITY = 1024**3
+        mock_settings.LLM_STATE_CACHE_DIR = None
+        mock_settings.LLM_STATE_CACHE_SIZE = 10 * 1024**3
+        mock_settings.LLM_TOKEN_CACHE_CAPACITY = 1_000_000
+        mock_settings.LLM_POOL_SIZE = 1
+        mock_settings.LLM_THREADS_PER_REPLICA = None
+        mock_settings.LLM_BATCH_MAX_SEQUENCES = 1
+        mock_settings.LLM_MAX_QUEUE_DEPTH = 32
+        mock_settings.LLM_BATCH_CTX_PER_SEQUENCE = 2048
+        mock_settings.LLM_SPECULATIVE_DECODING = "off"
+        mock_settings.LLM_DRAFT_MODEL_PATH = None
+        mock_settings.LLM_DRAFT_TOKENS = 10
 
         config = LLMInferenceConfig.from_settings(mock_settings)
 
@@ -161,6 +206,18 @@ class TestLLMInferenceConfig:
         mock_settings.LLM_VERBOSE = False
         mock_settings.LLM_VERBOSE_GENERATION = True
         mock_settings.LLM_CACHE_CAPACITY = 2 * 1024**3
+        mock_settings.LLM_PREFIX_CACHE_CAPACITY = 1024**3
+        mock_settings.LLM_STATE_CACHE_DIR = None
+        mock_settings.LLM_STATE_CACHE_SIZE = 10 * 1024**3
+        mock_settings.LLM_TOKEN_CACHE_CAPACITY = 1_000_000
+        mock_settings.LLM_POOL_SIZE = 1
+        mock_settings.LLM_THREADS_PER_REPLICA = None
+        mock_settings.LLM_BATCH_MAX_SEQUENCES = 1
+        mock_settings.LLM_MAX_QUEUE_DEPTH = 32
+        mock_settings.LLM_BATCH_CTX_PER_SEQUENCE = 2048
+        mock_settings.LLM_SPECULATIVE_DECODING = "off"
+        mock_settings.LLM_DRAFT_MODEL_PATH = None
+        mock_settings.LLM_DRAFT_TOKENS = 10
 
         config = LLMInferenceConfig.from_settings(mock_settings)
 
@@ -291,6 +348,160 @@ class TestLLMInferenceGeneration:
         assert response == "Chat response"
         mock_model.create_chat_completion.assert_called_once()
 
+    @patch('app.services.llm_inference.Llama')
+    @patch('pathlib.Path.exists')
+    def test_structured_output_uses_cached_grammar(self, mock_exists, mock_llama):
+        """Test that JSON-schema output passes the cached grammar instead of a schema"""
+        if not LLAMA_CPP_AVAILABLE:
+            pytest.skip("Requires llama-cpp-python to be installed")
+
+        mock_exists.return_value = True
+        mock_model = MagicMock()
+        mock_model.create_chat_completion.return_value = {
+            'choices': [{'message': {'content': '{"ok": true}'}}]
+        }
+        mock_model.return_value = {'choices': [{'text': '{"ok": true}'}]}
+        mock_llama.return_value = mock_model
+        llm = LLMInference(LLMInferenceConfig(model_path="/test/model.gguf"))
+
+        class Answer(BaseModel):
+            ok: bool
+
+        llm.chat_completion([{"role": "user", "content": "Hello"}], json_schema_class=Answer)
+        llm.generate("Hello", json_schema_class=Answer)
+
+        chat_kwargs = mock_model.create_chat_completion.call_args.kwargs
+        assert "response_format" not in chat_kwargs
+        assert chat_kwargs["grammar"] is get_grammar_cache().get(Answer)
+        assert mock_model.call_args.kwargs["grammar"] is chat_kwargs["grammar"]
+
+
+class TestTokenCaching:
+    """Test caching of token ids in encode"""
+
+    def make_llm(self, token_cache_capacity):
+        if not LLAMA_CPP_AVAILABLE:
+            pytest.skip("Requires llama-cpp-python to be installed")
+        mock_model = MagicMock()
+        mock_model.tokenize.side_effect = lambda text: list(text)
+        with patch('app.services.llm_inference.Llama', return_value=mock_model), \
+                patch('pathlib.Path.exists', return_value=True):
+            return LLMInference(LLMInferenceConfig(
+                model_path="/test/model.gguf", token_cache_capacity=token_cache_capacity))
+
+    def test_unchanged_text_tokenized_once(self):
+        llm = self.make_llm(1000)
+
+        assert llm.count_tokens("Once upon a time") == 16
+        assert llm.encode("Once upon a time") == list(b"Once upon a time")
+        assert llm.truncate_to_tokens("Once upon a time", 100).tail_token_count == 16
+
+        assert llm.model.tokenize.call_count == 1
+        stats = llm.get_stats()
+        assert stats["token_cache_hits"] == 2
+        assert stats["token_cache_misses"] == 1
+        assert stats["token_cache_tokens"] == 16
+
+    def test_changed_text_is_tokenized(self):
+        llm = self.make_llm(1000)
+
+        llm.count_tokens("Once upon a time")
+        llm.count_tokens("Once upon a time.")
+
+        assert llm.model.tokenize.call_count == 2
+
+    def test_disabled(self):
+        llm = self.make_llm(0)
+
+        llm.count_tokens("Once upon a time")
+        llm.count_tokens("Once upon a time")
+
+        assert llm.model.tokenize.call_count == 2
+        assert "token_cache_hits" not in llm.get_stats()
+
+
+class PieceTokenizer:
+    """Tokenizer over a fixed list of byte pieces, mimicking llama tokenize/detokenize"""
+
+    BOS = 0
+
+    def __init__(self, pieces):
+        self.pieces = [b''] + pieces
+
+    def tokenize(self, text):
+        return list(range(len(self.pieces)))
+
+    def detokenize(self, tokens):
+        return b''.join(self.pieces[t] for t in tokens)
+
+
+class TestTokenizedText:
+    """Test single-pass truncation with a token-to-character offset map"""
+
+    def make_llm(self, tokenizer):
+        if not LLAMA_CPP_AVAILABLE:
+            pytest.skip("Requires llama-cpp-python to be installed")
+        with patch('app.services.llm_inference.Llama', return_value=tokenizer), \
+                patch('pathlib.Path.exists', return_value=True):
+            return LLMInference(LLMInferenceConfig(model_path="/test/model.gguf"))
+
+    def test_offsets_follow_pieces(self):
+        llm = self.make_llm(PieceTokenizer([b'Once', b' upon', b' a', b' time']))
+
+        tokenized = llm.tokenize_with_offsets("Once upon a time")
+
+        # BOS adds no characters
+        assert tokenized.token_count == 5
+        assert tokenized.offsets == [0, 0, 4, 9, 11, 16]
+
+    def test_truncate_slices_text(self):
+        llm = self.make_llm(PieceTokenizer([b'Once', b' upon', b' a', b' time']))
+        tokenized = llm.tokenize_with_offsets("Once upon a time")
+
+        full = tokenized.truncate(100)
+        assert full.head is None and full.tail == "Once upon a time" and full.tail_token_count == 5
+
+        cut = tokenized.truncate(3)
+        assert cut.tail == "Once upon"
+        assert cut.head == " a time"
+        assert cut.tail_token_count == 3
+
+    def test_truncate_start_keeps_end(self):
+        llm = self.make_llm(PieceTokenizer([b'Once', b' upon', b' a', b' time']))
+        tokenized = llm.tokenize_with_offsets("Once upon a time")
+
+        full = tokenized.truncate_start(100)
+        assert full.head is None and full.tail == "Once upon a time" and full.tail_token_count == 5
+
+        cut = tokenized.truncate_start(2)
+        assert cut.tail == " a time"
+        assert cut.head == "Once upon"
+        assert cut.tail_token_count == 2
+
+    def test_sentencepiece_leading_space(self):
+        llm = self.make_llm(PieceTokenizer([b' Once', b' upon']))
+
+        assert llm.tokenize_with_offsets("Once upon").offsets == [0, 0, 4, 9]
+
+    def test_split_multibyte_character(self):
+        # "café" with the two bytes of "é" in separate tokens
+        llm = self.make_llm(PieceTokenizer([b'caf', b'\xc3', b'\xa9', b'!']))
+
+        tokenized = llm.tokenize_with_offsets("café!")
+
+        assert tokenized.offsets == [0, 0, 3, 3, 4, 5]
+        assert tokenized.truncate(3).tail == "caf"
+        assert tokenized.truncate(4).tail == "café"
+
+    def test_truncate_to_tokens_encodes_once(self):
+        tokenizer = MagicMock(wraps=PieceTokenizer([b'Once', b' upon', b' a', b' time']))
+        llm = self.make_llm(tokenizer)
+
+        truncation = llm.truncate_to_tokens("Once upon a time", 2)
+
+        assert truncation.tail == "Once"
+        assert tokenizer.tokenize.call_count == 1
+
 
 class TestSingletonPattern:
     """Test global singleton instance management"""
@@ -368,3 +579,451 @@ class TestErrorHandling:
 
         with pytest.raises(RuntimeError, match="Chat completion failed"):
             llm.chat_completion(messages)
+
+
+class FakeLlamaContext:
+    """Stand-in for the llama.cpp context read and written by llama_state_get_data/set_data."""
+
+    def __init__(self):
+        self.data = b''
+        self.loads = 0
+
+
+def fake_state_get_size(ctx):
+    return len(ctx.data)
+
+
+def fake_state_get_data(ctx, dst, size):
+    ctypes.memmove(dst, ctx.data, len(ctx.data))
+    return len(ctx.data)
+
+
+def fake_state_set_data(ctx, src, size):
+    ctx.data = bytes(src)[:size]
+    ctx.loads += 1
+    return size
+
+
+@pytest.fixture
+def fake_llama_state():
+    """Route the llama.cpp state calls of save_llama_state/load_llama_state to FakeLlamaContext."""
+    with patch.multiple('app.services.llm_state_cache.llama_cpp',
+                        llama_state_get_size=fake_state_get_size,
+                        llama_state_get_data=fake_state_get_data,
+                        llama_state_set_data=fake_state_set_data):
+        yield
+
+
+class FakeLlama:
+    """Minimal stand-in for llama_cpp.Llama that tracks evaluated tokens."""
+
+    def __init__(self, n_ctx=512):
+        import numpy as np
+        self.metadata = {
+            'tokenizer.chat_template':
+                "{% for m in messages %}<{{ m.role }}>{{ m.content }}{% endfor %}"
+                "{% if add_generation_prompt %}<assistant>{% endif %}"
+        }
+        self.input_ids = np.zeros(n_ctx, dtype=np.intc)
+        self.scores = np.zeros((8, 4), dtype=np.single)
+        self.n_tokens = 0
+        self.evaluated = []
+        self._ctx = SimpleNamespace(ctx=FakeLlamaContext())
+        self._seed = 0
+        self._logits_all = False
+
+    @property
+    def loads(self):
+        return self._ctx.ctx.loads
+
+    def token_eos(self):
+        return -1
+
+    def token_bos(self):
+        return -1
+
+    def detokenize(self, tokens, special=False):
+        return b''
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return list(text)
+
+    def eval(self, tokens):
+        self.input_ids[self.n_tokens:self.n_tokens + len(tokens)] = tokens
+        self.n_tokens += len(tokens)
+        self.evaluated.extend(tokens)
+        self._ctx.ctx.data = self.input_ids[:self.n_tokens].tobytes()
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def create_chat_completion(self, messages, **kwargs):
+        prompt = "".join(f"<{m['role']}>{m['content']}" for m in messages) + "<assistant>"
+        tokens = self.tokenize(prompt.encode('utf-8'))
+        # Same prefix matching as Llama.generate: always evaluate at least one token
+        n = 0
+        while n < min(self.n_tokens, len(tokens) - 1) and self.input_ids[n] == tokens[n]:
+            n += 1
+        self.n_tokens = n
+        self.eval(tokens[n:])
+        return {'choices': [{'message': {'content': 'ok'}}]}
+
+
+@pytest.mark.usefixtures("fake_llama_state")
+class TestPrefixStateReuse:
+    """Test reuse of the evaluated long-term context prefix"""
+
+    STORY_A = [{"role": "system", "content": "You write."}, {"role": "user", "content": "<WORLD>Story A</WORLD>"}]
+    STORY_B = [{"role": "system", "content": "You write."}, {"role": "user", "content": "<WORLD>Story B</WORLD>"}]
+
+    def make_llm(self, prefix_cache_capacity=1024**2, **config_kwargs):
+        if not LLAMA_CPP_AVAILABLE:
+            pytest.skip("Requires llama-cpp-python to be installed")
+        config_kwargs.setdefault('model_path', "/test/model.gguf")
+        with patch('app.services.llm_inference.Llama') as mock_llama, \
+                patch('pathlib.Path.exists', return_value=True):
+            mock_llama.return_value = FakeLlama()
+            return LLMInference(LLMInferenceConfig(
+                prefix_cache_capacity=prefix_cache_capacity,
+                **config_kwargs))
+
+    def request(self, prefix, instruction):
+        return prefix + [{"role": "user", "content": instruction}]
+
+    def test_disabled_by_default(self):
+        llm = self.make_llm(prefix_cache_capacity=0)
+        assert llm.prefix_cache is None
+
+        llm.chat_completion(self.request(self.STORY_A, "Rate it"), prefix_message_count=2)
+        assert llm.model.loads == 0
+
+    def test_prefix_restored_after_other_story(self):
+        llm = self.make_llm()
+        first = self.request(self.STORY_A, "Rate the pacing")
+        llm.chat_completion(first, prefix_message_count=2)
+        llm.chat_completion(self.request(self.STORY_B, "Rate the pacing"), prefix_message_count=2)
+
+        llm.model.evaluated.clear()
+        second = self.request(self.STORY_A, "Rate the dialog")
+        assert llm.chat_completion(second, prefix_message_count=2) == 'ok'
+
+        assert llm.model.loads == 1
+        assert llm.prefix_cache.hits == 1
+        # Only the instruction and generation prompt are evaluated again
+        prefix_len = len("".join(f"<{m['role']}>{m['content']}" for m in self.STORY_A))
+        full_len = len("".join(f"<{m['role']}>{m['content']}" for m in second) + "<assistant>")
+        assert len(llm.model.evaluated) == full_len - prefix_len
+
+    def test_warm_context_not_reloaded(self):
+        llm = self.make_llm()
+        llm.chat_completion(self.request(self.STORY_A, "Rate the pacing"), prefix_message_count=2)
+        llm.chat_completion(self.request(self.STORY_A, "Rate the dialog"), prefix_message_count=2)
+
+        assert llm.prefix_cache.hits == 1
+        assert llm.model.loads == 0
+
+    def test_no_prefix_skips_cache(self):
+        llm = self.make_llm()
+        llm.chat_completion(self.request(self.STORY_A, "Rate it"))
+
+        assert len(llm.prefix_cache) == 0
+
+    def test_streaming_uses_prefix_cache(self):
+        llm = self.make_llm()
+        llm.model.create_chat_completion = MagicMock(return_value=iter([]))
+        list(llm.chat_completion_stream(self.request(self.STORY_A, "Continue"), prefix_message_count=2))
+
+        assert len(llm.prefix_cache) == 1
+
+    def test_prefix_state_survives_restart(self, tmp_path):
+        model_file = tmp_path / "model.gguf"
+        model_file.write_bytes(b"GGUF weights")
+        state_dir = str(tmp_path / "states")
+
+        llm = self.make_llm(model_path=str(model_file), state_cache_dir=state_dir)
+        llm.chat_completion(self.request(self.STORY_A, "Rate the pacing"), prefix_message_count=2)
+        llm.prefix_cache.disk_cache.close()
+
+        # A fresh instance has an empty memory cache but finds the state on disk
+        restarted = self.make_llm(model_path=str(model_file), state_cache_dir=state_dir)
+        restarted.chat_completion(self.request(self.STORY_A, "Rate the dialog"), prefix_message_count=2)
+
+        assert restarted.prefix_cache.disk_hits == 1
+        assert restarted.model.loads == 1
+
+    def test_missing_state_dir_dependency_does_not_block_loading(self, tmp_path):
+        with patch('app.services.llm_inference.DiskStateCache', side_effect=ImportError("no diskcache")):
+            llm = self.make_llm(state_cache_dir=str(tmp_path / "states"))
+
+        assert llm.prefix_cache is not None
+        assert llm.prefix_cache.disk_cache is None
+
+
+class TestStreamCancellation:
+    """Test that abandoned streams stop generating and are counted"""
+
+    def make_llm(self, chunks):
+        if not LLAMA_CPP_AVAILABLE:
+            pytest.skip("Requires llama-cpp-python to be installed")
+        with patch('app.services.llm_inference.Llama') as mock_llama, \
+                patch('pathlib.Path.exists', return_value=True):
+            llm = LLMInference(LLMInferenceConfig(model_path="/test/model.gguf"))
+        self.closed = False
+        self.pulled = 0
+
+        def stream(**kwargs):
+            try:
+                for c in chunks:
+                    self.pulled += 1
+                    yield {'choices': [{'delta': {'content': c}}]}
+            finally:
+                self.closed = True
+
+        llm.model.create_chat_completion.side_effect = stream
+        return llm
+
+    def test_completed_stream_not_counted(self):
+        llm = self.make_llm(["a", "b", "c"])
+
+        assert list(llm.chat_completion_stream([{"role": "user", "content": "Hi"}], max_tokens=10)) == ["a", "b", "c"]
+        assert llm.get_stats()["cancelled_generations"] == 0
+
+    def test_closing_generator_stops_llama_stream(self):
+        llm = self.make_llm([str(i) for i in range(100)])
+
+        stream = llm.chat_completion_stream([{"role": "user", "content": "Hi"}], max_tokens=100)
+        assert [next(stream) for _ in range(3)] == ["0", "1", "2"]
+        stream.close()
+
+        assert self.closed
+        assert self.pulled == 3
+        assert llm.cancelled_generations == 1
+        assert llm.cancelled_tokens_saved == 97
+
+    def test_cancelled_job_stops_stream(self):
+        llm = self.make_llm([str(i) for i in range(100)])
+        cancelled = iter([False, False, True])
+
+        with patch('app.services.llm_inference.current_job_cancelled', side_effect=lambda: next(cancelled)):
+            result = list(llm.chat_completion_stream([{"role": "user", "content": "Hi"}], max_tokens=100))
+
+        assert result == ["0", "1"]
+        assert self.closed
+        assert llm.get_stats()["cancelled_tokens_saved"] == 98
+
+
+class TestBatchEngineSetup:
+    """Test the context size given to the batch engine"""
+
+    def make_llm(self, **config):
+        if not LLAMA_CPP_AVAILABLE:
+            pytest.skip("Requires llama-cpp-python to be installed")
+        with patch('app.services.llm_inference.Llama'), \
+                patch('app.services.llm_inference.BatchEngine') as mock_engine, \
+                patch.object(LLMInference, '_create_chat_formatter', return_value=Mock()), \
+                patch('pathlib.Path.exists', return_value=True):
+            LLMInference(LLMInferenceConfig(model_path="/test/model.gguf", batch_max_sequences=4, **config))
+        return mock_engine.call_args
+
+    def test_sequences_use_batch_context_size(self):
+        call = self.make_llm(n_ctx=8192, batch_ctx_per_sequence=2048)
+
+        assert call.args[1] == 4
+        assert call.kwargs["n_ctx_per_sequence"] == 2048
+
+    def test_sequence_context_capped_at_n_ctx(self):
+        call = self.make_llm(n_ctx=1024, batch_ctx_per_sequence=2048)
+
+        assert call.kwargs["n_ctx_per_sequence"] == 1024
+
+
+@pytest.mark.usefixtures("fake_llama_state")
+class TestStreamPreemption:
+    """Test that streams pause for higher-priority jobs and resume from a snapshot"""
+
+    N_CTX, N_VOCAB = 4096, 32000
+
+    def make_llm(self, chunks, n_tokens=3000, **config):
+        if not LLAMA_CPP_AVAILABLE:
+            pytest.skip("Requires llama-cpp-python to be installed")
+        import numpy as np
+        with patch('app.services.llm_inference.Llama'), \
+                patch('pathlib.Path.exists', return_value=True):
+            llm = LLMInference(LLMInferenceConfig(model_path="/test/model.gguf", **config))
+        # A context with logits_all set, as allocated for speculative decoding
+        llm.model._ctx = SimpleNamespace(ctx=FakeLlamaContext())
+        llm.model._ctx.ctx.data = b'kv' * 1024
+        llm.model._seed = 0
+        llm.model._logits_all = True
+        llm.model.input_ids = np.zeros(self.N_CTX, dtype=np.intc)
+        llm.model.scores = np.zeros((self.N_CTX, self.N_VOCAB), dtype=np.single)
+        llm.model.n_tokens = n_tokens
+        llm.model._sampler = "paused-sampler"
+        llm.model.draft_model = None
+
+        def stream(**kwargs):
+            for c in chunks:
+                yield {'choices': [{'delta': {'content': c}}]}
+
+        llm.model.create_chat_completion.side_effect = stream
+        return llm
+
+    def preempt_once(self, llm):
+        """Run a stream that is preempted after its second chunk; returns the snapshot."""
+        requested = iter([False, True, False])
+        snapshots = []
+
+        def serve():
+            # The higher-priority job replaces the sampler and evaluates its own prompt
+            llm.model._sampler = "other-sampler"
+            llm.model._ctx.ctx.data = b'other'
+            llm.model.n_tokens = 10
+            return 1
+
+        def load(model, state):
+            snapshots.append(state)
+            load_llama_state(model, state)
+
+        with patch('app.services.llm_inference.preemption_requested', side_effect=lambda: next(requested)), \
+                patch('app.services.llm_inference.serve_preempting_jobs', side_effect=serve) as mock_serve, \
+                patch('app.services.llm_inference.load_llama_state', side_effect=load):
+            result = list(llm.chat_completion_stream([{"role": "user", "content": "Hi"}], max_tokens=10))
+
+        assert result == ["a", "b", "c"]
+        mock_serve.assert_called_once()
+        return snapshots[0]
+
+    def test_pauses_and_restores_state(self):
+        llm = self.make_llm(["a", "b", "c"])
+
+        self.preempt_once(llm)
+
+        assert llm.model._ctx.ctx.data == b'kv' * 1024
+        assert llm.model.n_tokens == 3000
+        assert llm.model._sampler == "paused-sampler"
+        assert llm.get_stats()["preempted_generations"] == 1
+
+    def test_snapshot_skips_scores_matrix(self):
+        llm = self.make_llm(["a", "b", "c"])
+
+        state = self.preempt_once(llm)
+
+        # One logits row instead of the 3000 x 32000 rows evaluated so far (384 MB)
+        assert state.scores.shape == (1, self.N_VOCAB)
+        assert state_size_bytes(state) < 256 * 1024
+
+    def test_snapshot_keeps_draft_rows_while_drafting(self):
+        llm = self.make_llm(["a", "b", "c"], speculative_decoding='prompt_lookup', draft_tokens=4)
+        llm.model.draft_model = "drafter"
+
+        state = self.preempt_once(llm)
+
+        assert state.scores.shape == (5, self.N_VOCAB)
+        assert llm.model.draft_model == "drafter"
+
+    def test_no_snapshot_without_waiting_jobs(self):
+        llm = self.make_llm(["a", "b"])
+
+        with patch('app.services.llm_inference.save_llama_state') as mock_save:
+            assert list(llm.chat_completion_stream([{"role": "user", "content": "Hi"}], max_tokens=10)) == ["a", "b"]
+        mock_save.assert_not_called()
+        assert llm.preempted_generations == 0
+
+
+class TestSpeculativeStreaming:
+    """Test that speculative streams run on their own context with the drafter attached"""
+
+    def make_llm(self, chunks, mode='prompt_lookup'):
+        if not LLAMA_CPP_AVAILABLE:
+            pytest.skip("Requires llama-cpp-python to be installed")
+        self.contexts = []
+        self.drafters_seen = []
+
+        def load_context(**kwargs):
+            model = MagicMock()
+            model.n_vocab.return_value = 32000
+            model.draft_model = None
+
+            def stream(**stream_kwargs):
+                for c in chunks:
+                    self.drafters_seen.append((model, model.draft_model))
+                    yield {'choices': [{'delta': {'content': c}}]}
+
+            model.create_chat_completion.side_effect = stream
+            self.contexts.append((model, kwargs))
+            return model
+
+        with patch('app.services.llm_inference.Llama', side_effect=load_context), \
+                patch('pathlib.Path.exists', return_value=True):
+            llm = LLMInference(LLMInferenceConfig(model_path="/test/model.gguf", speculative_decoding=mode))
+        return llm
+
+    def test_disabled_by_default(self):
+        llm = self.make_llm(["a"], mode='off')
+
+        assert not llm.speculative_available
+        assert len(self.contexts) == 1
+        list(llm.chat_completion_stream([{"role": "user", "content": "Hi"}], speculative=True))
+        assert self.drafters_seen == [(llm.model, None)]
+        assert "speculative_drafts" not in llm.get_stats()
+
+    def test_main_context_keeps_last_logits_only(self):
+        llm = self.make_llm(["a"])
+
+        (main, main_kwargs), (speculative, speculative_kwargs) = self.contexts
+        assert main is llm.model
+        assert not main_kwargs.get("logits_all", False)
+        assert speculative_kwargs["logits_all"]
+        assert speculative_kwargs["n_ctx"] == main_kwargs["n_ctx"]
+
+    def test_speculative_stream_uses_drafter(self):
+        llm = self.make_llm(["a", "b"])
+        speculative = self.contexts[1][0]
+
+        result = list(llm.chat_completion_stream([{"role": "user", "content": "Hi"}], speculative=True))
+
+        assert result == ["a", "b"]
+        assert self.drafters_seen == [(speculative, llm._drafter), (speculative, llm._drafter)]
+        assert speculative.draft_model is None
+        llm.model.create_chat_completion.assert_not_called()
+        assert llm.get_stats()["speculative_acceptance_rate"] == 0.0
+
+    def test_other_streams_do_not_draft(self):
+        llm = self.make_llm(["a"])
+
+        list(llm.chat_completion_stream([{"role": "user", "content": "Hi"}]))
+
+        assert self.drafters_seen == [(llm.model, None)]
+
+    def test_speculative_context_failure_disables_drafting(self):
+        if not LLAMA_CPP_AVAILABLE:
+            pytest.skip("Requires llama-cpp-python to be installed")
+        main = MagicMock()
+        main.n_vocab.return_value = 32000
+        with patch('app.services.llm_inference.Llama', side_effect=[main, RuntimeError("out of memory")]), \
+                patch('pathlib.Path.exists', return_value=True):
+            llm = LLMInference(LLMInferenceConfig(model_path="/test/model.gguf", speculative_decoding='prompt_lookup'))
+
+        assert llm.model is main
+        assert not llm.speculative_available
+
+    def test_drafter_detached_while_preempted(self):
+        llm = self.make_llm(["a", "b"])
+        speculative = self.contexts[1][0]
+        requested = iter([True, False])
+        during_pause = []
+
+        def serve():
+            during_pause.append(speculative.draft_model)
+            return 1
+
+        with patch('app.services.llm_inference.preemption_requested', side_effect=lambda: next(requested)), \
+                patch('app.services.llm_inference.serve_preempting_jobs', side_effect=serve), \
+                patch('app.services.llm_inference.save_llama_state') as mock_save, \
+                patch('app.services.llm_inference.load_llama_state') as mock_load:
+            list(llm.chat_completion_stream([{"role": "user", "content": "Hi"}], speculative=True))
+
+        assert during_pause == [None]
+        assert self.drafters_seen[1] == (speculative, llm._drafter)
+        assert mock_save.call_args.args[0] is speculative
+        assert mock_load.call_args.args[0] is speculative
@@ -0,0 +1,139 @@
+"""
+Tests for the multi-replica LLMInferencePool.
+"""
+import asyncio
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.services.inference_executor import InferenceExecutor
+from app.services.llm_inference import LLAMA_CPP_AVAILABLE, LLMInferenceConfig, initialize_llm
+from app.services.llm_pool import LLMInferencePool
+
+
+def make_model(name):
+    model = MagicMock(name=name)
+    model.return_value = {'choices': [{'text': name}]}
+    model.tokenize.side_effect = lambda text: list(text)
+    return model
+
+
+@pytest.fixture
+def llama():
+    if not LLAMA_CPP_AVAILABLE:
+        pytest.skip("Requires llama-cpp-python to be installed")
+    with patch('app.services.llm_inference.Llama') as mock_llama, \
+            patch('pathlib.Path.exists', return_value=True):
+        mock_llama.side_effect = [make_model(f"replica-{i}") for i in range(4)]
+        yield mock_llama
+
+
+def make_pool(**kwargs):
+    kwargs.setdefault('model_path', "/test/model.gguf")
+    return LLMInferencePool(LLMInferenceConfig(**kwargs))
+
+
+class TestPoolLoading:
+    """Test replica creation"""
+
+    def test_loads_one_replica_per_slot(self, llama):
+        pool = make_pool(pool_size=3)
+
+        assert pool.pool_size == 3
+        assert llama.call_count == 3
+        assert len({id(r.model) for r in pool.replicas}) == 3
+
+    def test_splits_threads(self, llama):
+        make_pool(pool_size=4, n_threads=64)
+
+        assert {c.kwargs['n_threads'] for c in llama.call_args_list} == {16}
+
+    def test_threads_per_replica_overrides_split(self, llama):
+        make_pool(pool_size=2, n_threads=64, threads_per_replica=8)
+
+        assert {c.kwargs['n_threads'] for c in llama.call_args_list} == {8}
+
+    def test_splits_prefix_cache(self, llama):
+        pool = make_pool(pool_size=2, prefix_cache_capacity=1024)
+
+        assert {r.config.prefix_cache_capacity for r in pool.replicas} == {512}
+        # The caller's config is left untouched
+        assert pool.config.prefix_cache_capacity == 1024
+
+    def test_replicas_share_token_cache(self, llama):
+        pool = make_pool(pool_size=2, token_cache_capacity=1000)
+
+        pool.replicas[0].count_tokens("Once upon a time")
+        pool.replicas[1].count_tokens("Once upon a time")
+
+        assert pool.replicas[1].model.tokenize.call_count == 0
+        assert pool.get_stats()["token_cache_hits"] == 1
+
+    def test_initialize_llm_creates_pool(self, llama, monkeypatch):
+        monkeypatch.setattr('app.services.llm_inference._llm_instance', None)
+        llm = initialize_llm(LLMInferenceConfig(model_path="/test/model.gguf", pool_size=2))
+
+        assert isinstance(llm, LLMInferencePool)
+
+
+class TestPoolDispatch:
+    """Test routing of calls to the worker's replica"""
+
+    def test_outside_executor_uses_first_replica(self, llama):
+        pool = make_pool(pool_size=2)
+
+        assert pool.generate("prompt") == "replica-0"
+        assert pool.model_id == "model.gguf"
+
+    @pytest.mark.asyncio
+    async def test_each_worker_uses_its_replica(self, llama):
+        pool = make_pool(pool_size=2)
+        executor = InferenceExecutor(num_workers=2)
+        barrier = threading.Barrier(2)
+
+        def job():
+            # Both workers are busy at once, so each job runs on a different one
+            barrier.wait(timeout=5)
+            return pool.generate("prompt")
+
+        try:
+            results = await asyncio.gather(executor.run(job), executor.run(job))
+        finally:
+            executor.shutdown()
+
+        assert sorted(results) == ["replica-0", "replica-1"]
+
+    @pytest.mark.asyncio
+    async def test_bound_method_resolves_replica_when_run(self, llama):
+        """Endpoints take llm.generate on the event loop; the replica is picked on the worker"""
+        pool = make_pool(pool_size=2)
+        executor = InferenceExecutor(num_workers=2)
+        generate = pool.generate
+        hold = threading.Event()
+
+        def block():
+            hold.wait(timeout=5)
+
+        try:
+            blocked = asyncio.ensure_future(executor.run(block))
+            await asyncio.sleep(0.05)
+            result = await executor.run(generate, "prompt")
+            hold.set()
+            await blocked
+        finally:
+            executor.shutdown()
+
+        assert result in ("replica-0", "replica-1")
+        assert sum(r.model.call_count for r in pool.replicas) == 1
+
+    def test_stats_sum_replicas(self, llama):
+        pool = make_pool(pool_size=2)
+        pool.replicas[0].cancelled_generations = 1
+        pool.replicas[1].cancelled_generations = 2
+
+        stats = pool.get_stats()
+
+        assert stats["pool_size"] == 2
+        assert stats["cancelled_generations"] == 3
+        assert len(stats["replicas"]) == 2
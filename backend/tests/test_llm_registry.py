@@ -0,0 +1,141 @@
+"""
+Tests for the model registry that routes task types to named models.
+"""
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.services.inference_executor import get_inference_executor
+from app.services.llm_inference import LLMInferenceConfig
+from app.services.llm_registry import (
+    DEFAULT_MODEL,
+    LLMTask,
+    ModelRegistry,
+    get_model_registry,
+    get_task_executor,
+    get_task_llm,
+    initialize_models,
+    routed_model_config,
+    shutdown_models,
+)
+
+
+@pytest.fixture
+def registry():
+    registry = ModelRegistry()
+    yield registry
+    registry.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def clean_global_registry():
+    yield
+    shutdown_models()
+
+
+def small_model():
+    llm = MagicMock()
+    llm.model_id = "small.gguf"
+    llm.get_stats.return_value = {"cancelled_generations": 0}
+    return llm
+
+
+class TestModelRegistry:
+    """Test routing tasks to registered models"""
+
+    def test_unrouted_task_uses_default(self, registry):
+        default = MagicMock()
+
+        assert registry.get_llm(LLMTask.SUMMARIZE, default) is default
+        assert registry.get_executor(LLMTask.SUMMARIZE) is get_inference_executor()
+        assert registry.model_name(LLMTask.SUMMARIZE) == DEFAULT_MODEL
+
+    def test_routed_task_uses_named_model(self, registry):
+        llm, executor = small_model(), MagicMock()
+        registry.register("small", llm, executor)
+        registry.set_route(LLMTask.SUMMARIZE, "small")
+
+        assert registry.is_routed(LLMTask.SUMMARIZE)
+        assert registry.get_llm(LLMTask.SUMMARIZE, MagicMock()) is llm
+        assert registry.get_executor(LLMTask.SUMMARIZE) is executor
+        assert not registry.is_routed(LLMTask.GENERATE)
+
+    def test_route_back_to_default(self, registry):
+        registry.register("small", small_model(), MagicMock())
+        registry.set_route(LLMTask.EVALUATE, "small")
+        registry.set_route(LLMTask.EVALUATE, DEFAULT_MODEL)
+
+        assert not registry.is_routed(LLMTask.EVALUATE)
+
+    def test_route_to_unknown_model(self, registry):
+        with pytest.raises(ValueError, match="Unknown model"):
+            registry.set_route(LLMTask.RATE, "missing")
+
+    def test_default_name_reserved(self, registry):
+        with pytest.raises(ValueError, match="reserved"):
+            registry.register(DEFAULT_MODEL, small_model(), MagicMock())
+
+    def test_stats(self, registry):
+        executor = MagicMock()
+        executor.get_stats.return_value = [{"worker": 0}]
+        registry.register("small", small_model(), executor)
+        registry.set_route(LLMTask.RATE, "small")
+
+        stats = registry.get_stats()
+
+        assert stats["routes"]["rate"] == "small"
+        assert stats["routes"]["generate"] == DEFAULT_MODEL
+        assert stats["models"]["small"]["model_id"] == "small.gguf"
+        assert stats["models"]["small"]["inference_workers"] == [{"worker": 0}]
+
+    def test_shutdown_stops_executors(self, registry):
+        executor = MagicMock()
+        registry.register("small", small_model(), executor)
+        registry.set_route(LLMTask.RATE, "small")
+
+        registry.shutdown()
+
+        executor.shutdown.assert_called_once_with(wait=False)
+        assert not registry.is_routed(LLMTask.RATE)
+
+
+class TestInitializeModels:
+    """Test loading named models from settings"""
+
+    def config(self):
+        return LLMInferenceConfig(
+            model_path="/models/large.gguf", n_ctx=8192, pool_size=4, batch_max_sequences=8,
+            speculative_decoding='prompt_lookup')
+
+    def test_routed_model_config(self):
+        routed = routed_model_config(self.config(), "/models/small.gguf")
+
+        assert routed.model_path == "/models/small.gguf"
+        assert routed.n_ctx == 8192
+        assert routed.pool_size == 1
+        assert routed.batch_max_sequences == 1
+        assert routed.speculative_decoding == 'off'
+
+    def test_loads_models_and_routes(self):
+        with patch('app.services.llm_registry.LLMInference', side_effect=lambda config: small_model()) as loader:
+            initialize_models(self.config(), {"small": "/models/small.gguf"}, {"summarize": "small", "chat": "default"})
+
+        assert loader.call_args.args[0].model_path == "/models/small.gguf"
+        default = MagicMock()
+        assert get_task_llm(LLMTask.SUMMARIZE, default).model_id == "small.gguf"
+        assert get_task_llm(LLMTask.CHAT, default) is default
+        assert get_task_executor(LLMTask.SUMMARIZE) is not get_inference_executor()
+
+    def test_failed_model_falls_back_to_default(self):
+        with patch('app.services.llm_registry.LLMInference', side_effect=FileNotFoundError("missing")):
+            initialize_models(self.config(), {"small": "/models/small.gguf"}, {"summarize": "small"})
+
+        assert not get_model_registry().is_routed(LLMTask.SUMMARIZE)
+
+    def test_unknown_task(self):
+        with pytest.raises(ValueError, match="Unknown task 'outline'"):
+            initialize_models(self.config(), {}, {"outline": "small"})
+
+    def test_route_to_model_not_configured(self):
+        with pytest.raises(ValueError, match="not in LLM_MODELS"):
+            initialize_models(self.config(), {}, {"rate": "small"})
@@ -0,0 +1,126 @@
+"""
+Tests for the speculative decoding drafters.
+"""
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.services.llm_inference import LLMInferenceConfig
+from app.services.llm_speculative import LLAMA_CPP_AVAILABLE, TrackingDrafter, create_drafter
+
+if LLAMA_CPP_AVAILABLE:
+    import numpy as np
+
+pytestmark = pytest.mark.skipif(not LLAMA_CPP_AVAILABLE, reason="Requires llama-cpp-python to be installed")
+
+
+class FixedDrafter:
+    """Drafter proposing the given tokens on every call."""
+
+    def __init__(self, proposal):
+        self.proposal = proposal
+        self.calls = []
+
+    def __call__(self, input_ids, **kwargs):
+        self.calls.append(list(input_ids))
+        return np.array(self.proposal, dtype=np.intc)
+
+
+def ids(*tokens):
+    return np.array(tokens, dtype=np.intc)
+
+
+class TestTrackingDrafter:
+    """Test counting accepted draft tokens"""
+
+    def test_first_call_counts_nothing(self):
+        drafter = TrackingDrafter(FixedDrafter([7, 8, 9]))
+
+        assert list(drafter(ids(1, 2, 3))) == [7, 8, 9]
+        assert drafter.drafts == 0
+        assert drafter.acceptance_rate == 0.0
+
+    def test_partly_accepted_draft(self):
+        drafter = TrackingDrafter(FixedDrafter([7, 8, 9]))
+        drafter(ids(1, 2, 3))
+
+        # 7 and 8 accepted, then the model sampled 5 instead of 9
+        drafter(ids(1, 2, 3, 7, 8, 5))
+
+        assert drafter.drafts == 1
+        assert drafter.proposed_tokens == 3
+        assert drafter.accepted_tokens == 2
+
+    def test_fully_accepted_draft(self):
+        drafter = TrackingDrafter(FixedDrafter([7, 8]))
+        drafter(ids(1, 2))
+
+        # Both accepted, followed by the model's own next token
+        drafter(ids(1, 2, 7, 8, 4))
+
+        assert drafter.acceptance_rate == 1.0
+
+    def test_rejected_draft(self):
+        drafter = TrackingDrafter(FixedDrafter([7, 8]))
+        drafter(ids(1, 2))
+        drafter(ids(1, 2, 5))
+
+        assert drafter.proposed_tokens == 2
+        assert drafter.accepted_tokens == 0
+
+    def test_empty_proposal_not_counted(self):
+        drafter = TrackingDrafter(FixedDrafter([]))
+        drafter(ids(1, 2))
+        drafter(ids(1, 2, 3))
+
+        assert drafter.drafts == 0
+
+    def test_reset_drops_pending_draft(self):
+        drafter = TrackingDrafter(FixedDrafter([7, 8]))
+        drafter(ids(1, 2))
+        drafter.reset()
+
+        # A new generation with an unrelated context
+        drafter(ids(4, 4, 4, 4))
+
+        assert drafter.drafts == 0
+
+
+class TestCreateDrafter:
+    """Test building the configured drafter"""
+
+    def config(self, **kwargs):
+        return LLMInferenceConfig(model_path="/test/model.gguf", **kwargs)
+
+    def test_off(self):
+        assert create_drafter(self.config(), 32000) is None
+
+    def test_prompt_lookup(self):
+        drafter = create_drafter(self.config(speculative_decoding='prompt_lookup', draft_tokens=4), 32000)
+
+        # Continues the latest bigram from its earlier occurrence
+        assert list(drafter(ids(1, 2, 3, 4, 5, 6, 1, 2))) == [3, 4, 5, 6]
+
+    def test_draft_model_requires_path(self):
+        assert create_drafter(self.config(speculative_decoding='draft_model'), 32000) is None
+
+    def test_draft_model_vocabulary_mismatch(self):
+        draft = MagicMock()
+        draft.n_vocab.return_value = 151000
+        with patch('app.services.llm_speculative.Llama', return_value=draft):
+            config = self.config(speculative_decoding='draft_model', draft_model_path="/test/draft.gguf")
+            assert create_drafter(config, 32000) is None
+
+    def test_draft_model_proposes_greedy_tokens(self):
+        draft = MagicMock()
+        draft.n_vocab.return_value = 32000
+        draft.n_ctx.return_value = 4096
+        draft.token_eos.return_value = 2
+        draft.generate.side_effect = lambda tokens, **kwargs: iter([11, 12, 2, 13])
+        with patch('app.services.llm_speculative.Llama', return_value=draft):
+            config = self.config(
+                speculative_decoding='draft_model', draft_model_path="/test/draft.gguf", draft_tokens=8)
+            drafter = create_drafter(config, 32000)
+
+        assert list(drafter(ids(1, 2, 3))) == [11, 12]
+        assert draft.generate.call_args.kwargs["temp"] == 0.0
@@ -0,0 +1,308 @@
+"""
+Tests for the prompt-prefix state cache.
+"""
+import ctypes
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from app.services.llm_state_cache import (
+    LLAMA_CPP_AVAILABLE,
+    DiskStateCache,
+    LlamaState,
+    PrefixStateCache,
+    hash_message_prefix,
+    load_llama_state,
+    save_llama_state,
+    state_size_bytes,
+    trim_llama_state
+)
+
+
+def make_state(size: int, n_tokens: int = 4):
+    return SimpleNamespace(
+        input_ids=np.arange(n_tokens, dtype=np.intc),
+        scores=np.zeros((0, 0), dtype=np.single),
+        n_tokens=n_tokens,
+        llama_state=b'\0' * size,
+        llama_state_size=size)
+
+
+class TestHashMessagePrefix:
+    """Test message-prefix keys"""
+
+    def test_same_messages_same_key(self):
+        messages = [{"role": "system", "content": "Be helpful"}, {"role": "user", "content": "World"}]
+        assert hash_message_prefix(messages) == hash_message_prefix([dict(m) for m in messages])
+
+    def test_role_and_content_affect_key(self):
+        base = [{"role": "user", "content": "World"}]
+        assert hash_message_prefix(base) != hash_message_prefix([{"role": "system", "content": "World"}])
+        assert hash_message_prefix(base) != hash_message_prefix([{"role": "user", "content": "World!"}])
+
+    def test_message_boundaries_affect_key(self):
+        one = [{"role": "user", "content": "ab"}]
+        two = [{"role": "user", "content": "a"}, {"role": "user", "content": "b"}]
+        assert hash_message_prefix(one) != hash_message_prefix(two)
+
+
+class TestPrefixStateCache:
+    """Test the byte-bounded LRU"""
+
+    def test_state_size_includes_arrays(self):
+        state = make_state(100, n_tokens=4)
+        assert state_size_bytes(state) == 100 + state.input_ids.nbytes
+
+    def test_get_and_put(self):
+        cache = PrefixStateCache(capacity_bytes=1000)
+        state = make_state(100)
+        cache.put("a", state)
+
+        assert cache.get("a") is state
+        assert cache.get("b") is None
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        cache = PrefixStateCache(capacity_bytes=3 * state_size_bytes(make_state(100)))
+        cache.put("a", make_state(100))
+        cache.put("b", make_state(100))
+        cache.put("c", make_state(100))
+        cache.get("a")
+        cache.put("d", make_state(100))
+
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" in cache and "d" in cache
+        assert cache.cache_size <= cache.capacity_bytes
+
+    def test_replacing_key_updates_size(self):
+        cache = PrefixStateCache(capacity_bytes=10000)
+        cache.put("a", make_state(100))
+        cache.put("a", make_state(200))
+
+        assert len(cache) == 1
+        assert cache.cache_size == state_size_bytes(make_state(200))
+
+    def test_oversized_state_not_stored(self):
+        cache = PrefixStateCache(capacity_bytes=50)
+        cache.put("a", make_state(100))
+
+        assert len(cache) == 0
+        assert cache.cache_size == 0
+
+
+class FakeContext:
+    """llama.cpp context whose state data is a byte string."""
+
+    def __init__(self, data: bytes = b''):
+        self.data = data
+
+
+def get_state_size(ctx):
+    return len(ctx.data)
+
+
+def get_state_data(ctx, dst, size):
+    ctypes.memmove(dst, ctx.data, len(ctx.data))
+    return len(ctx.data)
+
+
+def set_state_data(ctx, src, size):
+    ctx.data = bytes(src)[:size]
+    return size
+
+
+def make_llama(n_ctx: int, n_vocab: int, logits_all: bool, kv_bytes: int = 0):
+    """Llama-shaped object: the arrays llama-cpp-python allocates, over a fake context."""
+    return SimpleNamespace(
+        _ctx=SimpleNamespace(ctx=FakeContext(b'\x07' * kv_bytes)),
+        input_ids=np.zeros(n_ctx, dtype=np.intc),
+        scores=np.zeros((n_ctx if logits_all else 512, n_vocab), dtype=np.single),
+        n_tokens=0,
+        _seed=1234,
+        _logits_all=logits_all)
+
+
+@pytest.mark.skipif(not LLAMA_CPP_AVAILABLE, reason="Requires llama-cpp-python to be installed")
+class TestSaveLlamaState:
+    """Test snapshots of a real-shaped llama context"""
+
+    # A 10k-token story prefix with a 32k vocabulary: the full scores matrix is 1.3 GB
+    N_CTX, N_VOCAB, N_TOKENS = 12288, 32000, 10000
+
+    @pytest.fixture(autouse=True)
+    def fake_state_calls(self):
+        with patch.multiple('app.services.llm_state_cache.llama_cpp',
+                            llama_state_get_size=get_state_size,
+                            llama_state_get_data=get_state_data,
+                            llama_state_set_data=set_state_data):
+            yield
+
+    def evaluated_llama(self, logits_all=True):
+        llama = make_llama(self.N_CTX, self.N_VOCAB, logits_all, kv_bytes=4 * 1024**2)
+        llama.input_ids[:self.N_TOKENS] = np.arange(self.N_TOKENS)
+        llama.n_tokens = self.N_TOKENS
+        if logits_all:
+            llama.scores[self.N_TOKENS - 1, :] = 0.5
+        return llama
+
+    def test_state_holds_kv_and_last_logits_only(self):
+        state = save_llama_state(self.evaluated_llama())
+
+        assert isinstance(state, LlamaState)
+        assert state.scores.shape == (1, self.N_VOCAB)
+        assert state.input_ids.shape == (self.N_TOKENS,)
+        assert state.llama_state_size == 4 * 1024**2
+        full_scores = self.N_TOKENS * self.N_VOCAB * 4
+        assert state_size_bytes(state) < 4 * 1024**2 + 256 * 1024
+        assert state_size_bytes(state) < full_scores // 100
+
+    def test_fits_default_memory_cache(self):
+        cache = PrefixStateCache(capacity_bytes=1024**3)
+        cache.put("story", save_llama_state(self.evaluated_llama()))
+
+        assert "story" in cache
+
+    def test_round_trip(self):
+        state = save_llama_state(self.evaluated_llama())
+        restored = make_llama(self.N_CTX, self.N_VOCAB, logits_all=True)
+
+        load_llama_state(restored, state)
+
+        assert restored.n_tokens == self.N_TOKENS
+        assert list(restored.input_ids[:3]) == [0, 1, 2]
+        assert restored.input_ids[self.N_TOKENS - 1] == self.N_TOKENS - 1
+        assert (restored.scores[self.N_TOKENS - 1] == 0.5).all()
+        assert restored._ctx.ctx.data == b'\x07' * 4 * 1024**2
+        assert restored._seed == 1234
+
+    def test_scores_skipped_without_logits_all(self):
+        state = save_llama_state(self.evaluated_llama(logits_all=False))
+        restored = make_llama(self.N_CTX, self.N_VOCAB, logits_all=False)
+
+        load_llama_state(restored, state)
+
+        assert state.scores.shape == (0, self.N_VOCAB)
+        assert restored.n_tokens == self.N_TOKENS
+
+    def test_rejected_state_raises(self):
+        state = save_llama_state(self.evaluated_llama())
+
+        with patch('app.services.llm_state_cache.llama_cpp.llama_state_set_data', return_value=0):
+            with pytest.raises(RuntimeError, match="Failed to set llama state data"):
+                load_llama_state(make_llama(self.N_CTX, self.N_VOCAB, logits_all=True), state)
+
+
+@pytest.fixture
+def model_file(tmp_path):
+    path = tmp_path / "model.gguf"
+    path.write_bytes(b"GGUF model weights v1")
+    return path
+
+
+class TestDiskStateCache:
+    """Test the persistent state store"""
+
+    def test_round_trip_across_instances(self, tmp_path, model_file):
+        directory = str(tmp_path / "states")
+        cache = DiskStateCache(directory, size_limit=1024**2, model_path=str(model_file))
+        cache.put("a", make_state(100))
+        cache.close()
+
+        reopened = DiskStateCache(directory, size_limit=1024**2, model_path=str(model_file))
+        state = reopened.get("a")
+
+        assert state is not None
+        assert state.llama_state_size == 100
+        assert list(state.input_ids) == [0, 1, 2, 3]
+
+    def test_model_change_invalidates_states(self, tmp_path, model_file):
+        directory = str(tmp_path / "states")
+        cache = DiskStateCache(directory, size_limit=1024**2, model_path=str(model_file))
+        cache.put("a", make_state(100))
+        cache.close()
+
+        model_file.write_bytes(b"GGUF model weights v2")
+        reopened = DiskStateCache(directory, size_limit=1024**2, model_path=str(model_file))
+
+        assert reopened.model_checksum != cache.model_checksum
+        assert reopened.get("a") is None
+
+    @pytest.mark.skipif(not LLAMA_CPP_AVAILABLE, reason="Requires llama-cpp-python to be installed")
+    def test_writes_trimmed_state(self, tmp_path, model_file):
+        # What Llama.save_state() returns after a 2000-token prompt with logits_all
+        state = LlamaState(
+            input_ids=np.arange(4096, dtype=np.intc),
+            scores=np.ones((2000, 32000), dtype=np.single),
+            n_tokens=2000,
+            llama_state=b'\0' * 1000,
+            llama_state_size=1000,
+            seed=7)
+        cache = DiskStateCache(str(tmp_path / "states"), size_limit=1024**3, model_path=str(model_file))
+        cache.put("a", state)
+
+        stored = cache.get("a")
+
+        assert stored.scores.shape == (1, 32000)
+        assert stored.input_ids.shape == (2000,)
+        assert stored.seed == 7
+        assert cache.volume < 1024**2
+
+    def test_missing_entry(self, tmp_path, model_file):
+        cache = DiskStateCache(str(tmp_path / "states"), size_limit=1024**2, model_path=str(model_file))
+        assert cache.get("missing") is None
+        assert "missing" not in cache
+
+
+@pytest.mark.skipif(not LLAMA_CPP_AVAILABLE, reason="Requires llama-cpp-python to be installed")
+class TestTrimLlamaState:
+    """Test shrinking states saved with the full scores matrix"""
+
+    def test_keeps_last_rows(self):
+        scores = np.arange(12, dtype=np.single).reshape(6, 2)
+        state = LlamaState(input_ids=np.arange(8, dtype=np.intc), scores=scores, n_tokens=6,
+                           llama_state=b'kv', llama_state_size=2, seed=0)
+
+        trimmed = trim_llama_state(state, score_rows=2)
+
+        assert trimmed.scores.tolist() == [[8, 9], [10, 11]]
+        assert list(trimmed.input_ids) == [0, 1, 2, 3, 4, 5]
+        assert trimmed.llama_state == b'kv'
+
+    def test_small_state_unchanged(self):
+        state = make_state(100)
+        assert trim_llama_state(state) is state
+
+
+class TestPrefixStateCacheWithDisk:
+    """Test the memory cache backed by a disk cache"""
+
+    def test_writes_through_to_disk(self, tmp_path, model_file):
+        disk = DiskStateCache(str(tmp_path / "states"), size_limit=1024**2, model_path=str(model_file))
+        cache = PrefixStateCache(capacity_bytes=10000, disk_cache=disk)
+        cache.put("a", make_state(100))
+
+        assert "a" in disk
+
+    def test_memory_miss_loads_from_disk(self, tmp_path, model_file):
+        disk = DiskStateCache(str(tmp_path / "states"), size_limit=1024**2, model_path=str(model_file))
+        disk.put("a", make_state(100))
+        cache = PrefixStateCache(capacity_bytes=10000, disk_cache=disk)
+
+        assert cache.get("a") is not None
+        assert cache.disk_hits == 1
+        # Promoted into memory for the next lookup
+        assert "a" in cache
+        cache.get("a")
+        assert cache.disk_hits == 1
+
+    def test_disk_only_when_memory_disabled(self, tmp_path, model_file):
+        disk = DiskStateCache(str(tmp_path / "states"), size_limit=1024**2, model_path=str(model_file))
+        cache = PrefixStateCache(capacity_bytes=0, disk_cache=disk)
+        cache.put("a", make_state(100))
+
+        assert len(cache) == 0
+        assert cache.get("a") is not None
@@ -0,0 +1,127 @@
+"""
+Tests for ranking story passages by relevance to the chapter being written.
+"""
+from datetime import datetime
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from app.models.request_context import ChapterDetails
+from app.services import passage_index
+from app.services.passage_index import PassageIndex, get_passage_index, split_passages
+
+VOCABULARY = ["dragon", "castle", "sea", "storm", "wedding"]
+
+
+def keyword_embed(texts):
+    """Embed texts as counts of a few keywords."""
+    return np.array([[text.lower().count(word) for word in VOCABULARY] + [0.1] for text in texts])
+
+
+def make_chapter(number: int, content: str, modified: datetime = datetime(2024, 1, 1)) -> ChapterDetails:
+    return ChapterDetails(
+        id=f"chapter-{number}",
+        number=number,
+        title=f"Title {number}",
+        content=content,
+        created=datetime(2024, 1, 1),
+        last_modified=modified)
+
+
+class TestSplitPassages:
+    """Test splitting chapters into passages of whole lines"""
+
+    def test_lines_packed_up_to_max_words(self):
+        content = "one two three\n\nfour five\nsix seven eight nine\n"
+
+        spans = split_passages(content, max_words=5)
+
+        assert [content[start:end] for start, end in spans] == ["one two three\n\nfour five", "six seven eight nine"]
+
+    def test_long_line_split_between_sentences(self):
+        content = "The dragon woke. It was hungry! The village slept on"
+
+        spans = split_passages(content, max_words=6)
+
+        assert [content[start:end] for start, end in spans] == [
+            "The dragon woke. It was hungry!", "The village slept on"]
+
+    def test_blank_content(self):
+        assert split_passages("\n \n", max_words=10) == []
+
+
+class TestPassageIndex:
+    """Test ranking passages and caching their embeddings"""
+
+    @pytest.fixture
+    def chapters(self):
+        return [
+            make_chapter(1, "They sailed the sea.\nA storm broke the mast.\n"),
+            make_chapter(2, "The castle gates opened.\nThe dragon slept below the castle.\n"),
+        ]
+
+    def test_most_relevant_passage_first(self, chapters):
+        index = PassageIndex(keyword_embed, passage_words=5)
+
+        ranked = index.rank("the dragon attacks", chapters)
+
+        assert ranked[0].passage.text == "The dragon slept below the castle."
+        assert ranked[0].passage.chapter is chapters[1]
+        assert len(ranked) == 4
+        assert ranked[0].score > ranked[-1].score
+
+    def test_chapters_embedded_once(self, chapters):
+        calls = []
+
+        def embed(texts):
+            calls.append(texts)
+            return keyword_embed(texts)
+
+        index = PassageIndex(embed, passage_words=5)
+        index.rank("dragon", chapters)
+        index.rank("storm", chapters)
+
+        # Two chapters, then only the queries
+        assert len(calls) == 4
+        assert index.get_stats() == {"hits": 2, "misses": 2, "chapters": 2}
+
+    def test_edited_chapter_reembedded(self, chapters):
+        index = PassageIndex(keyword_embed, passage_words=5)
+        index.rank("dragon", chapters)
+
+        edited = make_chapter(2, "A wedding at the castle.", modified=datetime(2024, 2, 1))
+        ranked = index.rank("wedding", [chapters[0], edited])
+
+        assert ranked[0].passage.text == "A wedding at the castle."
+        assert index.get_stats()["misses"] == 3
+
+    def test_capacity(self, chapters):
+        index = PassageIndex(keyword_embed, capacity=1)
+
+        index.rank("dragon", chapters)
+
+        assert len(index) == 1
+
+
+class TestGetPassageIndex:
+    """Test loading the global index"""
+
+    @pytest.fixture(autouse=True)
+    def reset_global(self, monkeypatch):
+        monkeypatch.setattr(passage_index, '_passage_index', None)
+        monkeypatch.setattr(passage_index, '_passage_index_failed', False)
+
+    def test_unavailable_without_sentence_transformers(self, monkeypatch):
+        monkeypatch.setattr(passage_index, 'SENTENCE_TRANSFORMERS_AVAILABLE', False)
+
+        assert get_passage_index() is None
+        assert passage_index._passage_index_failed
+
+    def test_model_load_failure_not_retried(self, monkeypatch):
+        monkeypatch.setattr(passage_index, 'SENTENCE_TRANSFORMERS_AVAILABLE', True)
+        with patch.object(passage_index, 'SentenceTransformer', side_effect=OSError("no model")) as load:
+            assert get_passage_index() is None
+            assert get_passage_index() is None
+
+        load.assert_called_once()
@@ -0,0 +1,306 @@
+"""
+Tests for shared endpoint utilities.
+"""
+import asyncio
+import json
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from fastapi import HTTPException
+
+from app.api.v1.endpoints.shared_utils import (
+    PartialTextStream,
+    QueuedCall,
+    StructuredStream,
+    admit_request,
+    parse_structured_response,
+    stream_chat_completion,
+    stream_until_disconnected,
+)
+from app.models.generation_models import RaterFeedback
+from app.services.inference_executor import InferenceExecutor, JobPriority, QueueFullError
+from app.services.streaming_json import JSONStreamError
+
+
+async def token_stream(tokens):
+    for token in tokens:
+        yield token
+
+
+def parse_events(events):
+    assert all(e.startswith('data: ') and e.endswith('\n\n') for e in events)
+    return [json.loads(e[6:]) for e in events]
+
+
+class TestPartialTextStream:
+    """Test coalescing of generated tokens into partial SSE events"""
+
+    @pytest.mark.asyncio
+    async def test_flushes_every_n_tokens(self):
+        tokens = [f"t{i} " for i in range(10)]
+        stream = PartialTextStream(token_stream(tokens), flush_tokens=4, flush_interval_ms=60_000)
+
+        events = parse_events([e async for e in stream.events()])
+
+        assert [e['content'] for e in events] == [
+            ''.join(tokens[0:4]), ''.join(tokens[4:8]), ''.join(tokens[8:10])]
+        assert [e['token_count'] for e in events] == [4, 8, 10]
+        assert all(e['type'] == 'partial' for e in events)
+
+    @pytest.mark.asyncio
+    async def test_flushes_after_interval(self):
+        tokens = ["a", "b", "c"]
+        stream = PartialTextStream(token_stream(tokens), flush_tokens=100, flush_interval_ms=0)
+
+        events = parse_events([e async for e in stream.events()])
+
+        assert [e['content'] for e in events] == tokens
+
+    @pytest.mark.asyncio
+    async def test_collects_full_text(self):
+        tokens = ["Once ", "upon ", "a ", "time"]
+        stream = PartialTextStream(token_stream(tokens), flush_tokens=3, flush_interval_ms=60_000)
+
+        events = parse_events([e async for e in stream.events()])
+
+        assert stream.text == "Once upon a time"
+        assert ''.join(e['content'] for e in events) == stream.text
+        assert stream.token_count == 4
+
+    @pytest.mark.asyncio
+    async def test_empty_stream(self):
+        stream = PartialTextStream(token_stream([]), flush_tokens=3, flush_interval_ms=0)
+
+        assert [e async for e in stream.events()] == []
+        assert stream.text == ""
+
+
+class FakeRequest:
+    """Request stand-in whose client disconnects after a number of checks"""
+
+    class url:
+        path = "/api/v1/test"
+
+    def __init__(self, disconnect_after=None):
+        self.checks = 0
+        self.disconnect_after = disconnect_after
+
+    async def is_disconnected(self):
+        self.checks += 1
+        return self.disconnect_after is not None and self.checks >= self.disconnect_after
+
+
+class TestStreamUntilDisconnected:
+    """Test disconnect detection for SSE responses"""
+
+    @pytest.mark.asyncio
+    async def test_forwards_all_events(self):
+        async def events():
+            yield "data: 1\n\n"
+            await asyncio.sleep(0.03)
+            yield "data: 2\n\n"
+
+        result = [e async for e in stream_until_disconnected(FakeRequest(), events(), poll_interval=0.01)]
+
+        assert result == ["data: 1\n\n", "data: 2\n\n"]
+
+    @pytest.mark.asyncio
+    async def test_disconnect_cancels_pending_generation(self):
+        state = {"cancelled": False, "finished": False}
+
+        async def events():
+            yield "data: status\n\n"
+            try:
+                # Waiting on a long generation
+                await asyncio.sleep(10)
+                yield "data: result\n\n"
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+            finally:
+                state["finished"] = True
+
+        request = FakeRequest(disconnect_after=2)
+        result = [e async for e in stream_until_disconnected(request, events(), poll_interval=0.01)]
+
+        assert result == ["data: status\n\n"]
+        assert state == {"cancelled": True, "finished": True}
+
+
+class TestQueuedCall:
+    """Test queue position events while a job waits for a worker"""
+
+    @pytest.fixture
+    def executor(self):
+        executor = InferenceExecutor()
+        yield executor
+        executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_reports_queue_position(self, executor):
+        release = threading.Event()
+        blocker = asyncio.ensure_future(executor.run(release.wait, 5))
+        ahead = asyncio.ensure_future(executor.run(lambda: None))
+        while executor.pending_jobs < 1:
+            await asyncio.sleep(0.01)
+
+        ticket = executor.admit(JobPriority.NORMAL)
+        call = QueuedCall(executor, ticket, lambda a, b: a + b, 2, b=3, progress=40, poll_interval=0.01)
+        events = []
+        async for event in call.events():
+            events.append(event)
+            if len(events) == 1:
+                release.set()
+        await asyncio.gather(blocker, ahead)
+
+        parsed = parse_events(events)
+        assert parsed[0]['phase'] == 'queued'
+        assert parsed[0]['data'] == {'queue_position': 2}
+        assert parsed[0]['progress'] == 40
+        assert call.result == 5
+
+    @pytest.mark.asyncio
+    async def test_no_events_when_worker_idle(self, executor):
+        ticket = executor.admit(JobPriority.NORMAL)
+        call = QueuedCall(executor, ticket, lambda: "done", poll_interval=0.5)
+
+        assert [e async for e in call.events()] == []
+        assert call.result == "done"
+
+    def test_admit_request_rejects_with_429(self):
+        executor = Mock(spec=InferenceExecutor)
+        executor.admit.side_effect = QueueFullError(pending=32, retry_after=45)
+
+        with pytest.raises(HTTPException) as exc_info:
+            admit_request(executor, JobPriority.NORMAL)
+
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.headers == {"Retry-After": "45"}
+
+    def test_admit_request_bounds_batch_queue(self):
+        executor = Mock(spec=InferenceExecutor)
+        llm = Mock()
+        llm.batch_engine.check_admission.side_effect = QueueFullError(pending=32, retry_after=20)
+
+        with pytest.raises(HTTPException) as exc_info:
+            admit_request(executor, JobPriority.NORMAL, llm=llm)
+
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.headers == {"Retry-After": "20"}
+        executor.admit.assert_not_called()
+
+
+class TestStructuredStream:
+    """Test turning structured output into per-item SSE events"""
+
+    class Tokens:
+        """Async token stream recording whether it was closed."""
+
+        def __init__(self, tokens):
+            self._tokens = iter(tokens)
+            self.consumed = 0
+            self.closed = False
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            try:
+                token = next(self._tokens)
+            except StopIteration:
+                raise StopAsyncIteration
+            self.consumed += 1
+            return token
+
+        async def aclose(self):
+            self.closed = True
+
+    async def collect(self, stream):
+        return [event async for event in stream.events()]
+
+    @pytest.mark.asyncio
+    async def test_items_sent_as_they_complete(self):
+        tokens = self.Tokens(['{"actions": ["nods', '", "waits"', '], "dialog": []}', ' '])
+        stream = StructuredStream(tokens)
+
+        events = parse_events(await self.collect(stream))
+
+        assert [(e["type"], e["path"], e["value"]) for e in events] == [
+            ("item", ["actions", 0], "nods"),
+            ("item", ["actions", 1], "waits"),
+            ("item", ["actions"], ["nods", "waits"]),
+            ("item", ["dialog"], []),
+        ]
+        assert stream.text == '{"actions": ["nods", "waits"], "dialog": []}'
+        assert tokens.consumed == 3
+        assert tokens.closed
+
+    @pytest.mark.asyncio
+    async def test_invalid_output_stops_generation(self):
+        tokens = self.Tokens(['{"actions": ["nods"]', ' "dialog"', ': []}'] + ['more'] * 100)
+        stream = StructuredStream(tokens)
+
+        with pytest.raises(JSONStreamError):
+            await self.collect(stream)
+
+        assert tokens.consumed == 2
+        assert tokens.closed
+
+
+class TestStreamChatCompletion:
+    """Test routing chat streams to the batch engine or the executor"""
+
+    def test_uses_executor_without_batch_engine(self):
+        executor = Mock(spec=InferenceExecutor)
+        llm = Mock()
+        llm.batch_engine = None
+        messages = [{"role": "user", "content": "Hi"}]
+
+        stream = stream_chat_completion(
+            executor, llm, messages, ticket="ticket", prefix_message_count=1, affinity="story", max_tokens=10)
+
+        assert stream is executor.stream.return_value
+        executor.stream.assert_called_once_with(
+            llm.chat_completion_stream, messages,
+            prefix_message_count=1, affinity="story", ticket="ticket", max_tokens=10)
+
+    def test_uses_batch_engine(self):
+        executor = Mock(spec=InferenceExecutor)
+        llm = Mock()
+        messages = [{"role": "user", "content": "Hi"}]
+
+        stream = stream_chat_completion(
+            executor, llm, messages, ticket="ticket", prefix_message_count=1, affinity="story", max_tokens=10)
+
+        assert stream is llm.batch_engine.stream.return_value
+        llm.batch_engine.stream.assert_called_once_with(messages, ticket="ticket", max_tokens=10)
+        executor.stream.assert_not_called()
+
+
+class TestParseStructuredResponse:
+    """Test validating grammar-constrained output against its response model"""
+
+    def test_valid_output(self):
+        text = json.dumps({
+            "opinion": "Strong opening.",
+            "suggestions": [{"issue": "Pacing", "suggestion": "Tighten the middle", "priority": "high"}]
+        })
+
+        feedback = parse_structured_response(text, RaterFeedback)
+
+        assert feedback.opinion == "Strong opening."
+        assert feedback.suggestions[0].priority == "high"
+
+    def test_truncated_output(self):
+        text = '{"opinion": "Strong opening.", "suggestions": [{"issue": "Pac'
+
+        with pytest.raises(ValueError, match="Incomplete JSON.*max_tokens"):
+            parse_structured_response(text, RaterFeedback)
+
+    def test_output_not_matching_schema(self):
+        text = json.dumps({"opinion": "Fine.", "suggestions": [{"issue": "x", "suggestion": "y", "priority": "urgent"}]})
+
+        with pytest.raises(ValueError, match="does not match RaterFeedback"):
+            parse_structured_response(text, RaterFeedback)
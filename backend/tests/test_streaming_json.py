@@ -0,0 +1,100 @@
+"""
+Tests for incremental parsing of streamed JSON output.
+"""
+import json
+
+import pytest
+
+from app.services.streaming_json import IncrementalJSONParser, JSONStreamError
+
+
+def feed_in_chunks(text, size):
+    parser = IncrementalJSONParser()
+    items = []
+    for start in range(0, len(text), size):
+        items.extend(parser.feed(text[start:start + size]))
+    return parser, items
+
+
+class TestIncrementalJSONParser:
+    """Test reporting completed values while the text streams in"""
+
+    DOCUMENT = {
+        "opinion": "A \"tense\" opening — well paced.",
+        "score": -1.5e3,
+        "suggestions": [
+            {"issue": "Pacing", "priority": "high", "tags": [1, 2]},
+            {"issue": "Dialog", "priority": "low", "resolved": None},
+        ],
+        "empty": [],
+    }
+
+    @pytest.mark.parametrize("size", [1, 3, 64, 10000])
+    def test_items_independent_of_chunking(self, size):
+        parser, items = feed_in_chunks(json.dumps(self.DOCUMENT), size)
+
+        assert parser.done
+        assert parser.value == self.DOCUMENT
+        assert [item.path for item in items] == [
+            ("opinion",), ("score",),
+            ("suggestions", 0, "tags", 0), ("suggestions", 0, "tags", 1),
+            ("suggestions", 0), ("suggestions", 1), ("suggestions",),
+            ("empty",),
+        ]
+        assert items[4].value == self.DOCUMENT["suggestions"][0]
+
+    def test_list_item_reported_when_it_closes(self):
+        parser = IncrementalJSONParser()
+
+        assert parser.feed('{"actions": ["grips the door') == []
+        items = parser.feed('", "steps')
+
+        assert [(item.path, item.value) for item in items] == [(("actions", 0), "grips the door")]
+        assert not parser.done
+
+    def test_number_reported_at_delimiter(self):
+        parser = IncrementalJSONParser()
+
+        assert parser.feed('[12') == []
+        assert parser.feed('5') == []
+        assert parser.feed(']')[0].value == 125
+        assert parser.done
+
+    def test_root_array(self):
+        parser, items = feed_in_chunks('[{"number": 1}, {"number": 2}] ', 5)
+
+        assert [item.path for item in items] == [(0,), (1,)]
+        assert parser.value == [{"number": 1}, {"number": 2}]
+
+    @pytest.mark.parametrize("text", [
+        'Sure! Here is the JSON: {',
+        '{"actions": [1,,',
+        '{"actions" [',
+        '{"done": tru}',
+        '{"score": 1.2.3}',
+        '{"text": "bad \\q escape"}',
+        '{"text": "line\nbreak"}',
+        '{"a": 1} trailing',
+    ])
+    def test_syntax_error_raised_immediately(self, text):
+        with pytest.raises(JSONStreamError, match="Invalid JSON at offset"):
+            feed_in_chunks(text, 1)
+
+    def test_error_is_value_error(self):
+        with pytest.raises(ValueError):
+            IncrementalJSONParser().feed('{]')
+
+    @pytest.mark.parametrize("text, value", [("42", 42), ("-1.5e3 ", -1500.0), ('{"a": 1}', {"a": 1}), ("[]", [])])
+    def test_close_completes_document(self, text, value):
+        parser, _ = feed_in_chunks(text, 1)
+
+        assert parser.close() == []
+        assert parser.done
+        assert parser.value == value
+
+    @pytest.mark.parametrize("text", ['', '   ', '{"a": 1', '[1, 2', '"unterminated', 'tr', '-', '{"a": 12'])
+    def test_close_raises_on_truncated_text(self, text):
+        parser, _ = feed_in_chunks(text, 1)
+
+        with pytest.raises(JSONStreamError, match="Invalid JSON at offset"):
+            parser.close()
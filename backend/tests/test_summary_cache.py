@@ -0,0 +1,111 @@
+"""
+Tests for the memoized context summary cache.
+"""
+from app.services.summary_cache import SummaryCache, make_summary_key
+
+
+def key(content="Once upon a time", budget=100, strategy="summarized", model_id="model.gguf"):
+    return make_summary_key(content, budget, strategy, model_id)
+
+
+class TestMakeSummaryKey:
+    """Test cache key construction"""
+
+    def test_same_inputs_same_key(self):
+        assert key() == key()
+
+    def test_each_component_changes_key(self):
+        base = key()
+        assert key(content="Once upon a time.") != base
+        assert key(budget=101) != base
+        assert key(strategy="summary_and_rolling_window") != base
+        assert key(model_id="other.gguf") != base
+
+    def test_content_is_hashed(self):
+        content = "A very long chapter " * 1000
+        assert content not in key(content=content)
+
+
+class TestSummaryCacheMemory:
+    """Test the in-memory LRU"""
+
+    def test_miss_then_hit(self):
+        cache = SummaryCache(capacity=4)
+
+        assert cache.get(key()) is None
+        cache.put(key(), "A summary", 2)
+
+        assert cache.get(key()) == ("A summary", 2)
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_evicts_least_recently_used(self):
+        cache = SummaryCache(capacity=2)
+        cache.put(key("a"), "A", 1)
+        cache.put(key("b"), "B", 1)
+        cache.get(key("a"))
+        cache.put(key("c"), "C", 1)
+
+        assert len(cache) == 2
+        assert cache.get(key("b")) is None
+        assert cache.get(key("a")) == ("A", 1)
+        assert cache.get(key("c")) == ("C", 1)
+
+    def test_clear(self):
+        cache = SummaryCache(capacity=2)
+        cache.put(key(), "A summary", 2)
+        cache.clear()
+
+        assert cache.get(key()) is None
+
+    def test_stats(self):
+        cache = SummaryCache(capacity=2)
+        cache.get(key())
+        cache.put(key(), "A summary", 2)
+        cache.get(key())
+
+        assert cache.get_stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+
+class TestSummaryCachePersistence:
+    """Test the SQLite layer"""
+
+    def test_survives_restart(self, tmp_path):
+        db_path = str(tmp_path / "summaries.db")
+        cache = SummaryCache(capacity=2, db_path=db_path)
+        cache.put(key(), "A summary", 2)
+        cache.close()
+
+        restarted = SummaryCache(capacity=2, db_path=db_path)
+
+        assert len(restarted) == 0
+        assert restarted.get(key()) == ("A summary", 2)
+        # Promoted into memory
+        assert len(restarted) == 1
+        restarted.close()
+
+    def test_memory_eviction_falls_back_to_database(self, tmp_path):
+        cache = SummaryCache(capacity=1, db_path=str(tmp_path / "summaries.db"))
+        cache.put(key("a"), "A", 1)
+        cache.put(key("b"), "B", 1)
+
+        assert cache.get(key("a")) == ("A", 1)
+        cache.close()
+
+    def test_database_is_pruned(self, tmp_path):
+        cache = SummaryCache(capacity=1, db_path=str(tmp_path / "summaries.db"), db_max_entries=2)
+        for content in ("a", "b", "c"):
+            cache.put(key(content), content.upper(), 1)
+
+        assert cache.get(key("a")) is None
+        assert cache.get(key("b")) == ("B", 1)
+        cache.close()
+
+    def test_clear_removes_persisted_summaries(self, tmp_path):
+        db_path = str(tmp_path / "summaries.db")
+        cache = SummaryCache(capacity=2, db_path=db_path)
+        cache.put(key(), "A summary", 2)
+        cache.clear()
+        cache.close()
+
+        assert SummaryCache(capacity=2, db_path=db_path).get(key()) is None
@@ -0,0 +1,63 @@
+"""
+Tests for the token-id cache used by LLMInference.encode.
+"""
+from app.services.token_cache import TokenCache
+
+
+class TestTokenCache:
+    """Test the token-count bounded LRU"""
+
+    def test_miss_then_hit(self):
+        cache = TokenCache(capacity_tokens=100)
+
+        assert cache.get("Once upon a time") is None
+        cache.put("Once upon a time", [1, 2, 3, 4])
+
+        assert cache.get("Once upon a time") == [1, 2, 3, 4]
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_returned_list_is_a_copy(self):
+        cache = TokenCache(capacity_tokens=100)
+        cache.put("text", [1, 2, 3])
+
+        cache.get("text").append(4)
+
+        assert cache.get("text") == [1, 2, 3]
+
+    def test_bounded_by_total_tokens(self):
+        cache = TokenCache(capacity_tokens=10)
+        cache.put("a", [1] * 4)
+        cache.put("b", [2] * 4)
+        cache.get("a")
+        cache.put("c", [3] * 4)
+
+        assert cache.cache_size == 8
+        assert cache.get("b") is None
+        assert cache.get("a") == [1] * 4
+        assert cache.get("c") == [3] * 4
+
+    def test_replacing_entry_updates_size(self):
+        cache = TokenCache(capacity_tokens=10)
+        cache.put("a", [1] * 4)
+        cache.put("a", [1] * 6)
+
+        assert len(cache) == 1
+        assert cache.cache_size == 6
+
+    def test_oversized_text_not_cached(self):
+        cache = TokenCache(capacity_tokens=10)
+        cache.put("small", [1])
+        cache.put("huge", [2] * 11)
+
+        assert cache.get("huge") is None
+        assert cache.get("small") == [1]
+
+    def test_clear(self):
+        cache = TokenCache(capacity_tokens=10)
+        cache.put("a", [1, 2])
+        cache.clear()
+
+        assert len(cache) == 0
+        assert cache.cache_size == 0
+        assert cache.get("a") is None